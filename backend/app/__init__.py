@@ -4,12 +4,23 @@ from dotenv import load_dotenv  # type: ignore # Load environment variables
 from flask import Flask # type: ignore
 from flask_sqlalchemy import SQLAlchemy # type: ignore
 from flask_socketio import SocketIO # type: ignore
-from flask_session import Session
 from flask_cors import CORS # type: ignore
-from flask_limiter import Limiter # type: ignore
-from flask_limiter.util import get_remote_address # type: ignore
+from sqlalchemy.pool import NullPool # type: ignore
 
-from config.config import Config
+from config.config import get_config
+from .bus import MessageBus
+from .cache import CompletionCache
+from .database import configure_engine, engine_options
+from .flow import FlowEngine
+from .jobs import JobQueue
+from .logs import configure_logging
+from .metrics import Metrics
+from .overload import ConcurrencyController
+from .providers import LLMRouter
+from .pubsub import socketio_options
+from .ratelimit import RateLimiter
+from .sanitize import InputSanitizer
+from .state import StateStore
 
 # Load environment variables from the .env file
 load_dotenv()
@@ -17,14 +28,37 @@ load_dotenv()
 # Initialize Flask extensions without an app context
 db = SQLAlchemy()  # SQLAlchemy database instance
 socketio = SocketIO()  # Flask-SocketIO instance for real-time WebSocket support
-session = Session()  # Flask session for managing user sessions
-limiter = Limiter(key_func=get_remote_address)  # Rate limiter for API request control
+metrics = Metrics()  # Prometheus histograms, gauges and counters served on /metrics
+llm = LLMRouter()  # Chat completions routed across providers, with hedging, circuit breakers and canned fallback
+limiter = RateLimiter()  # Shared token buckets for routes and socket events, plus upstream quota pacing
+overload = ConcurrencyController()  # Adaptive in-flight limit; sheds free-form generation before flow steps
+completion_cache = CompletionCache()  # LRU/TTL cache with single-flight in front of the LLM client
+state_store = StateStore()  # Per-connection conversation state (memory, SQLite or Redis)
+flow_engine = FlowEngine()  # Compiled, hot-reloadable conversation flow
+job_queue = JobQueue()  # Durable background jobs (profile extraction, ...) pushed back to sockets when done
+message_bus = MessageBus()  # Emits to rooms on every worker, with replay of missed replies on reconnect
+sanitizer = InputSanitizer()  # Message size limits and PII/profanity scrubbing before anything is stored
 
+# Extensions below depend on the models, which need ``db`` to exist first
+from .logwriter import ConversationLogWriter  # noqa: E402
+log_writer = ConversationLogWriter()  # Write-behind, batched ConversationLog persistence
+from .profiles import ProfileExtractor  # noqa: E402
+profile_extractor = ProfileExtractor()  # Batched profile extraction at the end of the flow, run as jobs
+from .matching import MatchEngine  # noqa: E402
+match_engine = MatchEngine()  # Vectorized top-k matching over completed profiles
+from .context import ContextManager  # noqa: E402
+context_manager = ContextManager()  # Token-budgeted multi-turn prompts with rolling summaries
+from .retention import ConversationRetention  # noqa: E402
+log_retention = ConversationRetention()  # TTL expiry and compressed monthly archives of ConversationLog
 
-def create_app() -> tuple[Flask, SocketIO, SQLAlchemy]:
+
+def create_app(config_class=None) -> tuple[Flask, SocketIO, SQLAlchemy]:
     """
     Application factory pattern to create and configure the Flask app instance.
 
+    Parameters:
+        config_class: Configuration object to load (defaults to the class named by ``APP_ENV``).
+
     Returns:
         tuple: A tuple containing the Flask app, SocketIO instance, and SQLAlchemy instance.
     """
@@ -32,14 +66,38 @@ def create_app() -> tuple[Flask, SocketIO, SQLAlchemy]:
     app = Flask(__name__)
 
     # Load configuration settings from config.py
-    app.config.from_object(Config)
+    app.config.from_object(config_class or get_config())
+    configure_logging(app)
+
+    # On green-thread workers DB calls run on native threads (see utils.run_blocking),
+    # which cannot share a pool guarded by monkey-patched locks
+    if app.config.get("SOCKETIO_ASYNC_MODE") in ("eventlet", "gevent"):
+        app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {}).setdefault("poolclass", NullPool)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
 
     # Initialize Flask extensions with the app context
     db.init_app(app)
-    socketio.init_app(app, cors_allowed_origins="*")
-    session.init_app(app)
+    with app.app_context():
+        configure_engine(db.engine, app.config)
+    socketio.init_app(app, **socketio_options(app.config))
     CORS(app)  # Enable Cross-Origin Resource Sharing
-    limiter.init_app(app)
+    metrics.init_app(app)
+    llm.init_app(app, metrics=metrics)
+    limiter.init_app(app, upstream=llm)
+    overload.init_app(app, metrics=metrics)  # After the limiter, so rate-limited requests never take a slot
+    completion_cache.init_app(app)
+    state_store.init_app(app)
+    flow_engine.init_app(app)
+    sanitizer.init_app(app, metrics=metrics)
+    log_writer.init_app(app)
+    # With a shared bus log every worker delivers to its own sockets, so emits skip the Socket.IO message queue
+    message_bus.init_app(app, metrics=metrics, deliver=lambda room, event, data: socketio.emit(
+        event, data, to=room, ignore_queue=message_bus.distributed))
+    profile_extractor.init_app(app)
+    match_engine.init_app(app, profiles=profile_extractor)
+    job_queue.init_app(app, notify=message_bus.publish, metrics=metrics)
+    log_retention.init_app(app, jobs=job_queue, metrics=metrics)
+    context_manager.init_app(app)
 
     # Import and register blueprints for routes
     from .routes import main_bp
@@ -48,7 +106,44 @@ def create_app() -> tuple[Flask, SocketIO, SQLAlchemy]:
     # Register SocketIO event handlers
     from .socketio_handlers import register_socket_handlers
     register_socket_handlers(socketio, app)
+    _register_gauges()
+
+    if not app.config.get("LAZY_INIT", True):
+        warm_up(app)
 
     return app, socketio, db
 
 
+def warm_up(app):
+    """
+    Do now what lazy initialization leaves for the first request: compile the
+    flow, import numpy and load the match index from the profile table.
+
+    Called by ``create_app`` when ``LAZY_INIT`` is off, and by the preforking
+    server (``prefork.py``) before it forks, so every worker shares one copy.
+
+    Parameters:
+    -----------
+    app : Flask
+        The application returned by ``create_app``.
+    """
+    flow_engine.reload(force=True)
+    try:
+        match_engine.refresh(force=True)
+    except Exception as e:
+        # A database without the profile table yet (before migrations) should not stop the server
+        app.logger.warning("Match index not loaded at start-up: %s", e)
+
+
+def _register_gauges():
+    """Gauges read at scrape time from the state they mirror, so the hot path pays nothing."""
+    from .socketio_handlers import active_connections
+    metrics.gauge("spokesperson_socket_connections", "Sockets connected to this process.",
+                  callback=lambda: active_connections.count)
+    metrics.gauge("spokesperson_queue_depth", "Items waiting in background and admission queues.", ("queue",),
+                  callback=lambda: {"log_writer": log_writer.depth, "llm_admission": limiter.admission.depth, "jobs": job_queue.depth,
+                                    "bus": message_bus.depth})
+    metrics.gauge("spokesperson_context_sessions", "Conversation contexts cached in this process.",
+                  callback=lambda: context_manager.stats()["sessions"])
+
+
@@ -0,0 +1,490 @@
+"""
+Approximate nearest-neighbour search over profile vectors (IVF).
+
+Brute-force matching reads every profile vector per query, which stops
+fitting the results-screen latency budget at a few hundred thousand
+profiles. ``AnnIndex`` partitions the vectors into ``nlist`` clusters with
+spherical k-means and, per query, scores only the ``nprobe`` clusters whose
+centroids are closest to it.
+
+The index lives on disk as immutable generations:
+
+    <path>/CURRENT                 name of the live generation
+    <path>/gen-000007/meta.json    counts, nlist, caller metadata (e.g. built_until)
+    <path>/gen-000007/*.npy        centroids, vectors grouped by cluster, ids,
+                                   cluster offsets and an id lookup table
+
+The arrays are opened with ``mmap_mode='r'``, so opening an index costs a few
+page mappings whatever its size, and every worker on a host shares one copy
+in the page cache.
+
+Changes made after a generation was written are kept in memory: inserts and
+updates go to a small exact ``MatchIndex`` (the delta), and deletes and
+replaced rows are tombstoned. Queries merge the delta with the probed
+clusters. Once the delta and tombstones outgrow ``rebuild_min`` and
+``rebuild_ratio`` of the base, ``maybe_rebuild`` compacts everything into a
+new generation on a background thread (one process per host, via a lock
+file), switches ``CURRENT`` atomically and keeps serving the old generation
+until the switch. Other processes notice the new generation through
+``reload_if_changed``.
+
+Build or inspect the index offline with:
+
+    python -m app.ann build
+    python -m app.ann stats
+"""
+import argparse
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+import numpy as np  # type: ignore
+
+from .matching import MatchIndex
+
+logger = logging.getLogger(__name__)
+
+ARRAYS = ("centroids", "vectors", "ids", "offsets", "sorted_ids", "sorted_rows")
+
+
+def default_nlist(count) -> int:
+    """About sqrt(N) clusters, the usual IVF trade-off between centroid and list scans."""
+    return int(min(4096, max(1, round(count ** 0.5))))
+
+
+def assign(vectors, centroids, block_rows=65536) -> np.ndarray:
+    """Index of the closest centroid (by inner product) for every vector."""
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_rows):
+        block = np.asarray(vectors[start:start + block_rows])
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def train_centroids(vectors, nlist, iterations=10, sample_per_list=64, seed=0) -> np.ndarray:
+    """
+    Spherical k-means on a sample of ``vectors``.
+
+    Parameters:
+    -----------
+    vectors : numpy.ndarray
+        Unit-length training vectors.
+    nlist : int
+        Number of clusters.
+    iterations : int
+        Lloyd iterations.
+    sample_per_list : int
+        Training points per cluster; the rest only get assigned.
+    seed : int
+        Random seed, for reproducible builds.
+
+    Returns:
+    --------
+    numpy.ndarray
+        ``(nlist, dim)`` unit-length centroids.
+    """
+    rng = np.random.default_rng(seed)
+    count = len(vectors)
+    size = min(count, nlist * sample_per_list)
+    sample = np.asarray(vectors[np.sort(rng.choice(count, size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(size, nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign(sample, centroids)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=nlist)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        centroids[filled] = np.add.reduceat(sample[order], starts, axis=0)
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(size, len(empty), replace=False)]
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        centroids /= np.where(norms == 0, 1, norms)
+    return centroids
+
+
+def write_generation(path, ids, vectors, nlist=None, meta=None, keep=2, seed=0) -> str:
+    """
+    Cluster ``vectors`` and write them as the next generation under ``path``.
+
+    Parameters:
+    -----------
+    path : str
+        Index directory.
+    ids : numpy.ndarray
+        Unique user ids, one per vector.
+    vectors : numpy.ndarray
+        Unit-length float32 vectors.
+    nlist : int, optional
+        Number of clusters, ``default_nlist`` by default.
+    meta : dict, optional
+        JSON-serializable metadata stored with the generation.
+    keep : int
+        Generations kept on disk, the new one included.
+    seed : int
+        Random seed for training.
+
+    Returns:
+    --------
+    str
+        Name of the generation, now current.
+    """
+    os.makedirs(path, exist_ok=True)
+    ids = np.asarray(ids, dtype=np.int64)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    count, dim = vectors.shape if vectors.ndim == 2 else (0, 0)
+    arrays = {"ids": ids, "vectors": vectors.reshape(count, dim)}
+    nlist = min(nlist or default_nlist(count), count) or 0
+    if count:
+        centroids = train_centroids(vectors, nlist, seed=seed)
+        labels = assign(vectors, centroids)
+        order = np.argsort(labels, kind="stable")
+        arrays.update(centroids=centroids, vectors=vectors[order], ids=ids[order],
+                      offsets=np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=nlist)))))
+    else:
+        arrays.update(centroids=np.zeros((0, dim), dtype=np.float32), offsets=np.zeros(1, dtype=np.int64))
+    arrays["sorted_rows"] = np.argsort(arrays["ids"], kind="stable")
+    arrays["sorted_ids"] = arrays["ids"][arrays["sorted_rows"]]
+
+    existing = sorted(name for name in os.listdir(path) if name.startswith("gen-") and "." not in name)
+    name = f"gen-{(int(existing[-1][4:]) + 1 if existing else 1):06d}"
+    staging = os.path.join(path, f"{name}.tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for key in ARRAYS:
+        np.save(os.path.join(staging, f"{key}.npy"), arrays[key])
+    with open(os.path.join(staging, "meta.json"), "w") as f:
+        json.dump({"count": int(count), "dim": int(dim), "nlist": int(nlist), "created_at": time.time(),
+                   **(meta or {})}, f)
+    os.replace(staging, os.path.join(path, name))
+
+    pointer = os.path.join(path, "CURRENT.tmp")
+    with open(pointer, "w") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer, os.path.join(path, "CURRENT"))
+
+    # Old generations may still be mapped by other processes; unlinking them is safe
+    for old in (existing + [name])[:-keep]:
+        shutil.rmtree(os.path.join(path, old), ignore_errors=True)
+    return name
+
+
+def current_generation(path):
+    """Name of the live generation under ``path``, or None."""
+    try:
+        with open(os.path.join(path, "CURRENT")) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class _Generation:
+    """One immutable, memory-mapped generation."""
+
+    def __init__(self, name, meta, arrays):
+        self.name = name
+        self.meta = meta
+        self.count = meta["count"]
+        self.nlist = meta["nlist"]
+        for key in ARRAYS:
+            setattr(self, key, arrays[key])
+
+    @classmethod
+    def open(cls, path, name):
+        directory = os.path.join(path, name)
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {key: np.load(os.path.join(directory, f"{key}.npy"), mmap_mode="r") for key in ARRAYS}
+        return cls(name, meta, arrays)
+
+    @classmethod
+    def empty(cls, dim):
+        arrays = {key: np.zeros(0, dtype=np.int64) for key in ARRAYS}
+        arrays.update(centroids=np.zeros((0, dim), dtype=np.float32), vectors=np.zeros((0, dim), dtype=np.float32),
+                      offsets=np.zeros(1, dtype=np.int64))
+        return cls(None, {"count": 0, "nlist": 0, "dim": dim}, arrays)
+
+    def row(self, user_id):
+        """Row of ``user_id`` in ``vectors``, or None."""
+        pos = int(np.searchsorted(self.sorted_ids, user_id))
+        if pos < self.count and self.sorted_ids[pos] == user_id:
+            return int(self.sorted_rows[pos])
+        return None
+
+
+class AnnIndex:
+    """
+    IVF index with memory-mapped generations and an in-memory delta.
+
+    Offers the same ``upsert``/``remove``/``top_k``/``vector`` interface as
+    ``MatchIndex``.
+
+    Attributes:
+    -----------
+    path : str
+        Directory holding the generations.
+    dim : int
+        Vector length.
+    nprobe : int
+        Clusters scored per query; higher is slower and more accurate.
+    rebuild_min, rebuild_ratio : int, float
+        ``maybe_rebuild`` compacts once pending changes exceed both
+        ``rebuild_min`` and ``rebuild_ratio`` times the base size.
+    """
+
+    def __init__(self, path, dim, nprobe=16, rebuild_min=10000, rebuild_ratio=0.1, nlist=None):
+        self.path = path
+        self.dim = dim
+        self.nprobe = nprobe
+        self.rebuild_min = rebuild_min
+        self.rebuild_ratio = rebuild_ratio
+        self.nlist = nlist
+        self.rebuilds = 0
+        self._delta = MatchIndex(dim)
+        self._tombstones = set()
+        self._tombstone_array = np.zeros(0, dtype=np.int64)
+        self._touched = None  # Ids changed while a rebuild runs
+        self._rebuild_thread = None
+        self._lock = threading.RLock()
+        self._base = self._open_current() or _Generation.empty(dim)
+
+    @property
+    def generation(self):
+        return self._base.name
+
+    @property
+    def meta(self) -> dict:
+        return dict(self._base.meta)
+
+    @property
+    def pending(self) -> int:
+        """Changes not yet compacted into the base generation."""
+        return len(self._delta) + len(self._tombstones)
+
+    def __len__(self):
+        return self._base.count - len(self._tombstones) + len(self._delta)
+
+    def __contains__(self, user_id):
+        return user_id in self._delta or (user_id not in self._tombstones and self._base.row(user_id) is not None)
+
+    def vector(self, user_id) -> np.ndarray:
+        if user_id in self._delta:
+            return self._delta.vector(user_id)
+        row = None if user_id in self._tombstones else self._base.row(user_id)
+        if row is None:
+            raise KeyError(user_id)
+        return np.array(self._base.vectors[row])
+
+    def upsert(self, user_id, vector):
+        self.upsert_many([user_id], np.asarray(vector, dtype=np.float32).reshape(1, -1))
+
+    def upsert_many(self, user_ids, matrix):
+        """Add or replace vectors; replaced base rows are tombstoned."""
+        user_ids = [int(user_id) for user_id in user_ids]
+        with self._lock:
+            self._delta.upsert_many(user_ids, matrix)
+            self._tombstone([user_id for user_id in user_ids if self._base.row(user_id) is not None])
+            if self._touched is not None:
+                self._touched.update(user_ids)
+
+    def remove(self, user_id):
+        with self._lock:
+            self._delta.remove(user_id)
+            if self._base.row(user_id) is not None:
+                self._tombstone([user_id])
+            if self._touched is not None:
+                self._touched.add(user_id)
+
+    def top_k(self, query, k=10, exclude=(), nprobe=None) -> list:
+        """
+        Approximately the most similar users to ``query``.
+
+        Parameters:
+        -----------
+        query : numpy.ndarray
+            A vector from the same encoder.
+        k : int
+            Number of matches.
+        exclude : iterable of int
+            User ids to leave out.
+        nprobe : int, optional
+            Clusters to score, defaults to ``self.nprobe``.
+
+        Returns:
+        --------
+        list of tuple
+            ``(user_id, score)`` pairs, best first.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        exclude = tuple(exclude)
+        with self._lock:
+            base, tombstones = self._base, self._tombstone_array
+        results = self._delta.top_k(query, k, exclude)
+        if base.count:
+            probe = min(nprobe or self.nprobe, base.nlist)
+            closeness = base.centroids @ query
+            lists = np.argpartition(closeness, -probe)[-probe:] if probe < base.nlist else range(base.nlist)
+            spans = [(base.offsets[i], base.offsets[i + 1]) for i in lists if base.offsets[i + 1] > base.offsets[i]]
+            scores = np.concatenate([base.vectors[a:b] @ query for a, b in spans])
+            ids = np.concatenate([base.ids[a:b] for a, b in spans])
+            hidden = np.concatenate((tombstones, np.asarray(exclude, dtype=np.int64)))
+            if len(hidden):
+                scores[np.isin(ids, hidden)] = -np.inf
+            top = min(k, len(scores))
+            best = np.argpartition(scores, -top)[-top:] if top < len(scores) else np.arange(len(scores))
+            results += [(int(ids[i]), float(scores[i])) for i in best if scores[i] != -np.inf]
+        results.sort(key=lambda match: -match[1])
+        return results[:k]
+
+    def maybe_rebuild(self, meta=None) -> bool:
+        """Start a background rebuild when pending changes warrant one."""
+        if self.pending < max(self.rebuild_min, self.rebuild_ratio * self._base.count):
+            return False
+        return self.rebuild(meta)
+
+    def rebuild(self, meta=None, wait=False) -> bool:
+        """
+        Compact the base, tombstones and delta into a new generation.
+
+        Parameters:
+        -----------
+        meta : dict, optional
+            Metadata stored with the generation (``MatchEngine`` records ``built_until``).
+        wait : bool
+            Block until the new generation is live.
+
+        Returns:
+        --------
+        bool
+            False when a rebuild is already running here or in another process.
+        """
+        with self._lock:
+            if self._rebuild_thread is not None:
+                return False
+            os.makedirs(self.path, exist_ok=True)
+            lock_file = open(os.path.join(self.path, "rebuild.lock"), "w")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            base, tombstones = self._base, self._tombstone_array
+            delta_ids, delta_vectors = self._delta.snapshot()
+            self._touched = set()
+            thread = threading.Thread(target=self._rebuild, name="ann-rebuild", daemon=True,
+                                      args=(base, tombstones, delta_ids, delta_vectors, meta, lock_file))
+            self._rebuild_thread = thread
+        thread.start()
+        if wait:
+            thread.join()
+        return True
+
+    def reload_if_changed(self) -> bool:
+        """
+        Switch to a generation written by another process.
+
+        The delta and tombstones are dropped, since the new generation was
+        built from that process's view; callers re-add changes made since
+        (``MatchEngine`` reloads profiles updated after ``meta['built_until']``).
+
+        Returns:
+        --------
+        bool
+            True when a different generation was opened.
+        """
+        name = current_generation(self.path)
+        if name is None or name == self._base.name or self._rebuild_thread is not None:
+            return False
+        generation = self._open(name)
+        if generation is None:
+            return False
+        with self._lock:
+            self._base = generation
+            self._delta = MatchIndex(self.dim)
+            self._tombstones = set()
+            self._tombstone_array = np.zeros(0, dtype=np.int64)
+        return True
+
+    def _tombstone(self, user_ids):
+        if user_ids:
+            self._tombstones.update(user_ids)
+            self._tombstone_array = np.fromiter(self._tombstones, dtype=np.int64, count=len(self._tombstones))
+
+    def _open_current(self):
+        name = current_generation(self.path)
+        return self._open(name) if name else None
+
+    def _open(self, name):
+        generation = _Generation.open(self.path, name)
+        if generation.count and generation.meta["dim"] != self.dim:
+            # Written with another encoder configuration; rebuilt from the database instead
+            logger.warning("Ignoring ANN generation %s with dimension %d (expected %d).",
+                           name, generation.meta["dim"], self.dim)
+            return None
+        return generation
+
+    def _rebuild(self, base, tombstones, delta_ids, delta_vectors, meta, lock_file):
+        started = time.perf_counter()
+        try:
+            keep = ~np.isin(base.ids, tombstones) & ~np.isin(base.ids, delta_ids)
+            ids = np.concatenate((np.asarray(base.ids)[keep], delta_ids))
+            vectors = np.concatenate((np.asarray(base.vectors)[keep], delta_vectors))
+            name = write_generation(self.path, ids, vectors, nlist=self.nlist, meta=meta)
+            generation = _Generation.open(self.path, name)
+            with self._lock:
+                touched = self._touched
+                for user_id in delta_ids.tolist():
+                    if user_id not in touched:
+                        self._delta.remove(user_id)  # Now part of the base
+                self._base = generation
+                self._tombstones = set()
+                self._tombstone_array = np.zeros(0, dtype=np.int64)
+                self._tombstone([user_id for user_id in touched if generation.row(user_id) is not None])
+            self.rebuilds += 1
+            logger.info("Rebuilt ANN index %s with %d vectors in %.1fs.", name, len(ids),
+                        time.perf_counter() - started)
+        except Exception as e:
+            logger.error("ANN index rebuild failed: %s", e)
+        finally:
+            with self._lock:
+                self._touched = None
+                self._rebuild_thread = None
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+
+def main(argv=None):
+    """Build the ANN index from the profile table, or print its statistics."""
+    parser = argparse.ArgumentParser(description="Build or inspect the profile ANN index.")
+    parser.add_argument("command", choices=("build", "stats"))
+    parser.add_argument("--path", help="Index directory (default: MATCH_INDEX_PATH).")
+    parser.add_argument("--nlist", type=int, help="Number of clusters (default: about sqrt(N)).")
+    args = parser.parse_args(argv)
+
+    from . import create_app
+    from config.config import get_config
+    app, _, _ = create_app(type("AnnConfig", (get_config(),), {"SQLALCHEMY_ECHO": False}))
+    engine = app.extensions["match_engine"]
+    path = args.path or app.config["MATCH_INDEX_PATH"]
+
+    if args.command == "stats":
+        index = AnnIndex(path, engine.encoder.dim)
+        print(json.dumps({"generation": index.generation, **index.meta}, indent=2))
+        return
+
+    index = AnnIndex(path, engine.encoder.dim, nlist=args.nlist)
+    with app.app_context():
+        from . import db
+        built_until = engine._load(db.engine, None, index)
+    index.rebuild({"built_until": built_until.isoformat() if built_until else None}, wait=True)
+    print(f"{index.generation}: {len(index)} profiles")
+
+
+if __name__ == "__main__":
+    main()
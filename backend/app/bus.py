@@ -0,0 +1,583 @@
+"""
+Message bus: Socket.IO events delivered to a room on every worker, with replay.
+
+An ``emit`` only reaches sockets connected to the process making it, so a reply
+produced somewhere else is lost: a job finished by a worker process, a completion
+that ends after the client reconnected to another worker. Publish it on the bus
+instead::
+
+    message_bus.publish("user:42", "response", {"id": "17", "message": "..."}, message_id=17)
+
+``publish`` emits to the room's sockets in this process at once and appends the
+message to a log shared by the workers. Every other worker runs a listener
+that reads new log entries and emits them to the sockets it holds, so a room
+reaches its sockets wherever they are connected. ``publish_many`` fans a batch
+out with a single log write.
+
+The log lives in a backend:
+
+- ``memory``: in this process only (one worker, tests); nothing is listened for;
+- ``sqlite``: a WAL-mode table shared by the processes of a host;
+- ``redis``: sorted sets on a Redis server, or on the ``local://`` stand-in
+  from ``app.localredis``.
+
+With the shared backends, published messages and acknowledgements are written
+behind by a background thread, in batches of up to ``BUS_BATCH_SIZE`` every
+``BUS_FLUSH_INTERVAL`` seconds, and listeners poll every ``BUS_POLL_INTERVAL``
+seconds.
+
+A message published with the ConversationLog id it answers (``message_id``)
+is kept for ``BUS_RETENTION`` seconds. Clients acknowledge what they have
+shown with an ``ack`` event; on reconnect, the room's messages newer than
+the last acknowledged id (or the ``last_id`` sent in the connect ``auth``)
+are sent again, in order. Other messages are dropped once every listener has
+had time to read them.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from bisect import bisect_right
+from collections import namedtuple
+from types import SimpleNamespace
+
+from .localredis import WatchError, connect as redis_connect
+from .utils import run_blocking, thread_connection
+
+logger = logging.getLogger(__name__)
+
+# ``origin`` identifies the publishing bus instance, whose own sockets were already
+# served by ``publish``; ``message_id`` is the ConversationLog id (None: not replayable)
+Message = namedtuple("Message", "seq room event data message_id origin created_at")
+
+# Messages without a ConversationLog id are only kept this long for slow listeners
+TRANSIENT_RETENTION = 300.0
+
+
+class MemoryBusBackend:
+    """Message log and acknowledgements in a process-local list and dict."""
+
+    blocking = False
+    shared = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._log = []
+        self._seqs = []
+        self._next = 1
+        self._acks = {}
+
+    def append(self, rows) -> int:
+        """Append ``(room, event, data, message_id, origin, created_at)`` rows; return the last sequence number."""
+        with self._lock:
+            for row in rows:
+                self._log.append(Message(self._next, *row))
+                self._seqs.append(self._next)
+                self._next += 1
+            return self._next - 1
+
+    def fetch(self, after, limit) -> list:
+        with self._lock:
+            start = bisect_right(self._seqs, after)
+            return self._log[start:start + limit]
+
+    def last_seq(self) -> int:
+        return self._next - 1
+
+    def replay(self, room, after, limit) -> list:
+        with self._lock:
+            found = [m for m in self._log if m.room == room and m.message_id is not None and m.message_id > after]
+        return sorted(found, key=lambda m: m.message_id)[:limit]
+
+    def ack(self, acks):
+        with self._lock:
+            for room, message_id in acks.items():
+                self._acks[room] = max(self._acks.get(room, 0), message_id)
+
+    def acked(self, room) -> int:
+        return self._acks.get(room, 0)
+
+    def purge(self, before, transient_before) -> int:
+        with self._lock:
+            kept = [m for m in self._log if m.created_at >= (before if m.message_id is not None else transient_before)]
+            removed = len(self._log) - len(kept)
+            self._log, self._seqs = kept, [m.seq for m in kept]
+        return removed
+
+
+class SQLiteBusBackend:
+    """
+    Message log as rows of a WAL-mode SQLite table shared by the processes of a host.
+
+    Attributes:
+    -----------
+    path : str
+        Location of the SQLite database file.
+    """
+
+    blocking = True
+    shared = True
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS bus_messages ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, room TEXT NOT NULL, event TEXT NOT NULL, data TEXT NOT NULL, "
+            "message_id INTEGER, origin TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_bus_messages_room ON bus_messages (room, message_id) "
+                     "WHERE message_id IS NOT NULL")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_bus_messages_created ON bus_messages (created_at)")
+        conn.execute("CREATE TABLE IF NOT EXISTS bus_acks (room TEXT PRIMARY KEY, message_id INTEGER NOT NULL)")
+
+    def _conn(self):
+        # One connection per native thread (and process); sqlite3 connections are not shareable
+        return thread_connection(self._local, self._connect)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def _message(row):
+        return Message(row[0], row[1], row[2], json.loads(row[3]), row[4], row[5], row[6])
+
+    def append(self, rows) -> int:
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO bus_messages (room, event, data, message_id, origin, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(room, event, json.dumps(data), message_id, origin, created_at)
+                 for room, event, data, message_id, origin, created_at in rows],
+            )
+            return conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+
+    def fetch(self, after, limit) -> list:
+        rows = self._conn().execute(
+            "SELECT seq, room, event, data, message_id, origin, created_at FROM bus_messages "
+            "WHERE seq > ? ORDER BY seq LIMIT ?", (after, limit)).fetchall()
+        return [self._message(row) for row in rows]
+
+    def last_seq(self) -> int:
+        return self._conn().execute("SELECT COALESCE(MAX(seq), 0) FROM bus_messages").fetchone()[0]
+
+    def replay(self, room, after, limit) -> list:
+        rows = self._conn().execute(
+            "SELECT seq, room, event, data, message_id, origin, created_at FROM bus_messages "
+            "WHERE room = ? AND message_id IS NOT NULL AND message_id > ? ORDER BY message_id LIMIT ?",
+            (room, after, limit)).fetchall()
+        return [self._message(row) for row in rows]
+
+    def ack(self, acks):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT INTO bus_acks (room, message_id) VALUES (?, ?) "
+                "ON CONFLICT (room) DO UPDATE SET message_id = MAX(message_id, excluded.message_id)",
+                list(acks.items()),
+            )
+
+    def acked(self, room) -> int:
+        row = self._conn().execute("SELECT message_id FROM bus_acks WHERE room = ?", (room,)).fetchone()
+        return row[0] if row else 0
+
+    def purge(self, before, transient_before) -> int:
+        return self._conn().execute(
+            "DELETE FROM bus_messages WHERE created_at < ? OR (message_id IS NULL AND created_at < ?)",
+            (before, transient_before)).rowcount
+
+
+class RedisBusBackend:
+    """
+    Message log in Redis sorted sets: one scored by sequence number for the
+    listeners, and one per room scored by ConversationLog id for replay.
+
+    Sequence numbers are taken and the entries added in one ``WATCH``/``MULTI``
+    transaction, so a listener never sees a number before the ones below it.
+
+    Attributes:
+    -----------
+    client : redis.Redis or LocalRedis
+        Client returned by ``app.localredis.connect``.
+    prefix : str
+        Namespace prepended to every key.
+    """
+
+    blocking = False
+    shared = True
+
+    def __init__(self, client, prefix="bus:"):
+        self.client = client
+        self.prefix = prefix
+
+    def append(self, rows) -> int:
+        seq_key = self.prefix + "seq"
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(seq_key)
+                    first = int(pipe.get(seq_key) or 0) + 1
+                    log, rooms = {}, {}
+                    for seq, (room, event, data, message_id, origin, created_at) in enumerate(rows, first):
+                        member = json.dumps([seq, room, event, data, message_id, origin, created_at])
+                        log[member] = seq
+                        if message_id is not None:
+                            rooms.setdefault(room, {})[member] = message_id
+                    pipe.multi()
+                    pipe.set(seq_key, first + len(rows) - 1)
+                    pipe.zadd(self.prefix + "log", log)
+                    for room, members in rooms.items():
+                        pipe.zadd(self.prefix + "room:" + room, members)
+                    pipe.execute()
+                    return first + len(rows) - 1
+                except WatchError:
+                    continue  # Another process appended first; take the next numbers
+
+    def fetch(self, after, limit) -> list:
+        members = self.client.zrangebyscore(self.prefix + "log", f"({after}", "+inf", start=0, num=limit)
+        return [Message(*json.loads(member)) for member in members]
+
+    def last_seq(self) -> int:
+        return int(self.client.get(self.prefix + "seq") or 0)
+
+    def replay(self, room, after, limit) -> list:
+        members = self.client.zrangebyscore(self.prefix + "room:" + room, f"({after}", "+inf", start=0, num=limit)
+        return [Message(*json.loads(member)) for member in members]
+
+    def ack(self, acks):
+        for room, message_id in acks.items():
+            if message_id > int(self.client.hget(self.prefix + "acks", room) or 0):
+                self.client.hset(self.prefix + "acks", room, message_id)
+
+    def acked(self, room) -> int:
+        return int(self.client.hget(self.prefix + "acks", room) or 0)
+
+    def purge(self, before, transient_before) -> int:
+        # Listeners only need the log briefly; replay reads the per-room sets
+        removed = self._purge(self.prefix + "log", transient_before)
+        for key in list(self.client.scan_iter(match=self.prefix + "room:*")):
+            removed += self._purge(key, before)
+        return removed
+
+    def _purge(self, key, before, chunk=500) -> int:
+        # Entries are in time order: remove from the lowest score up to the first one still needed
+        removed = 0
+        while True:
+            members = self.client.zrangebyscore(key, "-inf", "+inf", start=0, num=chunk, withscores=True)
+            stale = 0
+            for member, _ in members:
+                if json.loads(member)[6] >= before:
+                    break
+                stale += 1
+            if stale:
+                self.client.zremrangebyscore(key, "-inf", members[stale - 1][1])
+                removed += stale
+            if stale < len(members) or not members:
+                return removed
+
+
+class MessageBus:
+    """
+    Flask extension publishing Socket.IO events to rooms across workers.
+
+    Attributes:
+    -----------
+    backend : object
+        One of the ``*BusBackend`` classes above.
+    deliver : callable
+        ``deliver(room, event, data)`` emits to the room's sockets in this process.
+    poll_interval : float
+        Seconds between listener reads of the shared log.
+    flush_interval : float
+        Seconds between batched writes of published messages.
+    retention : float
+        Seconds replayable messages are kept.
+    replay_limit : int
+        Messages sent at most when a client reconnects.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.backend = MemoryBusBackend()
+        self.deliver = None
+        self.poll_interval = 0.05
+        self.flush_interval = 0.01
+        self.batch_size = 500
+        self.retention = 86400.0
+        self.replay_limit = 100
+        self._metrics = None
+        self._pending = []
+        self._acks = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._origin = None
+        self._origin_pid = None
+        self._last_purge = 0.0
+        self.reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, deliver=None, metrics=None):
+        """
+        Configure the bus from the ``BUS_*`` settings of the Flask app.
+
+        Parameters:
+        -----------
+        app : Flask
+            The Flask application.
+        deliver : callable, optional
+            Called as ``deliver(room, event, data)`` to emit to this process's sockets.
+        metrics : Metrics, optional
+            Registry receiving published, delivered and replayed message counts.
+        """
+        self.stop()
+        config = app.config
+        self.app = app
+        self.deliver = deliver
+        self.poll_interval = float(config.get("BUS_POLL_INTERVAL", self.poll_interval))
+        self.flush_interval = float(config.get("BUS_FLUSH_INTERVAL", self.flush_interval))
+        self.batch_size = int(config.get("BUS_BATCH_SIZE", self.batch_size))
+        self.retention = float(config.get("BUS_RETENTION", self.retention))
+        self.replay_limit = int(config.get("BUS_REPLAY_LIMIT", self.replay_limit))
+        backend = config.get("BUS_BACKEND", "memory")
+        if backend == "sqlite":
+            self.backend = SQLiteBusBackend(config.get("BUS_SQLITE_PATH", "bus.db"))
+        elif backend == "redis":
+            self.backend = RedisBusBackend(redis_connect(config.get("BUS_REDIS_URL", "local://bus")))
+        else:
+            self.backend = MemoryBusBackend()
+        if metrics is not None:
+            self._metrics = SimpleNamespace(
+                enabled=lambda: metrics.enabled,
+                messages=metrics.counter("spokesperson_bus_messages", "Bus messages by what happened to them.",
+                                         ("outcome",)),
+            )
+        if "bus" not in app.extensions:
+            app.before_request(self._ensure_started)
+        self.reset_stats()
+        app.extensions["bus"] = self
+
+    def reset_stats(self):
+        self.published = 0
+        self.delivered = 0
+        self.replayed = 0
+
+    @property
+    def distributed(self) -> bool:
+        """Whether other processes read the log (and emits should stay local)."""
+        return self.backend.shared
+
+    @property
+    def origin(self) -> str:
+        """Identity of this bus in this process; a forked child gets its own."""
+        if self._origin_pid != os.getpid():
+            self._origin, self._origin_pid = uuid.uuid4().hex, os.getpid()
+        return self._origin
+
+    @property
+    def depth(self) -> int:
+        """Published messages not yet written to the shared log."""
+        return len(self._pending)
+
+    def publish(self, room, event, data, message_id=None):
+        """
+        Emit ``event`` to ``room`` here and on every other worker.
+
+        Parameters:
+        -----------
+        room : str
+            Socket.IO room: a socket sid or a ``user:<id>`` room.
+        event : str
+            Socket.IO event name.
+        data : dict
+            JSON-serialisable payload.
+        message_id : int, optional
+            ConversationLog id the message answers; makes it replayable.
+        """
+        self.publish_many([(room, event, data, message_id)])
+
+    def publish_many(self, messages):
+        """Publish ``(room, event, data, message_id)`` tuples with one log write."""
+        for room, event, data, _ in messages:
+            self._deliver(room, event, data)
+        origin, now = self.origin, time.time()
+        rows = [(room, event, data, message_id, origin, now) for room, event, data, message_id in messages]
+        self.published += len(rows)
+        self._count("published", len(rows))
+        if not self.distributed:
+            self.backend.append(rows)
+            return
+        with self._lock:
+            self._pending.extend(rows)
+            full = len(self._pending) >= self.batch_size
+        self._ensure_started()
+        if full:
+            self._wake.set()
+
+    def ack(self, room, message_id):
+        """Record that ``room``'s client has shown every message up to ``message_id``."""
+        if not self.distributed:
+            self.backend.ack({room: message_id})
+            return
+        with self._lock:
+            self._acks[room] = max(self._acks.get(room, 0), message_id)
+        self._ensure_started()
+
+    def acked(self, room) -> int:
+        """The highest ConversationLog id acknowledged for ``room`` (0 if none)."""
+        return max(self._acks.get(room, 0), self._call(self.backend.acked, room))
+
+    def replay(self, room, after=None, to=None) -> int:
+        """
+        Send ``room``'s replayable messages newer than ``after`` again.
+
+        Parameters:
+        -----------
+        room : str
+            Room whose messages are replayed.
+        after : int, optional
+            Last ConversationLog id the client has (default: its last acknowledgement).
+        to : str, optional
+            Room or sid to send them to (default: ``room``).
+
+        Returns:
+        --------
+        int
+            Messages sent.
+        """
+        self.flush()
+        if after is None:
+            after = self.acked(room)
+        messages = self._call(self.backend.replay, room, after, self.replay_limit)
+        for message in messages:
+            self._deliver(to or room, message.event, message.data)
+        self.replayed += len(messages)
+        self._count("replayed", len(messages))
+        return len(messages)
+
+    def flush(self):
+        """Write pending messages and acknowledgements to the shared log now."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+                acks, self._acks = self._acks, {}
+            try:
+                if rows:
+                    self._call(self.backend.append, rows)
+                    rows = []
+                if acks:
+                    self._call(self.backend.ack, acks)
+            except Exception:
+                # Keep what was not written for the next flush, ahead of anything published since
+                with self._lock:
+                    self._pending[:0] = rows
+                    for room, message_id in acks.items():
+                        self._acks[room] = max(self._acks.get(room, 0), message_id)
+                raise
+
+    def purge(self, older_than=None) -> int:
+        """Delete messages older than ``older_than`` seconds (default: ``retention``)."""
+        now = time.time()
+        return self._call(self.backend.purge, now - (self.retention if older_than is None else older_than),
+                          now - TRANSIENT_RETENTION)
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "pid": os.getpid(),
+            "last_seq": self._call(self.backend.last_seq),
+            "pending": self.depth,
+            "published": self.published,
+            "delivered": self.delivered,
+            "replayed": self.replayed,
+        }
+
+    def start(self):
+        """Start the writer and the listener of a shared backend."""
+        with self._lock:
+            if self._threads or not self.distributed:
+                return
+            self._stopping.clear()
+            self._threads = [threading.Thread(target=self._flush_loop, name="bus-writer", daemon=True),
+                             threading.Thread(target=self._listen, args=(self._call(self.backend.last_seq),),
+                                              name="bus-listener", daemon=True)]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self):
+        """Stop the background threads after writing what is pending."""
+        threads, self._threads = self._threads, []
+        if threads:
+            self._stopping.set()
+            self._wake.set()
+            for thread in threads:
+                thread.join()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.warning("Writing pending bus messages failed: %s", e)
+
+    def _ensure_started(self):
+        if not self._threads and self.distributed:
+            self.start()
+
+    def _call(self, method, *args):
+        return run_blocking(method, *args) if self.backend.blocking else method(*args)
+
+    def _deliver(self, room, event, data):
+        if self.deliver is not None:
+            self.deliver(room, event, data)
+
+    def _count(self, outcome, amount):
+        m = self._metrics
+        if m is not None and m.enabled() and amount:
+            m.messages.inc(outcome, amount=amount)
+
+    def _flush_loop(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Writing bus messages failed: %s", e)  # Kept pending for the next round
+            if time.monotonic() - self._last_purge > 60:
+                self._last_purge = time.monotonic()
+                try:
+                    self.purge()
+                except Exception as e:
+                    logger.warning("Purging bus messages failed: %s", e)
+
+    def _listen(self, after):
+        origin = self.origin
+        while not self._stopping.is_set():
+            try:
+                messages = self._call(self.backend.fetch, after, self.batch_size)
+            except Exception as e:
+                logger.error("Reading bus messages failed: %s", e)
+                messages = []
+            delivered = 0
+            for message in messages:
+                after = message.seq
+                if message.origin != origin:
+                    try:
+                        self._deliver(message.room, message.event, message.data)
+                        delivered += 1
+                    except Exception as e:
+                        logger.warning("Delivering bus message %s failed: %s", message.seq, e)
+            self.delivered += delivered
+            self._count("delivered", delivered)
+            if len(messages) < self.batch_size:
+                self._stopping.wait(self.poll_interval)
@@ -0,0 +1,453 @@
+"""
+Completion cache sitting in front of the LLM client.
+
+Completions are keyed on a normalized prompt (model, messages and max_tokens,
+with whitespace and case folded) so trivially different inputs share an entry.
+An optional semantic key adds fuzzy hits: ``tokens`` matches prompts with the
+same set of words regardless of order and punctuation, and an ``embedder``
+callable can be attached for cosine-similarity lookups over recent entries.
+
+Entries live in an in-process LRU with TTL eviction and, optionally, in a
+shared SQLite file so every worker on the host benefits from a hit. Concurrent
+misses for the same key are coalesced (single-flight): one caller computes the
+completion and the others wait for its result.
+"""
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterator, Optional
+
+_WHITESPACE = re.compile(r"\s+")
+_WORD = re.compile(r"[\w']+")
+
+
+def normalize_text(text) -> str:
+    """Collapse whitespace and case-fold ``text`` for key construction."""
+    return _WHITESPACE.sub(" ", str(text)).strip().casefold()
+
+
+class MemoryBackend:
+    """
+    Thread-safe LRU mapping with per-entry expiry.
+
+    Attributes:
+    -----------
+    max_entries : int
+        Entries beyond this count evict the least recently used one.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def items(self):
+        """Snapshot of live ``(key, value)`` pairs, most recent last."""
+        now = time.time()
+        with self._lock:
+            return [(k, v) for k, (v, expires_at) in self._entries.items() if expires_at > now]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """
+    Cache table in a SQLite file shared by every worker process on the host.
+
+    Attributes:
+    -----------
+    path : str
+        Location of the SQLite database file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connect()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completion_cache "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._writes = 0
+
+    def _connect(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5, isolation_level=None)
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._pid = os.getpid()
+
+    def _db(self):
+        # A forked child (see prefork.py) must not use the parent's connection
+        if self._pid != os.getpid():
+            self._connect()
+        return self._conn
+
+    def get(self, key) -> Optional[str]:
+        with self._lock:
+            row = self._db().execute(
+                "SELECT value FROM completion_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._db().execute(
+                "INSERT OR REPLACE INTO completion_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl),
+            )
+            self._writes += 1
+            if self._writes % 256 == 0:
+                # Purge expired rows occasionally instead of on every write
+                self._db().execute("DELETE FROM completion_cache WHERE expires_at <= ?", (time.time(),))
+
+    def clear(self):
+        with self._lock:
+            self._db().execute("DELETE FROM completion_cache")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _Flight:
+    """A completion being computed on behalf of every caller waiting on its key."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class CompletionCache:
+    """
+    Flask extension caching LLM completions with single-flight deduplication.
+
+    Attributes:
+    -----------
+    enabled : bool
+        When False every lookup misses and nothing is stored.
+    ttl : float
+        Seconds an entry stays valid.
+    semantic : str
+        Fuzzy key strategy: ``exact`` (none) or ``tokens`` (word-set match).
+    embedder : callable, optional
+        ``text -> list[float]``; when set, misses fall back to a cosine lookup.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.ttl = 3600.0
+        self.semantic = "exact"
+        self.embedder: Optional[Callable] = None
+        self.similarity_threshold = 0.95
+        self.memory = MemoryBackend()
+        self.shared = None
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self._embeddings = OrderedDict()
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Configure the cache from the ``CACHE_*`` settings of the Flask app.
+
+        Parameters:
+        -----------
+        app : Flask
+            The Flask application.
+        """
+        config = app.config
+        self.enabled = bool(config.get("CACHE_ENABLED", True))
+        self.ttl = float(config.get("CACHE_TTL", self.ttl))
+        self.semantic = config.get("CACHE_SEMANTIC_KEY", "exact")
+        self.similarity_threshold = float(config.get("CACHE_SIMILARITY_THRESHOLD", self.similarity_threshold))
+        self.memory = MemoryBackend(int(config.get("CACHE_MAX_ENTRIES", 1024)))
+        if self.shared is not None:
+            self.shared.close()
+        self.shared = None
+        if config.get("CACHE_BACKEND", "memory") == "sqlite":
+            self.shared = SQLiteBackend(config.get("CACHE_SQLITE_PATH", "completion_cache.db"))
+        self._embeddings.clear()
+        self.reset_stats()
+        app.extensions["completion_cache"] = self
+
+    def reset_stats(self):
+        """Zero the hit/miss and latency counters."""
+        with self._stats_lock:
+            self._stats = {
+                "hits": 0,
+                "semantic_hits": 0,
+                "shared_hits": 0,
+                "misses": 0,
+                "coalesced": 0,
+                "lookup_seconds": 0.0,
+                "upstream_calls": 0,
+                "upstream_seconds": 0.0,
+            }
+
+    def stats(self) -> dict:
+        """
+        Snapshot of the cache counters.
+
+        Returns:
+        --------
+        dict
+            Counters plus derived ``hit_rate`` and mean upstream latency.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["upstream_mean_seconds"] = (
+            stats["upstream_seconds"] / stats["upstream_calls"] if stats["upstream_calls"] else 0.0
+        )
+        stats["entries"] = len(self.memory)
+        return stats
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    @staticmethod
+    def key_for(model, messages, max_tokens, **params) -> str:
+        """
+        Exact cache key for a normalized prompt.
+
+        Parameters:
+        -----------
+        model : str
+            Model name.
+        messages : list
+            Chat messages; roles are kept and content is normalized.
+        max_tokens : int
+            Completion length bound, part of the key since it changes the output.
+
+        Returns:
+        --------
+        str
+            Hex digest identifying the request.
+        """
+        canonical = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "messages": [[m.get("role"), normalize_text(m.get("content", ""))] for m in messages],
+            "params": params,
+        }
+        return "x:" + hashlib.sha256(json.dumps(canonical, sort_keys=True).encode()).hexdigest()
+
+    def semantic_key_for(self, model, messages, max_tokens) -> Optional[str]:
+        """Fuzzy key grouping prompts that differ only in word order or punctuation."""
+        if self.semantic != "tokens":
+            return None
+        words = []
+        for message in messages:
+            words.append(message.get("role", ""))
+            words.extend(sorted(set(_WORD.findall(normalize_text(message.get("content", ""))))))
+        canonical = json.dumps([model, max_tokens, words])
+        return "s:" + hashlib.sha256(canonical.encode()).hexdigest()
+
+    def get(self, key) -> Optional[str]:
+        """Look ``key`` up in memory, then in the shared backend."""
+        value = self.memory.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self._count("shared_hits")
+                self.memory.set(key, value, self.ttl)
+        return value
+
+    def set(self, key, value):
+        """Store ``value`` under ``key`` in every configured tier."""
+        self.memory.set(key, value, self.ttl)
+        if self.shared is not None:
+            self.shared.set(key, value, self.ttl)
+
+    def lookup(self, model, messages, max_tokens, **params) -> Optional[str]:
+        """
+        Return a cached completion for the prompt, trying exact then fuzzy keys.
+
+        Returns:
+        --------
+        str or None
+            The cached completion, or None on a miss.
+        """
+        if not self.enabled:
+            return None
+        start = time.perf_counter()
+        value = self.get(self.key_for(model, messages, max_tokens, **params))
+        if value is None:
+            value = self._fuzzy_get(model, messages, max_tokens)
+            if value is not None:
+                self._count("semantic_hits")
+        self._count("lookup_seconds", time.perf_counter() - start)
+        self._count("hits" if value is not None else "misses")
+        return value
+
+    def store(self, model, messages, max_tokens, value, **params):
+        """Store a completion under its exact key and, if enabled, its fuzzy keys."""
+        if not self.enabled or not getattr(value, "cacheable", True):
+            return  # Canned fallback replies (see app/providers.py) must not outlive the outage
+        value = str(value)  # A plain string, so hits do not report the provider of the original call
+        self.set(self.key_for(model, messages, max_tokens, **params), value)
+        semantic_key = self.semantic_key_for(model, messages, max_tokens)
+        if semantic_key:
+            self.set(semantic_key, value)
+        if self.embedder is not None:
+            self._embeddings[self._prompt_text(messages)] = (self.embedder(self._prompt_text(messages)), value)
+            while len(self._embeddings) > self.memory.max_entries:
+                self._embeddings.popitem(last=False)
+
+    def get_or_compute(self, model, messages, max_tokens, compute: Callable[[], str], **params) -> str:
+        """
+        Return the cached completion or compute it once for all concurrent callers.
+
+        Parameters:
+        -----------
+        model : str
+            Model name.
+        messages : list
+            Chat messages.
+        max_tokens : int
+            Completion length bound.
+        compute : callable
+            Zero-argument function performing the upstream call on a miss.
+
+        Returns:
+        --------
+        str
+            The completion text. Errors raised by ``compute`` propagate to every
+            caller waiting on the same key and are never cached.
+        """
+        cached = self.lookup(model, messages, max_tokens, **params)
+        if cached is not None:
+            return cached
+        if not self.enabled:
+            return self._timed(compute)
+
+        key = self.key_for(model, messages, max_tokens, **params)
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            self._count("coalesced")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = self._timed(compute)
+            self.store(model, messages, max_tokens, flight.value, **params)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def stream_through(self, model, messages, max_tokens, open_stream: Callable[[], Iterator[str]],
+                       **params) -> Iterator[str]:
+        """
+        Serve a streaming request from the cache, or relay and record a fresh stream.
+
+        A hit is yielded as a single chunk. On a miss the tokens are forwarded as
+        they arrive and the joined text is stored once the stream completes.
+        """
+        cached = self.lookup(model, messages, max_tokens, **params)
+        if cached is not None:
+            yield cached
+            return
+        tokens = []
+        start = time.perf_counter()
+        stream = open_stream()
+        try:
+            for token in stream:
+                tokens.append(token)
+                yield token
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()
+        self._count("upstream_calls")
+        self._count("upstream_seconds", time.perf_counter() - start)
+        if getattr(stream, "cacheable", True):
+            self.store(model, messages, max_tokens, "".join(tokens).strip(), **params)
+
+    def clear(self):
+        """Drop every entry from all tiers."""
+        self.memory.clear()
+        self._embeddings.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def _timed(self, compute) -> str:
+        start = time.perf_counter()
+        try:
+            return compute()
+        finally:
+            self._count("upstream_calls")
+            self._count("upstream_seconds", time.perf_counter() - start)
+
+    def _fuzzy_get(self, model, messages, max_tokens) -> Optional[str]:
+        semantic_key = self.semantic_key_for(model, messages, max_tokens)
+        if semantic_key:
+            value = self.get(semantic_key)
+            if value is not None:
+                return value
+        if self.embedder is None or not self._embeddings:
+            return None
+        query = self.embedder(self._prompt_text(messages))
+        best, best_score = None, self.similarity_threshold
+        for vector, value in list(self._embeddings.values()):
+            score = _cosine(query, vector)
+            if score >= best_score:
+                best, best_score = value, score
+        return best
+
+    @staticmethod
+    def _prompt_text(messages) -> str:
+        return "\n".join(normalize_text(m.get("content", "")) for m in messages)
+
+
+def _cosine(a, b) -> float:
+    """Cosine similarity of two equal-length vectors."""
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
@@ -0,0 +1,385 @@
+"""
+Prompt assembly for multi-turn LLM requests.
+
+``ContextManager.build`` turns a user's new message into the chat messages
+sent upstream: a system prompt, a rolling summary of older turns, as many
+recent turns as fit in ``CONTEXT_MAX_PROMPT_TOKENS`` and the new message.
+
+Each conversation's turns are cached in memory under its session key (the
+socket state key, or the signed-in user for HTTP requests). On a cold cache a
+signed-in user's turns are loaded from ConversationLog through the
+``(user_id, timestamp, id)`` index. Without a key the message is sent with
+the system prompt alone, so requests with no identity never share a history.
+ConversationLog only holds user messages, so assistant replies are added
+with ``record_reply`` while the session is cached.
+
+Turns that no longer fit are folded into the summary in batches, down to
+``CONTEXT_COMPACT_RATIO`` of the room available. The summary is therefore
+rewritten only every few turns, not on every request. The default
+summarizer is extractive and local; ``CONTEXT_SUMMARIZER=llm`` asks the model
+for a condensed summary and falls back to the extractive one on errors.
+
+Tokens are counted with tiktoken when it is installed, and otherwise with a
+close word-piece estimate. Counts are memoized per string, so a cached turn
+is tokenized only once.
+"""
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+from sqlalchemy import select  # type: ignore
+
+from .models import ConversationLog
+from .utils import run_blocking
+
+logger = logging.getLogger(__name__)
+
+# Chat formatting overhead, as counted for OpenAI chat models
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+_PIECES = re.compile(r"\w+|[^\w\s]")
+_SENTENCE = re.compile(r"(?<=[.!?])\s")
+
+Turn = namedtuple("Turn", "id role content tokens")
+
+
+class TokenCounter:
+    """
+    Counts tokens with tiktoken, or estimates them when it is not installed.
+
+    Attributes:
+    -----------
+    exact : bool
+        True when counts come from the model's tokenizer.
+    """
+
+    def __init__(self, encoding="cl100k_base", cache_size=8192):
+        try:
+            import tiktoken  # type: ignore
+            self._encode = tiktoken.get_encoding(encoding).encode
+            self.exact = True
+        except (ImportError, ValueError):
+            self._encode = None
+            self.exact = False
+        self.count = lru_cache(maxsize=cache_size)(self._count)
+
+    def _count(self, text) -> int:
+        if self._encode is not None:
+            return len(self._encode(text))
+        # BPE vocabularies hold most short words whole and split long ones every ~6 characters
+        return sum(1 + (len(piece) - 1) // 6 for piece in _PIECES.findall(text))
+
+    def message(self, content) -> int:
+        """Tokens taken by one chat message with ``content``."""
+        return MESSAGE_OVERHEAD + self.count(content)
+
+
+class ExtractiveSummarizer:
+    """Keeps the first sentence of each turn, dropping the oldest lines past the token limit."""
+
+    max_words = 25
+
+    def summarize(self, summary, turns, max_tokens, counter) -> str:
+        lines = summary.splitlines() if summary else []
+        for turn in turns:
+            sentence = _SENTENCE.split(turn.content.strip(), 1)[0]
+            words = sentence.split()
+            if len(words) > self.max_words:
+                sentence = " ".join(words[:self.max_words]) + "..."
+            lines.append(f"{'User' if turn.role == 'user' else 'Assistant'}: {sentence}")
+        while lines and counter.count("\n".join(lines)) > max_tokens:
+            lines.pop(0)
+        return "\n".join(lines)
+
+
+class LLMSummarizer:
+    """Asks the model to fold evicted turns into the summary; extractive on failure."""
+
+    def __init__(self, client, fallback=None):
+        self.client = client
+        self.fallback = fallback or ExtractiveSummarizer()
+
+    def summarize(self, summary, turns, max_tokens, counter) -> str:
+        transcript = "\n".join(f"{turn.role}: {turn.content}" for turn in turns)
+        messages = [
+            {"role": "system", "content": (
+                "Update the running summary of a conversation with the new turns. Keep names, preferences "
+                f"and facts the user shared. Reply with the summary only, under {max_tokens} tokens.")},
+            {"role": "user", "content": f"Summary so far:\n{summary or '(none)'}\n\nNew turns:\n{transcript}"},
+        ]
+        try:
+            # No canned fallback: it would be stored as the summary
+            return self.client.complete(messages, max_tokens=max_tokens, fallback=False, temperature=0)
+        except Exception as e:
+            logger.warning("LLM summary failed, using the extractive summary: %s", e)
+            return self.fallback.summarize(summary, turns, max_tokens, counter)
+
+
+class ContextWindow:
+    """
+    The assembled prompt and its per-request metrics.
+
+    Attributes:
+    -----------
+    messages : list
+        Chat messages to send upstream.
+    prompt_tokens : int
+        Tokens in ``messages``.
+    tokens_saved : int
+        Tokens a prompt replaying the whole session would have added.
+    assembly_ms : float
+        Time spent assembling the prompt.
+    turns : int
+        Earlier turns included verbatim.
+    summarized_turns : int
+        Earlier turns represented by the summary.
+    """
+
+    __slots__ = ("messages", "prompt_tokens", "tokens_saved", "assembly_ms", "turns", "summarized_turns")
+
+    def __init__(self, messages, prompt_tokens, tokens_saved, assembly_ms, turns, summarized_turns):
+        self.messages = messages
+        self.prompt_tokens = prompt_tokens
+        self.tokens_saved = tokens_saved
+        self.assembly_ms = assembly_ms
+        self.turns = turns
+        self.summarized_turns = summarized_turns
+
+    def metrics(self) -> dict:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "prompt_tokens_saved": self.tokens_saved,
+            "assembly_ms": round(self.assembly_ms, 3),
+            "turns": self.turns,
+            "summarized_turns": self.summarized_turns,
+        }
+
+    def headers(self) -> dict:
+        return {
+            "X-Prompt-Tokens": str(self.prompt_tokens),
+            "X-Prompt-Tokens-Saved": str(self.tokens_saved),
+            "Server-Timing": f"context;dur={self.assembly_ms:.3f}",
+        }
+
+
+class _Session:
+    __slots__ = ("turns", "summary", "summary_tokens", "summarized", "history_tokens", "touched", "lock")
+
+    def __init__(self, turns):
+        self.turns = turns
+        self.summary = ""
+        self.summary_tokens = 0
+        self.summarized = 0
+        self.history_tokens = sum(turn.tokens for turn in turns)
+        self.touched = time.monotonic()
+        self.lock = threading.Lock()
+
+
+class ContextManager:
+    """
+    Flask extension assembling token-budgeted prompts from cached conversation history.
+
+    Attributes:
+    -----------
+    max_prompt_tokens : int
+        Budget for the whole prompt, system prompt and summary included.
+    summary_max_tokens : int
+        Upper bound on the rolling summary.
+    history_turns : int
+        Turns loaded from ConversationLog when a session is not cached.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.system_prompt = ""
+        self.max_prompt_tokens = 1000
+        self.summary_max_tokens = 200
+        self.compact_ratio = 0.75
+        self.history_turns = 40
+        self.session_ttl = 3600.0
+        self.max_sessions = 10000
+        self.counter = TokenCounter()
+        self.summarizer = ExtractiveSummarizer()
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Configure the manager from the ``CONTEXT_*`` settings of the Flask app.
+
+        Parameters:
+        -----------
+        app : Flask
+            The Flask application.
+        """
+        config = app.config
+        self.enabled = config.get("CONTEXT_ENABLED", True)
+        self.system_prompt = config.get("CONTEXT_SYSTEM_PROMPT", "")
+        self.max_prompt_tokens = int(config.get("CONTEXT_MAX_PROMPT_TOKENS", self.max_prompt_tokens))
+        self.summary_max_tokens = int(config.get("CONTEXT_SUMMARY_MAX_TOKENS", self.summary_max_tokens))
+        self.compact_ratio = float(config.get("CONTEXT_COMPACT_RATIO", self.compact_ratio))
+        self.history_turns = int(config.get("CONTEXT_HISTORY_TURNS", self.history_turns))
+        self.session_ttl = float(config.get("CONTEXT_SESSION_TTL", self.session_ttl))
+        self.max_sessions = int(config.get("CONTEXT_MAX_SESSIONS", self.max_sessions))
+        self.counter = TokenCounter(config.get("CONTEXT_TOKENIZER", "cl100k_base"))
+        if config.get("CONTEXT_SUMMARIZER", "extractive") == "llm":
+            from . import llm
+            self.summarizer = LLMSummarizer(llm)
+        else:
+            self.summarizer = ExtractiveSummarizer()
+        self._sessions = OrderedDict()
+        self.reset_stats()
+        app.extensions["context_manager"] = self
+
+    def reset_stats(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.tokens_saved = 0
+        self.assembly_seconds = 0.0
+        self.compactions = 0
+        self.session_loads = 0
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "prompt_tokens_saved": self.tokens_saved,
+            "avg_assembly_ms": round(self.assembly_seconds * 1000 / self.requests, 3) if self.requests else 0.0,
+            "compactions": self.compactions,
+            "session_loads": self.session_loads,
+            "sessions": len(self._sessions),
+            "exact_token_counts": self.counter.exact,
+        }
+
+    def build(self, key, user_id, user_input, message_id=None) -> ContextWindow:
+        """
+        Assemble the prompt for ``user_input`` and add it to the session's turns.
+
+        Parameters:
+        -----------
+        key : str or None
+            Session key the turns are cached under; None for a one-off prompt
+            with no history.
+        user_id : int or None
+            Owner of the ConversationLog history loaded on a cold cache; None
+            (an anonymous client) starts the session empty.
+        user_input : str
+            The new user message.
+        message_id : int, optional
+            ConversationLog id of ``user_input``, skipped when loading history.
+
+        Returns:
+        --------
+        ContextWindow
+            Messages to send and the request's metrics.
+        """
+        start = time.perf_counter()
+        current = Turn(message_id, "user", user_input, self.counter.message(user_input))
+        if not self.enabled:
+            messages = [{"role": "user", "content": user_input}]
+            return ContextWindow(messages, current.tokens + REPLY_OVERHEAD, 0,
+                                 (time.perf_counter() - start) * 1000, 0, 0)
+
+        session = self._session(key, user_id, message_id) if key is not None else _Session([])
+        with session.lock:
+            system_tokens = self.counter.message(self.system_prompt) if self.system_prompt else 0
+            fixed = system_tokens + current.tokens + REPLY_OVERHEAD
+            available = self.max_prompt_tokens - fixed - self.summary_max_tokens - MESSAGE_OVERHEAD
+            if sum(turn.tokens for turn in session.turns) > available:
+                self._compact(session, max(0, int(available * self.compact_ratio)))
+
+            messages = [{"role": "system", "content": self.system_prompt}] if self.system_prompt else []
+            prompt_tokens = fixed
+            if session.summary:
+                messages.append({"role": "system", "content": f"Earlier in this conversation:\n{session.summary}"})
+                prompt_tokens += session.summary_tokens
+            for turn in session.turns:
+                messages.append({"role": turn.role, "content": turn.content})
+                prompt_tokens += turn.tokens
+            messages.append({"role": "user", "content": user_input})
+
+            saved = max(0, fixed + session.history_tokens - prompt_tokens)
+            window = ContextWindow(messages, prompt_tokens, saved, 0.0, len(session.turns), session.summarized)
+            session.turns.append(current)
+            session.history_tokens += current.tokens
+
+        window.assembly_ms = (time.perf_counter() - start) * 1000
+        self.requests += 1
+        self.prompt_tokens += window.prompt_tokens
+        self.tokens_saved += window.tokens_saved
+        self.assembly_seconds += window.assembly_ms / 1000
+        return window
+
+    def record_reply(self, key, text):
+        """Add the assistant's reply to a cached session."""
+        with self._lock:
+            session = self._sessions.get(key)
+        if session is None or not text:
+            return
+        with session.lock:
+            turn = Turn(None, "assistant", text, self.counter.message(text))
+            session.turns.append(turn)
+            session.history_tokens += turn.tokens
+
+    def forget(self, key):
+        """Drop a cached session (e.g. when its socket disconnects)."""
+        with self._lock:
+            self._sessions.pop(key, None)
+
+    def _session(self, key, user_id, message_id):
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None and now - session.touched < self.session_ttl:
+                session.touched = now
+                self._sessions.move_to_end(key)
+                return session
+        turns = self._load_turns(user_id, message_id) if self.history_turns and user_id is not None else []
+        with self._lock:
+            # Another request may have loaded it meanwhile; keep the first one
+            session = self._sessions.get(key)
+            if session is None or now - session.touched >= self.session_ttl:
+                session = self._sessions[key] = _Session(turns)
+                self.session_loads += 1
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session
+
+    def _load_turns(self, user_id, message_id):
+        """The user's latest logged messages, oldest first, served by the history index."""
+        from . import db
+        stmt = (select(ConversationLog.id, ConversationLog.message)
+                .where(ConversationLog.user_id == user_id)
+                .order_by(ConversationLog.timestamp.desc(), ConversationLog.id.desc())
+                .limit(self.history_turns + 1))
+        rows = run_blocking(_fetch_all, db.engine, stmt)
+        rows = [row for row in rows if row.id != message_id][:self.history_turns]
+        return [Turn(row.id, "user", row.message, self.counter.message(row.message)) for row in reversed(rows)]
+
+    def _compact(self, session, target):
+        """Summarize the oldest turns until the rest fit in ``target`` tokens."""
+        total = sum(turn.tokens for turn in session.turns)
+        evicted = 0
+        while evicted < len(session.turns) and total > target:
+            total -= session.turns[evicted].tokens
+            evicted += 1
+        if not evicted:
+            return
+        old, session.turns = session.turns[:evicted], session.turns[evicted:]
+        session.summary = self.summarizer.summarize(session.summary, old, self.summary_max_tokens, self.counter)
+        session.summary_tokens = self.counter.message(f"Earlier in this conversation:\n{session.summary}")
+        session.summarized += evicted
+        self.compactions += 1
+
+
+def _fetch_all(engine, stmt):
+    with engine.connect() as conn:
+        return conn.execute(stmt).all()
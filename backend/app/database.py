@@ -0,0 +1,95 @@
+"""
+Database engine configuration.
+
+``engine_options`` turns the ``DB_*`` settings into SQLAlchemy engine options
+for the configured backend: explicit pool sizing, pre-ping and recycling for
+server databases such as PostgreSQL, and a busy timeout for SQLite.
+``configure_engine`` then sets the SQLite pragmas on every new connection so
+readers do not wait for writers (WAL) and commits skip the per-transaction
+fsync that WAL makes unnecessary (``synchronous=NORMAL``).
+"""
+from sqlalchemy import event  # type: ignore
+from sqlalchemy.engine import make_url  # type: ignore
+from sqlalchemy.pool import NullPool, StaticPool  # type: ignore
+
+# Pragma values are interpolated into SQL, so only these are accepted
+JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+SYNCHRONOUS_LEVELS = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+
+def engine_options(config) -> dict:
+    """
+    Build ``SQLALCHEMY_ENGINE_OPTIONS`` from the ``DB_*`` settings.
+
+    Options already present in ``SQLALCHEMY_ENGINE_OPTIONS`` win, so a config
+    class or ``create_app`` can still force e.g. ``NullPool``.
+
+    Parameters:
+    -----------
+    config : Mapping
+        The Flask config.
+
+    Returns:
+    --------
+    dict
+        Engine options for Flask-SQLAlchemy.
+    """
+    options = dict(config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+    options.setdefault("pool_pre_ping", config.get("DB_POOL_PRE_PING", True))
+
+    if url.get_backend_name() == "sqlite":
+        # sqlite3's busy handler retries a locked database instead of failing at once
+        connect_args = options.setdefault("connect_args", {})
+        connect_args.setdefault("timeout", config.get("SQLITE_BUSY_TIMEOUT", 5000) / 1000)
+        if url.database in (None, "", ":memory:"):
+            return options  # A single shared connection (StaticPool); nothing to size
+
+    if options.get("poolclass") in (NullPool, StaticPool):
+        return options
+
+    options.setdefault("pool_size", config.get("DB_POOL_SIZE", 10))
+    options.setdefault("max_overflow", config.get("DB_MAX_OVERFLOW", 20))
+    options.setdefault("pool_timeout", config.get("DB_POOL_TIMEOUT", 30))
+    options.setdefault("pool_recycle", config.get("DB_POOL_RECYCLE", 1800))
+    return options
+
+
+def configure_engine(engine, config):
+    """
+    Apply per-connection settings to ``engine``.
+
+    Parameters:
+    -----------
+    engine : sqlalchemy.engine.Engine
+        The engine created by Flask-SQLAlchemy.
+    config : Mapping
+        The Flask config (``SQLITE_*`` keys; an empty value leaves that pragma alone).
+
+    Raises:
+    -------
+    ValueError
+        When a pragma value is not one SQLite accepts.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    journal_mode = (config.get("SQLITE_JOURNAL_MODE") or "").upper()
+    synchronous = (config.get("SQLITE_SYNCHRONOUS") or "").upper()
+    busy_timeout = int(config.get("SQLITE_BUSY_TIMEOUT", 5000))
+    if journal_mode and journal_mode not in JOURNAL_MODES:
+        raise ValueError(f"Unsupported SQLITE_JOURNAL_MODE: {journal_mode}")
+    if synchronous and synchronous not in SYNCHRONOUS_LEVELS:
+        raise ValueError(f"Unsupported SQLITE_SYNCHRONOUS: {synchronous}")
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            if journal_mode:
+                cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+            if synchronous:
+                cursor.execute(f"PRAGMA synchronous={synchronous}")
+            cursor.execute(f"PRAGMA busy_timeout={busy_timeout}")
+        finally:
+            cursor.close()
@@ -0,0 +1,246 @@
+"""
+Local fake of the chat-completions API for tests and benchmarks.
+
+The server speaks just enough of the OpenAI ``/chat/completions`` protocol for
+``app.llm.LLMClient``: plain JSON responses and ``stream: true`` server-sent
+events. Latency is simulated with a fixed delay before the first byte plus a
+per-token delay, and the first ``fail_first`` requests can be made to fail so
+retry behaviour can be exercised.
+
+``StubProvider`` is the in-process counterpart for ``app.providers.LLMRouter``:
+a provider with injected latency and failures and no sockets at all, so routing,
+hedging and circuit breakers can be tested and benchmarked deterministically.
+
+Run standalone with::
+
+    python -m app.fake_llm --port 8001 --latency 0.5 --token-delay 0.02
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeLLMServer:
+    """
+    Threaded HTTP server imitating an OpenAI-compatible completion endpoint.
+
+    Attributes:
+    -----------
+    latency : float
+        Seconds to wait before sending the response headers.
+    token_delay : float
+        Seconds to wait between streamed tokens.
+    reply : str, optional
+        Fixed reply text; when unset the server echoes the last user message.
+    fail_first : int
+        Number of initial requests answered with ``fail_status``.
+    fail_status : int
+        HTTP status used for the simulated failures.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, token_delay=0.0, reply=None,
+                 fail_first=0, fail_status=500):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.reply = reply
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.request_count = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = []
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """Base URL to use as ``LLM_API_BASE``."""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        """Serve requests on a background thread."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Shut the server down and close its socket."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def reply_for(self, payload) -> str:
+        """Return the reply text for a request payload."""
+        if self.reply is not None:
+            return self.reply
+        user_messages = [m.get("content", "") for m in payload.get("messages", []) if m.get("role") == "user"]
+        return f"You said: {user_messages[-1] if user_messages else ''}"
+
+    def _enter(self, payload) -> int:
+        with self._lock:
+            self.request_count += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.requests.append(payload)
+            return self.request_count
+
+    def _leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+class StubProvider:
+    """
+    In-process LLM provider with injected latency and failures.
+
+    Attributes:
+    -----------
+    name : str
+        Provider name reported by the router.
+    latency : float or callable
+        Seconds before the reply (or first token); a callable is drawn per call.
+    fail : bool or callable
+        Whether a call fails with ``LLMError``; a callable is evaluated per call.
+    reply : str
+        Reply text, streamed word by word.
+    calls, closed : int
+        Calls started, and streams closed before or after their last token.
+    """
+
+    canned = False
+    model = "stub"
+
+    def __init__(self, name, latency=0.0, fail=False, reply=None):
+        self.name = name
+        self.latency = latency
+        self.fail = fail
+        self.reply = reply if reply is not None else f"Reply from {name}."
+        self.calls = 0
+        self.closed = 0
+        self._lock = threading.Lock()
+
+    def complete(self, messages, max_tokens, timeout, **params) -> str:
+        self._wait(timeout)
+        return self.reply
+
+    def stream(self, messages, max_tokens, timeout, **params):
+        try:
+            self._wait(timeout)
+            yield from _tokenize(self.reply)
+        finally:
+            with self._lock:
+                self.closed += 1
+
+    def close(self):
+        pass
+
+    def _wait(self, timeout):
+        from .llm import LLMError, LLMTimeoutError
+
+        with self._lock:
+            self.calls += 1
+        delay = self.latency() if callable(self.latency) else self.latency
+        if delay > timeout:
+            time.sleep(timeout)
+            raise LLMTimeoutError(f"Stub provider '{self.name}' timed out.")
+        time.sleep(delay)
+        if self.fail() if callable(self.fail) else self.fail:
+            raise LLMError(f"Stub provider '{self.name}' failed.")
+
+
+def _tokenize(text):
+    """Split text into word tokens that keep their leading whitespace."""
+    words = text.split(" ")
+    return [words[0]] + [f" {word}" for word in words[1:]] if words else []
+
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out in separate writes; with Nagle on, the body waits for a delayed ACK (~40ms)
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            number = server._enter(payload)
+            try:
+                if server.latency:
+                    time.sleep(server.latency)
+                if number <= server.fail_first:
+                    self._send_json(server.fail_status, {"error": {"message": "simulated failure"}})
+                    return
+                reply = server.reply_for(payload)
+                if payload.get("stream"):
+                    self._send_stream(payload, reply)
+                else:
+                    self._send_json(200, {
+                        "id": f"chatcmpl-fake-{number}",
+                        "object": "chat.completion",
+                        "model": payload.get("model"),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": reply},
+                                     "finish_reason": "stop"}],
+                    })
+            finally:
+                server._leave()
+
+        def _send_json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_stream(self, payload, reply):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i, token in enumerate(_tokenize(reply)):
+                if i and server.token_delay:
+                    time.sleep(server.token_delay)
+                chunk = {"object": "chat.completion.chunk", "model": payload.get("model"),
+                         "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+        def _write_chunk(self, text):
+            data = text.encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake chat-completions server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before the first byte.")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between streamed tokens.")
+    parser.add_argument("--reply", default=None, help="Fixed reply text (defaults to echoing the prompt).")
+    args = parser.parse_args()
+
+    fake = FakeLLMServer(args.host, args.port, args.latency, args.token_delay, args.reply)
+    print(f"Fake LLM listening on {fake.url}")
+    try:
+        fake._httpd.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()
@@ -0,0 +1,420 @@
+"""
+Compiled conversation-flow engine.
+
+The conversation is declared in a JSON file (``app/flows/conversation.json``
+by default) as a set of nodes, each with a question, an answer type and its
+transitions:
+
+- ``next``: the node asked after a valid answer (omit it to end the flow).
+- ``branches``: for ``choice`` nodes, a node per option.
+- ``reprompt``: ``{"max_words": n, "next": node}`` asks a follow-up when a
+  text answer is ``n`` words or fewer.
+
+A top-level ``max_length`` caps text answers of nodes that set none.
+
+``compile_flow`` turns the definition into a ``CompiledFlow`` once: every node
+gets a step closure built for its type (compiled regexes, number ranges,
+choice sets as frozensets) that validates an answer and picks the next node
+from its transition table, so handling a message is a dict lookup and one
+function call instead of re-reading the definition. Choices match after
+Unicode (NFKC) normalization, case folding and collapsing punctuation and
+spaces, through a lookup table built at compile time; numbers accept
+full-width digits.
+
+``FlowEngine`` owns the compiled flow for the app. It reloads the file when
+it changes and swaps the new flow in with a single assignment; conversations
+record the version they started on and keep using it until they finish. With
+``LAZY_INIT`` the first use compiles the flow; run ``python -m app.flow check``
+at build time so a broken definition fails the build rather than a request.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+DEFAULT_FLOW_PATH = os.path.join(os.path.dirname(__file__), "flows", "conversation.json")
+
+# Returned by a node's step when the answer is invalid
+INVALID = None
+
+# Text answers of nodes without their own max_length, unless the flow sets one
+DEFAULT_MAX_LENGTH = 500
+
+# Runs of anything but letters and digits, collapsed to one space when matching choices
+_SEPARATORS = re.compile(r"[\W_]+")
+
+# Full-width digits, as typed by CJK input methods, read as ASCII ones
+_FULLWIDTH_DIGITS = {0xFF10 + digit: ord("0") + digit for digit in range(10)}
+
+
+class FlowError(ValueError):
+    """Raised when a flow definition is malformed."""
+
+
+# Each factory compiles one node into a step: ``step(raw) -> (value, next_id)``,
+# or ``INVALID``. Validation and the transition run in a single call per message.
+
+def _fold(value) -> str:
+    """The key a choice answer is looked up by: "  DEEP-discussions " -> "deep discussions"."""
+    return _SEPARATORS.sub(" ", unicodedata.normalize("NFKC", value).casefold()).strip()
+
+
+def _text_step(spec):
+    pattern = re.compile(spec["pattern"]) if spec.get("pattern") else None
+    max_length = spec.get("max_length") or DEFAULT_MAX_LENGTH
+    next_id = spec.get("next")
+    reprompt = spec.get("reprompt") or {}
+    max_words = int(reprompt.get("max_words", 0))
+    reprompt_next = reprompt.get("next")
+
+    def plain(raw):
+        value = raw.strip()
+        if not value or len(value) > max_length:
+            return INVALID
+        return value, next_id
+
+    if pattern is None and not max_words:
+        return plain
+
+    def step(raw):
+        value = raw.strip()
+        if not value or len(value) > max_length:
+            return INVALID
+        if pattern is not None and not pattern.fullmatch(value):
+            return INVALID
+        # Splitting at most max_words times is enough to tell "short" from "long"
+        if max_words and len(value.split(None, max_words)) <= max_words:
+            return value, reprompt_next
+        return value, next_id
+    return step
+
+
+def _number_step(spec):
+    low = spec.get("min", 1)
+    high = spec.get("max") or 10 ** 18  # An int, so the range check never compares int and float
+    # Longer inputs (beyond a few leading zeros) cannot be in range; int() never parses a huge string
+    max_digits = len(str(high)) + 2
+    next_id = spec.get("next")
+
+    def step(raw):
+        value = raw.strip()
+        if not value.isascii():
+            value = value.translate(_FULLWIDTH_DIGITS)
+        # isascii() keeps out digits int() cannot parse, such as superscripts
+        if not (value.isascii() and value.isdigit()) or len(value) > max_digits or not low <= int(value) <= high:
+            return INVALID
+        return value, next_id
+    return step
+
+
+def _choice_step(spec):
+    options = frozenset(spec.get("options") or ())
+    if not options:
+        raise FlowError(f"Choice node '{spec['id']}' has no options.")
+    branches = spec.get("branches") or {}
+    unknown = set(branches) - options
+    if unknown:
+        raise FlowError(f"Node '{spec['id']}' branches on unknown option(s): {', '.join(sorted(unknown))}.")
+    # Transition table keyed by the exact option, with normalized aliases
+    table = {option: (option, branches.get(option, spec.get("next"))) for option in options}
+    folded = {}
+    for option in options:
+        if folded.setdefault(_fold(option), table[option]) is not table[option]:
+            raise FlowError(f"Node '{spec['id']}' has options that only differ in case or punctuation.")
+
+    def step(raw):
+        return table.get(raw) or folded.get(_fold(raw))
+    return step
+
+
+# Step factories by answer type; resolved once per node at compile time
+STEPS = {
+    "text": _text_step,
+    "number": _number_step,
+    "choice": _choice_step,
+}
+
+
+class Node:
+    """
+    One compiled question of a flow.
+
+    Attributes:
+    -----------
+    id : str
+        Node identifier, stored in the conversation state.
+    key : str
+        ``user_data`` field the answer is saved under.
+    step : callable
+        ``step(raw)`` returns ``(value, next_id)`` for a valid answer, where
+        ``value`` is the normalized answer and ``next_id`` is None at the end
+        of the flow, or ``INVALID``.
+    """
+
+    __slots__ = ("id", "key", "question", "type", "options", "step", "targets")
+
+    def __init__(self, spec, step):
+        self.id = spec["id"]
+        self.key = spec.get("key", spec["id"])
+        self.question = spec["question"]
+        self.type = spec["type"]
+        self.options = list(spec.get("options") or [])
+        self.step = step
+        reprompt = spec.get("reprompt") or {}
+        self.targets = [spec.get("next"), reprompt.get("next"), *(spec.get("branches") or {}).values()]
+
+    def validate(self, raw):
+        """Return the normalized answer, or None when ``raw`` is invalid."""
+        result = self.step(raw)
+        return result[0] if result is not INVALID else None
+
+    def next_for(self, raw):
+        """Return the id of the node that follows ``raw`` (None at the end or when invalid)."""
+        result = self.step(raw)
+        return result[1] if result is not INVALID else None
+
+    def as_dict(self) -> dict:
+        """The legacy ``CONVERSATION_FLOW`` entry for this node."""
+        entry = {"question": self.question, "type": self.type, "key": self.key}
+        if self.options:
+            entry["options"] = list(self.options)
+        return entry
+
+
+class CompiledFlow:
+    """
+    A flow definition compiled into nodes and transition tables.
+
+    Attributes:
+    -----------
+    version : str
+        Content hash of the definition the flow was compiled from.
+    start : Node
+        First question of a conversation.
+    nodes : dict
+        Nodes by id.
+    positions : dict
+        Position of each node id in definition order; conversation state
+        stores the current node as this integer.
+    keys : tuple
+        Distinct answer keys in definition order; ``slots`` maps each one to
+        its index in a conversation's answer array.
+    """
+
+    def __init__(self, version, start, nodes, greeting, invalid, summary, summary_defaults):
+        self.version = version
+        self.start = start
+        self.nodes = nodes
+        self.order = list(nodes.values())
+        self.positions = {node_id: position for position, node_id in enumerate(nodes)}
+        self.keys = tuple(dict.fromkeys(node.key for node in nodes.values()))
+        self.slots = {key: slot for slot, key in enumerate(self.keys)}
+        self.greeting = greeting
+        self.invalid = invalid
+        self._summary = summary
+        self._summary_defaults = summary_defaults
+
+    def node(self, node_id) -> Node:
+        """Return the node ``node_id``, or the start node if this flow has no such node."""
+        return self.nodes.get(node_id, self.start)
+
+    def node_at(self, position) -> Node:
+        """Return the node at ``position`` in definition order, or the start node if out of range."""
+        return self.order[position] if 0 <= position < len(self.order) else self.start
+
+    def main_path(self) -> list:
+        """Nodes reached by following ``next`` from the start, without branches."""
+        path, node, seen = [], self.start, set()
+        while node is not None and node.id not in seen:
+            path.append(node)
+            seen.add(node.id)
+            node = self.nodes.get(node.targets[0])
+        return path
+
+    def summary(self, user_data) -> str:
+        """Closing message built from the collected answers."""
+        return self._summary.format_map({**self._summary_defaults, **user_data})
+
+    def invalid_message(self, node) -> str:
+        return self.invalid.format(question=node.question)
+
+
+def compile_flow(definition, version=None) -> CompiledFlow:
+    """
+    Compile a flow definition into a ``CompiledFlow``.
+
+    Parameters:
+    -----------
+    definition : dict
+        Parsed flow definition (see the module docstring).
+    version : str, optional
+        Version label; defaults to a hash of the definition.
+
+    Returns:
+    --------
+    CompiledFlow
+        The flow, with validators and transitions resolved.
+
+    Raises:
+    -------
+    FlowError
+        On unknown answer types, duplicate ids or transitions to missing nodes.
+    """
+    nodes = {}
+    max_length = definition.get("max_length") or DEFAULT_MAX_LENGTH
+    for spec in definition.get("nodes", []):
+        factory = STEPS.get(spec.get("type"))
+        if factory is None:
+            raise FlowError(f"Node '{spec.get('id')}' has unknown type '{spec.get('type')}'.")
+        if spec["id"] in nodes:
+            raise FlowError(f"Duplicate node id '{spec['id']}'.")
+        nodes[spec["id"]] = Node(spec, factory({"max_length": max_length, **spec}))
+
+    if definition.get("start") not in nodes:
+        raise FlowError(f"Start node '{definition.get('start')}' is not defined.")
+    for node in nodes.values():
+        missing = [target for target in node.targets if target is not None and target not in nodes]
+        if missing:
+            raise FlowError(f"Node '{node.id}' points to undefined node(s): {', '.join(missing)}.")
+
+    if version is None:
+        version = hashlib.sha1(json.dumps(definition, sort_keys=True).encode()).hexdigest()[:12]
+    summary = definition.get("summary") or {}
+    return CompiledFlow(
+        version=version,
+        start=nodes[definition["start"]],
+        nodes=nodes,
+        greeting=definition.get("greeting", "Welcome! You are now connected to the server."),
+        invalid=definition.get("invalid", "Invalid input for {question}."),
+        summary=summary.get("template", "Thanks for sharing, {name}!"),
+        summary_defaults=summary.get("defaults", {"name": "User"}),
+    )
+
+
+def load_flow(path) -> CompiledFlow:
+    """Read and compile the flow definition at ``path``."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    return compile_flow(json.loads(raw), version=hashlib.sha1(raw).hexdigest()[:12])
+
+
+class FlowEngine:
+    """
+    Flask extension holding the compiled conversation flow.
+
+    Attributes:
+    -----------
+    path : str
+        Flow definition file.
+    reload_interval : float
+        Minimum seconds between checks of the file for changes (0 disables reloads).
+    keep_versions : int
+        Number of compiled versions retained for conversations still in flight.
+    """
+
+    def __init__(self, app=None):
+        self.path = DEFAULT_FLOW_PATH
+        self.reload_interval = 2.0
+        self.keep_versions = 4
+        self._flow = None
+        self._versions = OrderedDict()
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Compile the flow named by the ``FLOW_*`` settings of the Flask app.
+
+        Parameters:
+        -----------
+        app : Flask
+            The Flask application.
+        """
+        config = app.config
+        self.path = config.get("FLOW_PATH") or DEFAULT_FLOW_PATH
+        self.reload_interval = float(config.get("FLOW_RELOAD_INTERVAL", self.reload_interval))
+        self.keep_versions = max(1, int(config.get("FLOW_KEEP_VERSIONS", self.keep_versions)))
+        self._versions.clear()
+        self._flow = None
+        if not config.get("LAZY_INIT", True):
+            self.reload(force=True)
+        app.extensions["flow_engine"] = self
+
+    @property
+    def flow(self) -> CompiledFlow:
+        """The current flow, reloaded first if the definition changed."""
+        if self._flow is None:
+            self.reload(force=True)
+        elif self.reload_interval > 0 and time.monotonic() - self._checked_at >= self.reload_interval:
+            self.reload()
+        return self._flow
+
+    def get(self, version) -> CompiledFlow:
+        """The flow a conversation started on, or the current one if it was evicted."""
+        flow = self._versions.get(version)
+        return flow if flow is not None else self.flow
+
+    def reload(self, force=False) -> bool:
+        """
+        Recompile the definition if its file changed (or always with ``force``).
+
+        A definition that fails to compile leaves the current flow in place,
+        unless there is no flow yet.
+
+        Returns:
+        --------
+        bool
+            True when a new version was swapped in.
+        """
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                if self._flow is None:
+                    raise
+                return False
+            if not force and mtime == self._mtime:
+                return False
+            try:
+                flow = load_flow(self.path)
+            except (OSError, ValueError, KeyError):
+                if self._flow is None:
+                    raise
+                return False
+            self._mtime = mtime
+            if self._flow is not None and flow.version == self._flow.version:
+                return False
+            self._versions[flow.version] = flow
+            while len(self._versions) > self.keep_versions:
+                self._versions.popitem(last=False)
+            self._flow = flow  # Atomic swap; readers see the old or the new flow, never a mix
+            return True
+
+
+def main(argv=None):
+    """Compile a flow definition and print its shape; exit with status 1 if it is invalid."""
+    parser = argparse.ArgumentParser(description="Check that a conversation flow definition compiles.")
+    parser.add_argument("command", choices=("check",))
+    parser.add_argument("path", nargs="?", default=DEFAULT_FLOW_PATH)
+    args = parser.parse_args(argv)
+    try:
+        flow = load_flow(args.path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"{args.path}: {type(e).__name__}: {e}")
+        return 1
+    print(f"{args.path}: version {flow.version}, {len(flow.nodes)} nodes, "
+          f"{len(flow.main_path())} on the main path, starting at '{flow.start.id}'")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,259 @@
+"""
+Reading conversation history back out of ConversationLog.
+
+``page_conversations`` serves one page of a user's messages using keyset
+pagination on ``(timestamp, id)``. The cursor encodes the last row of the
+previous page, so every page is an index range scan no matter how deep the
+client has paged, and rows inserted meanwhile neither shift nor duplicate
+results the way ``OFFSET`` would.
+
+Months that retention has moved into compressed archives (see
+``app/retention.py``) are read from there. The catalog marks where the archives
+end and the table begins, so a page is filled from both without duplicates.
+
+``iter_export`` streams rows in id order from a server-side cursor
+(``yield_per``) in fixed-size batches, after the archived months. ``ndjson_chunks``/``csv_chunks`` format
+them and ``gzip_chunks`` compresses on the fly, so an export holds one batch
+in memory whatever the table size. The same pipeline backs the
+``/conversations/export`` endpoint and the command line:
+
+    python -m app.history --format csv --gzip --output conversations.csv.gz
+"""
+import argparse
+import base64
+import csv
+import io
+import json
+import sys
+import zlib
+from datetime import datetime
+
+from sqlalchemy import select, tuple_  # type: ignore
+
+from . import db, log_retention
+from .models import ConversationLog
+from .utils import run_blocking
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+CSV_COLUMNS = ("id", "user_id", "timestamp", "message")
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+def encode_cursor(timestamp, row_id) -> str:
+    """Opaque, URL-safe token for the position just after ``(timestamp, row_id)``."""
+    raw = json.dumps([timestamp.isoformat(), row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Inverse of ``encode_cursor``; raises ``InvalidCursor`` on tampered or truncated tokens."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        timestamp, row_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {token!r}") from e
+
+
+def serialize(row) -> dict:
+    return {"id": row.id, "user_id": row.user_id, "timestamp": row.timestamp.isoformat(), "message": row.message}
+
+
+def page_conversations(user_id, limit=50, cursor=None, order="desc"):
+    """
+    Return one page of a user's messages and the cursor for the next one.
+
+    Parameters:
+    -----------
+    user_id : int
+        Author of the messages.
+    limit : int
+        Maximum rows in the page.
+    cursor : str, optional
+        ``next_cursor`` from the previous page; None for the first page.
+    order : str
+        ``desc`` (newest first) or ``asc``.
+
+    Returns:
+    --------
+    tuple
+        ``(rows, next_cursor)``; ``next_cursor`` is None on the last page.
+
+    Raises:
+    -------
+    InvalidCursor
+        When ``cursor`` cannot be decoded.
+    """
+    position = decode_cursor(cursor) if cursor else None
+    key = tuple_(ConversationLog.timestamp, ConversationLog.id)
+    stmt = select(ConversationLog.id, ConversationLog.user_id, ConversationLog.timestamp, ConversationLog.message)
+    stmt = stmt.where(ConversationLog.user_id == user_id)
+    if order == "asc":
+        stmt = stmt.order_by(ConversationLog.timestamp.asc(), ConversationLog.id.asc())
+    else:
+        stmt = stmt.order_by(ConversationLog.timestamp.desc(), ConversationLog.id.desc())
+    if position is not None:
+        stmt = stmt.where(key > position if order == "asc" else key < position)
+    partitions = log_retention.partitions()
+    if partitions:
+        stmt = stmt.where(ConversationLog.timestamp >= partitions[-1].ends_at)
+
+    def table(count):
+        return run_blocking(_fetch_all, db.engine, stmt.limit(count))
+
+    def archives(count):
+        return log_retention.user_rows(partitions, user_id, position, order, count) if partitions else []
+
+    # Archived months are older than anything in the table; one extra row tells
+    # whether another page exists without a COUNT
+    rows = []
+    for source in ((archives, table) if order == "asc" else (table, archives)):
+        if len(rows) <= limit:
+            rows.extend(source(limit + 1 - len(rows)))
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].timestamp, rows[-1].id)
+
+
+def _fetch_all(engine, stmt):
+    with engine.connect() as conn:
+        return conn.execute(stmt).all()
+
+
+def iter_export(engine, user_id=None, since=None, until=None, batch_size=1000):
+    """
+    Yield ConversationLog rows: archived months first (each in (user_id,
+    timestamp, id) order), then the table in id order from a server-side cursor.
+
+    Parameters:
+    -----------
+    engine : sqlalchemy.engine.Engine
+        Engine to read from; a dedicated connection is held for the whole export.
+    user_id : int, optional
+        Only export this user's messages.
+    since, until : datetime, optional
+        Inclusive lower and exclusive upper bounds on ``timestamp``.
+    batch_size : int
+        Rows fetched from the database per round trip.
+    """
+    stmt = select(ConversationLog.id, ConversationLog.user_id, ConversationLog.timestamp, ConversationLog.message)
+    if user_id is not None:
+        stmt = stmt.where(ConversationLog.user_id == user_id)
+    if since is not None:
+        stmt = stmt.where(ConversationLog.timestamp >= since)
+    if until is not None:
+        stmt = stmt.where(ConversationLog.timestamp < until)
+    stmt = stmt.order_by(ConversationLog.id)
+
+    partitions = log_retention.partitions(engine)
+    if partitions:
+        yield from log_retention.iter_rows(partitions, user_id, since, until)
+        stmt = stmt.where(ConversationLog.timestamp >= partitions[-1].ends_at)
+
+    with engine.connect() as conn:
+        # yield_per turns on stream_results, so drivers such as psycopg2 use a named cursor
+        result = run_blocking(conn.execution_options(yield_per=batch_size).execute, stmt)
+        try:
+            while True:
+                rows = run_blocking(result.fetchmany, batch_size)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            result.close()
+
+
+def ndjson_chunks(rows, rows_per_chunk=500):
+    """Format rows as newline-delimited JSON, a few hundred lines per chunk."""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(serialize(row), ensure_ascii=False))
+        if len(lines) >= rows_per_chunk:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def csv_chunks(rows, rows_per_chunk=500):
+    """Format rows as CSV with a header line, a few hundred lines per chunk."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    count = 0
+    for row in rows:
+        writer.writerow((row.id, row.user_id, row.timestamp.isoformat(), row.message))
+        count += 1
+        if count >= rows_per_chunk:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_chunks(rows, fmt):
+    """Text chunks for ``rows`` in ``fmt`` (one of ``EXPORT_FORMATS``)."""
+    if fmt == "csv":
+        return csv_chunks(rows)
+    if fmt == "ndjson":
+        return ndjson_chunks(rows)
+    raise ValueError(f"Unknown export format '{fmt}'; expected one of {', '.join(EXPORT_FORMATS)}.")
+
+
+def gzip_chunks(chunks, level=6):
+    """Compress text chunks into a gzip stream without buffering the whole output."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 writes the gzip header
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def main(argv=None):
+    """Export ConversationLog rows to a file or stdout."""
+    parser = argparse.ArgumentParser(description="Stream ConversationLog rows as NDJSON or CSV.")
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="ndjson")
+    parser.add_argument("--user-id", type=int, help="Only export this user's messages.")
+    parser.add_argument("--since", type=_parse_time, help="ISO timestamp, inclusive.")
+    parser.add_argument("--until", type=_parse_time, help="ISO timestamp, exclusive.")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rows fetched per round trip.")
+    parser.add_argument("--gzip", action="store_true", help="Compress the output.")
+    parser.add_argument("--output", "-o", help="Output file (default: stdout).")
+    args = parser.parse_args(argv)
+
+    from . import create_app
+    from config.config import get_config
+    # SQL echo would interleave log lines with the export on stdout
+    app, _, _ = create_app(type("ExportConfig", (get_config(),), {"SQLALCHEMY_ECHO": False}))
+    with app.app_context():
+        rows = iter_export(db.engine, args.user_id, args.since, args.until, args.batch_size)
+        chunks = export_chunks(rows, args.format)
+        if args.gzip:
+            chunks = gzip_chunks(chunks)
+        else:
+            chunks = (chunk.encode("utf-8") for chunk in chunks)
+
+        out = open(args.output, "wb") if args.output else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+        finally:
+            if args.output:
+                out.close()
+            else:
+                out.flush()
+
+
+if __name__ == "__main__":
+    main()
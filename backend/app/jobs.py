@@ -0,0 +1,795 @@
+"""
+Durable background jobs for work that should not hold up a socket event.
+
+Handlers enqueue a job (a registered task name and a JSON payload) and return;
+a worker runs it later and pushes the outcome to the Socket.IO room the job
+was enqueued for. Tasks are plain functions registered with ``@task``::
+
+    @task("profiles.extract", max_attempts=5, event="profile", batch_size=100)
+    def extract_profiles(payloads):
+        ...
+        return profiles     # one per payload, each pushed to its job's room as a 'profile' event
+
+    job_queue.enqueue("profiles.extract", {"user_id": 1, "answers": {...}},
+                      key="profile:1:<last message id>", room=request.sid)
+
+A task registered with ``batch_size`` greater than one is called with a list
+of payloads and returns one result per payload: a worker that claims one of
+its jobs also claims the other ready jobs of the same task, up to
+``batch_size``, so a backlog is drained in a few calls (one LLM request for
+many users' profiles) rather than one call per job. Each job still records,
+retries and pushes its own outcome. Without ``batch_size`` a task is called
+once per job with the payload as keyword arguments.
+
+Jobs live in a backend:
+
+- ``memory``: a list in the worker process (tests, single-process development);
+- ``sqlite``: a WAL-mode job table shared by every process on the host, so
+  queued jobs survive restarts and separate worker processes can run them.
+
+Workers claim the highest-priority ready job, then the oldest. A failed attempt
+is retried with exponential backoff and jitter until ``max_attempts``. A worker
+that dies mid-job loses its lease, and the job runs again once the lease
+expires, so tasks should be safe to run twice. Enqueueing with an idempotency
+``key`` that is already queued, running or done returns the existing job; a
+done job's result is pushed again to the new room.
+
+``JOBS_MODE`` decides where jobs run:
+
+- ``inline``: at enqueue time, in the caller (tests);
+- ``embedded``: on a small thread pool inside the web process;
+- ``external``: only in ``python -m app.jobs worker`` processes, which run
+  jobs on a process pool. Use a shared ``BUS_BACKEND`` (or set
+  ``SOCKETIO_MESSAGE_QUEUE``) so their pushes reach the web workers' sockets.
+"""
+import argparse
+import importlib
+import json
+import logging
+import os
+import pickle
+import random
+import signal
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from .utils import run_blocking, thread_connection
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -10
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+STATUSES = (QUEUED, RUNNING, DONE, FAILED)
+
+Job = namedtuple("Job", "id name payload priority status attempts max_attempts key room "
+                        "run_at created_at started_at finished_at lease_until result error")
+
+# ``event`` is the Socket.IO event carrying the result to the job's room (None: a generic 'job' event)
+Task = namedtuple("Task", "name func max_attempts priority timeout event batch_size")
+
+TASKS = {}
+
+
+def task(name, max_attempts=3, priority=PRIORITY_NORMAL, timeout=300.0, event=None, batch_size=1):
+    """
+    Register ``func(**payload)`` as the task run by jobs named ``name``, or
+    ``func(payloads)`` returning a list of results when ``batch_size`` > 1.
+
+    The function runs inside an app context and its return value (JSON
+    serialisable) becomes the job's result. It must be importable by module and
+    name, since process-pool workers look it up again in their own process.
+
+    Parameters:
+    -----------
+    name : str
+        Job name used with ``JobQueue.enqueue``.
+    max_attempts : int
+        Attempts before the job is marked failed.
+    priority : int
+        Default priority; higher runs first.
+    timeout : float
+        Seconds a worker holds the job before another may take it over.
+    event : str, optional
+        Socket.IO event pushing the result to the job's room.
+    batch_size : int
+        Ready jobs of this task run together in one call.
+    """
+    def decorator(func):
+        TASKS[name] = Task(name, func, max_attempts, priority, timeout, event, batch_size)
+        return func
+    return decorator
+
+
+def backoff(attempt, base, cap) -> float:
+    """Seconds before retry number ``attempt``: exponential, capped, with jitter against retry storms."""
+    return min(cap, base * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+
+
+def _dumps(value):
+    return None if value is None else json.dumps(value)
+
+
+def _loads(value):
+    return None if value is None else json.loads(value)
+
+
+class MemoryJobBackend:
+    """Jobs in a process-local list; a claim scans the ready jobs, which suits small queues."""
+
+    blocking = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._keys = {}
+        self._next_id = 1
+
+    def add(self, name, payload, priority, max_attempts, key, room, run_at) -> tuple:
+        with self._lock:
+            existing = self._jobs.get(self._keys.get(key)) if key is not None else None
+            if existing is not None:
+                if existing.status != FAILED:
+                    return existing, False
+                job = existing._replace(status=QUEUED, attempts=0, room=room, run_at=run_at, error=None)
+            else:
+                job = Job(self._next_id, name, _loads(_dumps(payload)), priority, QUEUED, 0, max_attempts, key,
+                          room, run_at, time.time(), None, None, None, None, None)
+                self._next_id += 1
+            self._jobs[job.id] = job
+            if key is not None:
+                self._keys[key] = job.id
+            return job, True
+
+    def claim(self, now, lease, name=None) -> Job:
+        with self._lock:
+            ready = []
+            for job in list(self._jobs.values()):
+                if job.status == RUNNING and job.lease_until < now:
+                    job = self._expire(job)
+                if job.status == QUEUED and job.run_at <= now and name in (None, job.name):
+                    ready.append(job)
+            if not ready:
+                return None
+            job = min(ready, key=lambda j: (-j.priority, j.run_at, j.id))
+            job = self._jobs[job.id] = job._replace(status=RUNNING, attempts=job.attempts + 1, started_at=now,
+                                                    lease_until=now + lease.get(job.name, 300.0))
+            return job
+
+    def _expire(self, job):
+        if job.attempts >= job.max_attempts:
+            job = job._replace(status=FAILED, error="lease expired", finished_at=time.time())
+        else:
+            job = job._replace(status=QUEUED)
+        self._jobs[job.id] = job
+        return job
+
+    def finish(self, job_id, result):
+        with self._lock:
+            job = self._jobs[job_id]
+            self._jobs[job_id] = job._replace(status=DONE, result=_loads(_dumps(result)), error=None,
+                                              finished_at=time.time(), lease_until=None)
+
+    def retry(self, job_id, error, run_at):
+        with self._lock:
+            self._jobs[job_id] = self._jobs[job_id]._replace(status=QUEUED, error=error, run_at=run_at,
+                                                             lease_until=None)
+
+    def fail(self, job_id, error):
+        with self._lock:
+            self._jobs[job_id] = self._jobs[job_id]._replace(status=FAILED, error=error, finished_at=time.time(),
+                                                             lease_until=None)
+
+    def get(self, job_id) -> Job:
+        return self._jobs.get(job_id)
+
+    def counts(self) -> dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = dict.fromkeys(STATUSES, 0)
+        for job in jobs:
+            counts[job.status] += 1
+        return counts
+
+    def oldest_ready(self, now) -> float:
+        with self._lock:
+            ready = [job.run_at for job in self._jobs.values() if job.status == QUEUED and job.run_at <= now]
+        return min(ready) if ready else None
+
+    def requeue_failed(self) -> int:
+        with self._lock:
+            failed = [job for job in self._jobs.values() if job.status == FAILED]
+            for job in failed:
+                self._jobs[job.id] = job._replace(status=QUEUED, attempts=0, run_at=time.time())
+        return len(failed)
+
+    def purge(self, before) -> int:
+        with self._lock:
+            old = [job for job in self._jobs.values()
+                   if job.status in (DONE, FAILED) and (job.finished_at or 0) < before]
+            for job in old:
+                del self._jobs[job.id]
+                if job.key is not None:
+                    self._keys.pop(job.key, None)
+        return len(old)
+
+
+class SQLiteJobBackend:
+    """
+    Jobs as rows of a WAL-mode SQLite table shared by the processes of a host.
+
+    Claims run in a ``BEGIN IMMEDIATE`` transaction, so two workers never take
+    the same job.
+
+    Attributes:
+    -----------
+    path : str
+        Location of the SQLite database file.
+    """
+
+    blocking = True
+    COLUMNS = ", ".join(Job._fields)
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, payload TEXT NOT NULL, "
+            "priority INTEGER NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL, "
+            "max_attempts INTEGER NOT NULL, key TEXT UNIQUE, room TEXT, run_at REAL NOT NULL, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL, lease_until REAL, result TEXT, error TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_ready ON jobs (status, priority, run_at)")
+
+    def _conn(self):
+        # One connection per native thread (and process); sqlite3 connections are not shareable
+        return thread_connection(self._local, self._connect)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def _job(row):
+        if row is None:
+            return None
+        row = list(row)
+        row[2], row[14] = json.loads(row[2]), _loads(row[14])
+        return Job(*row)
+
+    def _select(self, conn, where, params=()):
+        return self._job(conn.execute(f"SELECT {self.COLUMNS} FROM jobs WHERE {where}", params).fetchone())
+
+    def add(self, name, payload, priority, max_attempts, key, room, run_at) -> tuple:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            existing = self._select(conn, "key = ?", (key,)) if key is not None else None
+            if existing is not None and existing.status != FAILED:
+                conn.execute("COMMIT")
+                return existing, False
+            if existing is not None:
+                conn.execute("UPDATE jobs SET status = ?, attempts = 0, room = ?, run_at = ?, error = NULL "
+                             "WHERE id = ?", (QUEUED, room, run_at, existing.id))
+                job_id = existing.id
+            else:
+                job_id = conn.execute(
+                    "INSERT INTO jobs (name, payload, priority, status, attempts, max_attempts, key, room, run_at, "
+                    "created_at) VALUES (?, ?, ?, ?, 0, ?, ?, ?, ?, ?)",
+                    (name, json.dumps(payload), priority, QUEUED, max_attempts, key, room, run_at, time.time()),
+                ).lastrowid
+            job = self._select(conn, "id = ?", (job_id,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return job, True
+
+    def claim(self, now, lease, name=None) -> Job:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Jobs whose worker died: run again, or give up once out of attempts
+            conn.execute("UPDATE jobs SET status = ?, error = 'lease expired', finished_at = ? "
+                         "WHERE status = ? AND lease_until < ? AND attempts >= max_attempts",
+                         (FAILED, now, RUNNING, now))
+            conn.execute("UPDATE jobs SET status = ? WHERE status = ? AND lease_until < ?", (QUEUED, RUNNING, now))
+            if name is None:
+                job = self._select(conn, "status = ? AND run_at <= ? ORDER BY priority DESC, run_at, id LIMIT 1",
+                                   (QUEUED, now))
+            else:
+                job = self._select(conn, "status = ? AND run_at <= ? AND name = ? "
+                                   "ORDER BY priority DESC, run_at, id LIMIT 1", (QUEUED, now, name))
+            if job is not None:
+                job = job._replace(status=RUNNING, attempts=job.attempts + 1, started_at=now,
+                                   lease_until=now + lease.get(job.name, 300.0))
+                conn.execute("UPDATE jobs SET status = ?, attempts = ?, started_at = ?, lease_until = ? WHERE id = ?",
+                             (RUNNING, job.attempts, now, job.lease_until, job.id))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return job
+
+    def finish(self, job_id, result):
+        self._conn().execute("UPDATE jobs SET status = ?, result = ?, error = NULL, finished_at = ?, "
+                             "lease_until = NULL WHERE id = ?", (DONE, _dumps(result), time.time(), job_id))
+
+    def retry(self, job_id, error, run_at):
+        self._conn().execute("UPDATE jobs SET status = ?, error = ?, run_at = ?, lease_until = NULL WHERE id = ?",
+                             (QUEUED, error, run_at, job_id))
+
+    def fail(self, job_id, error):
+        self._conn().execute("UPDATE jobs SET status = ?, error = ?, finished_at = ?, lease_until = NULL "
+                             "WHERE id = ?", (FAILED, error, time.time(), job_id))
+
+    def get(self, job_id) -> Job:
+        return self._select(self._conn(), "id = ?", (job_id,))
+
+    def counts(self) -> dict:
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update(self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return counts
+
+    def oldest_ready(self, now) -> float:
+        return self._conn().execute("SELECT MIN(run_at) FROM jobs WHERE status = ? AND run_at <= ?",
+                                    (QUEUED, now)).fetchone()[0]
+
+    def requeue_failed(self) -> int:
+        return self._conn().execute("UPDATE jobs SET status = ?, attempts = 0, run_at = ? WHERE status = ?",
+                                    (QUEUED, time.time(), FAILED)).rowcount
+
+    def purge(self, before) -> int:
+        return self._conn().execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                                    (DONE, FAILED, before)).rowcount
+
+
+# Process-pool workers: the app is created once per process by the initializer
+_worker_app = None
+
+
+def _init_process(config):
+    global _worker_app
+    from . import create_app
+    _worker_app, _, _ = create_app(SimpleNamespace(**config))
+
+
+def _execute(module, qualname, payloads, batch):
+    """Run a task function in a pool process, looked up by name since functions are not sent across."""
+    func = importlib.import_module(module)
+    for part in qualname.split("."):
+        func = getattr(func, part)
+    with _worker_app.app_context():
+        return _call_task(func, payloads, batch)
+
+
+def _call_task(func, payloads, batch) -> list:
+    """Results of ``func`` for ``payloads``, one per payload, whether or not the task takes batches."""
+    if not batch:
+        return [func(**payloads[0])]
+    results = list(func(payloads))
+    if len(results) != len(payloads):
+        raise ValueError(f"Batch task returned {len(results)} results for {len(payloads)} jobs.")
+    return results
+
+
+class JobQueue:
+    """
+    Flask extension that enqueues jobs and, depending on ``mode``, runs them.
+
+    Attributes:
+    -----------
+    backend : object
+        ``MemoryJobBackend`` or ``SQLiteJobBackend``.
+    mode : str
+        ``inline``, ``embedded`` or ``external`` (see the module docstring).
+    concurrency : int
+        Task calls (single jobs or batches) run at once by this process's worker.
+    poll_interval : float
+        Seconds an idle worker waits before looking for new jobs again.
+    retry_base, retry_max : float
+        Backoff before the first retry, and its cap, in seconds.
+    retention : float
+        Seconds finished jobs (and their idempotency keys) are kept.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.backend = MemoryJobBackend()
+        self.mode = "embedded"
+        self.concurrency = 2
+        self.poll_interval = 0.5
+        self.retry_base = 1.0
+        self.retry_max = 300.0
+        self.retention = 7 * 86400.0
+        self.notify = None
+        self._metrics = None
+        self._executor = None
+        self._thread = None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._last_purge = 0.0
+        self.reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, notify=None, metrics=None):
+        """
+        Configure the queue from the ``JOBS_*`` settings of the Flask app.
+
+        Parameters:
+        -----------
+        app : Flask
+            The Flask application.
+        notify : callable, optional
+            Called as ``notify(room, event, data)`` to push a job's outcome.
+        metrics : Metrics, optional
+            Registry receiving throughput, run time and queue lag.
+        """
+        self.stop()
+        config = app.config
+        self.app = app
+        self.notify = notify
+        self.mode = config.get("JOBS_MODE", "embedded")
+        self.concurrency = int(config.get("JOBS_CONCURRENCY", self.concurrency))
+        self.poll_interval = float(config.get("JOBS_POLL_INTERVAL", self.poll_interval))
+        self.retry_base = float(config.get("JOBS_RETRY_BASE_DELAY", self.retry_base))
+        self.retry_max = float(config.get("JOBS_RETRY_MAX_DELAY", self.retry_max))
+        self.retention = float(config.get("JOBS_RETENTION", self.retention))
+        if config.get("JOBS_BACKEND", "memory") == "sqlite":
+            self.backend = SQLiteJobBackend(config.get("JOBS_SQLITE_PATH", "jobs.db"))
+        else:
+            self.backend = MemoryJobBackend()
+        if metrics is not None:
+            self._metrics = SimpleNamespace(
+                enabled=lambda: metrics.enabled,
+                jobs=metrics.counter("spokesperson_jobs", "Finished job attempts by outcome.", ("name", "status")),
+                seconds=metrics.histogram("spokesperson_job_seconds", "Job run time.", ("name",)),
+                lag=metrics.histogram("spokesperson_job_lag_seconds",
+                                      "Time from a job becoming ready to a worker starting it.", ("name",)),
+            )
+        if "job_queue" not in app.extensions:
+            app.before_request(self._ensure_started)
+        self.reset_stats()
+        app.extensions["job_queue"] = self
+
+    def reset_stats(self):
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+
+    @property
+    def depth(self) -> int:
+        """Jobs waiting to run."""
+        return self._call(self.backend.counts)[QUEUED]
+
+    def enqueue(self, name, payload=None, key=None, room=None, priority=None, delay=0.0) -> Job:
+        """
+        Queue a job for the task registered as ``name``.
+
+        Parameters:
+        -----------
+        name : str
+            Task name (see ``@task``).
+        payload : dict, optional
+            Keyword arguments for the task; must be JSON serialisable.
+        key : str, optional
+            Idempotency key: while a job with this key is queued, running or done,
+            that job is returned instead of adding another.
+        room : str, optional
+            Socket.IO room (e.g. a socket sid) the outcome is pushed to.
+        priority : int, optional
+            Higher runs first (default: the task's).
+        delay : float
+            Seconds before the job may start.
+
+        Returns:
+        --------
+        Job
+            The queued job, or the existing one for ``key``.
+
+        Raises:
+        -------
+        KeyError
+            When no task is registered as ``name``.
+        """
+        spec = TASKS[name]
+        job, created = self._call(self.backend.add, name, payload or {}, spec.priority if priority is None else priority,
+                                  spec.max_attempts, key, room, time.time() + delay)
+        if not created and job.status == DONE and room is not None:
+            self._push(job._replace(room=room), spec)  # Same work already done: deliver it here too
+        elif self.mode == "inline":
+            self.run_pending()
+            job = self.get(job.id)
+        elif self.mode == "embedded":
+            self._ensure_started()
+            self._wake.set()
+        return job
+
+    def get(self, job_id) -> Job:
+        return self._call(self.backend.get, job_id)
+
+    def stats(self) -> dict:
+        """Jobs by status, the age of the oldest ready job, and this process's worker totals."""
+        now = time.time()
+        oldest = self._call(self.backend.oldest_ready, now)
+        return {
+            "pid": os.getpid(),
+            "mode": self.mode,
+            "jobs": self._call(self.backend.counts),
+            "lag_s": round(now - oldest, 3) if oldest is not None else 0.0,
+            "in_flight": self._in_flight,
+            "processed": self.processed,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+    def requeue_failed(self) -> int:
+        """Queue every failed job again with fresh attempts."""
+        return self._call(self.backend.requeue_failed)
+
+    def purge(self, older_than=None) -> int:
+        """Delete finished jobs older than ``older_than`` seconds (default: ``retention``)."""
+        return self._call(self.backend.purge, time.time() - (self.retention if older_than is None else older_than))
+
+    def run_pending(self) -> int:
+        """Run every ready job in the calling thread and return how many attempts were made."""
+        count = 0
+        while True:
+            jobs = self._claim()
+            if not jobs:
+                return count
+            count += len(jobs)
+            try:
+                results, error = self._run_in_app(jobs), None
+            except Exception as e:
+                results, error = [None] * len(jobs), e
+            for job, result in zip(jobs, results):
+                self._complete(job, result, error)
+
+    def start(self, processes=None):
+        """
+        Start this process's worker.
+
+        Parameters:
+        -----------
+        processes : int, optional
+            Run jobs on a pool of this many processes instead of threads.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            if processes:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # Engine options are derived from the DB_* settings again in each process
+                config = {key: value for key, value in self.app.config.items()
+                          if key.isupper() and key != "SQLALCHEMY_ENGINE_OPTIONS" and _picklable(value)}
+                config["JOBS_MODE"] = "external"  # Pool processes only run what they are given
+                self.concurrency = processes
+                self._executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"),
+                                                     initializer=_init_process, initargs=(config,))
+            else:
+                self._executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix="job")
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._dispatch, name="job-dispatcher", daemon=True)
+            self._thread.start()
+
+    def stop(self, wait=True):
+        """Stop claiming jobs; with ``wait``, let the running ones finish."""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopping.set()
+            self._wake.set()
+            thread.join()
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _ensure_started(self):
+        if self.mode == "embedded" and self._thread is None and self.app is not None:
+            self.start()
+
+    def _call(self, method, *args):
+        return run_blocking(method, *args) if self.backend.blocking else method(*args)
+
+    def _claim(self) -> list:
+        """The next ready job, with up to ``batch_size - 1`` more ready jobs of the same task."""
+        leases = {name: spec.timeout for name, spec in TASKS.items()}
+        job = self._call(self.backend.claim, time.time(), leases)
+        if job is None:
+            return []
+        jobs = [job]
+        spec = TASKS.get(job.name)
+        while spec is not None and len(jobs) < spec.batch_size:
+            job = self._call(self.backend.claim, time.time(), leases, spec.name)
+            if job is None:
+                break
+            jobs.append(job)
+        return jobs
+
+    def _run_in_app(self, jobs) -> list:
+        spec = TASKS[jobs[0].name]
+        with self.app.app_context():
+            return run_blocking(_call_task, spec.func, [job.payload for job in jobs], spec.batch_size > 1)
+
+    def _dispatch(self):
+        while not self._stopping.is_set():
+            self._wake.clear()
+            while self._in_flight < self.concurrency and not self._stopping.is_set():
+                try:
+                    jobs = self._claim()
+                except Exception as e:
+                    logger.error("Claiming a job failed: %s", e)
+                    jobs = []
+                if not jobs:
+                    break
+                self._submit(jobs)
+            if time.monotonic() - self._last_purge > 3600:
+                self._last_purge = time.monotonic()
+                try:
+                    self.purge()
+                except Exception as e:
+                    logger.warning("Purging finished jobs failed: %s", e)
+            self._wake.wait(self.poll_interval)
+
+    def _submit(self, jobs):
+        with self._lock:
+            self._in_flight += 1
+        if not isinstance(self._executor, ThreadPoolExecutor):
+            spec = TASKS[jobs[0].name]
+            future = self._executor.submit(_execute, spec.func.__module__, spec.func.__qualname__,
+                                           [job.payload for job in jobs], spec.batch_size > 1)
+        else:
+            future = self._executor.submit(self._run_in_app, jobs)
+        future.add_done_callback(lambda f: self._done(jobs, f))
+
+    def _done(self, jobs, future):
+        try:
+            error = future.exception()
+            results = [None] * len(jobs) if error else future.result()
+            for job, result in zip(jobs, results):
+                self._complete(job, result, error)
+        except Exception as e:
+            logger.error("Recording the outcome of jobs %s failed: %s", [job.id for job in jobs], e)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._wake.set()
+
+    def _complete(self, job, result, error):
+        """Record one attempt's outcome, schedule a retry or push the outcome to the job's room."""
+        spec = TASKS.get(job.name)
+        now = time.time()
+        self._observe(job, now, "done" if error is None else "retried" if job.attempts < job.max_attempts else "failed")
+        if error is None:
+            self._call(self.backend.finish, job.id, result)
+            self.processed += 1
+            self._push(job._replace(status=DONE, result=result, error=None), spec)
+        elif job.attempts < job.max_attempts:
+            delay = backoff(job.attempts, self.retry_base, self.retry_max)
+            self._call(self.backend.retry, job.id, f"{type(error).__name__}: {error}", now + delay)
+            self.retried += 1
+            logger.warning("Job %s (%s) attempt %d failed, retrying in %.1fs: %s",
+                           job.id, job.name, job.attempts, delay, error)
+        else:
+            self._call(self.backend.fail, job.id, f"{type(error).__name__}: {error}")
+            self.failed += 1
+            logger.error("Job %s (%s) failed after %d attempts: %s", job.id, job.name, job.attempts, error)
+            self._push(job._replace(status=FAILED, error=str(error)), spec)
+
+    def _push(self, job, spec):
+        if job.room is None or self.notify is None:
+            return
+        try:
+            if job.status == DONE and spec is not None and spec.event:
+                self.notify(job.room, spec.event, job.result)
+            else:
+                self.notify(job.room, "job", {"id": job.id, "name": job.name, "status": job.status,
+                                              "result": job.result, "error": job.error})
+        except Exception as e:
+            logger.warning("Pushing the outcome of job %s failed: %s", job.id, e)
+
+    def _observe(self, job, now, status):
+        m = self._metrics
+        if m is None or not m.enabled():
+            return
+        m.jobs.inc(job.name, status)
+        m.seconds.observe(now - job.started_at, job.name)
+        if job.attempts == 1 or status == "done":
+            m.lag.observe(max(0.0, job.started_at - job.run_at), job.name)
+
+
+def _picklable(value) -> bool:
+    try:
+        pickle.dumps(value)
+    except Exception:
+        return False
+    return True
+
+
+def _serve_metrics(port):
+    """Serve ``GET /metrics`` of a worker process, which has no web server of its own."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from . import metrics
+    from .metrics import CONTENT_TYPE
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    """Run job workers, or inspect and maintain the job table."""
+    parser = argparse.ArgumentParser(description="Run background job workers or manage the job table.")
+    parser.add_argument("command", choices=("worker", "stats", "requeue-failed", "purge"))
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="Worker processes (default: one per CPU).")
+    parser.add_argument("--metrics-port", type=int, help="Serve this worker's /metrics on the port.")
+    parser.add_argument("--older-than", type=float, help="purge: seconds since finishing (default: JOBS_RETENTION).")
+    args = parser.parse_args(argv)
+
+    from . import create_app
+    from config.config import get_config
+    app, _, _ = create_app(type("JobsConfig", (get_config(),), {"SQLALCHEMY_ECHO": False, "JOBS_MODE": "external"}))
+    queue = app.extensions["job_queue"]
+
+    if args.command == "stats":
+        print(json.dumps(queue.stats(), indent=2))
+        return
+    if args.command == "requeue-failed":
+        print(f"{queue.requeue_failed()} jobs queued again")
+        return
+    if args.command == "purge":
+        print(f"{queue.purge(args.older_than)} finished jobs deleted")
+        return
+
+    if isinstance(queue.backend, MemoryJobBackend):
+        parser.error("JOBS_BACKEND=memory is private to one process; set JOBS_BACKEND=sqlite for separate workers.")
+    bus = app.extensions["bus"]
+    if not bus.distributed and not app.config.get("SOCKETIO_MESSAGE_QUEUE"):
+        logger.warning("BUS_BACKEND=memory and no SOCKETIO_MESSAGE_QUEUE; "
+                       "job results cannot be pushed to the web workers' sockets.")
+    if args.metrics_port:
+        _serve_metrics(args.metrics_port)
+
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopping.set())
+    queue.start(processes=args.processes)
+    print(f"job worker {os.getpid()} running {args.processes} processes on {queue.backend.path}", flush=True)
+    while not stopping.wait(1.0):
+        pass
+    print("stopping: waiting for running jobs", flush=True)
+    queue.stop(wait=True)
+    bus.stop()
+
+
+if __name__ == "__main__":
+    # ``python -m`` runs a second copy of this module; use the package's, which holds the task registry
+    from app.jobs import main as package_main
+    package_main()
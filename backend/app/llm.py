@@ -0,0 +1,310 @@
+"""
+Pooled, streaming client for the chat-completions API.
+
+The client talks to any OpenAI-compatible ``/chat/completions`` endpoint over a
+shared keep-alive connection pool. Concurrency is bounded by a semaphore so a
+burst of requests queues instead of opening an unbounded number of upstream
+connections, every call carries a timeout, and transient failures (connection
+errors, 429 and 5xx responses) are retried with jittered exponential backoff.
+When an admission queue is attached (see ``app/ratelimit.py``) each call first
+waits for a slot within the provider's requests- and tokens-per-minute quota.
+
+Streaming calls yield content tokens as soon as the upstream sends them, which
+lets the HTTP endpoint and the Socket.IO handlers forward the first token to the
+client instead of waiting for the whole completion.
+"""
+import json
+import random
+import threading
+import time
+from typing import Iterator, Optional
+
+import requests  # type: ignore
+from requests.adapters import HTTPAdapter  # type: ignore
+
+from .ratelimit import AdmissionRejected
+
+# Status codes worth retrying: rate limiting and transient upstream failures
+RETRYABLE_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+
+class LLMError(Exception):
+    """Raised when a completion cannot be produced."""
+
+
+class LLMTimeoutError(LLMError):
+    """Raised when a completion exceeds its deadline."""
+
+
+class LLMBusyError(LLMError):
+    """Raised when no concurrency slot frees up within the queue timeout."""
+
+
+class LLMClient:
+    """
+    Flask extension wrapping a pooled HTTP session for chat completions.
+
+    Attributes:
+    -----------
+    api_base : str
+        Base URL of the OpenAI-compatible API (e.g. https://api.openai.com/v1).
+    model : str
+        Default model used when a call does not specify one.
+    timeout : float
+        Default per-call deadline in seconds.
+    max_retries : int
+        Number of retries after the first attempt for retryable failures.
+    admission : AdmissionQueue or None
+        Upstream quota pacing, attached by ``RateLimiter.init_app``.
+    """
+
+    def __init__(self, app=None):
+        self.api_base = "https://api.openai.com/v1"
+        self.api_key = None
+        self.model = "gpt-3.5-turbo"
+        self.timeout = 30.0
+        self.connect_timeout = 3.05
+        self.max_retries = 2
+        self.backoff_base = 0.25
+        self.backoff_max = 4.0
+        self.queue_timeout = 10.0
+        self._semaphore = threading.BoundedSemaphore(8)
+        self._session = None
+        self.admission = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Configure the client from the Flask app config and build the connection pool.
+
+        Parameters:
+        -----------
+        app : Flask
+            The Flask application whose ``LLM_*`` settings are used.
+        """
+        self.configure(app.config)
+        app.extensions["llm"] = self
+
+    def configure(self, config, api_base=None, model=None, api_key=None):
+        """
+        Apply the ``LLM_*`` settings in ``config`` and build the connection pool.
+
+        The keyword arguments override the endpoint settings, so the router
+        (see ``app/providers.py``) can build one client per provider.
+
+        Returns:
+        --------
+        LLMClient
+            This client.
+        """
+        self.api_base = (api_base or config.get("LLM_API_BASE", self.api_base)).rstrip("/")
+        self.api_key = api_key if api_base else config.get("OPENAI_API_KEY")
+        self.model = model or config.get("LLM_MODEL", self.model)
+        self.timeout = float(config.get("LLM_TIMEOUT", self.timeout))
+        self.connect_timeout = float(config.get("LLM_CONNECT_TIMEOUT", self.connect_timeout))
+        self.max_retries = int(config.get("LLM_MAX_RETRIES", self.max_retries))
+        self.backoff_base = float(config.get("LLM_BACKOFF_BASE", self.backoff_base))
+        self.backoff_max = float(config.get("LLM_BACKOFF_MAX", self.backoff_max))
+        self.queue_timeout = float(config.get("LLM_QUEUE_TIMEOUT", self.queue_timeout))
+
+        max_concurrency = int(config.get("LLM_MAX_CONCURRENCY", 8))
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._session = self._build_session(int(config.get("LLM_POOL_SIZE", max_concurrency)))
+        return self
+
+    @staticmethod
+    def _build_session(pool_size):
+        """Create a requests session whose adapter keeps ``pool_size`` connections alive."""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def complete(self, messages, model=None, max_tokens=50, timeout=None, **params) -> str:
+        """
+        Run a non-streaming completion and return the assistant message content.
+
+        Parameters:
+        -----------
+        messages : list
+            Chat messages in the OpenAI ``{"role", "content"}`` format.
+        model : str, optional
+            Model name, defaults to the configured ``LLM_MODEL``.
+        max_tokens : int
+            Upper bound on generated tokens.
+        timeout : float, optional
+            Per-call deadline in seconds, defaults to ``LLM_TIMEOUT``.
+
+        Returns:
+        --------
+        str
+            The stripped completion text.
+        """
+        payload = self._payload(messages, model, max_tokens, stream=False, **params)
+        deadline = time.monotonic() + (timeout or self.timeout)
+
+        self._admit(messages, max_tokens, deadline)
+        with self._slot(deadline):
+            response = self._post(payload, deadline, stream=False)
+            try:
+                body = response.json()
+                return body["choices"][0]["message"]["content"].strip()
+            except (ValueError, KeyError, IndexError) as e:
+                raise LLMError(f"Malformed completion response: {e}") from e
+            finally:
+                response.close()
+
+    def stream(self, messages, model=None, max_tokens=50, timeout=None, **params) -> Iterator[str]:
+        """
+        Run a streaming completion, yielding content tokens as they arrive.
+
+        The concurrency slot is held until the generator is exhausted or closed,
+        so callers must either consume it fully or call ``close()`` on it.
+
+        Parameters:
+        -----------
+        messages : list
+            Chat messages in the OpenAI ``{"role", "content"}`` format.
+        model : str, optional
+            Model name, defaults to the configured ``LLM_MODEL``.
+        max_tokens : int
+            Upper bound on generated tokens.
+        timeout : float, optional
+            Per-call deadline in seconds, defaults to ``LLM_TIMEOUT``.
+
+        Yields:
+        -------
+        str
+            Content deltas in the order produced by the model.
+        """
+        payload = self._payload(messages, model, max_tokens, stream=True, **params)
+        deadline = time.monotonic() + (timeout or self.timeout)
+
+        self._admit(messages, max_tokens, deadline)
+        with self._slot(deadline):
+            response = self._post(payload, deadline, stream=True)
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    if time.monotonic() > deadline:
+                        raise LLMTimeoutError("Completion stream exceeded its deadline.")
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    try:
+                        delta = json.loads(data)["choices"][0].get("delta", {})
+                    except (ValueError, KeyError, IndexError) as e:
+                        raise LLMError(f"Malformed stream chunk: {e}") from e
+                    token = delta.get("content")
+                    if token:
+                        yield token
+            except requests.exceptions.RequestException as e:
+                raise LLMError(f"Completion stream interrupted: {e}") from e
+            finally:
+                response.close()
+
+    def _payload(self, messages, model, max_tokens, stream, **params) -> dict:
+        """Build the JSON body for a chat-completions request."""
+        payload = {"model": model or self.model, "messages": messages, "max_tokens": max_tokens, "stream": stream}
+        payload.update(params)
+        return payload
+
+    def _admit(self, messages, max_tokens, deadline):
+        """Wait for the provider's quota to allow this call (a rough 4-characters-per-token estimate)."""
+        if self.admission is None or not self.admission.enabled:
+            return
+        tokens = max_tokens + sum(len(str(m.get("content", ""))) for m in messages) // 4
+        try:
+            self.admission.admit(tokens, timeout=deadline - time.monotonic())
+        except AdmissionRejected as e:
+            raise LLMBusyError(str(e)) from e
+
+    def _slot(self, deadline):
+        """Acquire a concurrency slot, waiting at most ``LLM_QUEUE_TIMEOUT`` or until the deadline."""
+        wait = max(0.0, min(self.queue_timeout, deadline - time.monotonic()))
+        if not self._semaphore.acquire(timeout=wait):
+            raise LLMBusyError("All LLM connections are busy, try again shortly.")
+        return _Release(self._semaphore)
+
+    def _post(self, payload, deadline, stream) -> requests.Response:
+        """
+        POST the payload, retrying retryable failures until the deadline.
+
+        Only the request/headers phase is retried; once a streaming body has
+        started, failures are surfaced to the caller.
+        """
+        if self._session is None:
+            self._session = self._build_session(8)
+        url = f"{self.api_base}/chat/completions"
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+
+        last_error: Optional[str] = None
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            retry_after = None
+            try:
+                response = self._session.post(
+                    url,
+                    json=payload,
+                    headers=headers,
+                    stream=stream,
+                    timeout=(min(self.connect_timeout, remaining), remaining),
+                )
+            except requests.exceptions.Timeout as e:
+                last_error = f"timed out: {e}"
+            except requests.exceptions.ConnectionError as e:
+                last_error = f"connection failed: {e}"
+            else:
+                if response.status_code < 400:
+                    return response
+                last_error = f"HTTP {response.status_code}: {response.text[:200]}"
+                retry_after = response.headers.get("Retry-After")
+                response.close()
+                if response.status_code not in RETRYABLE_STATUS:
+                    raise LLMError(f"LLM request failed with {last_error}")
+
+            if attempt < self.max_retries:
+                delay = self._backoff(attempt, retry_after)
+                if time.monotonic() + delay >= deadline:
+                    break
+                time.sleep(delay)
+
+        if time.monotonic() >= deadline:
+            raise LLMTimeoutError(f"LLM request exceeded its deadline ({last_error}).")
+        raise LLMError(f"LLM request failed after {self.max_retries + 1} attempts ({last_error}).")
+
+    def _backoff(self, attempt, retry_after=None) -> float:
+        """Full-jitter exponential backoff, honouring a numeric ``Retry-After`` header."""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def close(self):
+        """Close all pooled connections."""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+class _Release:
+    """Context manager that releases an already-acquired semaphore on exit."""
+
+    def __init__(self, semaphore):
+        self._semaphore = semaphore
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._semaphore.release()
+        return False
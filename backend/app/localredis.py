@@ -0,0 +1,310 @@
+"""
+Redis connections, with an in-process stand-in for tests and development.
+
+``connect(url)`` returns a ``redis.Redis`` client for ``redis://`` and
+``rediss://`` URLs (the ``redis`` package is only imported then) and a shared
+``LocalRedis`` instance for ``local://<name>`` URLs. ``LocalRedis`` implements
+the subset of commands the backends use with the same semantics, including
+bytes return values, sorted sets, key expiry and optimistic ``WATCH``/``MULTI``
+transactions, so code can be exercised without a server.
+"""
+import fnmatch
+import threading
+import time
+
+try:
+    from redis.exceptions import WatchError  # type: ignore
+except ImportError:
+    class WatchError(Exception):
+        """Raised by ``execute`` when a watched key changed (as in redis-py)."""
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def connect(url):
+    """
+    Return a Redis-protocol client for ``url``.
+
+    Parameters:
+    -----------
+    url : str
+        ``redis://host:port/db`` for a real server or ``local://<name>`` for
+        the in-process stand-in (clients with the same name share data).
+    """
+    if url.startswith("local://"):
+        name = url[len("local://"):] or "default"
+        with _instances_lock:
+            if name not in _instances:
+                _instances[name] = LocalRedis()
+            return _instances[name]
+    import redis  # type: ignore
+    return redis.Redis.from_url(url)
+
+
+def _bytes(value) -> bytes:
+    """Encode keys and values the way redis-py sends them."""
+    return value if isinstance(value, bytes) else str(value).encode()
+
+
+class LocalRedis:
+    """Thread-safe in-memory implementation of a subset of Redis commands."""
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._versions = {}  # Bumped on every write, checked by watched pipelines
+        self._lock = threading.RLock()
+
+    def _alive(self, key) -> bool:
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+            self._touch(key)
+        return key in self._data
+
+    def _touch(self, key):
+        self._versions[key] = self._versions.get(key, 0) + 1
+
+    # Keys
+
+    def delete(self, *keys) -> int:
+        with self._lock:
+            removed = 0
+            for key in map(_bytes, keys):
+                if self._alive(key):
+                    del self._data[key]
+                    self._expires.pop(key, None)
+                    self._touch(key)
+                    removed += 1
+            return removed
+
+    def exists(self, *keys) -> int:
+        with self._lock:
+            return sum(1 for key in map(_bytes, keys) if self._alive(key))
+
+    def expire(self, key, seconds) -> bool:
+        with self._lock:
+            key = _bytes(key)
+            if not self._alive(key):
+                return False
+            self._expires[key] = time.time() + float(seconds)
+            self._touch(key)
+            return True
+
+    def ttl(self, key) -> int:
+        with self._lock:
+            key = _bytes(key)
+            if not self._alive(key):
+                return -2
+            if key not in self._expires:
+                return -1
+            return max(0, int(round(self._expires[key] - time.time())))
+
+    def scan_iter(self, match=None, count=None):
+        with self._lock:
+            keys = [key for key in list(self._data) if self._alive(key)]
+        pattern = _bytes(match).decode() if match is not None else None
+        for key in keys:
+            if pattern is None or fnmatch.fnmatchcase(key.decode(), pattern):
+                yield key
+
+    def flushall(self):
+        with self._lock:
+            for key in self._data:
+                self._touch(key)
+            self._data.clear()
+            self._expires.clear()
+
+    # Strings
+
+    def get(self, key):
+        with self._lock:
+            key = _bytes(key)
+            return self._data[key] if self._alive(key) else None
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._lock:
+            key = _bytes(key)
+            if nx and self._alive(key):
+                return None
+            self._data[key] = _bytes(value)
+            self._expires.pop(key, None)
+            if ex is not None:
+                self._expires[key] = time.time() + float(ex)
+            self._touch(key)
+            return True
+
+    def incrby(self, key, amount=1) -> int:
+        with self._lock:
+            key = _bytes(key)
+            value = int(self._data[key]) + amount if self._alive(key) else amount
+            self._data[key] = _bytes(value)
+            self._touch(key)
+            return value
+
+    def incr(self, key, amount=1) -> int:
+        return self.incrby(key, amount)
+
+    # Hashes
+
+    def hset(self, name, key=None, value=None, mapping=None) -> int:
+        with self._lock:
+            name = _bytes(name)
+            if not self._alive(name):
+                self._data[name] = {}
+            fields = self._data[name]
+            items = dict(mapping or {})
+            if key is not None:
+                items[key] = value
+            added = 0
+            for field, field_value in items.items():
+                field = _bytes(field)
+                added += field not in fields
+                fields[field] = _bytes(field_value)
+            self._touch(name)
+            return added
+
+    def hget(self, name, key):
+        with self._lock:
+            name = _bytes(name)
+            return self._data[name].get(_bytes(key)) if self._alive(name) else None
+
+    def hgetall(self, name) -> dict:
+        with self._lock:
+            name = _bytes(name)
+            return dict(self._data[name]) if self._alive(name) else {}
+
+    def hdel(self, name, *keys) -> int:
+        with self._lock:
+            name = _bytes(name)
+            if not self._alive(name):
+                return 0
+            fields = self._data[name]
+            removed = sum(1 for key in map(_bytes, keys) if fields.pop(key, None) is not None)
+            if removed:
+                self._touch(name)
+            if not fields:
+                del self._data[name]
+                self._expires.pop(name, None)
+            return removed
+
+    # Sorted sets
+
+    def zadd(self, name, mapping) -> int:
+        with self._lock:
+            name = _bytes(name)
+            if not self._alive(name):
+                self._data[name] = {}
+            scores = self._data[name]
+            added = 0
+            for member, score in mapping.items():
+                member = _bytes(member)
+                added += member not in scores
+                scores[member] = float(score)
+            self._touch(name)
+            return added
+
+    def zrangebyscore(self, name, min, max, start=None, num=None, withscores=False) -> list:
+        with self._lock:
+            name = _bytes(name)
+            scores = dict(self._data[name]) if self._alive(name) else {}
+        low, high = _score_bound(min), _score_bound(max)
+        found = sorted((score, member) for member, score in scores.items() if _within(score, low, high))
+        if start is not None and num is not None:
+            found = found[start:start + num]
+        return [(member, score) for score, member in found] if withscores else [member for _, member in found]
+
+    def zremrangebyscore(self, name, min, max) -> int:
+        with self._lock:
+            name = _bytes(name)
+            if not self._alive(name):
+                return 0
+            low, high = _score_bound(min), _score_bound(max)
+            scores = self._data[name]
+            removed = [member for member, score in scores.items() if _within(score, low, high)]
+            for member in removed:
+                del scores[member]
+            if removed:
+                self._touch(name)
+            if not scores:
+                del self._data[name]
+                self._expires.pop(name, None)
+            return len(removed)
+
+    def pipeline(self, transaction=True):
+        return _Pipeline(self)
+
+
+def _score_bound(value) -> tuple:
+    """Parse a ZRANGEBYSCORE bound: a number, '-inf'/'+inf', or '(x' for an exclusive bound."""
+    text = value.decode() if isinstance(value, bytes) else str(value)
+    exclusive = text.startswith("(")
+    return float(text[1:] if exclusive else text), exclusive
+
+
+def _within(score, low, high) -> bool:
+    (low_value, low_open), (high_value, high_open) = low, high
+    return (score > low_value if low_open else score >= low_value) and \
+        (score < high_value if high_open else score <= high_value)
+
+
+class _Pipeline:
+    """
+    Buffers commands and runs them under the client lock on ``execute``.
+
+    After ``watch(*keys)`` commands run immediately (so values can be read)
+    until ``multi()``; ``execute`` then raises ``WatchError`` without running
+    anything if a watched key was written in the meantime.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+        self._watched = {}
+        self._immediate = False
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+        if self._immediate:
+            return method
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def watch(self, *keys):
+        with self._client._lock:
+            for key in map(_bytes, keys):
+                self._client._alive(key)
+                self._watched[key] = self._client._versions.get(key, 0)
+        self._immediate = True
+
+    def multi(self):
+        self._immediate = False
+
+    def execute(self):
+        try:
+            with self._client._lock:
+                versions = self._client._versions
+                for key, version in self._watched.items():
+                    self._client._alive(key)
+                    if versions.get(key, 0) != version:
+                        raise WatchError("Watched variable changed.")
+                return [method(*args, **kwargs) for method, args, kwargs in self._commands]
+        finally:
+            self.reset()
+
+    def reset(self):
+        self._commands = []
+        self._watched = {}
+        self._immediate = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.reset()
+        return False
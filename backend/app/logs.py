@@ -0,0 +1,116 @@
+"""
+Structured, sampled and level-gated logging for the hot paths.
+
+``EventLogger`` takes an event name and keyword fields instead of an f-string::
+
+    log.info("message.handled", user_id=user_id, node=node.id)
+
+The level is checked first and debug/info events are then sampled
+(``LOG_SAMPLE_RATE``), so a dropped event costs one comparison and a random
+number; nothing is formatted until a handler actually writes the record.
+Warnings and errors are never sampled. With ``LOG_FORMAT=json`` every record
+of the ``app`` loggers is written as one JSON object per line, fields
+included; otherwise they read ``event key=value ...``.
+"""
+import json
+import logging
+import random
+
+
+class _Event:
+    """Log message rendered lazily, only if a handler emits the record."""
+
+    __slots__ = ("event", "fields")
+
+    def __init__(self, event, fields):
+        self.event = event
+        self.fields = fields
+
+    def __str__(self):
+        if not self.fields:
+            return self.event
+        return self.event + " " + " ".join(f"{key}={value!r}" for key, value in self.fields.items())
+
+
+class EventLogger:
+    """
+    Wrapper around a ``logging.Logger`` emitting named events with fields.
+
+    Attributes:
+    -----------
+    sample_rate : float
+        Fraction of debug and info events kept, shared by every instance.
+    """
+
+    sample_rate = 1.0
+
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+
+    def debug(self, event, **fields):
+        self._sampled(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._sampled(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        if self.logger.isEnabledFor(logging.WARNING):
+            self.logger.log(logging.WARNING, _Event(event, fields))
+
+    def error(self, event, **fields):
+        if self.logger.isEnabledFor(logging.ERROR):
+            self.logger.log(logging.ERROR, _Event(event, fields))
+
+    def _sampled(self, level, event, fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        rate = self.sample_rate
+        if rate < 1.0 and random.random() >= rate:
+            return
+        self.logger.log(level, _Event(event, fields))
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, event or message, and fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+        }
+        if isinstance(record.msg, _Event):
+            entry["event"] = record.msg.event
+            entry.update(record.msg.fields)
+        else:
+            entry["message"] = record.getMessage()
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(app):
+    """
+    Apply ``LOG_LEVEL``, ``LOG_FORMAT`` and ``LOG_SAMPLE_RATE`` to the ``app`` loggers.
+
+    Flask's ``app.logger`` and the module loggers (``app.logwriter``, ...) all
+    live under the ``app`` logger, so one handler covers them.
+
+    Parameters:
+    -----------
+    app : Flask
+        The Flask application.
+    """
+    config = app.config
+    EventLogger.sample_rate = max(0.0, min(1.0, float(config.get("LOG_SAMPLE_RATE", 1.0))))
+    root = logging.getLogger("app")
+    root.setLevel(getattr(logging, str(config.get("LOG_LEVEL", "INFO")).upper(), logging.INFO))
+    if str(config.get("LOG_FORMAT", "text")).lower() == "json":
+        handler = next((h for h in root.handlers if isinstance(h.formatter, JSONFormatter)), None)
+        if handler is None:
+            handler = logging.StreamHandler()
+            handler.setFormatter(JSONFormatter())
+            root.handlers = [h for h in root.handlers if not isinstance(h, logging.StreamHandler)]
+            root.addHandler(handler)
+    return root
+
@@ -0,0 +1,292 @@
+"""
+Write-behind persistence for ConversationLog.
+
+Handlers used to add and commit one ConversationLog row per chat message,
+which on SQLite meant an fsync and a trip through the global write lock for
+every line. ``ConversationLogWriter`` instead numbers each message from a
+preallocated id block, queues it in memory and returns immediately; a
+background writer drains the queue and bulk-inserts whole batches in a single
+transaction once ``LOG_WRITER_BATCH_SIZE`` rows are waiting or
+``LOG_WRITER_FLUSH_INTERVAL`` seconds have passed.
+
+The ids handed back to callers are the primary keys the rows are written
+with, so the ``id`` emitted to clients never changes after the flush.
+Anything else inserting ConversationLog rows should go through the writer as
+well, or ids reserved by a running process may collide with them.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import func, insert, select, update  # type: ignore
+from sqlalchemy.exc import IntegrityError  # type: ignore
+
+from . import db
+from .models import ConversationLog, IdAllocation
+from .utils import run_blocking
+
+logger = logging.getLogger(__name__)
+
+# Queued by close() to wake the writer without waiting out the flush interval
+_STOP = object()
+
+
+class LogQueueFull(Exception):
+    """Raised when the write-behind queue stays full past ``LOG_WRITER_PUT_TIMEOUT``."""
+
+
+class IdAllocator:
+    """
+    Reserves blocks of ConversationLog ids and hands them out one by one.
+
+    Blocks are claimed with an optimistic compare-and-set on ``id_allocation``,
+    so several processes can share a database without coordinating otherwise.
+    """
+
+    name = ConversationLog.__tablename__
+
+    def __init__(self, app, block_size=1000):
+        self.app = app
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+
+    def next_id(self) -> int:
+        with self._lock:
+            if self._next >= self._end:
+                self._next = run_blocking(self._reserve)
+                self._end = self._next + self.block_size
+            allocated = self._next
+            self._next += 1
+            return allocated
+
+    def _reserve(self) -> int:
+        """Claim the next block in the database and return its first id."""
+        with self.app.app_context():
+            IdAllocation.__table__.create(db.engine, checkfirst=True)
+            for _ in range(50):
+                try:
+                    with db.engine.begin() as conn:
+                        current = conn.execute(
+                            select(IdAllocation.next_id).where(IdAllocation.name == self.name)
+                        ).scalar()
+                        # Never hand out ids below rows already written by other means
+                        floor = conn.execute(select(func.coalesce(func.max(ConversationLog.id), 0) + 1)).scalar()
+                        start = max(current or 1, floor)
+                        if current is None:
+                            conn.execute(insert(IdAllocation).values(name=self.name, next_id=start + self.block_size))
+                            return start
+                        claimed = conn.execute(
+                            update(IdAllocation)
+                            .where(IdAllocation.name == self.name, IdAllocation.next_id == current)
+                            .values(next_id=start + self.block_size)
+                        ).rowcount
+                        if claimed:
+                            return start
+                except IntegrityError:
+                    pass  # Another process created the row first; retry against it
+                time.sleep(0.001)
+            raise RuntimeError("Could not reserve a ConversationLog id block.")
+
+
+class ConversationLogWriter:
+    """
+    Flask extension queueing ConversationLog rows for batched inserts.
+
+    Attributes:
+    -----------
+    mode : str
+        ``async`` (write-behind thread) or ``sync`` (write before returning, for tests).
+    batch_size : int
+        Rows per bulk insert; a full batch is flushed without waiting.
+    flush_interval : float
+        Maximum seconds a queued row waits before being written.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.mode = "async"
+        self.batch_size = 500
+        self.flush_interval = 0.05
+        self.put_timeout = 1.0
+        self.max_retries = 3
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self._queue = queue.Queue()
+        self._allocator = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._atexit_registered = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Configure the writer from the ``LOG_WRITER_*`` settings of the Flask app.
+
+        Parameters:
+        -----------
+        app : Flask
+            The Flask application.
+        """
+        self.close()
+        config = app.config
+        self.app = app
+        self.mode = config.get("LOG_WRITER_MODE", "async")
+        self.batch_size = int(config.get("LOG_WRITER_BATCH_SIZE", self.batch_size))
+        self.flush_interval = float(config.get("LOG_WRITER_FLUSH_INTERVAL", self.flush_interval))
+        self.put_timeout = float(config.get("LOG_WRITER_PUT_TIMEOUT", self.put_timeout))
+        self._queue = queue.Queue(maxsize=int(config.get("LOG_WRITER_QUEUE_SIZE", 10000)))
+        self._allocator = IdAllocator(app, int(config.get("LOG_WRITER_ID_BLOCK", 1000)))
+        self.written = self.dropped = self.batches = 0
+        if not self._atexit_registered:
+            atexit.register(self.close)
+            self._atexit_registered = True
+        app.extensions["log_writer"] = self
+
+    @property
+    def depth(self) -> int:
+        """Rows waiting to be written."""
+        return self._queue.qsize()
+
+    def log(self, user_id, message, kind="answer") -> int:
+        """
+        Queue a chat message for persistence and return its ConversationLog id.
+
+        Parameters:
+        -----------
+        user_id : int
+            Author of the message.
+        message : str
+            The message content.
+        kind : str
+            Retention class: ``answer`` (to the conversation flow) or ``prompt`` (to the LLM).
+
+        Returns:
+        --------
+        int
+            The id the row will be written with.
+
+        Raises:
+        -------
+        LogQueueFull
+            When the queue stays full for ``LOG_WRITER_PUT_TIMEOUT`` seconds.
+        """
+        row = {
+            "id": self._allocator.next_id(),
+            "user_id": user_id,
+            "message": message,
+            "timestamp": datetime.utcnow(),
+            "kind": kind,
+        }
+        if self.mode == "sync":
+            run_blocking(self._write, [row])
+            return row["id"]
+
+        self._ensure_started()
+        try:
+            # Block the producer for a bounded time instead of growing without limit
+            self._queue.put(row, timeout=self.put_timeout)
+        except queue.Full:
+            self.dropped += 1
+            raise LogQueueFull("Conversation log queue is full, message not saved.") from None
+        return row["id"]
+
+    def flush(self):
+        """Write everything queued so far from the calling thread."""
+        while True:
+            batch = self._drain(self.batch_size)
+            if not batch:
+                return
+            self._write_with_retries(batch)
+
+    def close(self):
+        """Stop the background writer after flushing every queued row."""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopping.set()
+            try:
+                self._queue.put_nowait(_STOP)
+            except queue.Full:
+                pass  # The writer is busy and will see the stop flag after this batch
+            thread.join()
+        if self.app is not None:
+            self.flush()
+        self._stopping.clear()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="conversation-log-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._collect()
+            if batch:
+                self._write_with_retries(batch)
+
+    def _collect(self):
+        """Wait for a full batch or the flush interval, whichever comes first."""
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        if first is _STOP:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                row = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if row is _STOP:
+                break
+            batch.append(row)
+        return batch
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                row = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is not _STOP:
+                batch.append(row)
+        return batch
+
+    def _write_with_retries(self, batch):
+        with self._flush_lock:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    run_blocking(self._write, batch)
+                    return
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        self.dropped += len(batch)
+                        logger.error("Dropping %d conversation log rows after %d attempts: %s",
+                                     len(batch), attempt + 1, e)
+                        return
+                    time.sleep(0.05 * (2 ** attempt))
+
+    def _write(self, rows):
+        """Bulk insert ``rows`` in one transaction (executemany)."""
+        with self.app.app_context():
+            db.session.execute(insert(ConversationLog), rows)
+            db.session.commit()
+        self.written += len(rows)
+        self.batches += 1
@@ -3,12 +3,25 @@ from flask import Flask # type: ignore
 from flask_socketio import SocketIO # type: ignore
 from flask_sqlalchemy import SQLAlchemy # type: ignore
 
-# Create the Flask app and initialize extensions (SocketIO and SQLAlchemy)
 app: Flask
 socketio: SocketIO
 db: SQLAlchemy
-app, socketio, db = create_app()
+_created = {}
+
+
+def __getattr__(name):
+    """
+    Create the Flask app and initialize extensions (SocketIO and SQLAlchemy) on first
+    access of ``app``, ``socketio`` or ``db`` rather than at import.
+    """
+    if name not in ("app", "socketio", "db"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if not _created:
+        _created.update(zip(("app", "socketio", "db"), create_app()))
+    return _created[name]
+
 
 if __name__ == '__main__':
     # Run the Flask-SocketIO app on the specified host and port in debug mode
-    socketio.run(app, host='0.0.0.0', port=5000, debug=True)
+    socketio = __getattr__("socketio")
+    socketio.run(__getattr__("app"), host='0.0.0.0', port=5000, debug=True)
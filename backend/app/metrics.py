@@ -0,0 +1,317 @@
+"""
+In-process Prometheus metrics for the request and socket hot paths.
+
+Counters, gauges and histograms are kept in plain Python objects and rendered
+in the Prometheus text exposition format by ``GET /metrics``, so no client
+library is needed. Recording is a dict lookup and an addition under a lock;
+gauges that mirror existing state (connected sockets, queue depths) are read
+from callbacks at scrape time and cost nothing on the hot path.
+
+Per-event latency is broken down with a ``StageTimer``: each ``mark(stage)``
+records the time since the previous mark, and ``finish()`` records the total::
+
+    timer = metrics.timer("message")
+    ...validate...
+    timer.mark("validate")
+    ...
+    timer.finish()
+
+Metrics are per process, like ``/socket_stats``; scrape every worker (or put
+them behind one port each) to see the whole deployment.
+"""
+import bisect
+import math
+import threading
+import time
+
+from flask import g, request  # type: ignore
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; spans sub-millisecond dispatch up to slow LLM completions
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+        return tuple(str(value) for value in labels)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Monotonic count, e.g. errors or invalid inputs."""
+
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}_total{_labels(self.labelnames, key)} {_number(value)}"
+                                for key, value in items]
+
+
+class Gauge(_Metric):
+    """
+    Current value: set explicitly or, with ``callback``, read at scrape time.
+
+    A callback returns a number for an unlabelled gauge, or a dict mapping
+    label tuples to numbers.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value, *labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, *labels):
+        if self.callback is not None:
+            values = self._collect()
+            return values.get(self._key(labels), 0)
+        return self._values.get(self._key(labels), 0)
+
+    def _collect(self) -> dict:
+        result = self.callback()
+        if isinstance(result, dict):
+            return {tuple(str(v) for v in (key if isinstance(key, tuple) else (key,))): value
+                    for key, value in result.items()}
+        return {(): result}
+
+    def render(self) -> list:
+        if self.callback is not None:
+            try:
+                items = sorted(self._collect().items())
+            except Exception:
+                items = []  # A failing source must not break the scrape
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+                                for key, value in items]
+
+
+class Histogram(_Metric):
+    """Distribution of observations (seconds) in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labels) -> int:
+        series = self._values.get(self._key(labels))
+        return series[2] if series else 0
+
+    def sum(self, *labels) -> float:
+        series = self._values.get(self._key(labels))
+        return series[1] if series else 0.0
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted((key, (list(series[0]), series[1], series[2])) for key, series in self._values.items())
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(bound))])} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class StageTimer:
+    """Records the time spent in each stage of one event, and the event's total."""
+
+    __slots__ = ("_metrics", "event", "_start", "_last")
+
+    def __init__(self, metrics, event):
+        self._metrics = metrics
+        self.event = event
+        self._start = self._last = time.perf_counter()
+
+    def mark(self, stage):
+        """Close ``stage`` (the time since the previous mark or the start)."""
+        now = time.perf_counter()
+        self._metrics.stage_seconds.observe(now - self._last, self.event, stage)
+        self._last = now
+
+    def skip(self):
+        """Restart the clock without recording, for work that belongs to no stage."""
+        self._last = time.perf_counter()
+
+    def finish(self, outcome="ok") -> float:
+        """Record the event's total latency and return it in seconds."""
+        elapsed = time.perf_counter() - self._start
+        self._metrics.event_seconds.observe(elapsed, self.event, outcome)
+        return elapsed
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def mark(self, stage):
+        pass
+
+    def skip(self):
+        pass
+
+    def finish(self, outcome="ok") -> float:
+        return 0.0
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """
+    Flask extension owning the metric registry and the HTTP timing hooks.
+
+    Attributes:
+    -----------
+    enabled : bool
+        False turns recording into no-ops (``METRICS_ENABLED``).
+    event_seconds : Histogram
+        Socket event and HTTP handler latency by event and outcome.
+    stage_seconds : Histogram
+        Latency of each stage (validate, session_io, db, lookup, emit, llm) by event.
+    errors : Counter
+        Failures by where they happened.
+    invalid_inputs : Counter
+        Answers rejected by the conversation flow, by node.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self._metrics = {}
+        self.event_seconds = self.histogram(
+            "spokesperson_event_seconds", "Socket.IO event and HTTP request latency.", ("event", "outcome"))
+        self.stage_seconds = self.histogram(
+            "spokesperson_event_stage_seconds", "Time spent in each stage of an event.", ("event", "stage"))
+        self.errors = self.counter("spokesperson_errors", "Errors by where they were caught.", ("where",))
+        self.invalid_inputs = self.counter(
+            "spokesperson_invalid_inputs", "Answers rejected by the conversation flow.", ("node",))
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Configure recording from ``METRICS_ENABLED`` and time every HTTP request.
+
+        Parameters:
+        -----------
+        app : Flask
+            The Flask application.
+        """
+        self.enabled = bool(app.config.get("METRICS_ENABLED", True))
+        if "metrics" not in app.extensions:
+            app.before_request(self._start_request)
+            app.after_request(self._finish_request)
+        app.extensions["metrics"] = self
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None) -> Gauge:
+        """Register a gauge; registering a name again replaces it (e.g. a new app's callback)."""
+        metric = Gauge(name, documentation, labelnames, callback)
+        self._metrics[name] = metric
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def timer(self, event):
+        """A ``StageTimer`` for one ``event``, or a no-op timer when disabled."""
+        return StageTimer(self, event) if self.enabled else _NULL_TIMER
+
+    def request_timer(self):
+        """The timer of the current HTTP request, for marking its stages."""
+        return g.get("metrics_timer", _NULL_TIMER)
+
+    def error(self, where):
+        if self.enabled:
+            self.errors.inc(where)
+
+    def invalid(self, node):
+        if self.enabled:
+            self.invalid_inputs.inc(node)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _start_request(self):
+        if self.enabled:
+            g.metrics_timer = StageTimer(self, f"http:{request.endpoint}")
+
+    def _finish_request(self, response):
+        timer = g.pop("metrics_timer", None)
+        if timer is not None:
+            timer.finish(str(response.status_code))
+        return response
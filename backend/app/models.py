@@ -1,6 +1,6 @@
 from datetime import datetime
 from sqlalchemy.orm import relationship, Mapped, mapped_column # type: ignore
-from sqlalchemy import ForeignKey, String, Integer, DateTime # type: ignore
+from sqlalchemy import ForeignKey, Index, JSON, String, Integer, DateTime # type: ignore
 from . import db
 
 class User(db.Model):
@@ -40,13 +40,115 @@ class ConversationLog(db.Model):
         The content of the message.
     timestamp : datetime
         Timestamp of when the message was sent.
+    kind : str
+        Message class the retention TTLs apply to: ``answer`` (a reply to the
+        conversation flow) or ``prompt`` (free text sent to the LLM).
     """
     __tablename__ = 'conversation_log'
+    __table_args__ = (
+        # History reads filter on the user and page by (timestamp, id)
+        Index('ix_conversation_log_user_id_timestamp_id', 'user_id', 'timestamp', 'id'),
+        # Retention expires and archives by time range
+        Index('ix_conversation_log_timestamp_id', 'timestamp', 'id'),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)  # Primary key
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey('user.id'), nullable=False)  # Foreign key to User model
     message: Mapped[str] = mapped_column(String, nullable=False)  # Message content
     timestamp: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)  # Message timestamp
+    kind: Mapped[str] = mapped_column(String(16), nullable=False, default='answer',
+                                      server_default='answer')  # Retention class
 
     # Establish the relationship to the User model
     user: Mapped[User] = relationship('User', back_populates='conversations')
+
+
+class IdAllocation(db.Model):
+    """
+    IdAllocation hands out blocks of primary keys to worker processes.
+
+    Writers reserve a block up front so rows can be numbered (and the id sent to
+    clients) before they are actually inserted.
+
+    Attributes:
+    -----------
+    name : str
+        Name of the table the ids belong to.
+    next_id : int
+        First id not yet reserved by any process.
+    """
+    __tablename__ = 'id_allocation'
+
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)  # Table name
+    next_id: Mapped[int] = mapped_column(Integer, nullable=False)  # Next unreserved id
+
+
+class Profile(db.Model):
+    """
+    Profile stores the structured profile extracted from a user's answers.
+
+    ``data`` follows the storage format in ConversationFlow.txt §7 (interests,
+    personality_traits, communication_style, values, date_preferences,
+    additional_details).
+
+    Attributes:
+    -----------
+    user_id : int
+        The user the profile belongs to (one profile per user).
+    answers : dict
+        The raw answers collected by the conversation flow.
+    answers_hash : str
+        SHA-256 of the normalized answers; identical answers reuse an extraction.
+    extractor : str
+        Extractor that produced ``data`` (``rules`` or ``llm``).
+    data : dict
+        The extracted profile.
+    updated_at : datetime
+        Timestamp of the last extraction.
+    """
+    __tablename__ = 'profile'
+
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey('user.id'), primary_key=True)  # One profile per user
+    answers: Mapped[dict] = mapped_column(JSON, nullable=False)  # Raw flow answers
+    answers_hash: Mapped[str] = mapped_column(String(64), nullable=False, index=True)  # Extraction cache key
+    extractor: Mapped[str] = mapped_column(String(16), nullable=False)  # 'rules' or 'llm'
+    data: Mapped[dict] = mapped_column(JSON, nullable=False)  # ConversationFlow §7 profile
+    updated_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)  # Last extraction
+
+
+class ConversationArchive(db.Model):
+    """
+    ConversationArchive catalogs the monthly partitions of ConversationLog
+    moved out of the table into compressed archive files (see app/retention.py).
+
+    Every month before ``ends_at`` of the newest partition is read from the
+    archives; the table only answers for later messages.
+
+    Attributes:
+    -----------
+    month : str
+        Partition, as ``YYYY-MM``.
+    starts_at, ends_at : datetime
+        Bounds of the partition's timestamps (inclusive, exclusive).
+    path : str
+        Archive file name inside ``RETENTION_ARCHIVE_PATH``.
+    rows : int
+        Messages in the archive.
+    bytes : int
+        Size of the archive file.
+    blocks : list
+        ``[first_user_id, last_user_id, offset, length, rows, kinds]`` for every
+        separately compressed block, in (user_id, timestamp, id) order.
+    created_at : datetime
+        Timestamp of the last (re)write of the archive.
+    """
+    __tablename__ = 'conversation_archive'
+
+    month: Mapped[str] = mapped_column(String(7), primary_key=True)  # YYYY-MM
+    starts_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)  # First instant of the month
+    ends_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)  # First instant of the next month
+    path: Mapped[str] = mapped_column(String(255), nullable=False)  # Archive file name
+    rows: Mapped[int] = mapped_column(Integer, nullable=False)  # Messages archived
+    bytes: Mapped[int] = mapped_column(Integer, nullable=False)  # Compressed size
+    blocks: Mapped[list] = mapped_column(JSON, nullable=False)  # Block index for per-user reads
+    created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)  # Last write
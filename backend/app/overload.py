@@ -0,0 +1,441 @@
+"""
+Adaptive concurrency limits and load shedding for HTTP requests and Socket.IO events.
+
+Rate limits (``app/ratelimit.py``) bound what each user may send. They do not
+stop a worker from taking on more concurrent work than its threads, database
+locks and LLM quota can serve, at which point everyone's latency collapses.
+``ConcurrencyController`` caps the requests and events in flight in a process,
+and adjusts the cap from the latency of the work it admits, in the manner of
+Netflix's concurrency-limits:
+
+- ``gradient`` (default): per window of samples the limit is multiplied by
+  ``tolerance * long_rtt / short_rtt``, clamped to 0.5..1. ``long_rtt`` is a
+  slow moving average of each endpoint's latency and ``short_rtt`` the
+  window's mean, so the limit shrinks as soon as in-flight work slows down.
+  While latency holds, the limit grows smoothly towards ``limit + sqrt(limit)``.
+- ``aimd``: the limit grows by one per window in which the work was not slower
+  than ``tolerance`` times its usual latency and nothing failed, and is
+  multiplied by ``backoff`` otherwise.
+
+Latencies are compared per endpoint, so a three-second LLM call and a
+sub-millisecond flow step share one limit without the slow one reading as
+congestion. Work that waits for a slot is not timed until it is admitted.
+
+Work has a priority, and each priority may only use a share of the limit
+(``OVERLOAD_SHARES``): scripted flow steps (``critical``) may use all of it,
+other routes (``normal``) most of it, and free-form generation (``low``)
+half. As the limit shrinks, free-form generation is shed first. Critical and
+normal work waits up to ``OVERLOAD_QUEUE_TIMEOUT`` for a slot, with critical
+work served first. Low-priority work never waits. Callers answer it with a
+degraded reply (a cached or templated completion, see
+``services.degraded_reply``) instead of the model's.
+"""
+import functools
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+
+from flask import current_app, g, jsonify, request  # type: ignore
+
+PRIORITIES = ("critical", "normal", "low")
+DEFAULT_SHARES = {"critical": 1.0, "normal": 0.9, "low": 0.5}
+
+
+def parse_shares(value) -> dict:
+    """Priority shares from ``"critical=1.0, normal=0.9, low=0.5"``; unnamed priorities keep their default."""
+    shares = dict(DEFAULT_SHARES)
+    for item in filter(None, (part.strip() for part in (value or "").replace(";", ",").split(","))):
+        name, _, share = item.partition("=")
+        name = name.strip()
+        if name not in shares or not share.strip():
+            raise ValueError(f"Invalid overload share '{item}'; expected e.g. low=0.5 for one of {PRIORITIES}.")
+        shares[name] = min(1.0, max(0.0, float(share)))
+    return shares
+
+
+class Window:
+    """
+    Samples of admitted work since the last limit update.
+
+    Attributes:
+    -----------
+    rtt : dict
+        Endpoint to ``[total seconds, samples]``.
+    dropped : int
+        Samples that failed or timed out.
+    max_inflight : int
+        Most work in flight when a sample was admitted.
+    """
+
+    __slots__ = ("started", "rtt", "count", "dropped", "max_inflight")
+
+    def __init__(self, now):
+        self.started = now
+        self.rtt = defaultdict(lambda: [0.0, 0])
+        self.count = 0
+        self.dropped = 0
+        self.max_inflight = 0
+
+    def add(self, key, seconds, dropped, inflight):
+        entry = self.rtt[key]
+        entry[0] += seconds
+        entry[1] += 1
+        self.count += 1
+        self.dropped += dropped
+        self.max_inflight = max(self.max_inflight, inflight)
+
+
+class _Baselines:
+    """Per-endpoint long-term latency: a slow moving average of window means, floored at ``min_rtt``."""
+
+    def __init__(self, long_window=500, min_rtt=0.001):
+        self.alpha = 2.0 / (long_window + 1)
+        self.min_rtt = min_rtt
+        self.long = {}
+
+    def ratios(self, window):
+        """Yield ``(long_rtt / short_rtt, samples)`` per endpoint of ``window``, then fold it into the baselines."""
+        for key, (total, count) in window.rtt.items():
+            short = max(self.min_rtt, total / count)
+            long = self.long.get(key, short)
+            yield long / short, count
+            if long / short > 2.0:
+                long *= 0.95  # Latency dropped for good (a cold start, a fixed outage): catch up faster
+            self.long[key] = long + self.alpha * (short - long)
+
+
+class GradientLimit:
+    """
+    Limit following the ratio of long-term to recent latency (Netflix's Gradient2).
+
+    Attributes:
+    -----------
+    tolerance : float
+        Slowdown tolerated before the limit shrinks (1.5: 50% slower).
+    smoothing : float
+        Weight of each window's larger limit against the current one; a
+        smaller limit applies at once, so overload is cut short.
+    """
+
+    name = "gradient"
+
+    def __init__(self, min_limit=4, max_limit=200, tolerance=1.5, smoothing=0.2, long_window=500, min_rtt=0.001):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.baselines = _Baselines(long_window, min_rtt)
+
+    def update(self, limit, window) -> float:
+        weighted = sum(min(1.0, max(0.5, self.tolerance * ratio)) * count
+                       for ratio, count in self.baselines.ratios(window))
+        gradient = weighted / window.count
+        if gradient >= 1.0 and window.max_inflight * 2 < limit:
+            return limit  # Not using the limit, so its latency says nothing about a larger one
+        if gradient < 1.0:
+            return max(self.min_limit, limit * gradient)  # Cut at once, so a backlog does not build while it settles
+        target = limit + math.sqrt(limit)  # Headroom for bursts, probing for a larger limit
+        if target > limit:
+            target = limit * (1 - self.smoothing) + target * self.smoothing
+        return min(self.max_limit, max(self.min_limit, target))
+
+
+class AIMDLimit:
+    """
+    Additive increase, multiplicative decrease on failures and slowdowns.
+
+    Attributes:
+    -----------
+    tolerance : float
+        Slowdown over an endpoint's usual latency that counts as congestion.
+    backoff : float
+        Factor applied to the limit on congestion.
+    """
+
+    name = "aimd"
+
+    def __init__(self, min_limit=4, max_limit=200, tolerance=1.5, backoff=0.9, long_window=500, min_rtt=0.001):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.baselines = _Baselines(long_window, min_rtt)
+
+    def update(self, limit, window) -> float:
+        slow = any(self.tolerance * ratio < 1.0 for ratio, _ in list(self.baselines.ratios(window)))
+        if window.dropped or slow:
+            limit *= self.backoff
+        elif window.max_inflight * 2 >= limit:
+            limit += 1
+        return min(self.max_limit, max(self.min_limit, limit))
+
+
+LIMITS = {"gradient": GradientLimit, "aimd": AIMDLimit}
+
+
+class Ticket:
+    """A slot held by one request or event; ``release`` it exactly once, when the work is done."""
+
+    __slots__ = ("controller", "key", "started", "inflight", "released")
+
+    def __init__(self, controller, key, started, inflight):
+        self.controller = controller
+        self.key = key
+        self.started = started
+        self.inflight = inflight
+        self.released = False
+
+    def release(self, dropped=False):
+        """Free the slot and report the work's latency; ``dropped`` for failures and timeouts."""
+        if not self.released:
+            self.released = True
+            self.controller._release(self, dropped)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release(dropped=exc_type is not None)
+        return False
+
+
+class ConcurrencyController:
+    """
+    Flask extension admitting HTTP requests and Socket.IO events under an adaptive concurrency limit.
+
+    Attributes:
+    -----------
+    enabled : bool
+        False admits everything (``OVERLOAD_ENABLED``).
+    limit : float
+        Current limit on work in flight in this process.
+    inflight : int
+        Work admitted and not yet released.
+    shares : dict
+        Fraction of the limit each priority may fill.
+    queue_timeout : float
+        Longest wait for a slot, in seconds, for critical and normal work.
+    degrade : bool
+        Whether shed or LLM-starved generation gets a degraded reply rather than an error.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.algorithm = GradientLimit()
+        self.limit = 20.0
+        self.inflight = 0
+        self.peak = 0
+        self.shares = dict(DEFAULT_SHARES)
+        self.queue_timeout = 0.2
+        self.max_queue = 100
+        self.window_seconds = 0.1
+        self.window_samples = 10
+        self.degrade = True
+        self.admitted = Counter()
+        self.shed = Counter()
+        self._waiting = Counter()
+        self._window = Window(time.monotonic())
+        self._cond = threading.Condition()
+        self._metrics = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, metrics=None):
+        """
+        Configure the limit from the ``OVERLOAD_*`` settings and guard every HTTP request.
+
+        Parameters:
+        -----------
+        app : Flask
+            The Flask application.
+        metrics : Metrics, optional
+            Registry receiving shed work and the current limit.
+        """
+        config = app.config
+        self.enabled = bool(config.get("OVERLOAD_ENABLED", True))
+        name = config.get("OVERLOAD_ALGORITHM", "gradient")
+        if name not in LIMITS:
+            raise ValueError(f"Unknown OVERLOAD_ALGORITHM '{name}'; use one of {sorted(LIMITS)}.")
+        self.algorithm = LIMITS[name](
+            min_limit=int(config.get("OVERLOAD_MIN_LIMIT", 4)),
+            max_limit=int(config.get("OVERLOAD_MAX_LIMIT", 200)),
+            tolerance=float(config.get("OVERLOAD_TOLERANCE", 1.5)),
+            min_rtt=float(config.get("OVERLOAD_MIN_RTT", 0.001)),
+        )
+        self.limit = float(config.get("OVERLOAD_INITIAL_LIMIT", 20))
+        self.shares = parse_shares(config.get("OVERLOAD_SHARES"))
+        self.queue_timeout = float(config.get("OVERLOAD_QUEUE_TIMEOUT", 0.2))
+        self.max_queue = int(config.get("OVERLOAD_MAX_QUEUE", 100))
+        self.window_seconds = float(config.get("OVERLOAD_WINDOW", 0.1))
+        self.window_samples = int(config.get("OVERLOAD_WINDOW_SAMPLES", 10))
+        self.degrade = bool(config.get("OVERLOAD_DEGRADE", True))
+        self.inflight = self.peak = 0
+        self.admitted, self.shed, self._waiting = Counter(), Counter(), Counter()
+        self._window = Window(time.monotonic())
+        if metrics is not None:
+            self._metrics = SimpleNamespace(
+                enabled=lambda: metrics.enabled,
+                shed=metrics.counter("spokesperson_shed", "Requests and events shed under overload.",
+                                     ("endpoint", "priority")),
+            )
+            metrics.gauge("spokesperson_concurrency_limit", "Adaptive limit on work in flight in this process.",
+                          callback=lambda: round(self.limit, 2))
+            metrics.gauge("spokesperson_in_flight", "Requests and events in flight in this process.",
+                          callback=lambda: self.inflight)
+        if "overload" not in app.extensions:
+            app.before_request(self._enter_request)
+            app.after_request(self._mark_response)
+            app.teardown_request(self._leave_request)
+        app.extensions["overload"] = self
+
+    def priority(self, level, degrade=None):
+        """
+        Decorate a view with its priority, and optionally the degraded response sent when it is shed.
+
+        Views without one are ``normal``; views exempt from rate limits
+        (health, metrics, stats) are never shed, so an overloaded worker can
+        still be observed.
+        """
+        if level not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{level}'; use one of {PRIORITIES}.")
+
+        def decorator(view):
+            view._overload_priority = level
+            view._overload_degrade = degrade
+            return view
+        return decorator
+
+    def guard_event(self, event, level="critical"):
+        """
+        Decorate a Socket.IO handler so it only runs in a slot of the limit.
+
+        A shed event is not handled; the client receives an ``overloaded``
+        event with the event name and ``retry_after`` in seconds instead.
+        """
+        endpoint = f"socket.{event}"
+
+        def decorator(handler):
+            @functools.wraps(handler)
+            def wrapper(*args, **kwargs):
+                ticket = self.acquire(level, endpoint)
+                if ticket is None:
+                    from flask_socketio import emit  # type: ignore
+                    emit("overloaded", {"event": event, "retry_after": 1})
+                    return None
+                with ticket:
+                    return handler(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def acquire(self, level="normal", key="default"):
+        """
+        Take a slot for work of priority ``level``, waiting up to ``queue_timeout``
+        unless the work is low priority.
+
+        Parameters:
+        -----------
+        level : str
+            One of ``critical``, ``normal`` or ``low``.
+        key : str
+            Endpoint the work belongs to; latencies are compared per endpoint.
+
+        Returns:
+        --------
+        Ticket or None
+            The slot to release when the work is done, or None when the work is shed.
+        """
+        if not self.enabled:
+            return Ticket(self, None, 0.0, 0)
+        with self._cond:
+            if not self._admissible(level):
+                wait = 0.0 if level == "low" else self.queue_timeout
+                if wait <= 0 or sum(self._waiting.values()) >= self.max_queue:
+                    return self._shed(level, key)
+                deadline = time.monotonic() + wait
+                self._waiting[level] += 1
+                try:
+                    while not self._admissible(level):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return self._shed(level, key)
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting[level] -= 1
+            self.inflight += 1
+            self.peak = max(self.peak, self.inflight)
+            self.admitted[level] += 1
+            return Ticket(self, key, time.monotonic(), self.inflight)
+
+    def stats(self) -> dict:
+        """The limit, work in flight and waiting, and admitted and shed counts by priority."""
+        with self._cond:
+            return {
+                "enabled": self.enabled,
+                "algorithm": self.algorithm.name,
+                "limit": round(self.limit, 2),
+                "in_flight": self.inflight,
+                "peak_in_flight": self.peak,
+                "waiting": sum(self._waiting.values()),
+                "admitted": dict(self.admitted),
+                "shed": dict(self.shed),
+                "baseline_ms": {key: round(seconds * 1000, 3)
+                                for key, seconds in self.algorithm.baselines.long.items()},
+            }
+
+    def _admissible(self, level) -> bool:
+        """Whether work of ``level`` fits its share of the limit, behind any waiting work of higher priority."""
+        for higher in PRIORITIES[:PRIORITIES.index(level)]:
+            if self._waiting[higher]:
+                return False
+        return self.inflight < max(1.0, self.limit * self.shares[level])
+
+    def _shed(self, level, key):
+        self.shed[level] += 1
+        m = self._metrics
+        if m is not None and m.enabled():
+            m.shed.inc(key, level)
+        return None
+
+    def _release(self, ticket, dropped):
+        if ticket.key is None:
+            return  # Admitted while disabled
+        now = time.monotonic()
+        with self._cond:
+            self.inflight -= 1
+            window = self._window
+            window.add(ticket.key, now - ticket.started, dropped, ticket.inflight)
+            if window.count >= self.window_samples and now - window.started >= self.window_seconds:
+                self.limit = self.algorithm.update(self.limit, window)
+                self._window = Window(now)
+            if self._waiting:
+                self._cond.notify_all()
+
+    def _enter_request(self):
+        if not self.enabled or request.endpoint is None:
+            return None
+        view = current_app.view_functions.get(request.endpoint)
+        if view is None or getattr(view, "_rate_limit_exempt", False):
+            return None
+        ticket = self.acquire(getattr(view, "_overload_priority", "normal"), request.endpoint)
+        if ticket is not None:
+            g.overload_ticket = ticket
+            return None
+        degrade = getattr(view, "_overload_degrade", None)
+        if degrade is not None and self.degrade:
+            return degrade()
+        response = jsonify({"error": "The server is overloaded, please retry shortly."})
+        response.status_code = 503
+        response.headers["Retry-After"] = "1"
+        return response
+
+    def _mark_response(self, response):
+        if response.status_code in (503, 504) and "overload_ticket" in g:
+            g.overload_dropped = True
+        return response
+
+    def _leave_request(self, exc):
+        ticket = g.pop("overload_ticket", None)
+        if ticket is not None:
+            ticket.release(dropped=exc is not None or g.pop("overload_dropped", False))
@@ -0,0 +1,434 @@
+"""
+Structured profile extraction.
+
+When a user finishes the conversation flow, their answers are turned into
+the profile JSON of ConversationFlow.txt §7 and stored in ``Profile``:
+
+    {"user_id": ..., "interests": [...],
+     "personality_traits": {"adventurous": ..., "optimistic": ..., "independent": ...},
+     "communication_style": {"humor": ..., "casual_tone": ..., "expressiveness": ...},
+     "values": [...], "date_preferences": {"settings": [...], "atmosphere": ...},
+     "additional_details": "..."}
+
+Two extractors produce it:
+
+- ``RuleExtractor`` maps words and phrases in the answers to the schema's
+  vocabulary with dictionary lookups; it is local, deterministic and fast.
+- ``LLMExtractor`` sends many users' answers in one chat-completions request
+  and falls back to the rules for any profile it cannot parse.
+
+``ProfileExtractor`` deduplicates extractions by answer hash, looks them up
+in the cache (memory, then previously stored profiles) and extracts only the
+misses, in batches. Finished flows reach it through ``profiles.extract`` jobs
+(see ``app/jobs.py``), so the last socket message is not held up; the job
+queue runs the jobs waiting together, so many users' answers share one LLM
+request.
+"""
+import hashlib
+import json
+import logging
+import re
+from datetime import datetime
+
+from . import db
+from .cache import MemoryBackend
+from .jobs import task
+from .models import Profile
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"[a-z0-9']+")
+
+# Answers feeding each part of the profile, by flow key (see app/flows/conversation.json)
+INTEREST_FIELDS = ("hobby", "hobby_details", "unwind", "spontaneous", "favorite_topics")
+VALUE_FIELDS = ("passion", "passion_details", "favorite_topics")
+DATE_FIELDS = ("ideal_date", "ideal_date_details")
+DETAIL_FIELDS = ("spontaneous", "hobby_details", "passion_details")
+
+
+def _vocabulary(table):
+    """Invert ``{canonical: [phrases]}`` into ``{phrase: canonical}`` (phrases of one or two words)."""
+    return {phrase: canonical for canonical, phrases in table.items() for phrase in phrases}
+
+
+INTERESTS = _vocabulary({
+    "hiking": ["hike", "hikes", "hiking", "trail", "trails", "trekking"],
+    "photography": ["photo", "photos", "photography", "camera", "photographing"],
+    "live music": ["live music", "concert", "concerts", "gig", "gigs", "festival", "festivals"],
+    "music": ["music", "singing", "guitar", "piano", "playlist", "band", "songs"],
+    "yoga": ["yoga", "meditation", "meditating"],
+    "painting": ["painting", "drawing", "sketching", "art"],
+    "reading": ["reading", "books", "novels", "book"],
+    "writing": ["writing", "poetry", "journaling", "blogging"],
+    "cooking": ["cooking", "baking", "recipes", "cook", "bake"],
+    "travel": ["travel", "traveling", "travelling", "road trip", "road trips", "trips"],
+    "gaming": ["gaming", "video games", "games", "board games"],
+    "climbing": ["climbing", "bouldering"],
+    "running": ["running", "marathon", "marathons", "jogging"],
+    "cycling": ["cycling", "biking", "bike", "cycled"],
+    "dancing": ["dancing", "dance", "salsa"],
+    "movies": ["movies", "films", "cinema", "film"],
+    "sports": ["sports", "football", "soccer", "basketball", "tennis"],
+    "fitness": ["gym", "fitness", "workout", "lifting"],
+    "gardening": ["gardening", "plants"],
+    "volunteering": ["volunteering", "volunteer", "charity"],
+    "outdoors": ["outdoors", "outdoor", "nature", "camping", "kayaking", "surfing"],
+})
+
+VALUES = _vocabulary({
+    "personal_growth": ["growth", "self improvement", "learning", "personal development", "mindfulness"],
+    "environmentalism": ["environment", "environmental", "sustainability", "conservation", "climate",
+                         "zero waste", "planet", "nature"],
+    "social_justice": ["justice", "equality", "human rights", "activism", "advocacy", "advocate"],
+    "mental_health": ["mental health", "wellbeing", "therapy"],
+    "career": ["career", "business", "startup", "entrepreneurship", "ambition"],
+    "family": ["family", "kids", "parents"],
+    "community": ["community", "volunteer", "volunteering", "charity", "neighbors"],
+    "creativity": ["creativity", "creative", "art", "music"],
+    "education": ["education", "teaching", "mentoring"],
+    "animal_welfare": ["animals", "animal", "rescue", "shelter", "dogs", "cats"],
+})
+
+DATE_SETTINGS = _vocabulary({
+    "outdoor_adventures": ["hike", "hiking", "trail", "picnic", "beach", "park", "sunset", "camping", "kayaking",
+                           "outdoors", "mountain", "lake"],
+    "cozy_cafes": ["cafe", "coffee", "latte", "lattes", "tea", "bookstore", "brunch"],
+    "artistic_venues": ["gallery", "museum", "art", "theater", "theatre", "exhibition"],
+    "live_music_venues": ["concert", "live music", "gig", "festival", "jazz"],
+    "dining": ["dinner", "restaurant", "food", "wine", "cooking", "tasting"],
+    "experiential": ["escape room", "cooking class", "workshop", "bowling", "karaoke", "arcade", "class"],
+    "trendy_spots": ["bar", "rooftop", "club", "cocktail", "cocktails", "lounge"],
+})
+
+# First matching setting decides the atmosphere
+ATMOSPHERES = (
+    ("outdoor_adventures", "exciting_and_memorable"),
+    ("experiential", "exciting_and_memorable"),
+    ("live_music_venues", "lively_and_social"),
+    ("trendy_spots", "lively_and_social"),
+    ("cozy_cafes", "relaxed_and_intimate"),
+    ("artistic_venues", "relaxed_and_intimate"),
+    ("dining", "relaxed_and_intimate"),
+)
+
+ADVENTUROUS_WORDS = frozenset({"adventure", "adventurous", "adventurer", "spontaneous", "thrill", "explore",
+                               "exploring", "new", "travel", "skydiving"})
+OPTIMISTIC_WORDS = frozenset({"love", "loved", "excited", "amazing", "great", "happy", "fun", "enjoy", "awesome",
+                              "perfect", "inspiring", "best", "favorite"})
+INDEPENDENT_WORDS = frozenset({"solo", "alone", "independent", "myself", "own", "self"})
+HUMOR_WORDS = frozenset({"joke", "jokes", "meme", "memes", "laugh", "funny", "banter", "sarcasm", "lol", "haha"})
+
+
+def normalize_answers(answers) -> dict:
+    """Answers with whitespace collapsed, for hashing and extraction."""
+    return {key: " ".join(str(value).split()) for key, value in sorted(answers.items()) if value is not None}
+
+
+def answers_hash(answers) -> str:
+    """SHA-256 of the normalized answers; identical answers share one extraction."""
+    canonical = json.dumps(normalize_answers(answers), sort_keys=True, ensure_ascii=False).casefold()
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def empty_profile() -> dict:
+    return {
+        "interests": [],
+        "personality_traits": {"adventurous": False, "optimistic": False, "independent": False},
+        "communication_style": {"humor": False, "casual_tone": False, "expressiveness": False},
+        "values": [],
+        "date_preferences": {"settings": [], "atmosphere": "casual"},
+        "additional_details": "",
+    }
+
+
+def normalize_profile(raw) -> dict:
+    """
+    Coerce an extracted profile into the schema, dropping unknown keys.
+
+    Raises:
+    -------
+    ValueError
+        When ``raw`` is not a JSON object.
+    """
+    if not isinstance(raw, dict):
+        raise ValueError("Profile must be a JSON object.")
+    profile = empty_profile()
+    profile["interests"] = [str(item) for item in raw.get("interests") or [] if item]
+    profile["values"] = [str(item) for item in raw.get("values") or [] if item]
+    for section in ("personality_traits", "communication_style"):
+        given = raw.get(section) or {}
+        for trait in profile[section]:
+            profile[section][trait] = bool(given.get(trait, False))
+    dates = raw.get("date_preferences") or {}
+    profile["date_preferences"]["settings"] = [str(item) for item in dates.get("settings") or [] if item]
+    profile["date_preferences"]["atmosphere"] = str(dates.get("atmosphere") or "casual")
+    profile["additional_details"] = str(raw.get("additional_details") or "")
+    return profile
+
+
+def _terms(text):
+    """Lowercase words and adjacent word pairs of ``text``."""
+    words = _TOKEN.findall(text.lower())
+    return words, words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def _match(terms, vocabulary):
+    found = []
+    for term in terms:
+        canonical = vocabulary.get(term)
+        if canonical is not None and canonical not in found:
+            found.append(canonical)
+    return found
+
+
+class RuleExtractor:
+    """Keyword extractor: dictionary lookups of words and word pairs, no network calls."""
+
+    name = "rules/1"
+
+    def extract(self, answers) -> dict:
+        answers = normalize_answers(answers)
+        profile = empty_profile()
+
+        def text(fields):
+            return " ".join(answers.get(field, "") for field in fields)
+
+        _, interest_terms = _terms(text(INTEREST_FIELDS))
+        profile["interests"] = _match(interest_terms, INTERESTS)
+        _, value_terms = _terms(text(VALUE_FIELDS))
+        profile["values"] = _match(value_terms, VALUES)
+        _, date_terms = _terms(text(DATE_FIELDS))
+        settings = _match(date_terms, DATE_SETTINGS)
+        profile["date_preferences"]["settings"] = settings
+        for setting, atmosphere in ATMOSPHERES:
+            if setting in settings:
+                profile["date_preferences"]["atmosphere"] = atmosphere
+                break
+
+        all_words, _ = _terms(" ".join(answers.values()))
+        words = set(all_words)
+        personality = answers.get("personality", "").casefold()
+        communication = answers.get("communication", "").casefold()
+        traits = profile["personality_traits"]
+        traits["adventurous"] = personality == "adventurous" or (
+            personality != "routine-oriented" and bool(words & ADVENTUROUS_WORDS))
+        traits["optimistic"] = bool(words & OPTIMISTIC_WORDS)
+        traits["independent"] = bool(words & INDEPENDENT_WORDS)
+
+        style = profile["communication_style"]
+        style["humor"] = communication == "banter" or bool(words & HUMOR_WORDS)
+        style["casual_tone"] = communication == "banter"
+        free_text = [value for key, value in answers.items() if key not in ("age", "personality", "communication")]
+        average_words = sum(len(value.split()) for value in free_text) / max(1, len(free_text))
+        style["expressiveness"] = communication == "deep discussions" or average_words >= 6 or any(
+            "!" in value for value in free_text)
+
+        profile["additional_details"] = next((answers[f] for f in DETAIL_FIELDS if answers.get(f)), "")
+        return profile
+
+    def extract_many(self, batch) -> list:
+        return [self.extract(answers) for answers in batch]
+
+
+class LLMExtractor:
+    """
+    Extracts many profiles with one chat-completions request.
+
+    Attributes:
+    -----------
+    client : LLMClient
+        Client used for the request.
+    fallback : RuleExtractor
+        Used for every profile the model response does not yield.
+    max_tokens_per_profile : int
+        Completion budget per profile in the batch.
+    """
+
+    name = "llm/1"
+
+    def __init__(self, client, fallback=None, max_tokens_per_profile=250):
+        self.client = client
+        self.fallback = fallback or RuleExtractor()
+        self.max_tokens_per_profile = max_tokens_per_profile
+        self.requests = 0
+
+    def prompt(self, batch) -> list:
+        schema = json.dumps(empty_profile())
+        users = json.dumps({str(i): normalize_answers(answers) for i, answers in enumerate(batch)},
+                           ensure_ascii=False)
+        return [
+            {"role": "system", "content": (
+                "You turn dating-profile questionnaire answers into structured profiles. "
+                f"Reply with one JSON object mapping each input id to a profile shaped like {schema}. "
+                "Use short snake_case or lowercase phrases for list items. Reply with JSON only.")},
+            {"role": "user", "content": users},
+        ]
+
+    def extract_many(self, batch) -> list:
+        results = [None] * len(batch)
+        try:
+            self.requests += 1
+            reply = self.client.complete(self.prompt(batch), max_tokens=self.max_tokens_per_profile * len(batch),
+                                         fallback=False, temperature=0)
+            parsed = json.loads(reply[reply.index("{"):reply.rindex("}") + 1])
+            for i in range(len(batch)):
+                try:
+                    results[i] = normalize_profile(parsed.get(str(i)))
+                except ValueError:
+                    pass
+        except Exception as e:
+            logger.warning("LLM profile extraction failed for %d answers, using rules: %s", len(batch), e)
+        missing = [i for i, result in enumerate(results) if result is None]
+        for i, profile in zip(missing, self.fallback.extract_many([batch[i] for i in missing])):
+            results[i] = profile
+        return results
+
+
+class ProfileExtractor:
+    """
+    Flask extension extracting and storing profiles in batches.
+
+    Finished conversations arrive as ``profiles.extract`` jobs; the job queue
+    runs the ready ones together (see ``extract_profiles``), so a backlog of
+    users is extracted in a few rounds.
+
+    Attributes:
+    -----------
+    batch_size : int
+        Answer sets extracted per round (and per LLM request).
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.batch_size = 20
+        self.extractor = RuleExtractor()
+        self.cache = MemoryBackend(4096)
+        self.cache_ttl = 86400.0
+        self.listeners = []
+        self.reset_stats()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Configure the extractor from the ``PROFILE_*`` settings of the Flask app.
+
+        Parameters:
+        -----------
+        app : Flask
+            The Flask application.
+        """
+        config = app.config
+        self.app = app
+        self.batch_size = int(config.get("PROFILE_BATCH_SIZE", self.batch_size))
+        self.cache = MemoryBackend(int(config.get("PROFILE_CACHE_SIZE", 4096)))
+        self.cache_ttl = float(config.get("PROFILE_CACHE_TTL", self.cache_ttl))
+        if config.get("PROFILE_EXTRACTOR", "rules") == "llm":
+            from . import llm
+            self.extractor = LLMExtractor(llm, max_tokens_per_profile=int(config.get("PROFILE_LLM_MAX_TOKENS", 250)))
+        else:
+            self.extractor = RuleExtractor()
+        self.reset_stats()
+        app.extensions["profile_extractor"] = self
+
+    def subscribe(self, listener):
+        """Call ``listener(user_id, answers)`` whenever a profile has been stored."""
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    def reset_stats(self):
+        self.extracted = 0
+        self.cache_hits = 0
+        self.batches = 0
+
+    def extract_many(self, answer_sets) -> list:
+        """
+        Extract profiles for many answer sets, reusing cached extractions.
+
+        Parameters:
+        -----------
+        answer_sets : list of dict
+            Answers to extract, in order.
+
+        Returns:
+        --------
+        list of dict
+            One profile per answer set (without ``user_id``).
+        """
+        hashes = [answers_hash(answers) for answers in answer_sets]
+        found = {}
+        for digest in set(hashes):
+            cached = self.cache.get(self._cache_key(digest))
+            if cached is not None:
+                found[digest] = cached
+        missing = [digest for digest in dict.fromkeys(hashes) if digest not in found]
+        if missing:
+            found.update(self._stored_profiles(missing))
+        self.cache_hits += sum(1 for digest in hashes if digest in found)
+
+        pending = {}
+        for digest, answers in zip(hashes, answer_sets):
+            if digest not in found:
+                pending.setdefault(digest, answers)
+        pending_items = list(pending.items())
+        for start in range(0, len(pending_items), self.batch_size):
+            chunk = pending_items[start:start + self.batch_size]
+            for (digest, _), profile in zip(chunk, self.extractor.extract_many([a for _, a in chunk])):
+                found[digest] = profile
+                self.extracted += 1
+        for digest, profile in found.items():
+            self.cache.set(self._cache_key(digest), profile, self.cache_ttl)
+        return [json.loads(json.dumps(found[digest])) for digest in hashes]
+
+    def process(self, jobs) -> list:
+        """
+        Extract and store profiles for ``(user_id, answers)`` pairs, then tell the listeners.
+
+        Returns:
+        --------
+        list of dict
+            The stored profiles with their ``user_id``, one per user.
+        """
+        # The latest submission wins when a user finishes twice in one batch
+        latest = {}
+        for job in jobs:
+            latest[job[0]] = job
+        jobs = list(latest.values())
+        profiles = self.extract_many([answers for _, answers in jobs])
+        with self.app.app_context():
+            now = datetime.utcnow()
+            for (user_id, answers), profile in zip(jobs, profiles):
+                db.session.merge(Profile(user_id=user_id, answers=answers, answers_hash=answers_hash(answers),
+                                         extractor=self.extractor.name, data=profile, updated_at=now))
+            db.session.commit()
+        self.batches += 1
+        for user_id, answers in jobs:
+            for listener in self.listeners:
+                listener(user_id, answers)
+        return [{"user_id": user_id, **profile} for (user_id, _), profile in zip(jobs, profiles)]
+
+    def _cache_key(self, digest) -> str:
+        return f"{self.extractor.name}:{digest}"
+
+    def _stored_profiles(self, digests) -> dict:
+        """Profiles already extracted by this extractor for any of ``digests``."""
+        with self.app.app_context():
+            rows = db.session.execute(
+                db.select(Profile.answers_hash, Profile.data)
+                .where(Profile.answers_hash.in_(digests), Profile.extractor == self.extractor.name)
+            ).all()
+        return {digest: data for digest, data in rows}
+
+
+@task("profiles.extract", max_attempts=5, event="profile", batch_size=100)
+def extract_profiles(payloads):
+    """
+    Job: extract and store the profiles of finished conversations, one
+    ``{"user_id", "answers"}`` payload each, and return them in order; each is
+    pushed to its job's room as the 'profile' event. Jobs queued together run
+    as one batch, in ``PROFILE_BATCH_SIZE`` answer sets per LLM request.
+    """
+    from . import profile_extractor
+    stored = {profile["user_id"]: profile
+              for profile in profile_extractor.process([(p["user_id"], p["answers"]) for p in payloads])}
+    return [stored[payload["user_id"]] for payload in payloads]
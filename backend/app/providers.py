@@ -0,0 +1,621 @@
+"""
+Routing of LLM calls across several providers.
+
+``LLM_PROVIDERS`` lists the providers in tiers separated by ``|``; within a tier
+providers are separated by commas:
+
+- ``primary``: the endpoint of the ``LLM_*`` settings (``LLM_API_BASE``,
+  ``LLM_MODEL``, ``OPENAI_API_KEY``).
+- ``name=URL [MODEL]``: another OpenAI-compatible endpoint, such as a second
+  vendor or a small model served on the CPU by llama.cpp or Ollama. Its key is
+  read from ``LLM_<NAME>_API_KEY``.
+- ``template``: canned replies built without a model (``services.template_reply``),
+  so the chat keeps answering with no network at all.
+
+``LLMRouter`` keeps a rolling window of latencies (total time for completions,
+time to the first token for streams) and outcomes per provider. Each call goes
+to the provider of the first tier with the lowest median latency, weighted by
+its error rate. A provider that has not been measured yet is tried first, so
+every provider in a tier gets sampled. When the chosen provider is slower than its own p95
+(clamped to ``LLM_HEDGE_MIN_DELAY``..``LLM_HEDGE_MAX_DELAY``) the call is hedged
+to the next provider of the same tier and the first answer wins; hedges are
+limited to ``LLM_HEDGE_BUDGET`` of the calls. Failures move on to the next
+provider, then to the next tier.
+
+Each provider has a circuit breaker: ``LLM_BREAKER_FAILURES`` failures in a row,
+or an error rate of ``LLM_BREAKER_ERROR_RATE`` over at least
+``LLM_BREAKER_MIN_CALLS`` calls, opens it. An open provider gets no traffic
+for ``LLM_BREAKER_COOLDOWN`` seconds, then a single probe call decides whether it
+closes again.
+
+Replies carry the provider that produced them (``Completion.provider``); canned
+replies are marked ``cacheable = False`` so the completion cache never serves
+them once the providers are back.
+"""
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from .llm import LLMBusyError, LLMClient, LLMError, LLMTimeoutError
+
+_MISSING = object()
+
+
+class Completion(str):
+    """
+    A completion's text, with the provider that produced it.
+
+    Attributes:
+    -----------
+    provider : str
+        Name of the provider.
+    cacheable : bool
+        False for canned replies, which must not be cached.
+    """
+
+    __slots__ = ("provider", "cacheable")
+
+    def __new__(cls, text, provider, cacheable=True):
+        completion = super().__new__(cls, text)
+        completion.provider = provider
+        completion.cacheable = cacheable
+        return completion
+
+
+class HTTPProvider:
+    """An OpenAI-compatible endpoint served by a pooled ``LLMClient``."""
+
+    canned = False
+
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+
+    @property
+    def model(self) -> str:
+        return self.client.model
+
+    def complete(self, messages, max_tokens, timeout, **params) -> str:
+        return self.client.complete(messages, max_tokens=max_tokens, timeout=timeout, **params)
+
+    def stream(self, messages, max_tokens, timeout, **params):
+        return self.client.stream(messages, max_tokens=max_tokens, timeout=timeout, **params)
+
+    def close(self):
+        self.client.close()
+
+
+class TemplateProvider:
+    """Canned replies from ``responder(messages)``; never fails and needs no network."""
+
+    canned = True
+    model = "template"
+
+    def __init__(self, name="template", responder=None):
+        from .services import template_reply
+        self.name = name
+        self.responder = responder or template_reply
+
+    def complete(self, messages, max_tokens, timeout, **params) -> str:
+        return self.responder(messages)
+
+    def stream(self, messages, max_tokens, timeout, **params):
+        words = self.responder(messages).split(" ")
+        for i, word in enumerate(words):
+            yield word if i == len(words) - 1 else word + " "
+
+    def close(self):
+        pass
+
+
+class ProviderStats:
+    """
+    Rolling latencies and outcomes of one provider.
+
+    Attributes:
+    -----------
+    window : int
+        Samples kept per call kind.
+    max_age : float
+        Seconds after which a sample no longer counts.
+    """
+
+    def __init__(self, window=200, max_age=300.0):
+        self.window = window
+        self.max_age = max_age
+        self._latencies = {"complete": deque(maxlen=window), "stream": deque(maxlen=window)}
+        self._outcomes = deque(maxlen=window)
+        self._cache = {}
+
+    def record(self, kind, seconds, ok):
+        now = time.monotonic()
+        if ok:
+            self._latencies[kind].append((now, seconds))
+        self._outcomes.append((now, ok))
+        self._cache.clear()
+
+    def quantile(self, kind, q):
+        """The ``q`` quantile of recent successful latencies, or None without samples."""
+        key = (kind, q)
+        value = self._cache.get(key, _MISSING)
+        if value is _MISSING:
+            horizon = time.monotonic() - self.max_age
+            values = sorted(seconds for at, seconds in self._latencies[kind] if at >= horizon)
+            value = self._cache[key] = values[min(len(values) - 1, int(q * len(values)))] if values else None
+        return value
+
+    def samples(self, kind) -> int:
+        return len(self._latencies[kind])
+
+    def error_rate(self):
+        """``(rate, calls)`` over the recent calls."""
+        horizon = time.monotonic() - self.max_age
+        outcomes = [ok for at, ok in self._outcomes if at >= horizon]
+        return (outcomes.count(False) / len(outcomes) if outcomes else 0.0), len(outcomes)
+
+
+class CircuitBreaker:
+    """
+    Closed, open or half-open gate in front of one provider.
+
+    Attributes:
+    -----------
+    state : str
+        ``closed`` (traffic flows), ``open`` (no traffic until the cooldown
+        ends) or ``half_open`` (one probe call in flight).
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failures=5, error_rate=0.5, min_calls=20, cooldown=30.0):
+        self.failures = failures
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.consecutive = 0
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        """Whether the provider may be chosen: closed, or open long enough for a probe."""
+        return self.state == self.CLOSED or time.monotonic() - self.opened_at >= self.cooldown
+
+    def begin(self) -> bool:
+        """
+        Claim a call. Past the cooldown an open breaker lets one probe through
+        and turns half-open; a probe that never reports back is replaced after
+        another cooldown.
+        """
+        if self.state == self.CLOSED:
+            return True
+        with self._lock:
+            if time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.state = self.HALF_OPEN
+            self.opened_at = time.monotonic()
+            return True
+
+    def record(self, ok, stats):
+        """Update the state with the outcome of a call and the provider's recent error rate."""
+        with self._lock:
+            if ok:
+                self.consecutive = 0
+                self.state = self.CLOSED
+                return
+            self.consecutive += 1
+            rate, calls = stats.error_rate()
+            if (self.state == self.HALF_OPEN or self.consecutive >= self.failures
+                    or (calls >= self.min_calls and rate >= self.error_rate)):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class _Route:
+    """A provider with its stats and breaker."""
+
+    __slots__ = ("provider", "stats", "breaker", "tier")
+
+    def __init__(self, provider, stats, breaker, tier):
+        self.provider = provider
+        self.stats = stats
+        self.breaker = breaker
+        self.tier = tier
+
+    def score(self, kind) -> float:
+        """Median latency weighted by the error rate; 0 until measured, so new providers get sampled."""
+        median = self.stats.quantile(kind, 0.5)
+        if median is None:
+            return 0.0
+        return median * (1.0 + 4.0 * self.stats.error_rate()[0])
+
+
+class _Race:
+    """Results of the attempts of one call; results arriving after it is decided are discarded."""
+
+    def __init__(self):
+        self.results = queue.Queue()
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def put(self, result):
+        with self._lock:
+            if not self.closed:
+                self.results.put(result)
+                return
+        _discard(result)
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+        while True:
+            try:
+                _discard(self.results.get_nowait())
+            except queue.Empty:
+                return
+
+
+def _discard(result):
+    """Release a losing attempt: close its stream so its connection slot is freed."""
+    winner, value = result
+    if winner is not None and isinstance(value, tuple):
+        value[1].close()
+
+
+class RoutedStream:
+    """
+    Tokens of a routed streaming call.
+
+    Attributes:
+    -----------
+    provider : str or None
+        Provider serving the stream, known once the first token has arrived.
+    cacheable : bool
+        False when the tokens are a canned reply.
+    """
+
+    def __init__(self, router, messages, max_tokens, timeout, fallback, params):
+        self.provider = None
+        self.cacheable = True
+        self._tokens = self._run(router, messages, max_tokens, timeout, fallback, params)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._tokens)
+
+    def close(self):
+        self._tokens.close()
+
+    def _run(self, router, messages, max_tokens, timeout, fallback, params):
+        def open_stream(provider, remaining):
+            tokens = provider.stream(messages, max_tokens, remaining, **params)
+            return next(tokens, ""), tokens
+
+        route, (first, tokens) = router._route("stream", open_stream, timeout, fallback)
+        self.provider = route.provider.name
+        self.cacheable = not route.provider.canned
+        try:
+            if first:
+                yield first
+            yield from tokens
+        finally:
+            tokens.close()
+
+
+class LLMRouter:
+    """
+    Flask extension sending LLM calls to the fastest healthy provider.
+
+    Offers the ``LLMClient`` calls (``complete``, ``stream``, ``model``,
+    ``admission``), so routes and handlers use it in place of a single client.
+
+    Attributes:
+    -----------
+    routes : list
+        Providers with their stats and breakers, in configuration order.
+    hedge : bool
+        Whether slow calls are hedged to a second provider.
+    timeout : float
+        Default per-call deadline in seconds.
+    """
+
+    def __init__(self, app=None):
+        self.routes = []
+        self.hedge = True
+        self.hedge_min_delay = 0.25
+        self.hedge_max_delay = 3.0
+        self.hedge_budget = 0.1
+        self.timeout = 30.0
+        self.threads = 16
+        self._hedge_tokens = 1.0
+        self._executor = None
+        self._metrics = None
+        self._admission = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, metrics=None):
+        """
+        Build the providers listed in ``LLM_PROVIDERS`` and their breakers.
+
+        Parameters:
+        -----------
+        app : Flask
+            The Flask application.
+        metrics : Metrics, optional
+            Registry receiving calls by provider and outcome.
+        """
+        config = app.config
+        self.close()
+        self.hedge = bool(config.get("LLM_HEDGE_ENABLED", self.hedge))
+        self.hedge_min_delay = float(config.get("LLM_HEDGE_MIN_DELAY", self.hedge_min_delay))
+        self.hedge_max_delay = float(config.get("LLM_HEDGE_MAX_DELAY", self.hedge_max_delay))
+        self.hedge_budget = float(config.get("LLM_HEDGE_BUDGET", self.hedge_budget))
+        self.timeout = float(config.get("LLM_TIMEOUT", self.timeout))
+        self.routes = [
+            _Route(provider,
+                   ProviderStats(int(config.get("LLM_ROUTER_WINDOW", 200)),
+                                 float(config.get("LLM_ROUTER_WINDOW_SECONDS", 300))),
+                   CircuitBreaker(int(config.get("LLM_BREAKER_FAILURES", 5)),
+                                  float(config.get("LLM_BREAKER_ERROR_RATE", 0.5)),
+                                  int(config.get("LLM_BREAKER_MIN_CALLS", 20)),
+                                  float(config.get("LLM_BREAKER_COOLDOWN", 30))),
+                   tier)
+            for tier, provider in parse_providers(config.get("LLM_PROVIDERS") or "primary", config)
+        ]
+        # Race threads: enough for every provider's concurrency limit to be used
+        self.threads = 2 * int(config.get("LLM_MAX_CONCURRENCY", 8)) * max(1, len(self.routes))
+        self.admission = self._admission
+        if metrics is not None:
+            self._metrics = SimpleNamespace(
+                enabled=lambda: metrics.enabled,
+                calls=metrics.counter("spokesperson_llm_calls", "LLM calls by provider and outcome.",
+                                      ("provider", "outcome")),
+            )
+        app.extensions["llm"] = self
+
+    def add(self, provider, tier=0, stats=None, breaker=None):
+        """Append ``provider`` to ``tier``, e.g. a stub provider in tests and benchmarks."""
+        self.routes.append(_Route(provider, stats or ProviderStats(), breaker or CircuitBreaker(), tier))
+
+    @property
+    def model(self) -> str:
+        """Model of the first provider, used to key the completion cache."""
+        return self.routes[0].provider.model if self.routes else ""
+
+    @property
+    def admission(self):
+        return self._admission
+
+    @admission.setter
+    def admission(self, admission):
+        # The quota paced by the admission queue is the primary provider's
+        self._admission = admission
+        for route in self.routes:
+            if route.provider.name == "primary":
+                route.provider.client.admission = admission
+
+    def complete(self, messages, max_tokens=50, timeout=None, fallback=True, **params) -> Completion:
+        """
+        Run a completion on the best provider available.
+
+        Parameters:
+        -----------
+        messages : list
+            Chat messages in the OpenAI ``{"role", "content"}`` format.
+        max_tokens : int
+            Upper bound on generated tokens.
+        timeout : float, optional
+            Deadline in seconds for the whole call, hedges and failovers included.
+        fallback : bool
+            Whether canned replies may answer when no model does; callers that
+            parse the reply (summaries, profile extraction) pass False.
+
+        Returns:
+        --------
+        Completion
+            The reply text, with the provider that produced it.
+
+        Raises:
+        -------
+        LLMError
+            When no provider produced a reply; the error of the first provider tried.
+        """
+        route, text = self._route(
+            "complete", lambda provider, remaining: provider.complete(messages, max_tokens, remaining, **params),
+            timeout, fallback)
+        return Completion(text, route.provider.name, cacheable=not route.provider.canned)
+
+    def stream(self, messages, max_tokens=50, timeout=None, fallback=True, **params) -> RoutedStream:
+        """
+        Run a streaming completion on the best provider available.
+
+        Hedging and failover apply until the first token; after that the
+        stream stays with its provider. Nothing is sent upstream until the
+        first ``next()``. Callers must exhaust or ``close()`` the stream.
+        """
+        return RoutedStream(self, messages, max_tokens, timeout, fallback, params)
+
+    def stats(self) -> dict:
+        """Latency percentiles, error rate and breaker state per provider."""
+        report = {}
+        for route in self.routes:
+            rate, calls = route.stats.error_rate()
+            report[route.provider.name] = {
+                "tier": route.tier,
+                "model": route.provider.model,
+                "breaker": route.breaker.state,
+                "calls": calls,
+                "error_rate": round(rate, 4),
+                **{f"{kind}_{name}_ms": (None if value is None else round(value * 1000, 1))
+                   for kind in ("complete", "stream") for name, q in (("p50", 0.5), ("p95", 0.95))
+                   for value in (route.stats.quantile(kind, q),)},
+            }
+        return report
+
+    def close(self):
+        """Close every provider's connections and stop the hedging threads."""
+        for route in self.routes:
+            route.provider.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _candidates(self, kind, fallback) -> list:
+        """Providers whose breaker lets a call through: by tier, then by score."""
+        allowed = [route for route in self.routes
+                   if (fallback or not route.provider.canned) and route.breaker.available()]
+        order = {id(route): i for i, route in enumerate(self.routes)}
+        return sorted(allowed, key=lambda route: (route.tier, route.score(kind), order[id(route)]))
+
+    def _hedge_delay(self, route, kind) -> float:
+        if route.stats.samples(kind) < 10:
+            return self.hedge_max_delay
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, route.stats.quantile(kind, 0.95)))
+
+    def _take_hedge(self) -> bool:
+        """Spend one hedge from the budget, which earns ``hedge_budget`` per call (at most 10 banked)."""
+        if self._hedge_tokens >= 1.0:
+            self._hedge_tokens -= 1.0
+            return True
+        return False
+
+    def _route(self, kind, call, timeout, fallback):
+        """
+        Run ``call(provider, remaining_seconds)`` until a provider answers.
+
+        Returns:
+        --------
+        tuple
+            ``(route, value)`` of the provider that answered.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        self._hedge_tokens = min(10.0, self._hedge_tokens + self.hedge_budget)
+        pending = deque(self._candidates(kind, fallback))
+        if not pending:
+            raise LLMBusyError("No LLM provider is available right now, try again shortly.")
+        error = None
+        while pending and time.monotonic() < deadline:
+            route = pending.popleft()
+            partner = pending[0] if self.hedge and pending and pending[0].tier == route.tier else None
+            if partner is None:
+                winner, value = self._attempt(route, kind, call, deadline)
+            else:
+                winner, value, hedged = self._race(route, partner, kind, call, deadline)
+                if hedged:
+                    pending.popleft()  # The partner has had its try
+            if winner is not None:
+                return winner, value
+            error = error or value
+        raise error or LLMTimeoutError("LLM call exceeded its deadline.")
+
+    def _attempt(self, route, kind, call, deadline):
+        """One call to one provider: ``(route, value)``, or ``(None, error)``."""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None, LLMTimeoutError("LLM call exceeded its deadline.")
+        if not route.breaker.begin():
+            return None, LLMBusyError(f"LLM provider '{route.provider.name}' is unavailable (circuit open).")
+        start = time.monotonic()
+        try:
+            value = call(route.provider, remaining)
+        except LLMError as e:
+            self._record(route, kind, time.monotonic() - start, e)
+            return None, e
+        self._record(route, kind, time.monotonic() - start, None)
+        return route, value
+
+    def _race(self, route, partner, kind, call, deadline):
+        """
+        Run ``route`` alone until its hedge delay, then ``partner`` as well.
+
+        The first answer wins and the other result is discarded when it
+        arrives; a failure of one leaves the other running.
+
+        Returns:
+        --------
+        tuple
+            ``(route, value, hedged)`` of the winner, or ``(None, error, hedged)``.
+        """
+        race = _Race()
+        executor = self._pool()
+        executor.submit(lambda: race.put(self._attempt(route, kind, call, deadline)))
+        running, hedged, error = 1, False, None
+        hedge_at = time.monotonic() + self._hedge_delay(route, kind)
+        try:
+            while running:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                if not hedged and now >= hedge_at:
+                    hedge_at = float("inf")
+                    if self._take_hedge():
+                        hedged, running = True, running + 1
+                        self._count(partner, "hedge")
+                        executor.submit(lambda: race.put(self._attempt(partner, kind, call, deadline)))
+                try:
+                    winner, value = race.results.get(timeout=min(hedge_at, deadline) - now)
+                except queue.Empty:
+                    continue
+                running -= 1
+                if winner is not None:
+                    return winner, value, hedged
+                error = error or value
+            return None, error or LLMTimeoutError("LLM call exceeded its deadline."), hedged
+        finally:
+            race.close()
+
+    def _record(self, route, kind, seconds, error):
+        ok = error is None
+        if isinstance(error, LLMBusyError):
+            return  # Our own concurrency limit or quota, not the provider's health
+        route.stats.record(kind, seconds, ok)
+        if not route.provider.canned:
+            route.breaker.record(ok, route.stats)
+        self._count(route, "ok" if ok else "error")
+
+    def _count(self, route, outcome):
+        m = self._metrics
+        if m is not None and m.enabled():
+            m.calls.inc(route.provider.name, outcome)
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="llm-hedge")
+        return self._executor
+
+
+def parse_providers(spec, config) -> list:
+    """
+    ``(tier, provider)`` pairs for an ``LLM_PROVIDERS`` value.
+
+    Raises:
+    -------
+    ValueError
+        On an entry that is neither ``primary``, ``template`` nor ``name=URL [MODEL]``.
+    """
+    providers = []
+    for tier, group in enumerate(spec.split("|")):
+        for entry in filter(None, (item.strip() for item in group.split(","))):
+            name, _, target = entry.partition("=")
+            name = name.strip()
+            if not target:
+                if name == "primary":
+                    providers.append((tier, HTTPProvider("primary", LLMClient().configure(config))))
+                elif name == "template":
+                    providers.append((tier, TemplateProvider()))
+                else:
+                    raise ValueError(f"Unknown LLM provider '{name}'; use primary, template or name=URL [MODEL].")
+                continue
+            url, _, model = target.strip().partition(" ")
+            api_key = config.get(f"LLM_{name.upper()}_API_KEY") or os.getenv(f"LLM_{name.upper()}_API_KEY")
+            client = LLMClient().configure(config, api_base=url, model=model.strip() or None, api_key=api_key)
+            providers.append((tier, HTTPProvider(name, client)))
+    return providers
+
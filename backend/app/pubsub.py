@@ -0,0 +1,111 @@
+"""
+Socket.IO server options and message-queue client managers.
+
+Running several Socket.IO worker processes requires a message queue so an
+``emit`` issued by one worker reaches clients connected to another. Flask-SocketIO
+handles ``redis://``, ``amqp://`` and ``kafka://`` URLs itself; this module adds
+a ``local://<channel>`` stand-in that fans messages out between Socket.IO
+servers living in the same process, which is enough for tests and for running
+several in-process servers during development.
+"""
+import queue
+import threading
+
+import socketio as python_socketio  # type: ignore
+
+
+class _LocalBroker:
+    """In-process pub/sub broker: every subscriber gets its own unbounded queue."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, channel) -> queue.Queue:
+        inbox = queue.Queue()
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(inbox)
+        return inbox
+
+    def unsubscribe(self, channel, inbox):
+        with self._lock:
+            subscribers = self._subscribers.get(channel, [])
+            if inbox in subscribers:
+                subscribers.remove(inbox)
+
+    def publish(self, channel, message) -> int:
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, []))
+        for inbox in subscribers:
+            inbox.put(message)
+        return len(subscribers)
+
+
+local_broker = _LocalBroker()
+
+
+class LocalPubSubManager(python_socketio.PubSubManager):
+    """
+    Client manager that fans Socket.IO messages out through ``local_broker``.
+
+    Attributes:
+    -----------
+    channel : str
+        Broker channel shared by every server that should see the same clients.
+    """
+    name = 'local'
+
+    def __init__(self, channel='flask-socketio', write_only=False, logger=None, broker=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.broker = broker or local_broker
+        self._inbox = None if write_only else self.broker.subscribe(channel)
+
+    def _publish(self, data):
+        return self.broker.publish(self.channel, data)
+
+    def _listen(self):
+        while True:
+            message = self._inbox.get()
+            if message is None:
+                break
+            yield message
+
+    def close(self):
+        """Stop the listener and detach from the broker."""
+        if self._inbox is not None:
+            self.broker.unsubscribe(self.channel, self._inbox)
+            self._inbox.put(None)
+
+
+def socketio_options(config) -> dict:
+    """
+    Build ``SocketIO.init_app`` keyword arguments from the app config.
+
+    Parameters:
+    -----------
+    config : Mapping
+        The Flask config (``SOCKETIO_*`` keys).
+
+    Returns:
+    --------
+    dict
+        Options for async mode, message queue or client manager, and heartbeats.
+    """
+    options = {
+        "cors_allowed_origins": "*",
+        "ping_interval": config.get("SOCKETIO_PING_INTERVAL", 25),
+        "ping_timeout": config.get("SOCKETIO_PING_TIMEOUT", 20),
+        "max_http_buffer_size": config.get("SOCKETIO_MAX_HTTP_BUFFER_SIZE", 64_000),
+    }
+    async_mode = config.get("SOCKETIO_ASYNC_MODE")
+    if async_mode:
+        options["async_mode"] = async_mode
+
+    message_queue = config.get("SOCKETIO_MESSAGE_QUEUE")
+    channel = config.get("SOCKETIO_CHANNEL", "flask-socketio")
+    if message_queue and message_queue.startswith("local://"):
+        options["client_manager"] = LocalPubSubManager(channel=message_queue[len("local://"):] or channel)
+    elif message_queue:
+        options["message_queue"] = message_queue
+        options["channel"] = channel
+    return options
@@ -0,0 +1,597 @@
+"""
+Shared token-bucket rate limiting for HTTP routes, Socket.IO events and the
+upstream LLM quota.
+
+Buckets follow GCRA (the generic cell rate algorithm): each key stores a single
+"theoretical arrival time" (TAT). A limit of ``rate`` per second with room for
+``burst`` requests admits a request of cost ``c`` at time ``now`` when
+``max(TAT, now) + c / rate - burst / rate <= now`` and then advances the TAT by
+``c / rate``. One float per key fits in a SQLite row or a Redis string, so the
+memory, SQLite and Redis backends below all update a bucket atomically and the
+SQLite and Redis ones share it across worker processes.
+
+Three kinds of bucket are kept:
+
+- per identity: ``RATELIMIT_DEFAULT`` applies to every HTTP request and
+  Socket.IO event of a user (the session ``user_id``, or the client address
+  when there is none, so users behind one NAT no longer share a bucket and
+  an anonymous client cannot refill its bucket by reconnecting);
+- per endpoint: limits declared with ``@limiter.limit`` on routes and
+  ``@limiter.limit_event`` on socket handlers, counted per identity and
+  overridable through ``RATELIMIT_ENDPOINTS``; an anonymous socket is also
+  held to the declared event limit per connection;
+- upstream: ``AdmissionQueue`` paces calls to the provider's requests- and
+  tokens-per-minute quota. Instead of rejecting a burst it reserves the next
+  free slot and lets the caller sleep until then, so bursts are spread out
+  rather than answered with 429 by us or by the provider.
+"""
+import functools
+import math
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, namedtuple
+
+from flask import current_app, g, jsonify, request, session  # type: ignore
+
+from .localredis import WatchError, connect as redis_connect
+from .utils import run_blocking, thread_connection
+
+# A bucket refilling at ``rate`` per second that holds at most ``burst``
+Limit = namedtuple("Limit", "rate burst")
+
+# Outcome of taking from a bucket: ``wait`` is the delay before the caller may
+# proceed when allowed, and the time until it would be allowed otherwise
+Decision = namedtuple("Decision", "allowed wait remaining")
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+_LIMIT_RE = re.compile(
+    r"^\s*(\d+)\s*(?:per|/)\s*(\d*)\s*(second|minute|hour|day)s?\s*(?:burst\s+(\d+))?\s*$", re.IGNORECASE
+)
+
+
+class AdmissionRejected(Exception):
+    """Raised when an upstream slot cannot be reserved within the allowed wait."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_limit(spec) -> Limit:
+    """
+    Parse a limit such as ``"10 per minute"``, ``"100/hour"`` or ``"60 per minute burst 10"``.
+
+    Without ``burst`` the bucket holds the whole period's allowance.
+
+    Raises:
+    -------
+    ValueError
+        If ``spec`` is not in one of the forms above.
+    """
+    if isinstance(spec, Limit):
+        return spec
+    match = _LIMIT_RE.match(str(spec))
+    if not match:
+        raise ValueError(f"Invalid rate limit '{spec}'; expected e.g. '10 per minute burst 5'.")
+    count, multiple, period, burst = match.groups()
+    seconds = _PERIODS[period.lower()] * int(multiple or 1)
+    count = int(count)
+    if count <= 0:
+        raise ValueError(f"Invalid rate limit '{spec}'; the count must be positive.")
+    return Limit(count / seconds, int(burst) if burst else count)
+
+
+def parse_overrides(value) -> dict:
+    """Parse ``RATELIMIT_ENDPOINTS`` (``"endpoint=limit; ..."`` or a dict) into ``{endpoint: Limit}``."""
+    if not value:
+        return {}
+    if isinstance(value, str):
+        pairs = [item.split("=", 1) for item in value.split(";") if item.strip()]
+        value = {name.strip(): spec for name, spec in pairs}
+    return {name: parse_limit(spec) for name, spec in value.items()}
+
+
+def gcra(tat, now, limit, cost=1, max_wait=0.0):
+    """
+    Apply one request to a bucket.
+
+    Parameters:
+    -----------
+    tat : float or None
+        Stored theoretical arrival time (``None`` for a full bucket).
+    now : float
+        Current time in seconds.
+    limit : Limit
+        The bucket's refill rate and capacity.
+    cost : float
+        Tokens taken by the request.
+    max_wait : float
+        Seconds the caller is willing to wait for its turn; 0 rejects instead.
+
+    Returns:
+    --------
+    tuple
+        The new TAT to store (``None`` if the request was rejected) and the ``Decision``.
+    """
+    interval = 1.0 / limit.rate
+    tat = max(tat or 0.0, now)
+    new_tat = tat + cost * interval
+    wait = new_tat - limit.burst * interval - now
+    if wait > max_wait:
+        remaining = int(max(0.0, limit.burst - (tat - now) / interval))
+        return None, Decision(False, wait, remaining)
+    remaining = int(max(0.0, limit.burst - (new_tat - now) / interval))
+    return new_tat, Decision(True, max(0.0, wait), remaining)
+
+
+class MemoryBucketBackend:
+    """Buckets in a dict of this process; fine for a single worker and for tests."""
+
+    blocking = False
+
+    def __init__(self):
+        self._tats = {}
+        self._lock = threading.Lock()
+        self._sweep_at = 1024
+
+    def take(self, key, limit, cost=1, max_wait=0.0) -> Decision:
+        with self._lock:
+            now = time.time()
+            new_tat, decision = gcra(self._tats.get(key), now, limit, cost, max_wait)
+            if new_tat is not None:
+                self._tats[key] = new_tat
+                if len(self._tats) > self._sweep_at:
+                    # A TAT in the past is a full bucket, the same as no entry
+                    self._tats = {k: tat for k, tat in self._tats.items() if tat > now}
+                    self._sweep_at = max(1024, 2 * len(self._tats))
+            return decision
+
+    def reset(self):
+        with self._lock:
+            self._tats.clear()
+
+
+class SQLiteBucketBackend:
+    """
+    Buckets as rows of a WAL-mode SQLite table shared by the workers of a host.
+
+    Each update runs in a ``BEGIN IMMEDIATE`` transaction, so concurrent
+    processes serialise on the write lock instead of losing updates.
+
+    Attributes:
+    -----------
+    path : str
+        Location of the SQLite database file.
+    """
+
+    blocking = True
+    SWEEP_EVERY = 1000  # Updates between deletions of full buckets
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._updates = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS rate_buckets (key TEXT PRIMARY KEY, tat REAL NOT NULL)")
+
+    def _conn(self):
+        # One connection per native thread (and process); sqlite3 connections are not shareable
+        return thread_connection(self._local, self._connect)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def take(self, key, limit, cost=1, max_wait=0.0) -> Decision:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tat FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            new_tat, decision = gcra(row[0] if row else None, now, limit, cost, max_wait)
+            if new_tat is not None:
+                conn.execute("INSERT OR REPLACE INTO rate_buckets (key, tat) VALUES (?, ?)", (key, new_tat))
+                self._updates += 1
+                if self._updates % self.SWEEP_EVERY == 0:
+                    conn.execute("DELETE FROM rate_buckets WHERE tat <= ?", (now,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return decision
+
+    def reset(self):
+        self._conn().execute("DELETE FROM rate_buckets")
+
+
+class RedisBucketBackend:
+    """
+    One Redis string per bucket, updated with an optimistic ``WATCH``/``MULTI``
+    transaction and expired by Redis once the bucket is full again.
+
+    Worker clocks are assumed to be kept in sync (NTP); the TAT is wall-clock time.
+
+    Attributes:
+    -----------
+    client : redis.Redis or LocalRedis
+        Client returned by ``app.localredis.connect``.
+    prefix : str
+        Namespace prepended to every key.
+    """
+
+    blocking = False
+
+    def __init__(self, client, prefix="ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+
+    def take(self, key, limit, cost=1, max_wait=0.0) -> Decision:
+        name = self.prefix + key
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(name)
+                    raw = pipe.get(name)
+                    now = time.time()
+                    new_tat, decision = gcra(float(raw) if raw is not None else None, now, limit, cost, max_wait)
+                    if new_tat is None:
+                        return decision
+                    pipe.multi()
+                    pipe.set(name, repr(new_tat), ex=max(1, math.ceil(new_tat - now)))
+                    pipe.execute()
+                    return decision
+                except WatchError:
+                    continue  # Another worker updated the bucket first; retry on the new value
+
+    def reset(self):
+        for key in list(self.client.scan_iter(match=self.prefix + "*")):
+            self.client.delete(key)
+
+
+def _take(backend, key, limit, cost=1, max_wait=0.0) -> Decision:
+    if backend.blocking:
+        return run_blocking(backend.take, key, limit, cost, max_wait)
+    return backend.take(key, limit, cost, max_wait)
+
+
+class AdmissionQueue:
+    """
+    Paces calls to the LLM provider so they stay within its quota.
+
+    Every call reserves the next free slot on a shared requests bucket and a
+    shared tokens bucket (prompt estimate plus ``max_tokens``) and sleeps until
+    that slot comes up. Callers therefore queue in arrival order across all
+    workers using the same backend; only when the wait would exceed
+    ``max_wait`` (or the caller's deadline), or ``max_depth`` callers are
+    already waiting in this process, is the call rejected.
+
+    Attributes:
+    -----------
+    requests : Limit or None
+        Requests-per-minute quota as a bucket, ``None`` when unlimited.
+    tokens : Limit or None
+        Tokens-per-minute quota as a bucket, ``None`` when unlimited.
+    max_wait : float
+        Longest a caller is made to wait for its slot, in seconds.
+    max_depth : int
+        Callers allowed to wait at once in this process.
+    """
+
+    def __init__(self, backend=None, rpm=0, tpm=0, burst_window=10.0, max_wait=10.0, max_depth=1000,
+                 key="upstream:llm"):
+        self.backend = backend or MemoryBucketBackend()
+        self.requests = self._quota(rpm, burst_window)
+        self.tokens = self._quota(tpm, burst_window)
+        self.max_wait = float(max_wait)
+        self.max_depth = int(max_depth)
+        self.key = key
+        self._lock = threading.Lock()
+        self.depth = 0
+        self.peak_depth = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.delayed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.last_wait = 0.0
+
+    @staticmethod
+    def _quota(per_minute, burst_window):
+        """A per-minute quota as a bucket holding ``burst_window`` seconds of it."""
+        if not per_minute or per_minute <= 0:
+            return None
+        rate = per_minute / 60.0
+        return Limit(rate, max(1, int(rate * burst_window)))
+
+    @property
+    def enabled(self) -> bool:
+        return self.requests is not None or self.tokens is not None
+
+    def admit(self, tokens=0, timeout=None) -> float:
+        """
+        Wait for an upstream slot.
+
+        Parameters:
+        -----------
+        tokens : int
+            Estimated tokens of the call (prompt plus completion budget).
+        timeout : float, optional
+            The caller's remaining deadline; the wait never exceeds it.
+
+        Returns:
+        --------
+        float
+            Seconds spent waiting.
+
+        Raises:
+        -------
+        AdmissionRejected
+            If the queue is full or the slot is further away than allowed.
+        """
+        if not self.enabled:
+            return 0.0
+        max_wait = self.max_wait if timeout is None else max(0.0, min(self.max_wait, timeout))
+        with self._lock:
+            if self.depth >= self.max_depth:
+                self.rejected += 1
+                raise AdmissionRejected("Too many calls are waiting for the LLM quota, try again shortly.", 1.0)
+            self.depth += 1
+            self.peak_depth = max(self.peak_depth, self.depth)
+        try:
+            wait = 0.0
+            if self.requests is not None:
+                decision = _take(self.backend, f"{self.key}:requests", self.requests, 1, max_wait)
+                self._check(decision)
+                wait = decision.wait
+            if self.tokens is not None and tokens:
+                decision = _take(self.backend, f"{self.key}:tokens", self.tokens, tokens, max_wait)
+                self._check(decision)
+                wait = max(wait, decision.wait)
+            if wait > 0:
+                time.sleep(wait)
+        finally:
+            with self._lock:
+                self.depth -= 1
+        with self._lock:
+            self.admitted += 1
+            self.delayed += wait > 0
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.last_wait = wait
+        return wait
+
+    def _check(self, decision):
+        if not decision.allowed:
+            with self._lock:
+                self.rejected += 1
+            raise AdmissionRejected(
+                f"LLM quota exhausted, next slot in {decision.wait:.1f}s.", decision.wait
+            )
+
+    def stats(self) -> dict:
+        """Queue depth, admissions and wait times of this process."""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "depth": self.depth,
+                "peak_depth": self.peak_depth,
+                "admitted": self.admitted,
+                "delayed": self.delayed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.wait_total / self.admitted * 1000, 2) if self.admitted else 0.0,
+                "max_wait_ms": round(self.wait_max * 1000, 2),
+                "last_wait_ms": round(self.last_wait * 1000, 2),
+            }
+
+
+class RateLimiter:
+    """
+    Flask extension enforcing per-identity and per-endpoint buckets on HTTP
+    requests and Socket.IO events, and owning the upstream admission queue.
+
+    Attributes:
+    -----------
+    enabled : bool
+        False skips the HTTP and socket checks (``RATELIMIT_ENABLED``).
+    backend : object
+        One of the ``*BucketBackend`` classes above.
+    default : Limit or None
+        Bucket every request and event of an identity draws from.
+    overrides : dict
+        Endpoint name to ``Limit``, replacing the limits declared in code.
+    admission : AdmissionQueue
+        Pacing for the LLM provider's quota.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.backend = MemoryBucketBackend()
+        self.default = None
+        self.overrides = {}
+        self.admission = AdmissionQueue(self.backend)
+        self.allowed = 0
+        self.denied = Counter()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, upstream=None):
+        """
+        Configure the limiter from the ``RATELIMIT_*`` and ``LLM_UPSTREAM_*`` settings.
+
+        Parameters:
+        -----------
+        app : Flask
+            The Flask application.
+        upstream : LLMClient, optional
+            Client whose calls go through the admission queue.
+        """
+        config = app.config
+        self.enabled = bool(config.get("RATELIMIT_ENABLED", True))
+        backend = config.get("RATELIMIT_BACKEND", "memory")
+        if backend == "sqlite":
+            self.backend = SQLiteBucketBackend(config.get("RATELIMIT_SQLITE_PATH", "ratelimit.db"))
+        elif backend == "redis":
+            self.backend = RedisBucketBackend(redis_connect(config.get("RATELIMIT_REDIS_URL", "local://ratelimit")))
+        else:
+            self.backend = MemoryBucketBackend()
+        default = config.get("RATELIMIT_DEFAULT")
+        self.default = parse_limit(default) if default else None
+        self.overrides = parse_overrides(config.get("RATELIMIT_ENDPOINTS"))
+        self.trusted_proxies = int(config.get("RATELIMIT_TRUSTED_PROXIES", 0))
+        self.admission = AdmissionQueue(
+            self.backend,
+            rpm=float(config.get("LLM_UPSTREAM_RPM", 0)),
+            tpm=float(config.get("LLM_UPSTREAM_TPM", 0)),
+            burst_window=float(config.get("LLM_UPSTREAM_BURST_WINDOW", 10)),
+            max_wait=float(config.get("LLM_ADMISSION_MAX_WAIT", 10)),
+            max_depth=int(config.get("LLM_ADMISSION_MAX_DEPTH", 1000)),
+        )
+        if upstream is not None:
+            upstream.admission = self.admission
+        self.allowed = 0
+        self.denied = Counter()
+        if "limiter" not in app.extensions:
+            app.before_request(self._check_request)
+            app.after_request(self._add_headers)
+        app.extensions["limiter"] = self
+
+    def limit(self, spec):
+        """Decorate a view with an endpoint limit such as ``"10 per minute"``."""
+        limit = parse_limit(spec)
+
+        def decorator(view):
+            view._rate_limit = limit
+            return view
+        return decorator
+
+    def exempt(self, view):
+        """Decorate a view that no bucket applies to (health checks, metrics)."""
+        view._rate_limit_exempt = True
+        return view
+
+    def limit_event(self, event, spec=None):
+        """
+        Decorate a Socket.IO handler with the identity bucket and an optional event limit.
+
+        A rejected event is not handled; the client receives a ``rate_limited``
+        event with the event name and ``retry_after`` in seconds instead.
+        """
+        limit = parse_limit(spec) if spec else None
+        endpoint = f"socket.{event}"
+
+        def decorator(handler):
+            @functools.wraps(handler)
+            def wrapper(*args, **kwargs):
+                if self.enabled:
+                    decision = self.hit(endpoint, limit)
+                    if decision.allowed and limit is not None and session.get("user_id") is None:
+                        # Anonymous sockets on one address share its bucket, which RATELIMIT_ENDPOINTS may
+                        # raise for NATs; each connection stays held to the limit declared here
+                        decision = self._take_connection(endpoint, limit, decision)
+                    if not decision.allowed:
+                        from flask_socketio import emit  # type: ignore
+                        emit("rate_limited", {"event": event, "retry_after": round(decision.wait, 3)})
+                        return None
+                return handler(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def identity(self) -> str:
+        """
+        Bucket owner of the current request or event: the signed-in user
+        (``user_id`` in the session), else the client address. Anonymous
+        clients never share a bucket through a placeholder user id, and a
+        socket that reconnects keeps drawing from its address's bucket.
+        """
+        user_id = session.get("user_id")
+        if user_id is not None:
+            return f"user:{user_id}"
+        return f"ip:{self.client_address()}"
+
+    def client_address(self) -> str:
+        """
+        Address of the client behind ``RATELIMIT_TRUSTED_PROXIES`` proxies: the
+        ``X-Forwarded-For`` entry the outermost trusted proxy appended, or the
+        peer address when no proxy is trusted (or one is already undone by
+        ``ProxyFix``) or the header is shorter than the proxy chain.
+        """
+        if self.trusted_proxies:
+            forwarded = [addr.strip() for addr in request.headers.get("X-Forwarded-For", "").split(",") if addr.strip()]
+            if len(forwarded) >= self.trusted_proxies:
+                return forwarded[-self.trusted_proxies]
+        return request.remote_addr
+
+    def hit(self, endpoint, limit=None, identity=None) -> Decision:
+        """
+        Take one token from the endpoint bucket and the identity bucket.
+
+        The endpoint bucket is checked first so a rejected call does not also
+        drain the identity's general allowance.
+        """
+        identity = identity or self.identity()
+        limit = self.overrides.get(endpoint, limit)
+        decision = Decision(True, 0.0, None)
+        if limit is not None:
+            decision = _take(self.backend, f"{identity}:{endpoint}", limit)
+        if decision.allowed and self.default is not None:
+            general = _take(self.backend, identity, self.default)
+            remaining = general.remaining if decision.remaining is None else min(decision.remaining, general.remaining)
+            decision = general._replace(remaining=remaining)
+        with self._lock:
+            if decision.allowed:
+                self.allowed += 1
+            else:
+                self.denied[endpoint] += 1
+        return decision
+
+    def _take_connection(self, endpoint, limit, decision) -> Decision:
+        """Take from the socket connection's own bucket for ``endpoint`` after the identity's allowed the event."""
+        connection = _take(self.backend, f"sid:{request.sid}:{endpoint}", limit)
+        if connection.allowed:
+            return decision._replace(remaining=min(decision.remaining, connection.remaining))
+        with self._lock:
+            self.allowed -= 1
+            self.denied[endpoint] += 1
+        return connection
+
+    def stats(self) -> dict:
+        """Allowed and rejected counts by endpoint plus the admission queue's figures."""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "backend": type(self.backend).__name__,
+                "allowed": self.allowed,
+                "denied": dict(self.denied),
+                "admission": self.admission.stats(),
+            }
+
+    def reset(self):
+        """Refill every bucket."""
+        self.backend.reset()
+
+    def _check_request(self):
+        if not self.enabled or request.endpoint is None:
+            return None
+        view = current_app.view_functions.get(request.endpoint)
+        if view is None or getattr(view, "_rate_limit_exempt", False):
+            return None
+        decision = self.hit(request.endpoint, getattr(view, "_rate_limit", None))
+        g.rate_limit = decision
+        if decision.allowed:
+            return None
+        retry_after = max(1, math.ceil(decision.wait))
+        response = jsonify({"error": f"Rate limit exceeded, retry in {retry_after}s."})
+        response.status_code = 429
+        response.headers["Retry-After"] = str(retry_after)
+        return response
+
+    def _add_headers(self, response):
+        decision = g.pop("rate_limit", None)
+        if decision is not None and decision.remaining is not None:
+            response.headers["X-RateLimit-Remaining"] = str(decision.remaining)
+        return response
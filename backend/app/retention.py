@@ -0,0 +1,507 @@
+"""
+Retention, monthly partitions and compressed archives for ConversationLog.
+
+ConversationLog is append-only, so without retention the table, its indexes
+and every backup grow forever. ``ConversationRetention`` keeps the table to a
+hot window and moves everything older out, one calendar month at a time:
+
+- expiry: every message class (``kind``: ``answer`` or ``prompt``) has its
+  own time to live in ``RETENTION_TTL_DAYS`` (0 keeps it forever), and
+  expired rows are deleted;
+- compaction: a month that ended more than ``RETENTION_HOT_DAYS`` ago is
+  written to an archive file in ``RETENTION_ARCHIVE_PATH``, registered in the
+  ``conversation_archive`` catalog, and then deleted from the table;
+- archive expiry: once a class's TTL has passed for a whole archived month,
+  the archive is rewritten without it.
+
+An archive holds the month in (user_id, timestamp, id) order as NDJSON, cut
+into blocks of ``RETENTION_BLOCK_ROWS`` rows that are each compressed as a
+separate gzip member. The file as a whole is an ordinary ``.ndjson.gz`` that
+``zcat`` reads, and the catalog's block index lets the history API decompress
+only the blocks holding one user's messages. The month is read from the
+table in time order and sorted on the way out through runs of
+``RETENTION_SORT_BUFFER`` rows spilled to temporary files, so memory stays
+bounded whatever the size of the month.
+
+The catalog is the switch between table and archives. Once a month is
+registered, readers take everything before its end from the archives and
+ignore table rows in that range. Deleting those rows afterwards, or a run that
+stops part-way through, therefore never shows a message twice or loses one.
+
+Deletes run in batches of ``RETENTION_BATCH_SIZE`` rows. Each batch is its own
+short transaction followed by a pause of ``RETENTION_BATCH_PAUSE`` seconds, so
+the write lock is never held for long and log writes get in between. A run
+stops after ``RETENTION_MAX_SECONDS`` and the next one carries on from there.
+Every ``RETENTION_INTERVAL`` seconds a ``retention.run`` job is queued, keyed
+by the interval so only one worker of the host runs it. Runs can also be
+started by hand:
+
+    python -m app.retention run
+    python -m app.retention status
+"""
+import argparse
+import gzip
+import heapq
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+from functools import lru_cache
+from types import SimpleNamespace
+
+from sqlalchemy import delete, func, insert, select, tuple_, update  # type: ignore
+
+from . import db
+from .jobs import PRIORITY_LOW, task
+from .models import ConversationArchive, ConversationLog
+from .utils import run_blocking
+
+logger = logging.getLogger(__name__)
+
+# Rows read back from an archive; ``serialize`` and the history cursors treat them like table rows
+ArchivedRow = namedtuple("ArchivedRow", "id user_id timestamp message kind")
+
+Partition = namedtuple("Partition", "month starts_at ends_at path rows bytes blocks")
+
+# Unreferenced archive files (superseded by a rewrite, or left by a crash) are removed after this long
+FILE_GRACE = 3600.0
+
+
+def month_bounds(timestamp) -> tuple:
+    """First instant of the month holding ``timestamp`` and of the month after it."""
+    starts_at = timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    ends_at = (starts_at + timedelta(days=32)).replace(day=1)
+    return starts_at, ends_at
+
+
+@lru_cache(maxsize=64)
+def _read_block(path, offset, length) -> tuple:
+    # Archive files are never modified in place (a rewrite gets a new name), so caching by position is safe
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    return tuple(ArchivedRow(d["id"], d["user_id"], datetime.fromisoformat(d["timestamp"]), d["message"], d["kind"])
+                 for d in map(json.loads, gzip.decompress(data).splitlines()))
+
+
+def _fetch_all(engine, stmt):
+    with engine.connect() as conn:
+        return conn.execute(stmt).all()
+
+
+def _fetch_scalar(engine, stmt):
+    with engine.connect() as conn:
+        return conn.execute(stmt).scalar()
+
+
+def _execute(engine, stmt) -> int:
+    with engine.begin() as conn:
+        return conn.execute(stmt).rowcount
+
+
+class ConversationRetention:
+    """
+    Flask extension expiring, partitioning and archiving ConversationLog.
+
+    Attributes:
+    -----------
+    ttl_days : dict
+        Days each message class is kept (0: forever).
+    hot_days : float
+        Months that ended this many days ago are archived (0: never).
+    archive_path : str
+        Directory holding the archive files.
+    batch_size : int
+        Rows deleted per transaction.
+    batch_pause : float
+        Seconds slept after every deleting transaction.
+    max_seconds : float
+        Time budget of one run.
+    interval : float
+        Seconds between scheduled runs (0: only by hand).
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.ttl_days = {}
+        self.hot_days = 90.0
+        self.archive_path = "archive"
+        self.block_rows = 1000
+        self.sort_buffer = 50000
+        self.batch_size = 500
+        self.batch_pause = 0.01
+        self.max_seconds = 60.0
+        self.interval = 0.0
+        self._jobs = None
+        self._metrics = None
+        self._next_schedule = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, jobs=None, metrics=None):
+        """
+        Configure retention from the ``RETENTION_*`` settings of the Flask app.
+
+        Parameters:
+        -----------
+        app : Flask
+            The Flask application.
+        jobs : JobQueue, optional
+            Queue the scheduled ``retention.run`` jobs go to.
+        metrics : Metrics, optional
+            Registry receiving expired, archived and deleted row counts.
+        """
+        config = app.config
+        self.app = app
+        self.ttl_days = {kind: float(days) for kind, days in config.get("RETENTION_TTL_DAYS", {}).items()}
+        self.hot_days = float(config.get("RETENTION_HOT_DAYS", self.hot_days))
+        self.archive_path = config.get("RETENTION_ARCHIVE_PATH", self.archive_path)
+        self.block_rows = int(config.get("RETENTION_BLOCK_ROWS", self.block_rows))
+        self.sort_buffer = int(config.get("RETENTION_SORT_BUFFER", self.sort_buffer))
+        self.batch_size = int(config.get("RETENTION_BATCH_SIZE", self.batch_size))
+        self.batch_pause = float(config.get("RETENTION_BATCH_PAUSE", self.batch_pause))
+        self.max_seconds = float(config.get("RETENTION_MAX_SECONDS", self.max_seconds))
+        self.interval = float(config.get("RETENTION_INTERVAL", self.interval))
+        self._jobs = jobs
+        self._next_schedule = 0.0
+        if metrics is not None:
+            self._metrics = SimpleNamespace(
+                enabled=lambda: metrics.enabled,
+                rows=metrics.counter("spokesperson_retention_rows", "ConversationLog rows handled by retention.",
+                                     ("action",)),
+            )
+        if self.interval > 0 and "log_retention" not in app.extensions:
+            app.before_request(self._schedule)
+        app.extensions["log_retention"] = self
+
+    def partitions(self, engine=None) -> list:
+        """The archived months, oldest first."""
+        table = ConversationArchive
+        stmt = select(table.month, table.starts_at, table.ends_at, table.path, table.rows, table.bytes,
+                      table.blocks).order_by(table.month)
+        return [Partition(*row) for row in run_blocking(_fetch_all, engine or db.engine, stmt)]
+
+    def user_rows(self, partitions, user_id, position=None, order="desc", limit=50) -> list:
+        """
+        Archived messages of one user, in the order of ``page_conversations``.
+
+        Parameters:
+        -----------
+        partitions : list
+            Catalog from ``partitions()``.
+        user_id : int
+            Author of the messages.
+        position : tuple, optional
+            ``(timestamp, id)`` of the last row already returned; only rows after it are read.
+        order : str
+            ``desc`` (newest first) or ``asc``.
+        limit : int
+            Maximum rows returned.
+
+        Returns:
+        --------
+        list
+            ``ArchivedRow`` tuples.
+        """
+        found = []
+        descending = order != "asc"
+        for partition in (reversed(partitions) if descending else partitions):
+            if len(found) >= limit:
+                break
+            if position is not None and (partition.starts_at > position[0] if descending
+                                         else partition.ends_at <= position[0]):
+                continue
+            rows = run_blocking(self._user_partition, partition, user_id)
+            if position is not None:
+                rows = [row for row in rows if ((row.timestamp, row.id) < position if descending
+                                                else (row.timestamp, row.id) > position)]
+            if descending:
+                rows.reverse()
+            found.extend(rows[:limit - len(found)])
+        return found
+
+    def iter_rows(self, partitions, user_id=None, since=None, until=None):
+        """Yield archived rows, month by month in (user_id, timestamp, id) order, within the bounds given."""
+        for partition in partitions:
+            if (since is not None and partition.ends_at <= since) or (until is not None and partition.starts_at >= until):
+                continue
+            for block in partition.blocks:
+                if user_id is not None and not block[0] <= user_id <= block[1]:
+                    continue
+                for row in run_blocking(_read_block, self._file(partition.path), block[2], block[3]):
+                    if ((user_id is None or row.user_id == user_id)
+                            and (since is None or row.timestamp >= since) and (until is None or row.timestamp < until)):
+                        yield row
+
+    def run(self, now=None, max_seconds=None) -> dict:
+        """
+        Expire, archive and clean up until nothing is left to do or the time budget runs out.
+
+        Parameters:
+        -----------
+        now : datetime, optional
+            Current UTC time (default: ``datetime.utcnow()``).
+        max_seconds : float, optional
+            Time budget (default: ``max_seconds``).
+
+        Returns:
+        --------
+        dict
+            Rows 'expired' from the table, 'archived' into new partitions, 'deleted'
+            from the table after archiving and 'rewritten' in archives, the months
+            archived, and 'complete' (False when the budget ran out first).
+        """
+        now = now or datetime.utcnow()
+        deadline = time.monotonic() + (self.max_seconds if max_seconds is None else max_seconds)
+        report = {"expired": 0, "archived": 0, "deleted": 0, "rewritten": 0, "months": [], "complete": False}
+        log = ConversationLog
+
+        partitions = self.partitions()
+        archived_until = partitions[-1].ends_at if partitions else None
+        if archived_until is not None:
+            # Rows of months already archived (a run that stopped between registering and deleting)
+            report["deleted"] += self._delete(deadline, log.timestamp < archived_until)
+
+        for kind, days in self.ttl_days.items():
+            if days > 0:
+                report["expired"] += self._delete(deadline, log.kind == kind,
+                                                  log.timestamp < now - timedelta(days=days))
+
+        while self.hot_days > 0 and time.monotonic() < deadline:
+            oldest = run_blocking(_fetch_scalar, db.engine, select(func.min(log.timestamp)))
+            if oldest is None:
+                break
+            starts_at, ends_at = month_bounds(oldest)
+            if ends_at > now - timedelta(days=self.hot_days) or (archived_until and starts_at < archived_until):
+                break
+            partition = self._compact(starts_at, ends_at)
+            if partition is None:
+                break  # Another run archived it first
+            report["archived"] += partition.rows
+            report["months"].append(partition.month)
+            archived_until = ends_at
+            report["deleted"] += self._delete(deadline, log.timestamp >= starts_at, log.timestamp < ends_at)
+
+        for partition in self.partitions():
+            if time.monotonic() >= deadline:
+                break
+            expired = {kind for kind, days in self.ttl_days.items()
+                       if days > 0 and partition.ends_at <= now - timedelta(days=days)}
+            if any(expired.intersection(block[5]) for block in partition.blocks):
+                report["rewritten"] += self._rewrite(partition, expired)
+
+        self._sweep()
+        report["complete"] = time.monotonic() < deadline
+        for action in ("expired", "archived", "deleted", "rewritten"):
+            self._count(action, report[action])
+        return report
+
+    def status(self) -> dict:
+        """Rows in the table and the archived months with their sizes."""
+        log = ConversationLog
+        hot_rows, oldest = run_blocking(_fetch_all, db.engine, select(func.count(), func.min(log.timestamp)))[0]
+        partitions = self.partitions()
+        return {
+            "hot_rows": hot_rows,
+            "oldest_hot": oldest.isoformat() if oldest else None,
+            "archived_until": partitions[-1].ends_at.isoformat() if partitions else None,
+            "partitions": [{"month": p.month, "rows": p.rows, "bytes": p.bytes, "blocks": len(p.blocks),
+                            "file": p.path} for p in partitions],
+        }
+
+    def _schedule(self):
+        if self._jobs is None or time.monotonic() < self._next_schedule:
+            return
+        self._next_schedule = time.monotonic() + self.interval
+        try:
+            self._jobs.enqueue("retention.run", key=f"retention:{int(time.time() // self.interval)}")
+        except Exception as e:
+            logger.warning("Scheduling a retention run failed: %s", e)
+
+    def _delete(self, deadline, *conditions) -> int:
+        """Delete matching rows one short transaction at a time until none are left or the deadline passes."""
+        log = ConversationLog
+        batch = select(log.id).where(*conditions).order_by(log.timestamp, log.id).limit(self.batch_size)
+        stmt = delete(log).where(log.id.in_(batch))
+        deleted = 0
+        while time.monotonic() < deadline:
+            count = run_blocking(_execute, db.engine, stmt)
+            deleted += count
+            if count < self.batch_size:
+                break
+            time.sleep(self.batch_pause)  # Let the log writer take the write lock
+        return deleted
+
+    def _compact(self, starts_at, ends_at):
+        """Archive the month and register it; None when another run registered it first."""
+        month = starts_at.strftime("%Y-%m")
+        rows, blocks, name = self._write(month, self._sorted(self._month_rows(starts_at, ends_at)))
+        size = os.path.getsize(self._file(name))
+        try:
+            run_blocking(_execute, db.engine, insert(ConversationArchive).values(
+                month=month, starts_at=starts_at, ends_at=ends_at, path=name, rows=rows, bytes=size,
+                blocks=blocks, created_at=datetime.utcnow()))
+        except Exception as e:
+            if run_blocking(_fetch_scalar, db.engine, select(ConversationArchive.path)
+                            .where(ConversationArchive.month == month)) is None:
+                raise
+            logger.info("Month %s was archived by another run: %s", month, e)
+            os.remove(self._file(name))
+            return None
+        logger.info("Archived %d ConversationLog rows of %s into %s (%d bytes)", rows, month, name, size)
+        return Partition(month, starts_at, ends_at, name, rows, size, blocks)
+
+    def _rewrite(self, partition, expired) -> int:
+        """Write ``partition`` again without the ``expired`` classes; return the rows dropped."""
+        kept = ((row.user_id, row.timestamp.isoformat(), row.id, row.message, row.kind)
+                for row in self.iter_rows([partition]) if row.kind not in expired)
+        rows, blocks, name = self._write(partition.month, kept)
+        table = ConversationArchive
+        # Compare-and-set on the file name: a concurrent rewrite wins and this one is discarded
+        updated = run_blocking(_execute, db.engine, update(table).where(
+            table.month == partition.month, table.path == partition.path).values(
+            path=name, rows=rows, bytes=os.path.getsize(self._file(name)), blocks=blocks,
+            created_at=datetime.utcnow()))
+        if not updated:
+            os.remove(self._file(name))
+            return 0
+        return partition.rows - rows
+
+    def _month_rows(self, starts_at, ends_at):
+        """Yield ``(user_id, timestamp, id, message, kind)`` tuples of the month in time order."""
+        log = ConversationLog
+        columns = select(log.user_id, log.timestamp, log.id, log.message, log.kind)
+        position = None
+        while True:
+            stmt = columns.where(log.timestamp >= starts_at, log.timestamp < ends_at)
+            if position is not None:
+                stmt = stmt.where(tuple_(log.timestamp, log.id) > position)
+            rows = run_blocking(_fetch_all, db.engine, stmt.order_by(log.timestamp, log.id).limit(self.block_rows))
+            if not rows:
+                return
+            for row in rows:
+                yield row.user_id, row.timestamp.isoformat(), row.id, row.message, row.kind
+            position = (rows[-1].timestamp, rows[-1].id)
+
+    def _sorted(self, items):
+        """Yield ``items`` in (user_id, timestamp, id) order, spilling sorted runs to disk past ``sort_buffer``."""
+        runs, buffer = [], []
+        try:
+            for item in items:
+                buffer.append(item)
+                if len(buffer) >= self.sort_buffer:
+                    runs.append(self._spill(sorted(buffer)))
+                    buffer = []
+            buffer.sort()
+            yield from heapq.merge(*(map(tuple, map(json.loads, run)) for run in runs), buffer)
+        finally:
+            for run in runs:
+                run.close()
+
+    def _spill(self, items):
+        run = tempfile.TemporaryFile("w+", encoding="utf-8", dir=self._directory())
+        for item in items:
+            run.write(json.dumps(item, ensure_ascii=False) + "\n")
+        run.seek(0)
+        return run
+
+    def _write(self, month, items) -> tuple:
+        """Write sorted items as gzip blocks to a new archive file; return (rows, block index, file name)."""
+        name = f"conversation_log-{month}.{uuid.uuid4().hex[:8]}.ndjson.gz"
+        path = self._file(name)
+        blocks, block = [], []
+        with open(path + ".tmp", "wb") as f:
+            def flush():
+                lines = "".join(json.dumps({"id": row_id, "user_id": user_id, "timestamp": timestamp,
+                                            "message": message, "kind": kind}, ensure_ascii=False) + "\n"
+                                for user_id, timestamp, row_id, message, kind in block)
+                data = gzip.compress(lines.encode("utf-8"), compresslevel=9, mtime=0)
+                blocks.append([block[0][0], block[-1][0], f.tell(), len(data), len(block),
+                               sorted({item[4] for item in block})])
+                f.write(data)
+
+            for item in items:
+                block.append(item)
+                if len(block) >= self.block_rows:
+                    flush()
+                    block = []
+            if block:
+                flush()
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        return sum(b[4] for b in blocks), blocks, name
+
+    def _user_partition(self, partition, user_id) -> list:
+        rows = []
+        for block in partition.blocks:
+            if block[0] <= user_id <= block[1]:
+                rows.extend(row for row in _read_block(self._file(partition.path), block[2], block[3])
+                            if row.user_id == user_id)
+        return rows
+
+    def _sweep(self):
+        """Remove archive files no partition refers to, once they are old enough that no reader still uses them."""
+        directory = self.archive_path
+        if not os.path.isdir(directory):
+            return
+        referenced = {partition.path for partition in self.partitions()}
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if (name.startswith("conversation_log-") and name not in referenced
+                    and time.time() - os.path.getmtime(path) > FILE_GRACE):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning("Removing archive file %s failed: %s", path, e)
+
+    def _directory(self) -> str:
+        os.makedirs(self.archive_path, exist_ok=True)
+        return self.archive_path
+
+    def _file(self, name) -> str:
+        return os.path.join(self._directory(), name)
+
+    def _count(self, action, amount):
+        m = self._metrics
+        if m is not None and m.enabled() and amount:
+            m.rows.inc(action, amount=amount)
+
+
+@task("retention.run", max_attempts=1, priority=PRIORITY_LOW, timeout=3600.0)
+def run_retention():
+    """Job: one retention run within ``RETENTION_MAX_SECONDS``; the next scheduled run continues it."""
+    from . import log_retention
+    return log_retention.run()
+
+
+def main(argv=None):
+    """Run retention or report the table and its archives."""
+    parser = argparse.ArgumentParser(description="Expire and archive ConversationLog rows.")
+    parser.add_argument("command", choices=("run", "status"))
+    parser.add_argument("--max-seconds", type=float, help="run: time budget (default: RETENTION_MAX_SECONDS).")
+    args = parser.parse_args(argv)
+
+    from . import create_app
+    from config.config import get_config
+    app, _, _ = create_app(type("RetentionConfig", (get_config(),), {"SQLALCHEMY_ECHO": False}))
+    retention = app.extensions["log_retention"]
+    with app.app_context():
+        if args.command == "status":
+            print(json.dumps(retention.status(), indent=2))
+            return
+        while True:
+            report = retention.run(max_seconds=args.max_seconds)
+            print(json.dumps(report), flush=True)
+            if report["complete"]:
+                return
+
+
+if __name__ == "__main__":
+    # ``python -m`` runs a second copy of this module; use the package's, which holds the task registry
+    from app.retention import main as package_main
+    package_main()
@@ -1,16 +1,21 @@
-from flask import Blueprint, jsonify, session, request  # type: ignore
-from flask_limiter import Limiter  # type: ignore
-from flask_limiter.util import get_remote_address  # type: ignore
-from .models import User, ConversationLog
-from . import db
-from .services import get_next_question
-import openai  # type: ignore
+from flask import Blueprint, Response, current_app, g, jsonify, session, request, stream_with_context  # type: ignore
+from .models import User, ConversationLog, Profile
+from . import (db, llm, completion_cache, context_manager, flow_engine, job_queue, limiter, log_writer, match_engine,
+               message_bus, metrics, overload, sanitizer, socketio, state_store)
+from .history import EXPORT_FORMATS, InvalidCursor, export_chunks, gzip_chunks, iter_export, page_conversations, serialize
+from .llm import LLMError, LLMBusyError, LLMTimeoutError
+from .logs import EventLogger
+from .metrics import CONTENT_TYPE
+from .services import degraded_reply
+from .socketio_handlers import active_connections
+import hmac
+import os
+from datetime import datetime
 
 # Define the main blueprint for the application
 main_bp = Blueprint('main', __name__)
 
-# Set up a rate limiter for all routes
-limiter = Limiter(key_func=get_remote_address)
+log = EventLogger(__name__)
 
 
 @main_bp.route('/')
@@ -26,8 +31,30 @@ def index():
     return jsonify({"message": "Welcome to the Spokesperson App!"})
 
 
+def _degraded_response(user_input=None, reason="shed"):
+    """
+    Answer ``/generate_response`` without the model, from the cache or a template
+    (see ``services.degraded_reply``), flagged with ``X-Degraded: <reason>``.
+
+    Called with no input when the request is shed before the view runs; input
+    that would not pass the view's checks then gets a plain 503.
+    """
+    body = request.get_json(silent=True) or {}
+    if user_input is None:
+        user_input = body.get("user_input")
+        if not user_input or sanitizer.admit(user_input) is not None:
+            return jsonify({"error": "The server is overloaded, please retry shortly."}), 503, {"Retry-After": "1"}
+        user_input = sanitizer.scrub(user_input)
+    text, source = degraded_reply(user_input, current_app.config.get("LLM_MAX_TOKENS", 50))
+    headers = {"X-Degraded": reason, "X-LLM-Provider": source}
+    if body.get("stream"):
+        return Response(text, mimetype="text/plain", headers=headers)
+    return jsonify({"user_input": user_input, "summary": text, "degraded": True}), 200, headers
+
+
 @main_bp.route('/generate_response', methods=['POST'])
-@limiter.limit("10 per minute")  # Limit API requests to prevent abuse
+@limiter.limit("10 per minute burst 5")  # Per user, on top of RATELIMIT_DEFAULT
+@overload.priority("low", degrade=_degraded_response)  # Shed before flow steps, answered from cache or template
 def generate_response():
     """
     Endpoint to generate a response using the OpenAI API.
@@ -35,13 +62,25 @@ def generate_response():
     Expects:
     --------
     - A JSON body containing the key "user_input" with the user message.
+    - Optionally "stream": true to receive the completion as a chunked
+      text/plain response, flushed token by token as the model produces it.
 
     Returns:
     --------
     JSON response:
-        - 'user_input': The original user input message.
+        - 'user_input': The user input message, with PII and profanity scrubbed (see ``app/sanitize.py``).
         - 'summary': The AI-generated response summary.
-        - 'error': Error message, if any exception occurs.
+        - 'context': Prompt metrics (tokens sent, tokens saved by trimming, assembly time).
+        - 'error': Error message, if any exception occurs; 413 for input over ``MESSAGE_MAX_CHARS``.
+
+    For a signed-in user (``user_id`` in the session) the prompt carries their
+    recent turns and a summary of older ones (see ``app/context.py``); the metrics are also sent as ``X-Prompt-Tokens``,
+    ``X-Prompt-Tokens-Saved`` and ``Server-Timing`` headers. ``X-LLM-Provider``
+    names the provider that answered (see ``app/providers.py``), or ``cache``.
+
+    Under overload (see ``app/overload.py``), or when no LLM slot is free, the
+    reply is a cached or templated one without the model, flagged with
+    ``"degraded": true`` and ``X-Degraded: shed`` or ``busy``.
 
     Example:
     --------
@@ -56,42 +95,387 @@ def generate_response():
         "summary": "I'm doing great, thank you for asking!"
     }
     """
+    timer = metrics.request_timer()
     try:
         # Extract user input from the POST request body
         user_input = request.json.get("user_input")
         if not user_input:
+            metrics.invalid("generate_response")
             return jsonify({"error": "No user input provided."}), 400
+        rejected = sanitizer.admit(user_input)
+        if rejected is not None:
+            metrics.invalid(rejected)
+            return jsonify({"error": sanitizer.rejection(rejected)}), 413 if rejected == "oversize" else 400
+        user_input = sanitizer.scrub(user_input)  # What is logged, cached and sent upstream
+        timer.mark("validate")
+        stream = bool(request.json.get("stream", False))
 
-        # Retrieve the user ID from the session or default to 1 (for demo purposes)
-        user_id = session.get('user_id', 1)
+        # The signed-in user, if any; anonymous visitors are logged under user 1 (for demo purposes)
+        user_id = session.get('user_id')
 
-        # Store the user input in the ConversationLog table in the database
-        new_message = ConversationLog(user_id=user_id, message=user_input)
-        db.session.add(new_message)
-        db.session.commit()
+        # Queue the user input for the ConversationLog table (written in batches)
+        message_id = log_writer.log(user_id if user_id is not None else 1, user_input, kind="prompt")
+        timer.mark("db")
 
-        # Generate a response using the OpenAI ChatCompletion API
-        messages = [{"role": "user", "content": user_input}]
-        response = openai.ChatCompletion.create(model="gpt-3.5-turbo", messages=messages, max_tokens=50)
+        # Recent turns and a rolling summary of older ones, trimmed to the token budget.
+        # Only a signed-in user has a history; an anonymous visitor's message is sent on its own.
+        context_key = f"user:{user_id}" if user_id is not None else None
+        window = context_manager.build(context_key, user_id, user_input, message_id)
+        messages = window.messages
+        max_tokens = current_app.config.get("LLM_MAX_TOKENS", 50)
+        timer.mark("context")
 
-        # Extract the response content
-        ai_response = response['choices'][0]['message']['content'].strip()
+        if stream:
+            # Pull the first token before answering so upstream errors still map to a status code
+            tokens = completion_cache.stream_through(
+                llm.model, messages, max_tokens, lambda: llm.stream(messages, max_tokens=max_tokens)
+            )
+            first = next(tokens, "")
+            timer.mark("llm_first_token")
+            relay = _relay(first, tokens, lambda text: context_manager.record_reply(context_key, text))
+            return Response(stream_with_context(relay), mimetype="text/plain", headers=window.headers())
+
+        # Identical prompts are served from the cache; concurrent misses share one upstream call
+        ai_response = completion_cache.get_or_compute(
+            llm.model, messages, max_tokens, lambda: llm.complete(messages, max_tokens=max_tokens)
+        )
+        timer.mark("llm")
+        context_manager.record_reply(context_key, ai_response)
 
         # Return a JSON response with the original input and AI-generated summary
-        return jsonify({"user_input": user_input, "summary": ai_response})
+        response = jsonify({"user_input": user_input, "summary": ai_response, "context": window.metrics()})
+        response.headers.update(window.headers())
+        response.headers["X-LLM-Provider"] = getattr(ai_response, "provider", "cache")
+        return response
 
-    except openai.error.OpenAIError as oe:
+    except LLMBusyError as be:
+        # Every upstream slot is taken; answer without the model rather than queueing forever
+        metrics.error("llm")
+        if overload.degrade:
+            g.overload_dropped = True  # Still a sign of saturation for the concurrency limit
+            return _degraded_response(user_input, "busy")
+        return jsonify({"error": f"OpenAI API Error: {str(be)}"}), 503
+    except LLMTimeoutError as te:
+        metrics.error("llm")
+        return jsonify({"error": f"OpenAI API Error: {str(te)}"}), 504
+    except LLMError as oe:
         # Specific handling for OpenAI-related errors
+        metrics.error("llm")
         return jsonify({"error": f"OpenAI API Error: {str(oe)}"}), 500
     except Exception as e:
         # General error handling for unexpected issues
+        metrics.error("http.generate_response")
+        log.error("generate_response.failed", error=str(e))
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
 
+def _relay(first, tokens, on_complete=None):
+    """
+    Forward streamed tokens to the client, logging failures after the headers are sent.
+
+    Once the first chunk has gone out the status code can no longer change, so a
+    mid-stream upstream error ends the body early instead of raising.
+    ``on_complete`` receives the full text once the stream has finished.
+    """
+    parts = [first]
+    try:
+        yield first
+        for token in tokens:
+            parts.append(token)
+            yield token
+        if on_complete is not None:
+            on_complete("".join(parts).strip())
+    except LLMError as e:
+        metrics.error("llm")
+        log.error("completion.aborted", error=str(e))
+    finally:
+        tokens.close()
+
+
+@main_bp.route('/socket_stats', methods=['GET'])
+def socket_stats():
+    """
+    Report the Socket.IO connections held by the worker process serving this request.
+
+    Returns:
+    --------
+    JSON response:
+        - 'pid': Worker process id.
+        - 'async_mode': Socket.IO async mode of the worker.
+        - 'connections': Currently connected sockets.
+        - 'peak_connections': Highest connection count since start.
+    """
+    return jsonify({
+        "pid": os.getpid(),
+        "async_mode": socketio.async_mode,
+        "connections": active_connections.count,
+        "peak_connections": active_connections.peak,
+    })
+
+
+@main_bp.route('/metrics', methods=['GET'])
+@limiter.exempt
+def metrics_endpoint():
+    """
+    Prometheus metrics of the worker process serving this request.
+
+    Returns:
+    --------
+    text/plain response in the Prometheus exposition format:
+        - spokesperson_event_seconds: HTTP request and socket event latency.
+        - spokesperson_event_stage_seconds: per-stage latency (session_io, validate, db, lookup, emit, context, llm).
+        - spokesperson_socket_connections, spokesperson_queue_depth: current load.
+        - spokesperson_errors_total, spokesperson_invalid_inputs_total: failures and rejected answers.
+    """
+    return Response(metrics.render(), mimetype=CONTENT_TYPE)
+
+
+@main_bp.route('/overload_stats', methods=['GET'])
+@limiter.exempt
+def overload_stats():
+    """
+    Report the adaptive concurrency limit of this worker process: the algorithm,
+    the current limit, work in flight and waiting for a slot, admitted and shed
+    counts by priority, and each endpoint's baseline latency in milliseconds.
+    """
+    return jsonify({"pid": os.getpid(), **overload.stats()})
+
+
+@main_bp.route('/ratelimit_stats', methods=['GET'])
+@limiter.exempt
+def ratelimit_stats():
+    """
+    Report rate-limit decisions and the upstream admission queue of this worker process.
+
+    Returns:
+    --------
+    JSON response:
+        - 'pid': Worker process id.
+        - 'allowed' / 'denied': Requests and socket events let through, and rejections by endpoint.
+        - 'admission': LLM calls waiting for the provider's quota ('depth', 'peak_depth'),
+          admitted, delayed and rejected calls, and average/maximum/last wait in milliseconds.
+    """
+    return jsonify({"pid": os.getpid(), **limiter.stats()})
+
+
+def _is_admin() -> bool:
+    """Whether the request carries ``Authorization: Bearer <ADMIN_TOKEN>``; never when no token is configured."""
+    token = current_app.config.get("ADMIN_TOKEN")
+    supplied = request.headers.get("Authorization", "")
+    return bool(token) and hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode())
+
+
+def _owns_job(job) -> bool:
+    """Whether the signed-in user is the one the job works for (its room or its payload's ``user_id``)."""
+    user_id = session.get('user_id')
+    if user_id is None:
+        return False
+    return job.room == f"user:{user_id}" or (isinstance(job.payload, dict) and job.payload.get("user_id") == user_id)
+
+
+@main_bp.route('/jobs/<int:job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    Report the state of a background job to the signed-in user it works for,
+    or to an operator sending ``ADMIN_TOKEN`` as a bearer token.
+
+    Returns:
+    --------
+    JSON response:
+        - 'id', 'name', 'status' ('queued', 'running', 'done' or 'failed'), 'attempts', 'priority'.
+        - 'result' once done, 'error' after a failed attempt.
+        - 404 for an unknown or purged job, and for someone else's.
+    """
+    job = job_queue.get(job_id)
+    if job is None or not (_owns_job(job) or _is_admin()):
+        return jsonify({"error": "No such job."}), 404
+    return jsonify({field: getattr(job, field) for field in
+                    ("id", "name", "status", "attempts", "max_attempts", "priority", "result", "error")})
+
+
+@main_bp.route('/job_stats', methods=['GET'])
+@limiter.exempt
+def job_stats():
+    """
+    Report the job queue: jobs by status, the wait of the oldest ready job ('lag_s'),
+    and the jobs run, retried and failed by this worker process.
+    """
+    return jsonify(job_queue.stats())
+
+
+@main_bp.route('/bus_stats', methods=['GET'])
+@limiter.exempt
+def bus_stats():
+    """
+    Report the message bus of this worker process: its backend, the last log
+    sequence number, messages waiting to be written ('pending'), and the messages
+    published, delivered from other workers and replayed since start.
+    """
+    return jsonify(message_bus.stats())
+
+
+@main_bp.route('/llm_stats', methods=['GET'])
+@limiter.exempt
+def llm_stats():
+    """
+    Report each LLM provider of this worker process: its tier and model, the
+    state of its circuit breaker, its recent error rate and its p50/p95
+    latencies (whole completions and time to the first streamed token).
+    """
+    return jsonify(llm.stats())
+
+
+@main_bp.route('/users/<int:user_id>/conversations', methods=['GET'])
+def user_conversations(user_id):
+    """
+    Page through a user's ConversationLog messages: the signed-in user's own,
+    or anyone's for an operator sending ``ADMIN_TOKEN`` as a bearer token.
+
+    Query parameters:
+    -----------------
+    - limit: Rows per page (default ``HISTORY_PAGE_SIZE``, capped at ``HISTORY_MAX_PAGE_SIZE``).
+    - cursor: ``next_cursor`` from the previous page.
+    - order: ``desc`` (newest first, default) or ``asc``.
+
+    Returns:
+    --------
+    JSON response:
+        - 'user_id': The user.
+        - 'conversations': Messages with 'id', 'user_id', 'timestamp' and 'message'.
+        - 'next_cursor': Cursor for the following page, or null on the last one.
+        - 403 for another user's messages.
+    """
+    if session.get('user_id') != user_id and not _is_admin():
+        return jsonify({"error": "Not allowed to read this user's conversations."}), 403
+    config = current_app.config
+    limit = request.args.get('limit', config.get("HISTORY_PAGE_SIZE", 50), type=int)
+    limit = max(1, min(limit, config.get("HISTORY_MAX_PAGE_SIZE", 500)))
+    order = request.args.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        return jsonify({"error": "order must be 'asc' or 'desc'."}), 400
+
+    try:
+        rows, next_cursor = page_conversations(user_id, limit, request.args.get('cursor'), order)
+    except InvalidCursor as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "user_id": user_id,
+        "conversations": [serialize(row) for row in rows],
+        "next_cursor": next_cursor,
+    })
+
+
+@main_bp.route('/users/<int:user_id>/profile', methods=['GET'])
+def user_profile(user_id):
+    """
+    Return the structured profile extracted from the user's last completed conversation,
+    to the signed-in user themselves or to an operator sending ``ADMIN_TOKEN``.
+
+    Returns:
+    --------
+    JSON response:
+        - The ConversationFlow.txt §7 profile, plus 'extractor' and 'updated_at'.
+        - 403 for another user's profile.
+        - 404 when the user has not completed a conversation yet.
+    """
+    if session.get('user_id') != user_id and not _is_admin():
+        return jsonify({"error": "Not allowed to read this user's profile."}), 403
+    profile = db.session.get(Profile, user_id)
+    if profile is None:
+        return jsonify({"error": "No profile for this user yet."}), 404
+    return jsonify({"user_id": user_id, **profile.data, "extractor": profile.extractor,
+                    "updated_at": profile.updated_at.isoformat()})
+
+
+@main_bp.route('/matches/<int:user_id>', methods=['GET'])
+def user_matches(user_id):
+    """
+    Return the users most compatible with ``user_id``, to the signed-in user
+    themselves or to an operator sending ``ADMIN_TOKEN``.
+
+    Query parameters:
+    -----------------
+    - k: Number of matches (default ``MATCH_DEFAULT_K``, capped at ``MATCH_MAX_K``).
+
+    Returns:
+    --------
+    JSON response:
+        - 'user_id': The user.
+        - 'matches': Objects with 'user_id' and 'score' (cosine similarity), best first.
+        - 403 for another user's matches.
+        - 404 when the user has not completed a conversation yet.
+    """
+    if session.get('user_id') != user_id and not _is_admin():
+        return jsonify({"error": "Not allowed to read this user's matches."}), 403
+    config = current_app.config
+    k = request.args.get('k', config.get("MATCH_DEFAULT_K", 10), type=int)
+    k = max(1, min(k, config.get("MATCH_MAX_K", 100)))
+    matches = match_engine.matches(user_id, k)
+    if matches is None:
+        return jsonify({"error": "No profile for this user yet."}), 404
+    return jsonify({
+        "user_id": user_id,
+        "matches": [{"user_id": match_id, "score": round(score, 4)} for match_id, score in matches],
+    })
+
+
+@main_bp.route('/conversations/export', methods=['GET'])
+def export_conversations():
+    """
+    Stream ConversationLog rows as NDJSON or CSV without loading them into memory.
+    Operators only: the request must send ``ADMIN_TOKEN`` as a bearer token
+    (403 otherwise, and always while no token is configured).
+
+    Query parameters:
+    -----------------
+    - format: ``ndjson`` (default) or ``csv``.
+    - user_id: Only export this user's messages.
+    - since, until: ISO timestamps bounding ``timestamp`` (inclusive, exclusive).
+    - gzip: ``1`` to gzip the body; also used when the client sends ``Accept-Encoding: gzip``.
+    """
+    if not _is_admin():
+        return jsonify({"error": "Exporting conversations needs the operator token."}), 403
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(EXPORT_FORMATS)}."}), 400
+    try:
+        since = datetime.fromisoformat(request.args['since']) if request.args.get('since') else None
+        until = datetime.fromisoformat(request.args['until']) if request.args.get('until') else None
+    except ValueError:
+        return jsonify({"error": "since and until must be ISO 8601 timestamps."}), 400
+
+    rows = iter_export(db.engine, request.args.get('user_id', type=int), since, until,
+                       current_app.config.get("HISTORY_EXPORT_BATCH_SIZE", 1000))
+    chunks = export_chunks(rows, fmt)
+    headers = {"Content-Disposition": f"attachment; filename=conversations.{fmt}"}
+    if request.args.get('gzip') == '1' or 'gzip' in request.accept_encodings:
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    return Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[fmt], headers=headers)
+
+
 @main_bp.route('/get_next_question', methods=['GET'])
 def get_next_question_route():
-    conversation_stage = session.get('conversation_stage', 0)
-    next_question = get_next_question(conversation_stage)
-    if next_question:
-        return jsonify({"question": next_question['question']})
-    return jsonify({"message": "Conversation complete."})
\ No newline at end of file
+    """
+    Return the question the caller's conversation is waiting on.
+
+    Progress lives in the state store (see ``app/state.py``). Over HTTP it can
+    only be found for a signed-in user whose conversation follows them
+    (``STATE_KEY=user``); anyone else is at the first question of the current
+    flow, which is where their next conversation starts.
+
+    Returns:
+    --------
+    JSON response:
+        - 'question': The current node's question.
+    """
+    conversation = None
+    if current_app.config.get("STATE_KEY", "sid") == "user" and session.get('user_id') is not None:
+        conversation = state_store.load(f"user:{session['user_id']}").get('conversation')
+    if conversation is not None:
+        # A conversation finishes on the flow version it started on; one whose version was evicted starts over
+        flow = flow_engine.get(conversation.flow_version)
+        if flow.version == conversation.flow_version:
+            return jsonify({"question": flow.node_at(conversation.stage).question})
+    return jsonify({"question": flow_engine.flow.start.question})
@@ -0,0 +1,346 @@
+"""
+Input limits and scrubbing of user text before it is stored or sent upstream.
+
+Every socket message and prompt goes through three checks, cheapest first:
+
+- ``admit`` rejects frames that are not text or are longer than
+  ``MESSAGE_MAX_CHARS``, before the handler loads any state or touches the
+  database (Socket.IO already drops frames above
+  ``SOCKETIO_MAX_HTTP_BUFFER_SIZE`` bytes at the transport).
+- The flow's compiled step validates the answer (see ``app/flow.py``).
+- ``scrub`` masks profanity with asterisks and replaces e-mail addresses and
+  long digit runs (phone, card and account numbers, but not dates and
+  times) with ``[email]`` and ``[number]`` in what is stored, logged and
+  sent to the model.
+
+Profanity is found with an Aho-Corasick automaton compiled once from the term
+list (``app/wordlists/profanity.txt`` plus ``SCRUB_TERMS``). Failure links are
+resolved into the transition table at compile time, so scanning is one dict
+lookup per character however many terms there are; for lists of up to a few
+hundred terms a regex search first skips to the next word that opens like a
+term, so clean text is mostly scanned at C speed. A match only counts on word boundaries, so "class" and
+"Scunthorpe" pass. E-mail addresses and numbers are
+patterns rather than fixed strings and use precompiled regexes.
+
+``check_many`` re-checks stored text in bulk; ``python -m app.sanitize scan
+[--fix]`` runs it over ConversationLog, e.g. after the term list grows, and
+with ``--fix`` scrubs the rows still in the table.
+"""
+import argparse
+import json
+import os
+import re
+from collections import deque, namedtuple
+from itertools import islice
+from types import SimpleNamespace
+
+from sqlalchemy import bindparam, update  # type: ignore
+
+DEFAULT_TERMS_PATH = os.path.join(os.path.dirname(__file__), "wordlists", "profanity.txt")
+
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+# Nine digits or more, optionally separated by spaces, dots, dashes or brackets: phones, cards, IBAN tails.
+# Each digit run (colons, slashes and a "T" included) is taken whole first; a run made up entirely of dates
+# and times (2024-01-15, 15.01.2024, 10:30:00, 2024-01-15T10:30) is left alone, any other run is masked as
+# a number, so a phone or card number that merely opens like a date or time is still caught.
+_NUMBER = re.compile(r"(?<!\w)\+?\d(?:[ ().-]{0,2}\d){8,}(?!\w)")
+_DIGIT_RUN = re.compile(r"(?<!\w)\+?\d(?:[ ().:/T-]{0,2}\d)*(?!\w)")
+_STAMP = r"(?:\d{4}-\d{1,2}-\d{1,2}|\d{1,2}[./-]\d{1,2}[./-]\d{4}|\d{1,2}:\d{2}(?::\d{2}(?:\.\d+)?)?)"
+_STAMPS = re.compile(r"%s(?:[T ]%s)*" % (_STAMP, _STAMP))
+_DIGITS = "0123456789"
+
+
+def _replace_number(match) -> str:
+    run = match.group()
+    return run if _STAMPS.fullmatch(run) else _NUMBER.sub("[number]", run)
+
+
+# Term lists with more distinct three-letter prefixes than this are scanned without the regex skip
+PREFILTER_MAX_PREFIXES = 256
+
+REJECTIONS = {
+    "type": "Messages must be text.",
+    "oversize": "Messages are limited to {max_chars} characters.",
+}
+
+# Result of ``InputSanitizer.check``: the scrubbed text and what was found ("oversize", "pii", "profanity")
+Finding = namedtuple("Finding", ["text", "reasons"])
+
+
+class TermMatcher:
+    """
+    Aho-Corasick automaton over a fixed set of terms, compiled into a DFA.
+
+    Attributes:
+    -----------
+    terms : tuple
+        The terms, lower-cased with their whitespace collapsed.
+    """
+
+    __slots__ = ("terms", "_delta", "_out", "_first")
+
+    def __init__(self, terms):
+        self.terms = tuple(dict.fromkeys(" ".join(term.lower().split()) for term in terms if term.strip()))
+        goto, out = [{}], [()]
+        for term in self.terms:
+            state = 0
+            for ch in term:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = goto[state][ch] = len(goto)
+                    goto.append({})
+                    out.append(())
+                state = nxt
+            out[state] = (len(term),)
+
+        # Breadth first, so a state's failure target is complete before the state copies its moves
+        delta = [dict(moves) for moves in goto]
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in delta[fail[state]].items():
+                delta[state].setdefault(ch, nxt)
+            for ch, nxt in goto[state].items():
+                fail[nxt] = delta[fail[state]].get(ch, 0)
+                out[nxt] = tuple(sorted(set(out[nxt] + out[fail[nxt]]), reverse=True))
+                queue.append(nxt)
+        self._delta = delta
+        self._out = out
+        # Matches start a word, so a C-speed search can skip to words opening like a term; past a few
+        # hundred alternatives the regex costs more than it saves and the automaton reads every character
+        prefixes = sorted({term[:3] for term in self.terms}, key=len, reverse=True)
+        self._first = re.compile(r"(?<![^\W_])(?:%s)" % "|".join(map(re.escape, prefixes))) \
+            if prefixes and len(prefixes) <= PREFILTER_MAX_PREFIXES else None
+
+    def spans(self, text) -> list:
+        """``(start, end)`` of each term in ``text`` on word boundaries, longest first at each end."""
+        folded = text.lower()
+        if len(folded) != len(text):
+            folded = "".join(ch.lower()[0] for ch in text)  # Keep offsets: "İ".lower() is two characters
+        delta, out = self._delta, self._out
+        size = len(folded)
+        found = []
+        end = 0
+        search = self._first.search if self._first is not None else None
+        # Jump to the next word that opens like a term and run the automaton until no partial match is left
+        while end < size:
+            if search is not None:
+                candidate = search(folded, end)
+                if candidate is None:
+                    break
+                end = candidate.start()
+            state = 0
+            while end < size:
+                state = delta[state].get(folded[end], 0)
+                end += 1
+                if out[state]:
+                    for length in out[state]:
+                        start = end - length
+                        if (start == 0 or not folded[start - 1].isalnum()) and (end == size or not folded[end].isalnum()):
+                            found.append((start, end))
+                            break
+                elif not state and search is not None:
+                    break
+        return found
+
+    def mask(self, text) -> str:
+        """``text`` with every term replaced by asterisks of the same length."""
+        spans = self.spans(text)
+        if not spans:
+            return text
+        chars = list(text)
+        for start, end in spans:
+            chars[start:end] = "*" * (end - start)
+        return "".join(chars)
+
+
+def load_terms(path) -> list:
+    """Terms from a word list file: one per line, ``#`` comments and blank lines skipped."""
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+class InputSanitizer:
+    """
+    Flask extension applying the input limits and scrubbing the text users send.
+
+    Attributes:
+    -----------
+    max_chars : int
+        Longest message or prompt accepted, in characters.
+    enabled : bool
+        Whether ``scrub`` changes anything (``admit`` always applies).
+    pii : bool
+        Replace e-mail addresses and long digit runs.
+    matcher : TermMatcher or None
+        Profanity automaton, None when the term list is empty.
+    """
+
+    def __init__(self, app=None):
+        self.max_chars = 2000
+        self.enabled = True
+        self.pii = True
+        self.matcher = None
+        self._metrics = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, metrics=None):
+        """
+        Compile the term list named by the ``SCRUB_*`` settings of the Flask app.
+
+        Parameters:
+        -----------
+        app : Flask
+            The Flask application.
+        metrics : Metrics, optional
+            Registry counting what was scrubbed, by kind.
+        """
+        config = app.config
+        self.max_chars = int(config.get("MESSAGE_MAX_CHARS", self.max_chars))
+        self.enabled = bool(config.get("SCRUB_ENABLED", self.enabled))
+        self.pii = bool(config.get("SCRUB_PII", self.pii))
+        path = config.get("SCRUB_TERMS_PATH") or DEFAULT_TERMS_PATH
+        extra = [term for term in (config.get("SCRUB_TERMS") or "").split(",") if term.strip()]
+        terms = (load_terms(path) if path != "none" else []) + extra
+        self.matcher = TermMatcher(terms) if terms else None
+        if metrics is not None:
+            self._metrics = SimpleNamespace(
+                enabled=lambda: metrics.enabled,
+                scrubbed=metrics.counter("spokesperson_scrubbed", "Messages with PII or profanity scrubbed.",
+                                         ("kind",)),
+            )
+        app.extensions["sanitizer"] = self
+
+    def admit(self, data):
+        """
+        None when ``data`` may be handled, else the reason it is rejected:
+        ``"type"`` for anything but a string, ``"oversize"`` past ``max_chars``.
+        """
+        if not isinstance(data, str):
+            return "type"
+        if len(data) > self.max_chars:
+            return "oversize"
+        return None
+
+    def rejection(self, reason) -> str:
+        """The message sent back for a frame ``admit`` rejected."""
+        return REJECTIONS[reason].format(max_chars=self.max_chars)
+
+    def scrub(self, text) -> str:
+        """``text`` with PII replaced and profanity masked; the same object when nothing was found."""
+        if not self.enabled or not text:
+            return text
+        clean, reasons = self._inspect(text)
+        if reasons:
+            m = self._metrics
+            if m is not None and m.enabled():
+                for reason in reasons:
+                    m.scrubbed.inc(reason)
+        return clean
+
+    def check(self, text) -> Finding:
+        """The scrubbed ``text`` and every problem found in it, including a length over ``max_chars``."""
+        clean, reasons = self._inspect(text) if text else (text, ())
+        if text and len(text) > self.max_chars:
+            reasons = ("oversize",) + reasons
+        return Finding(clean, reasons)
+
+    def check_many(self, texts) -> list:
+        """``check`` for a batch of stored messages, e.g. a page of ConversationLog."""
+        return [self.check(text) for text in texts]
+
+    def _inspect(self, text):
+        clean, reasons = text, ()
+        if self.pii:
+            if "@" in clean:
+                clean = _EMAIL.sub("[email]", clean)
+            if sum(map(clean.count, _DIGITS)) >= 9:  # Ten C-speed counts rule out most text before the regex
+                clean = _DIGIT_RUN.sub(_replace_number, clean)
+            if clean != text:
+                reasons = ("pii",)
+        if self.matcher is not None:
+            masked = self.matcher.mask(clean)
+            if masked is not clean:
+                clean, reasons = masked, reasons + ("profanity",)
+        return (clean if reasons else text), reasons
+
+    def scan(self, engine, fix=False, user_id=None, batch_size=500) -> dict:
+        """
+        Re-check stored messages against the current limits and term list.
+
+        Archived months are only counted; with ``fix`` the rows still in the
+        table are rewritten with their scrubbed text.
+
+        Parameters:
+        -----------
+        engine : sqlalchemy.engine.Engine
+            Engine holding ConversationLog.
+        fix : bool
+            Update flagged rows in the table.
+        user_id : int, optional
+            Only scan this user's messages.
+        batch_size : int
+            Rows checked, and updated, per batch.
+
+        Returns:
+        --------
+        dict
+            Rows scanned, counts by reason, rows fixed and flagged rows left in archives.
+        """
+        from . import log_retention
+        from .history import iter_export
+        from .models import ConversationLog
+
+        partitions = log_retention.partitions(engine)
+        archived_until = partitions[-1].ends_at if partitions else None
+        report = {"rows": 0, "oversize": 0, "pii": 0, "profanity": 0, "archived": 0, "fixed": 0}
+        fixes = []
+        rows = iter_export(engine, user_id=user_id, batch_size=batch_size)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            report["rows"] += len(batch)
+            for row, finding in zip(batch, self.check_many([row.message for row in batch])):
+                if not finding.reasons:
+                    continue
+                for reason in finding.reasons:
+                    report[reason] += 1
+                if archived_until is not None and row.timestamp < archived_until:
+                    report["archived"] += 1
+                elif fix and finding.text != row.message:
+                    fixes.append({"row_id": row.id, "message": finding.text})
+
+        # Written after the export's cursor is closed, so SQLite readers and the writer never overlap
+        table = ConversationLog.__table__
+        stmt = update(table).where(table.c.id == bindparam("row_id")).values(message=bindparam("message"))
+        for first in range(0, len(fixes), batch_size):
+            with engine.begin() as conn:
+                conn.execute(stmt, fixes[first:first + batch_size])
+        report["fixed"] = len(fixes)
+        return report
+
+
+def main(argv=None):
+    """Scan ConversationLog for oversize messages, PII and profanity; print the report as JSON."""
+    parser = argparse.ArgumentParser(description="Re-check stored messages against the input limits and scrubber.")
+    parser.add_argument("command", choices=("scan",))
+    parser.add_argument("--fix", action="store_true", help="Scrub flagged rows still in the table.")
+    parser.add_argument("--user-id", type=int, help="Only scan this user's messages.")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    from . import create_app, db
+    from config.config import get_config
+    app, _, _ = create_app(type("ScanConfig", (get_config(),), {"SQLALCHEMY_ECHO": False}))
+    with app.app_context():
+        report = app.extensions["sanitizer"].scan(db.engine, fix=args.fix, user_id=args.user_id,
+                                                  batch_size=args.batch_size)
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,21 @@
-import openai  # type: ignore
-from .models import ConversationLog
-
-CONVERSATION_FLOW = [
-    {"question": "What is your name?", "type": "text", "key": "name"},
-    {"question": "How old are you?", "type": "number", "key": "age"},
-    {"question": "What is your gender?", "type": "text", "key": "gender"},
-    {"question": "What is your favorite hobby?", "type": "text", "key": "hobby"},
-    {"question": "Would you describe yourself as more adventurous or more routine-oriented?", "type": "choice", "key": "personality", "options": ["Adventurous", "Routine-oriented"]},
-    {"question": "What kind of conversations do you enjoy? Banter or deep discussions?", "type": "choice", "key": "communication", "options": ["Banter", "Deep discussions"]},
-    {"question": "What’s something you’re passionate about?", "type": "text", "key": "passion"},
-    {"question": "Describe your ideal date. What does it look like?", "type": "text", "key": "ideal_date"}
-]
-
-def get_next_question(conversation_stage, user_data):
+from functools import lru_cache
+
+from .flow import INVALID, STEPS
+
+
+def get_next_question(conversation_stage, user_data=None):
     """
     Retrieve the next question or summary at the end of the conversation.
 
+    Follows the main path of the compiled flow (see ``app/flow.py``); branches
+    and follow-ups are only taken by the Socket.IO handlers, which track the
+    current node instead of a stage index.
+
     Parameters:
     -----------
     conversation_stage : int
-        The current stage of the conversation (index in the flow).
-    user_data : dict
+        The current stage of the conversation (index in the main path).
+    user_data : dict, optional
         Dictionary containing the user's collected responses.
 
     Returns:
@@ -28,26 +23,14 @@ def get_next_question(conversation_stage, user_data):
     dict
         The next question or a summary message.
     """
-    if conversation_stage < len(CONVERSATION_FLOW):
-        return CONVERSATION_FLOW[conversation_stage]
-    
-    # If conversation_stage exceeds the flow, provide a summary message.
-    name = user_data.get("name", "User")
-    age = user_data.get("age", "unknown")
-    gender = user_data.get("gender", "not specified")
-    hobby = user_data.get("hobby", "no particular hobby")
-    personality = user_data.get("personality", "no preference")
-    communication = user_data.get("communication", "not specified")
-    passion = user_data.get("passion", "no specific passion shared")
-    ideal_date = user_data.get("ideal_date", "not described")
-
-    summary_message = (
-        f"Nice to meet you, {name}! You are {age} years old, identify as {gender}, "
-        f"and enjoy {hobby}. You see yourself as {personality} and prefer {communication}. "
-        f"You are passionate about {passion}, and your ideal date involves {ideal_date}."
-    )
-    return {"question": summary_message, "type": "end"}
+    from . import flow_engine
+    flow = flow_engine.flow
+    path = flow.main_path()
+    if conversation_stage < len(path):
+        return path[conversation_stage].as_dict()
 
+    # If conversation_stage exceeds the flow, provide a summary message.
+    return {"question": flow.summary(user_data or {}), "type": "end"}
 
 
 def generate_facilitator_response(user_data):
@@ -70,12 +53,76 @@ def generate_facilitator_response(user_data):
     hobby = user_data.get("hobby", "no particular hobby")
 
     return f"Nice to meet you, {name}! You are {age} years old, identify as {gender}, and enjoy {hobby}."
+
+
+def template_reply(messages):
+    """
+    Reply to a chat prompt without a model, for when no LLM provider can be reached.
+
+    Like ``generate_facilitator_response`` it is a fixed template filled in from
+    what the user said: it acknowledges the last user message and asks a question
+    that keeps the conversation going.
+
+    Parameters:
+    -----------
+    messages : list
+        Chat messages in the OpenAI ``{"role", "content"}`` format.
+
+    Returns:
+    --------
+    str
+        The reply text.
+    """
+    text = next((str(m.get("content", "")) for m in reversed(messages) if m.get("role") == "user"), "")
+    words = text.split()
+    if not words:
+        return "I'm here! What would you like to talk about?"
+    if text.rstrip().endswith("?"):
+        return "Good question! I can't look into that right now, but I'd love to hear your own take on it."
+    topic = " ".join(words[:6]) + ("..." if len(words) > 6 else "")
+    return f"Thanks for sharing \"{topic}\". What do you enjoy most about it?"
+
+
+def degraded_reply(user_input, max_tokens=50):
+    """
+    A fast reply to a free-form prompt when the model is not asked: under
+    overload (see ``app/overload.py``) or when no LLM slot is free.
+
+    The completion cache is tried with the prompt the message would get as the
+    first turn of a conversation (the system prompt and the message), which is
+    how common openers were cached; otherwise the reply is ``template_reply``.
+
+    Parameters:
+    -----------
+    user_input : str
+        The user's message, already scrubbed.
+    max_tokens : int
+        ``LLM_MAX_TOKENS``, part of the cache key.
+
+    Returns:
+    --------
+    tuple
+        ``(text, source)`` where ``source`` is ``"cache"`` or ``"template"``.
+    """
+    from . import completion_cache, context_manager, llm
+    system_prompt = context_manager.system_prompt if context_manager.enabled else ""
+    messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+    messages.append({"role": "user", "content": user_input})
+    cached = completion_cache.lookup(llm.model, messages, max_tokens)
+    if cached is not None:
+        return cached, "cache"
+    return template_reply(messages), "template"
     
     
 def validate_input(input_value, input_type, options=None):
     """
     Validate the user input based on the expected input type.
 
+    Uses the same rules as the compiled flow (see ``app/flow.py``): text must
+    be non-blank and at most ``DEFAULT_MAX_LENGTH`` characters, numbers are
+    positive integers, and choices match one of ``options`` after case and
+    punctuation are normalized.
+
     Parameters:
     -----------
     input_value : str
@@ -90,14 +137,23 @@ def validate_input(input_value, input_type, options=None):
     bool
         True if input is valid, False otherwise.
     """
-    try:
-        if input_type == "text":
-            return bool(input_value.strip())
-        elif input_type == "number":
-            return input_value.isdigit() and int(input_value) > 0
-        elif input_type == "choice":
-            return input_value in options if options else False
-        else:
-            return False
-    except Exception:
+    if not isinstance(input_value, str):
         return False
+    step = _STEPS_BY_TYPE.get(input_type)
+    if step is None:
+        if input_type != "choice" or not options:
+            return False
+        if input_value in options:
+            return True
+        step = _choice_validator(tuple(options))
+    return step(input_value) is not INVALID
+
+
+# Text and number rules take no options, so their steps are built once
+_STEPS_BY_TYPE = {input_type: STEPS[input_type]({"id": input_type}) for input_type in ("text", "number")}
+
+
+@lru_cache(maxsize=256)
+def _choice_validator(options):
+    """The compiled choice step for ``options``, built once per option list."""
+    return STEPS["choice"]({"id": "choice", "options": options})
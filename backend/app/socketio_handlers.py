@@ -1,8 +1,38 @@
+import threading
 from flask import session, request  # type: ignore
-from flask_socketio import emit  # type: ignore
-from .models import ConversationLog
-from . import db
-from .services import CONVERSATION_FLOW, get_next_question, validate_input
+from flask_socketio import emit, join_room  # type: ignore
+from . import (llm, completion_cache, context_manager, flow_engine, job_queue, limiter, log_writer, message_bus, metrics,
+               overload, sanitizer, state_store)
+from .flow import INVALID
+from .llm import LLMBusyError, LLMError
+from .logs import EventLogger
+from .services import degraded_reply
+from .state import Conversation
+
+log = EventLogger(__name__)
+
+
+class ConnectionCounter:
+    """Thread-safe count of sockets connected to this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.peak = 0
+
+    def increment(self):
+        with self._lock:
+            self.count += 1
+            self.peak = max(self.peak, self.count)
+
+    def decrement(self):
+        with self._lock:
+            self.count = max(0, self.count - 1)
+
+
+# Live socket connections handled by this worker process
+active_connections = ConnectionCounter()
+
 
 def register_socket_handlers(socketio, app):
     """
@@ -10,87 +40,307 @@ def register_socket_handlers(socketio, app):
     """
 
     @socketio.on('connect')
-    def handle_connect():
-        """Handles a new WebSocket client connection."""
-        app.logger.info("Client connected via WebSocket")
+    def handle_connect(auth=None):
+        """
+        Handles a new WebSocket client connection.
+
+        A signed-in socket joins its user's room (``user:<id>``). When
+        conversations follow the user (``STATE_KEY=user``), replies the client
+        has not acknowledged are sent again after the current question; a
+        client can pass the last id it has as ``auth={'last_id': ...}``.
+        Anonymous sockets keep their conversation to themselves.
+        """
+        log.debug("socket.connected", sid=request.sid)
+        active_connections.increment()
 
-        # Initialize user_id, conversation_stage, and user_data in the session
-        if request and 'user_id' not in session:
-            session['user_id'] = 1
-        if 'conversation_stage' not in session:
-            session['conversation_stage'] = 0
-        if 'user_data' not in session:
-            session['user_data'] = {}
+        # The user id comes from the HTTP session; conversation progress lives in the state store
+        if session.get('user_id') is not None:
+            join_room(f"user:{session['user_id']}")
+        with state_store.conversation(_state_key()) as state:
+            conversation, flow = _conversation(state, _log_user_id())
 
-        user_data = session['user_data']  # Use this for storing user responses
+            # Send welcome message and the current question
+            emit('response', {'id': '0', 'message': flow.greeting})
+            emit('response', {'id': '0', 'message': flow.node_at(conversation.stage).question})
+        if _follows_user():
+            last_id = auth.get('last_id') if isinstance(auth, dict) else None
+            message_bus.replay(_room(), after=int(last_id) if str(last_id).isdigit() else None, to=request.sid)
 
-        # Send welcome message and the first question
-        emit('response', {'id': '0', 'message': 'Welcome! You are now connected to the server.'})
-        first_question = get_next_question(session['conversation_stage'], user_data)
-        emit('response', {'id': '0', 'message': first_question['question']})
+    @socketio.on('ack')
+    def handle_ack(data):
+        """Records that the client has shown every reply up to ``data['id']``."""
+        message_id = data.get('id') if isinstance(data, dict) else data
+        if _follows_user() and str(message_id).isdigit():
+            message_bus.ack(_room(), int(message_id))
 
     @socketio.on('message')
+    @limiter.limit_event('message', "60 per minute burst 20")
+    @overload.guard_event('message', 'critical')  # Flow steps are the last work shed under overload
     def handle_message(data):
         """
         Handles incoming messages from WebSocket clients.
+
+        Each stage (session I/O, validation, the database write, the next-question
+        lookup and the emit) is timed into ``spokesperson_event_stage_seconds``.
         """
-        user_id = session.get('user_id', 1)
-        conversation_stage = session.get('conversation_stage', 0)
-        user_data = session.get('user_data', {})
-        new_message = None
+        timer = metrics.timer("message")
+        # Oversize and non-text frames are turned away before any session or database work
+        rejected = sanitizer.admit(data)
+        if rejected is not None:
+            metrics.invalid(rejected)
+            emit('response', {'id': '0', 'message': sanitizer.rejection(rejected)})
+            timer.finish("invalid")
+            return
+        state = state_store.load(_state_key())
+        timer.mark("session_io")
+        conversation, flow = _conversation(state, _log_user_id())
+        user_id = conversation.user_id
+        message_id = None
+        node = None
+        outcome = "ok"
 
         try:
-            app.logger.info(f"Message received from user {user_id}: {data}")
-
-            # Save user response in user_data based on the current stage
-            if conversation_stage < len(CONVERSATION_FLOW):
-                question_data = CONVERSATION_FLOW[conversation_stage]
-                input_type = question_data["type"]
-                key = question_data["key"]
-                options = question_data.get("options", None)
-
-                # Validate input
-                if not validate_input(data, input_type, options):
-                    emit('response', {'id': '0', 'message': f"Invalid input for {question_data['question']}."})
-                    return
-
-                # Save valid data
-                user_data[key] = data
-                session['user_data'] = user_data  # Update session data
-                app.logger.info(f"Updated user_data: {user_data}")
-
-            # Log the message in the database
-            new_message = ConversationLog(user_id=user_id, message=data)
-            db.session.add(new_message)
-            db.session.commit()
-            app.logger.info(f"Message {new_message.id} saved to the database.")
-
-            # Move to the next stage and fetch the next question
-            session['conversation_stage'] += 1
-            next_question = get_next_question(session['conversation_stage'], user_data)
-
-            # Check if we are at the end of the conversation
-            if next_question["type"] == "end":
-                emit('response', {'id': str(new_message.id), 'message': next_question["question"]})
-                # Reset the session for a new conversation
-                session['conversation_stage'] = 0
-                session['user_data'] = {}
+            # Dispatch on the compiled node; conversations finish on the flow version they started with
+            node = flow.node_at(conversation.stage)
+            data = sanitizer.scrub(data)  # Answers, logs and prompts built from them never hold PII or profanity
+            result = node.step(data)
+            timer.mark("validate")
+            if result is INVALID:
+                outcome = "invalid"
+                metrics.invalid(node.id)
+                emit('response', {'id': '0', 'message': flow.invalid_message(node)})
+                timer.mark("emit")
+                return
+            value, next_id = result
+
+            # Save valid data
+            conversation.answer(flow.slots[node.key], value, choice=node.type == "choice")
+            state['conversation'] = conversation  # Marked dirty, written once after the event
+
+            # Queue the message for the database; the id is final before the row is written
+            message_id = log_writer.log(user_id, data)
+            timer.mark("db")
+
+            # Follow the node's transition table to the next question
+            next_node = flow.nodes.get(next_id)
+            if next_node is None:
+                # Extraction runs as a job; the profile is pushed to this socket as a 'profile' event.
+                # Anonymous answers are logged under the demo user, so they get the summary but no profile.
+                # The key is this completion's last message, so finishing again with earlier answers re-runs
+                # extraction (answer sets already extracted are served from the extractor's cache).
+                user_data = conversation.user_data(flow.keys)
+                if session.get('user_id') is not None:
+                    job_queue.enqueue("profiles.extract", {"user_id": user_id, "answers": user_data},
+                                      key=f"profile:{user_id}:{message_id}", room=_room())
+                reply = flow.summary(user_data)
+                # Reset the state for a new conversation on the current flow
+                _start_conversation(state, flow_engine.flow, user_id)
             else:
-                emit('response', {'id': str(new_message.id), 'message': next_question["question"]})
+                conversation.stage = flow.positions[next_node.id]
+                reply = next_node.question
+            timer.mark("lookup")
+            _reply(reply, message_id)
+            timer.mark("emit")
 
         except Exception as e:
-            app.logger.error(f"Error handling message for user {user_id}: {str(e)}")
+            outcome = "error"
+            metrics.error("socket.message")
+            log.error("message.failed", user_id=user_id, node=getattr(node, "id", None), error=str(e))
             emit('response', {'id': '0', 'message': f"An error occurred: {str(e)}"})
+            timer.skip()
 
         finally:
-            # Ensure consistent state and logging
-            if new_message:
-                app.logger.info(f"Completed handling of message {new_message.id} for user {user_id}.")
-            else:
-                app.logger.warning(f"No message object was created during handling for user {user_id}.")
-            app.logger.info(f"Final user_data state for user {user_id}: {session.get('user_data', {})}")
+            # Persist the fields changed by this event in one write
+            state_store.save(state)
+            timer.mark("session_io")
+            elapsed = timer.finish(outcome)
+            log.info("message.handled", user_id=user_id, message_id=message_id, node=getattr(node, "id", None),
+                     outcome=outcome, ms=round(elapsed * 1000, 3))
+
+    @socketio.on('generate')
+    @limiter.limit_event('generate', "10 per minute burst 5")
+    def handle_generate(data):
+        """
+        Streams a free-form LLM completion back to the client.
+
+        Tokens are emitted as 'response' events flagged with ``partial: True`` as soon
+        as the model produces them, followed by one final 'response' event carrying the
+        complete text. The upstream call runs in a background task so the handler
+        returns immediately; its slot of the concurrency limit is held until the
+        completion ends. Under overload the prompt is shed and answered at once
+        with a cached or templated reply flagged ``degraded: True``.
+        """
+        timer = metrics.timer("generate")
+        user_input = data.get('user_input') if isinstance(data, dict) else data
+        if not user_input or not str(user_input).strip():
+            metrics.invalid("generate")
+            emit('response', {'id': '0', 'message': "No user input provided."})
+            timer.finish("invalid")
+            return
+        rejected = sanitizer.admit(user_input)
+        if rejected is not None:
+            metrics.invalid(rejected)
+            emit('response', {'id': '0', 'message': sanitizer.rejection(rejected)})
+            timer.finish("invalid")
+            return
+        user_input = sanitizer.scrub(user_input)
+        timer.mark("validate")
+        ticket = overload.acquire("low", "socket.generate")
+        if ticket is None:
+            text, _ = degraded_reply(user_input, app.config.get("LLM_MAX_TOKENS", 50))
+            emit('response', {'id': '0', 'message': text, 'degraded': True})
+            timer.finish("shed")
+            return
+        try:
+            conversation = state_store.load(_state_key()).get('conversation')
+            user_id = conversation.user_id if conversation is not None else _log_user_id()
+            timer.mark("session_io")
+
+            message_id = log_writer.log(user_id, user_input, kind="prompt")
+            timer.mark("db")
+            # History is kept per socket, and loaded from ConversationLog only for a signed-in user
+            context_key = _state_key()
+            window = context_manager.build(context_key, session.get('user_id'), user_input, message_id)
+            timer.mark("context")
+
+            socketio.start_background_task(
+                _stream_completion, socketio, app, request.sid, str(message_id), window, context_key, _room(), ticket
+            )
+        except Exception:
+            ticket.release(dropped=True)
+            raise
+        timer.finish()
 
     @socketio.on('disconnect')
     def handle_disconnect():
         """Handles a WebSocket client disconnection."""
-        app.logger.info("Client disconnected from WebSocket")
+        log.debug("socket.disconnected", sid=request.sid)
+        active_connections.decrement()
+        if not _follows_user():
+            state_store.delete(_state_key())
+            context_manager.forget(_state_key())
+
+    def _start_conversation(state, flow, user_id):
+        """Point ``state`` at the first question of ``flow`` with no answers."""
+        conversation = Conversation(user_id, flow.version, len(flow.keys), flow.positions[flow.start.id])
+        state['conversation'] = conversation
+        return conversation
+
+    def _conversation(state, user_id):
+        """
+        The conversation in ``state`` and the flow version it runs on, starting
+        one on the current flow if there is none. Stages and answer slots are
+        positions in a particular flow version, so a conversation whose version
+        has been evicted starts over rather than being read against another layout.
+        """
+        conversation = state.get('conversation')
+        if conversation is not None:
+            flow = flow_engine.get(conversation.flow_version)
+            if flow.version == conversation.flow_version:
+                return conversation, flow
+            user_id = conversation.user_id
+        flow = flow_engine.flow
+        return _start_conversation(state, flow, user_id), flow
+
+    def _log_user_id():
+        """User the connection's messages are logged under: the signed-in user, else user 1 (for demo purposes)."""
+        user_id = session.get('user_id')
+        return user_id if user_id is not None else 1
+
+    def _follows_user():
+        """
+        Whether the conversation follows a signed-in user across sockets rather
+        than living and dying with one. Anonymous sockets never share a user.
+        """
+        return app.config.get("STATE_KEY", "sid") == "user" and session.get('user_id') is not None
+
+    def _room():
+        """Room that replies and pushes for the current conversation go to."""
+        return f"user:{session['user_id']}" if _follows_user() else request.sid
+
+    def _reply(message, message_id):
+        """
+        Answer the current socket. A conversation that follows the user is
+        answered through the bus, so the reply reaches every socket of the
+        user on any worker and is replayed to one that missed it.
+        """
+        payload = {'id': str(message_id), 'message': message}
+        if _follows_user():
+            message_bus.publish(_room(), 'response', payload, message_id=message_id)
+        else:
+            emit('response', payload)
+
+    def _state_key():
+        """Key of the current connection's conversation state (socket sid or user id)."""
+        if _follows_user():
+            return f"user:{session['user_id']}"
+        return f"sid:{request.sid}"
+
+
+def _stream_completion(socketio, app, sid, message_id, window, context_key, room=None, ticket=None):
+    """
+    Relays a streaming completion to a single client as 'response' events.
+
+    The final event carries the prompt metrics of ``window`` under 'context'
+    and is published on the bus to ``room``, so it still arrives (or is
+    replayed) if the client reconnected while the completion was running.
+
+    Parameters:
+    -----------
+    socketio : SocketIO
+        The server used to emit outside of the request context.
+    app : Flask
+        The application, used for configuration and logging.
+    sid : str
+        Socket.IO session id of the requesting client.
+    message_id : str
+        ConversationLog id the streamed reply belongs to.
+    window : ContextWindow
+        The assembled prompt (see ``app/context.py``).
+    context_key : str
+        Session the reply is recorded under for later prompts.
+    room : str, optional
+        Room the final reply is published to (default: ``sid``).
+    ticket : Ticket, optional
+        Slot of the concurrency limit (see ``app/overload.py``), released when the completion ends.
+    """
+    messages = window.messages
+    max_tokens = app.config.get("LLM_MAX_TOKENS", 50)
+    tokens = []
+    dropped = False
+    timer = metrics.timer("llm_stream")
+    try:
+        stream = completion_cache.stream_through(
+            llm.model, messages, max_tokens, lambda: llm.stream(messages, max_tokens=max_tokens)
+        )
+        for token in stream:
+            if not tokens:
+                timer.mark("llm_first_token")
+            tokens.append(token)
+            socketio.emit('response', {'id': message_id, 'message': token, 'partial': True}, to=sid)
+        timer.mark("llm")
+        reply = "".join(tokens).strip()
+        context_manager.record_reply(context_key, reply)
+        message_bus.publish(room or sid, 'response', {'id': message_id, 'message': reply, 'context': window.metrics()},
+                            message_id=int(message_id))
+        timer.mark("emit")
+        timer.finish()
+    except LLMBusyError as e:
+        # No LLM slot is free: answer without the model rather than with an error
+        metrics.error("llm")
+        timer.finish("error")
+        dropped = True
+        if overload.degrade and not tokens:
+            text, _ = degraded_reply(messages[-1]["content"], max_tokens)
+            socketio.emit('response', {'id': message_id, 'message': text, 'degraded': True}, to=sid)
+        else:
+            socketio.emit('response', {'id': '0', 'message': f"An error occurred: {str(e)}"}, to=sid)
+    except LLMError as e:
+        metrics.error("llm")
+        timer.finish("error")
+        dropped = True
+        log.error("completion.failed", message_id=message_id, error=str(e))
+        socketio.emit('response', {'id': '0', 'message': f"An error occurred: {str(e)}"}, to=sid)
+    finally:
+        if ticket is not None:
+            ticket.release(dropped)
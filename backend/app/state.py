@@ -0,0 +1,465 @@
+"""
+Conversation state store for Socket.IO connections.
+
+Per-connection conversation state (``user_id``, ``conversation_stage`` and
+``user_data``) used to live in the Flask session, which the filesystem session
+backend pickled to a file under ``flask_session/`` on every write. The
+``StateStore`` extension keeps it in a pluggable backend instead:
+
+- ``memory``: a dict in the worker process (the default, single node).
+- ``sqlite``: one row per field in a WAL-mode SQLite file shared by every
+  worker on the host.
+- ``redis``: one hash per conversation on a Redis server, or on the
+  in-process ``local://`` stand-in from ``app.localredis``.
+
+Handlers load the state once per event and save it once at the end, and only
+fields assigned during the event are written. Idle state expires after
+``STATE_TTL`` seconds and a background sweeper removes it.
+
+The conversation itself is one ``Conversation`` record per connection: a
+``__slots__`` object with the current node and an answer array laid out by the
+flow, rather than a dict of fields and a growing ``user_data`` dict. The
+memory backend keeps the object; the SQLite and Redis backends store it in the
+struct-packed binary form produced by ``Conversation.pack``.
+"""
+import json
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from .localredis import connect as redis_connect
+from .utils import run_blocking, thread_connection
+
+
+class ConversationState:
+    """
+    Mutable view of one conversation's fields that records which ones changed.
+
+    Assigning a field marks it dirty; mutating a nested value in place does not,
+    so reassign it (``state['conversation'] = conversation``) to have it saved.
+    """
+
+    def __init__(self, key, fields=None):
+        self.key = key
+        self._fields = dict(fields or {})
+        self.dirty = set()
+
+    def get(self, field, default=None):
+        return self._fields.get(field, default)
+
+    def setdefault(self, field, default):
+        if field not in self._fields:
+            self[field] = default
+        return self._fields[field]
+
+    def to_dict(self) -> dict:
+        return dict(self._fields)
+
+    def __getitem__(self, field):
+        return self._fields[field]
+
+    def __setitem__(self, field, value):
+        self._fields[field] = value
+        self.dirty.add(field)
+
+    def __contains__(self, field):
+        return field in self._fields
+
+
+class Conversation:
+    """
+    Compact state of one conversation on one flow version.
+
+    Attributes:
+    -----------
+    user_id : int
+        Owner of the conversation.
+    flow_version : str
+        Version of the flow the conversation started on (interned, so every
+        conversation on a version shares one string).
+    stage : int
+        Position of the current node in the flow (``CompiledFlow.positions``).
+    answers : list
+        One slot per answer key of the flow (``CompiledFlow.slots``), None
+        until answered. Choice answers are interned strings shared by every
+        conversation that gave the same answer.
+    choices : int
+        Bit mask of the slots holding choice answers.
+    """
+
+    __slots__ = ("user_id", "flow_version", "stage", "answers", "choices")
+
+    # Binary layout: marker, format, user id, stage, slot count, version length,
+    # then the version and per slot a tag byte and, unless empty, a varint length
+    # and the UTF-8 answer. The marker byte never starts JSON, so packed and JSON
+    # values can share a column.
+    MARKER = b"\xc1"
+    FORMAT = 1
+    _header = struct.Struct("<cBqHHB")
+    _EMPTY, _TEXT, _CHOICE = 0, 1, 2
+
+    def __init__(self, user_id, flow_version, slots, stage=0):
+        self.user_id = user_id
+        self.flow_version = sys.intern(flow_version)
+        self.stage = stage
+        self.answers = [None] * slots
+        self.choices = 0
+
+    def answer(self, slot, value, choice=False):
+        """Store ``value`` in ``slot``; a choice is interned rather than kept as its own copy."""
+        if slot >= len(self.answers):
+            self.answers.extend([None] * (slot + 1 - len(self.answers)))
+        if choice:
+            self.answers[slot] = sys.intern(value)
+            self.choices |= 1 << slot
+        else:
+            self.answers[slot] = value
+            self.choices &= ~(1 << slot)
+
+    def user_data(self, keys) -> dict:
+        """The answers as a ``{key: value}`` dict, given the flow's ``keys``."""
+        return {key: value for key, value in zip(keys, self.answers) if value is not None}
+
+    def pack(self) -> bytes:
+        """Serialize to the binary form read back by ``unpack``."""
+        version = self.flow_version.encode()
+        out = bytearray(self._header.pack(self.MARKER, self.FORMAT, self.user_id, self.stage, len(self.answers),
+                                          len(version)))
+        out += version
+        choices = self.choices
+        for slot, value in enumerate(self.answers):
+            if value is None:
+                out.append(self._EMPTY)
+                continue
+            data = value.encode()
+            length = len(data)
+            out.append(self._CHOICE if choices >> slot & 1 else self._TEXT)
+            while length >= 0x80:
+                out.append(length & 0x7F | 0x80)
+                length >>= 7
+            out.append(length)
+            out += data
+        return bytes(out)
+
+    @classmethod
+    def unpack(cls, data):
+        """
+        Rebuild a conversation from ``pack`` output.
+
+        Raises:
+        -------
+        ValueError
+            If ``data`` is not a packed conversation of a known format.
+        """
+        data = bytes(data)
+        try:
+            marker, fmt, user_id, stage, slots, version_length = cls._header.unpack_from(data)
+        except struct.error as e:
+            raise ValueError(f"Truncated conversation state: {e}") from None
+        if marker != cls.MARKER or fmt != cls.FORMAT:
+            raise ValueError("Not a packed conversation state.")
+        try:
+            return cls._unpack_answers(data, user_id, stage, slots, version_length)
+        except IndexError:
+            raise ValueError("Truncated conversation state.") from None
+
+    @classmethod
+    def _unpack_answers(cls, data, user_id, stage, slots, version_length):
+        offset = cls._header.size
+        conversation = cls(user_id, data[offset:offset + version_length].decode(), slots, stage)
+        offset += version_length
+        answers, choices = conversation.answers, 0
+        for slot in range(slots):
+            tag = data[offset]
+            offset += 1
+            if tag == cls._EMPTY:
+                continue
+            length = data[offset]
+            offset += 1
+            if length >= 0x80:
+                length, shift = length & 0x7F, 7
+                while True:
+                    byte = data[offset]
+                    offset += 1
+                    length |= (byte & 0x7F) << shift
+                    shift += 7
+                    if byte < 0x80:
+                        break
+            end = offset + length
+            if end > len(data):
+                raise IndexError(slot)
+            value = data[offset:end].decode()
+            if tag == cls._CHOICE:
+                value = sys.intern(value)
+                choices |= 1 << slot
+            answers[slot] = value
+            offset = end
+        conversation.choices = choices
+        return conversation
+
+    def __eq__(self, other):
+        return isinstance(other, Conversation) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return f"Conversation(user_id={self.user_id!r}, flow_version={self.flow_version!r}, stage={self.stage})"
+
+
+def _encode(value):
+    return value.pack() if isinstance(value, Conversation) else json.dumps(value)
+
+
+def _decode(raw):
+    if isinstance(raw, (bytes, memoryview)) and bytes(raw[:1]) == Conversation.MARKER:
+        return Conversation.unpack(raw)
+    return json.loads(raw)
+
+
+class MemoryStateBackend:
+    """Process-local dict of conversation fields with expiry timestamps."""
+
+    blocking = False
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def load(self, key) -> dict:
+        with self._lock:
+            if self._expires.get(key, 0) <= time.time():
+                return {}
+            return dict(self._data.get(key, {}))
+
+    def save(self, key, fields, ttl):
+        with self._lock:
+            self._data.setdefault(key, {}).update(fields)
+            self._expires[key] = time.time() + ttl
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+
+    def sweep(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [key for key, expires_at in self._expires.items() if expires_at <= now]
+            for key in expired:
+                self._data.pop(key, None)
+                del self._expires[key]
+        return len(expired)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteStateBackend:
+    """
+    Conversation fields stored as rows of a WAL-mode SQLite table.
+
+    Attributes:
+    -----------
+    path : str
+        Location of the SQLite database file shared by the workers.
+    """
+
+    blocking = True
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversation_state ("
+            "key TEXT NOT NULL, field TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL, "
+            "PRIMARY KEY (key, field))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_conversation_state_expires ON conversation_state (expires_at)")
+
+    def _conn(self):
+        # One connection per native thread (and process); sqlite3 connections are not shareable
+        return thread_connection(self._local, self._connect)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def load(self, key) -> dict:
+        rows = self._conn().execute(
+            "SELECT field, value FROM conversation_state WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchall()
+        return {field: _decode(value) for field, value in rows}
+
+    def save(self, key, fields, ttl):
+        expires_at = time.time() + ttl
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN")
+            if fields:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO conversation_state (key, field, value, expires_at) VALUES (?, ?, ?, ?)",
+                    [(key, field, _encode(value), expires_at) for field, value in fields.items()],
+                )
+            # Touch the untouched fields so the whole conversation shares one expiry
+            conn.execute("UPDATE conversation_state SET expires_at = ? WHERE key = ?", (expires_at, key))
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM conversation_state WHERE key = ?", (key,))
+
+    def sweep(self) -> int:
+        return self._conn().execute("DELETE FROM conversation_state WHERE expires_at <= ?", (time.time(),)).rowcount
+
+
+class RedisStateBackend:
+    """
+    One Redis hash per conversation, expired by Redis itself.
+
+    Attributes:
+    -----------
+    client : redis.Redis or LocalRedis
+        Client returned by ``app.localredis.connect``.
+    prefix : str
+        Namespace prepended to every key.
+    """
+
+    blocking = False
+
+    def __init__(self, client, prefix="conversation:"):
+        self.client = client
+        self.prefix = prefix
+
+    def load(self, key) -> dict:
+        raw = self.client.hgetall(self.prefix + key)
+        return {_text(field): _decode(value) for field, value in raw.items()}
+
+    def save(self, key, fields, ttl):
+        pipe = self.client.pipeline()
+        if fields:
+            pipe.hset(self.prefix + key, mapping={field: _encode(value) for field, value in fields.items()})
+        pipe.expire(self.prefix + key, int(ttl))
+        pipe.execute()
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def sweep(self) -> int:
+        return 0  # Redis expires keys on its own
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class StateStore:
+    """
+    Flask extension holding per-connection conversation state.
+
+    Attributes:
+    -----------
+    backend : object
+        One of the ``*StateBackend`` classes above.
+    ttl : float
+        Seconds of inactivity after which a conversation's state expires.
+    sweep_interval : float
+        Seconds between background sweeps of expired state.
+    """
+
+    def __init__(self, app=None):
+        self.backend = MemoryStateBackend()
+        self.ttl = 3600.0
+        self.sweep_interval = 60.0
+        self._sweeper = None
+        self._sweeper_lock = threading.Lock()
+        self._stopping = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Configure the store from the ``STATE_*`` settings of the Flask app.
+
+        Parameters:
+        -----------
+        app : Flask
+            The Flask application.
+        """
+        config = app.config
+        self.stop()
+        self.ttl = float(config.get("STATE_TTL", self.ttl))
+        self.sweep_interval = float(config.get("STATE_SWEEP_INTERVAL", self.sweep_interval))
+        backend = config.get("STATE_BACKEND", "memory")
+        if backend == "sqlite":
+            self.backend = SQLiteStateBackend(config.get("STATE_SQLITE_PATH", "conversation_state.db"))
+        elif backend == "redis":
+            self.backend = RedisStateBackend(redis_connect(config.get("STATE_REDIS_URL", "local://state")))
+        else:
+            self.backend = MemoryStateBackend()
+        app.extensions["state_store"] = self
+
+    def load(self, key) -> ConversationState:
+        """Fetch the live state for ``key`` (empty if missing or expired)."""
+        self._ensure_sweeper()
+        return ConversationState(key, self._call(self.backend.load, key))
+
+    def save(self, state):
+        """Write the dirty fields of ``state`` and refresh its expiry."""
+        fields = {field: state.get(field) for field in state.dirty}
+        self._call(self.backend.save, state.key, fields, self.ttl)
+        state.dirty.clear()
+
+    def delete(self, key):
+        """Forget the state for ``key``."""
+        self._call(self.backend.delete, key)
+
+    def sweep(self) -> int:
+        """Remove expired state now and return how many entries were dropped."""
+        return self._call(self.backend.sweep)
+
+    @contextmanager
+    def conversation(self, key):
+        """
+        Load the state for ``key`` and save its dirty fields when the block exits.
+
+        Fields changed before an exception are still saved, matching how the
+        Flask session behaved when a handler failed half-way.
+        """
+        state = self.load(key)
+        try:
+            yield state
+        finally:
+            if state.dirty:
+                self.save(state)
+            else:
+                self._call(self.backend.save, key, {}, self.ttl)
+
+    def stop(self):
+        """Stop the background sweeper."""
+        sweeper, self._sweeper = self._sweeper, None
+        if sweeper is not None:
+            self._stopping.set()
+            sweeper.join()
+            self._stopping.clear()
+
+    def _call(self, method, *args):
+        return run_blocking(method, *args) if self.backend.blocking else method(*args)
+
+    def _ensure_sweeper(self):
+        if self._sweeper is not None or self.sweep_interval <= 0:
+            return
+        with self._sweeper_lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep_loop, name="state-sweeper", daemon=True)
+                self._sweeper.start()
+
+    def _sweep_loop(self):
+        while not self._stopping.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception:
+                pass  # A failed sweep is retried on the next interval
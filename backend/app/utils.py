@@ -1 +1,92 @@
-# empty for now
\ No newline at end of file
+"""
+Utility functions shared by the route and Socket.IO handlers.
+"""
+import importlib.util
+import os
+import sys
+
+
+def lazy_import(name):
+    """
+    Return module ``name`` without executing it until an attribute is first used.
+
+    For heavy dependencies (numpy) of code that most processes never call, so
+    importing the package stays cheap for scripts, tests and worker start-up.
+
+    Parameters:
+    -----------
+    name : str
+        Absolute module name.
+
+    Returns:
+    --------
+    module
+        The module, already imported or loading on first attribute access.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def thread_connection(local, connect):
+    """
+    The connection cached on ``local`` for the calling thread, opened with ``connect()`` if missing.
+
+    A process forked after the connection was opened (see ``prefork.py``) gets
+    a new one: SQLite connections must not be used on both sides of a fork.
+
+    Parameters:
+    -----------
+    local : threading.local
+        Holder of the per-thread connection.
+    connect : callable
+        Opens a new connection.
+    """
+    conn = getattr(local, "conn", None)
+    if conn is None or local.pid != os.getpid():
+        conn = local.conn = connect()
+        local.pid = os.getpid()
+    return conn
+
+
+def run_blocking(func, *args, **kwargs):
+    """
+    Run a blocking call without stalling the Socket.IO event loop.
+
+    Under the eventlet or gevent workers, C-level blocking calls (sqlite3,
+    file I/O) would freeze every connection served by the process, so they are
+    handed to the worker's native thread pool and the calling greenlet yields
+    until the result is ready. In threading mode the call runs inline.
+
+    ``func`` runs on a native thread, so it should stick to plain I/O: it must
+    not emit Socket.IO events or block on green-thread primitives.
+
+    Parameters:
+    -----------
+    func : callable
+        The blocking function to run.
+    *args, **kwargs
+        Arguments forwarded to ``func``.
+
+    Returns:
+    --------
+    Any
+        Whatever ``func`` returns; exceptions propagate to the caller.
+    """
+    from . import socketio
+
+    async_mode = getattr(socketio, "async_mode", None)
+    if async_mode == "eventlet":
+        from eventlet import tpool  # type: ignore
+        return tpool.execute(func, *args, **kwargs)
+    if async_mode == "gevent":
+        import gevent  # type: ignore
+        return gevent.get_hub().threadpool.apply(func, args, kwargs)
+    return func(*args, **kwargs)
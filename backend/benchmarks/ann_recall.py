@@ -0,0 +1,119 @@
+"""
+Recall versus latency of the IVF index against exact search.
+
+Builds N synthetic profile vectors (see match_scoring.py), writes them as an
+``AnnIndex`` generation and, for each ``nprobe``, reports recall@k against the
+brute-force ``MatchIndex`` and per-query p50/p99 latency. Also reports the
+build time, the time to open the memory-mapped index and the cost of
+incremental inserts. BLAS is pinned to one thread.
+
+Example:
+    python benchmarks/ann_recall.py --profiles 1000000 --nprobe 1 4 8 16 32 64
+"""
+import os
+
+# Must be set before NumPy loads its BLAS
+for _var in ("OPENBLAS_NUM_THREADS", "OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(_var, "1")
+
+import argparse  # noqa: E402
+import json  # noqa: E402
+import random  # noqa: E402
+import sys  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+
+# Ensure that the application modules can be imported
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.ann import AnnIndex, write_generation  # noqa: E402
+from app.matching import ProfileEncoder  # noqa: E402
+from match_scoring import build_index, percentile, synthetic_answers  # noqa: E402
+
+
+def timed_queries(search, queries):
+    latencies, results = [], []
+    for user_id, query in queries:
+        start = time.perf_counter()
+        results.append(search(query, user_id))
+        latencies.append(time.perf_counter() - start)
+    return results, latencies
+
+
+def run(args) -> dict:
+    encoder = ProfileEncoder(args.buckets)
+    exact, _ = build_index(args, encoder)
+    rng = random.Random(args.seed + 1)
+    queries = [(user_id, exact.vector(user_id)) for user_id in
+               (rng.randrange(args.profiles) for _ in range(args.queries))]
+    truth, exact_latency = timed_queries(lambda q, u: exact.top_k(q, args.k, (u,)), queries)
+    truth = [{user_id for user_id, _ in result} for result in truth]
+    report = {
+        "profiles": args.profiles,
+        "exact": {"p50_ms": round(percentile(exact_latency, 50) * 1000, 2),
+                  "p99_ms": round(percentile(exact_latency, 99) * 1000, 2)},
+    }
+
+    with tempfile.TemporaryDirectory() as path:
+        ids, vectors = exact.snapshot()
+        del exact
+        start = time.perf_counter()
+        write_generation(path, ids, vectors, nlist=args.nlist)
+        report["build_s"] = round(time.perf_counter() - start, 2)
+        del ids, vectors
+
+        start = time.perf_counter()
+        index = AnnIndex(path, encoder.dim)
+        report["open_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        report["nlist"] = index.meta["nlist"]
+
+        report["ivf"] = {}
+        for nprobe in args.nprobe:
+            results, latency = timed_queries(lambda q, u: index.top_k(q, args.k, (u,), nprobe=nprobe), queries)
+            hits = sum(len(expected & {user_id for user_id, _ in result}) for expected, result in zip(truth, results))
+            report["ivf"][nprobe] = {
+                "recall": round(hits / (args.k * len(queries)), 4),
+                "p50_ms": round(percentile(latency, 50) * 1000, 2),
+                "p99_ms": round(percentile(latency, 99) * 1000, 2),
+            }
+
+        answers = [synthetic_answers(rng) for _ in range(args.inserts)]
+        start = time.perf_counter()
+        for i, item in enumerate(answers):
+            index.upsert(args.profiles + i, encoder.encode(item))
+        report["insert_us"] = round((time.perf_counter() - start) / len(answers) * 1e6, 1)
+        _, latency = timed_queries(lambda q, u: index.top_k(q, args.k, (u,)), queries)
+        report["p50_ms_with_delta"] = round(percentile(latency, 50) * 1000, 2)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="IVF recall and latency versus exact search.")
+    parser.add_argument("--profiles", type=int, default=1_000_000)
+    parser.add_argument("--distinct", type=int, default=20_000, help="Distinct answer sets encoded.")
+    parser.add_argument("--buckets", type=int, default=16, help="Hashed bag-of-words width per text block.")
+    parser.add_argument("--nlist", type=int, help="IVF clusters (default: about sqrt(N)).")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--inserts", type=int, default=5000, help="Vectors added to the delta afterwards.")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON report.")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return report
+    print(f"profiles {report['profiles']}, nlist {report['nlist']}, build {report['build_s']}s, "
+          f"open {report['open_ms']}ms, insert {report['insert_us']}us")
+    print(f"{'search':<12}{'recall':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    print(f"{'exact':<12}{1.0:>8}{report['exact']['p50_ms']:>10}{report['exact']['p99_ms']:>10}")
+    for nprobe, stats in report["ivf"].items():
+        print(f"{'nprobe=' + str(nprobe):<12}{stats['recall']:>8}{stats['p50_ms']:>10}{stats['p99_ms']:>10}")
+    print(f"p50 with {args.inserts} pending inserts: {report['p50_ms_with_delta']} ms")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Fan-out throughput of the message bus between worker processes.
+
+Starts ``--workers`` listener processes on a shared SQLite bus log, then
+publishes ``--messages`` messages from this process in ``publish_many``
+batches of ``--batch`` (or one ``publish`` at a time with ``--batch 1``).
+Every listener counts what it receives; the report gives the time until the
+slowest listener has everything, the resulting messages per second, and the
+delivery latency (publish to receipt) percentiles seen by the listeners.
+
+Example:
+    python benchmarks/bus_fanout.py --workers 4 --messages 20000 --batch 100
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Ensure that the application modules can be imported
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask  # type: ignore # noqa: E402
+from app.bus import MessageBus  # noqa: E402
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+LISTENER = """
+import json, sys, time
+from flask import Flask
+from app.bus import MessageBus
+count = int(sys.argv[2])
+latencies = []
+app = Flask("listener")
+app.config.update(BUS_BACKEND="sqlite", BUS_SQLITE_PATH=sys.argv[1], BUS_POLL_INTERVAL=0.005, BUS_BATCH_SIZE=1000)
+bus = MessageBus()
+bus.init_app(app, deliver=lambda room, event, data: latencies.append(time.time() - data["t"]))
+bus.start()
+print("ready", flush=True)
+deadline = time.monotonic() + 120
+while len(latencies) < count and time.monotonic() < deadline:
+    time.sleep(0.002)
+done = time.time()
+bus.stop()
+print(json.dumps({"received": len(latencies), "done": done, "latencies": latencies}), flush=True)
+"""
+
+
+def percentile(values, q) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def run(args) -> dict:
+    tmp = tempfile.mkdtemp(prefix="spokesperson-bus-")
+    path = os.path.join(tmp, "bus.db")
+    app = Flask("publisher")
+    app.config.update(BUS_BACKEND="sqlite", BUS_SQLITE_PATH=path, BUS_BATCH_SIZE=max(args.batch, 500))
+    bus = MessageBus()
+    bus.init_app(app)
+
+    listeners = [subprocess.Popen([sys.executable, "-c", LISTENER, path, str(args.messages)], cwd=BACKEND,
+                                  stdout=subprocess.PIPE, text=True) for _ in range(args.workers)]
+    for proc in listeners:
+        proc.stdout.readline()  # "ready": listening from the current end of the log
+
+    start = time.time()
+    for first in range(0, args.messages, args.batch):
+        batch = [(f"user:{i % args.rooms}", "response", {"n": i, "t": time.time()}, None)
+                 for i in range(first, min(first + args.batch, args.messages))]
+        if args.batch == 1:
+            bus.publish(*batch[0])
+        else:
+            bus.publish_many(batch)
+    bus.stop()
+    published = time.time() - start
+
+    results = [json.loads(proc.communicate(timeout=180)[0].strip().splitlines()[-1]) for proc in listeners]
+    latencies = [value for result in results for value in result["latencies"]]
+    elapsed = max(result["done"] for result in results) - start
+    return {
+        "workers": args.workers,
+        "messages": args.messages,
+        "batch": args.batch,
+        "publish_s": round(published, 3),
+        "fan_out_s": round(elapsed, 3),
+        "messages_per_s": round(args.messages / elapsed),
+        "deliveries_per_s": round(len(latencies) / elapsed),
+        "all_received": all(result["received"] == args.messages for result in results),
+        "latency_ms": {"p50": round(statistics.median(latencies) * 1e3, 2) if latencies else 0.0,
+                       "p99": round(percentile(latencies, 0.99) * 1e3, 2),
+                       "max": round(max(latencies, default=0.0) * 1e3, 2)},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Message bus fan-out throughput between worker processes.")
+    parser.add_argument("--workers", type=int, default=4, help="Listener processes.")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=100, help="Messages per publish_many call (1: publish).")
+    parser.add_argument("--rooms", type=int, default=1000)
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON report.")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return report
+
+    latency = report["latency_ms"]
+    print(f"{report['messages']} messages to {report['workers']} workers in batches of {report['batch']}: "
+          f"published in {report['publish_s']}s, everything delivered after {report['fan_out_s']}s")
+    print(f"{report['messages_per_s']} msg/s, {report['deliveries_per_s']} deliveries/s, "
+          f"latency p50 {latency['p50']} ms, p99 {latency['p99']} ms, max {latency['max']} ms"
+          + ("" if report["all_received"] else "  (some messages were not received)"))
+    return report
+
+
+if __name__ == "__main__":
+    main()
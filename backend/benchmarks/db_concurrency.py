@@ -0,0 +1,185 @@
+"""
+Mixed read/write concurrency benchmark for conversation logs.
+
+Writer threads insert ConversationLog rows one transaction at a time (the
+worst case, e.g. with ``LOG_WRITER_MODE=sync``) while reader threads fetch a
+user's latest messages, the history access pattern. Reports throughput and
+p50/p99 latency per operation, plus operations that failed on a locked
+database.
+
+With ``--compare`` (SQLite only) it runs the old engine profile (rollback
+journal, ``synchronous=FULL``, no history index) and the tuned one (WAL,
+``synchronous=NORMAL``, ``(user_id, timestamp, id)`` index) on the same data.
+
+Example:
+    python benchmarks/db_concurrency.py --compare --writers 4 --readers 8 --seconds 5
+    python benchmarks/db_concurrency.py --url postgresql+psycopg2://localhost/spokesperson_bench
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, insert, select, text  # type: ignore
+
+# Ensure that the application modules can be imported
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app, db  # noqa: E402
+from app.models import ConversationLog, User  # noqa: E402
+from config.config import ProductionConfig  # noqa: E402
+
+INDEX_NAME = "ix_conversation_log_user_id_timestamp_id"
+
+PROFILES = {
+    "baseline": {"SQLITE_JOURNAL_MODE": "DELETE", "SQLITE_SYNCHRONOUS": "FULL", "index": False},
+    "tuned": {"SQLITE_JOURNAL_MODE": "WAL", "SQLITE_SYNCHRONOUS": "NORMAL", "index": True},
+}
+
+
+def percentile(values, pct) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def make_app(url, pool_size, **overrides):
+    config = type("BenchConfig", (ProductionConfig,), {
+        "SQLALCHEMY_DATABASE_URI": url,
+        "DB_POOL_SIZE": pool_size,
+        "LOG_WRITER_MODE": "sync",
+        "STATE_BACKEND": "memory",
+        **overrides,
+    })
+    app, _, _ = create_app(config)
+    return app
+
+
+def seed(app, users, rows, with_index):
+    """Create the schema and ``rows`` messages spread over ``users`` users."""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        if not with_index:
+            db.session.execute(text(f"DROP INDEX IF EXISTS {INDEX_NAME}"))
+        db.session.execute(insert(User), [{"id": i, "username": f"user{i}"} for i in range(1, users + 1)])
+        start = datetime.utcnow() - timedelta(days=30)
+        for offset in range(0, rows, 10_000):
+            db.session.execute(insert(ConversationLog), [
+                {"user_id": random.randint(1, users), "message": f"seed message {i}",
+                 "timestamp": start + timedelta(seconds=i)}
+                for i in range(offset, min(rows, offset + 10_000))
+            ])
+        db.session.commit()
+
+
+def run_profile(app, args) -> dict:
+    with app.app_context():
+        engine = db.engine
+        engine.dispose()
+    stop = threading.Event()
+    results = {"read": [], "write": []}
+    errors = {"read": 0, "write": 0}
+    lock = threading.Lock()
+
+    def writer():
+        samples, failed = [], 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                with engine.begin() as conn:
+                    conn.execute(insert(ConversationLog).values(
+                        user_id=random.randint(1, args.users), message="benchmark", timestamp=datetime.utcnow()))
+                samples.append(time.perf_counter() - start)
+            except Exception:
+                failed += 1
+        with lock:
+            results["write"].extend(samples)
+            errors["write"] += failed
+
+    def reader():
+        samples, failed = [], 0
+        query = (select(ConversationLog.id, ConversationLog.message, ConversationLog.timestamp)
+                 .where(ConversationLog.user_id == bindparam("user_id"))
+                 .order_by(ConversationLog.timestamp.desc()).limit(args.page))
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    conn.execute(query, {"user_id": random.randint(1, args.users)}).fetchall()
+                samples.append(time.perf_counter() - start)
+            except Exception:
+                failed += 1
+        with lock:
+            results["read"].extend(samples)
+            errors["read"] += failed
+
+    threads = ([threading.Thread(target=writer) for _ in range(args.writers)]
+               + [threading.Thread(target=reader) for _ in range(args.readers)])
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    report = {}
+    for op, samples in results.items():
+        report[op] = {
+            "ops_per_s": round(len(samples) / args.seconds, 1),
+            "p50_ms": round(percentile(samples, 50) * 1000, 3),
+            "p99_ms": round(percentile(samples, 99) * 1000, 3),
+            "errors": errors[op],
+        }
+    return report
+
+
+def run(args) -> dict:
+    reports = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        url = args.url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        profiles = PROFILES if args.compare else {"configured": {"index": True}}
+        for name, profile in profiles.items():
+            overrides = {key: value for key, value in profile.items() if key != "index"}
+            app = make_app(url, args.writers + args.readers, **overrides)
+            seed(app, args.users, args.rows, profile["index"])
+            reports[name] = run_profile(app, args)
+            with app.app_context():
+                db.engine.dispose()
+    return reports
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Conversation log read/write concurrency benchmark.")
+    parser.add_argument("--url", help="Database URL (default: a temporary SQLite file).")
+    parser.add_argument("--compare", action="store_true", help="Run the baseline and tuned SQLite profiles.")
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rows", type=int, default=200_000, help="Messages seeded before the run.")
+    parser.add_argument("--page", type=int, default=50, help="Messages fetched per history read.")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON report.")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return report
+
+    print(f"{'profile':<12}{'op':<7}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, ops in report.items():
+        for op, stats in ops.items():
+            print(f"{name:<12}{op:<7}{stats['ops_per_s']:>10}{stats['p50_ms']:>10}{stats['p99_ms']:>10}"
+                  f"{stats['errors']:>8}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Per-message dispatch cost of the conversation flow.
+
+Times the work a socket handler does for each answer, without I/O: validate
+the answer, pick the next question. The compiled engine (``app/flow.py``) is
+compared with the previous interpreter, which indexed a list of dicts by stage
+and compared the ``type`` string in ``services.validate_input`` every time
+(reproduced here as ``legacy_validate_input``).
+
+Example:
+    python benchmarks/flow_dispatch.py --rounds 20000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+# Ensure that the application modules can be imported
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.flow import DEFAULT_FLOW_PATH, load_flow  # noqa: E402
+
+ANSWERS = {"text": "hiking and taking photos", "number": "29"}
+
+
+def answer_for(entry_type, options):
+    return options[0] if entry_type == "choice" else ANSWERS[entry_type]
+
+
+def legacy_validate_input(input_value, input_type, options=None):
+    """``services.validate_input`` as it was: a type-string comparison per call."""
+    try:
+        if input_type == "text":
+            return bool(input_value.strip())
+        elif input_type == "number":
+            return input_value.isdigit() and int(input_value) > 0
+        elif input_type == "choice":
+            return input_value in options if options else False
+        else:
+            return False
+    except Exception:
+        return False
+
+
+def legacy_next_question(flow_list, stage, user_data):
+    """``services.get_next_question`` as it was: list index, else build the summary."""
+    if stage < len(flow_list):
+        return flow_list[stage]
+    return {"question": f"Nice to meet you, {user_data.get('name', 'User')}!", "type": "end"}
+
+
+def legacy_dispatch(flow_list, answers):
+    """The stage-indexed interpreter the handlers used before the compiled flow."""
+    user_data = {}
+    for stage, answer in enumerate(answers):
+        question = flow_list[stage]
+        if not legacy_validate_input(answer, question["type"], question.get("options", None)):
+            raise AssertionError(answer)
+        user_data[question["key"]] = answer
+        next_question = legacy_next_question(flow_list, stage + 1, user_data)
+        if next_question["type"] != "end":
+            next_question["question"]
+    return user_data
+
+
+def compiled_dispatch(flow, node_ids, answers):
+    """Node lookup and one precompiled step (validator plus transition table)."""
+    user_data = {}
+    nodes = flow.nodes
+    for node_id, answer in zip(node_ids, answers):
+        node = nodes[node_id]
+        result = node.step(answer)
+        if result is None:
+            raise AssertionError(answer)
+        value, next_id = result
+        user_data[node.key] = value
+        next_node = nodes.get(next_id)
+        if next_node is not None:
+            next_node.question
+    return user_data
+
+
+def time_per_message(func, args, messages, rounds, repeat) -> list:
+    """Best-of-``repeat`` samples, each the mean ns per message over ``rounds`` conversations."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for _ in range(rounds):
+            func(*args)
+        samples.append((time.perf_counter_ns() - start) / (rounds * messages))
+    return samples
+
+
+def run(args) -> dict:
+    flow = load_flow(args.flow)
+    path = flow.main_path()
+    flow_list = [node.as_dict() for node in path]
+    answers = [answer_for(node.type, node.options) for node in path]
+    node_ids = [node.id for node in path]
+
+    legacy = time_per_message(legacy_dispatch, (flow_list, answers), len(path), args.rounds, args.repeat)
+    compiled = time_per_message(compiled_dispatch, (flow, node_ids, answers), len(path), args.rounds, args.repeat)
+    return {
+        "messages_per_round": len(path),
+        "rounds": args.rounds,
+        "legacy_ns": {"best": round(min(legacy), 1), "median": round(statistics.median(legacy), 1)},
+        "compiled_ns": {"best": round(min(compiled), 1), "median": round(statistics.median(compiled), 1)},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Conversation-flow dispatch micro-benchmark.")
+    parser.add_argument("--flow", default=DEFAULT_FLOW_PATH)
+    parser.add_argument("--rounds", type=int, default=20000, help="Conversations replayed per sample.")
+    parser.add_argument("--repeat", type=int, default=5, help="Samples per engine.")
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON report.")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return report
+
+    print(f"{report['messages_per_round']} messages x {report['rounds']} conversations")
+    for name in ("legacy_ns", "compiled_ns"):
+        print(f"  {name[:-3]:<10} best {report[name]['best']:>8} ns/message   median {report[name]['median']:>8}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Registry, timing and result files for the benchmark suite (see suite.py).
+
+A case is a function decorated with ``@case`` that returns one or more
+``Result``s. Results are written as JSON together with the machine and commit
+they were measured on, and ``compare`` flags every result that moved in the
+wrong direction by more than its tolerance relative to a stored baseline.
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+# ``better`` is 'lower' (latencies) or 'higher' (throughputs); ``extra`` holds
+# secondary figures reported but not compared
+Result = namedtuple("Result", "name value unit better extra")
+Result.__new__.__defaults__ = ({},)
+
+Case = namedtuple("Case", "name func group")
+
+CASES = {}
+
+
+def case(name, group):
+    """Register ``func(ctx) -> list[Result]`` under ``name``."""
+    def decorator(func):
+        CASES[name] = Case(name, func, group)
+        return func
+    return decorator
+
+
+def per_call(func, number, repeat=5) -> list:
+    """Seconds per call of ``func()`` for each of ``repeat`` runs of ``number`` calls (as ``timeit``)."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - start) / number)
+    return samples
+
+
+def percentile(values, pct) -> float:
+    """Nearest-rank percentile of ``values`` (0 when empty)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(samples) -> dict:
+    """Median, spread and extremes of a list of measurements."""
+    return {
+        "median": statistics.median(samples),
+        "min": min(samples),
+        "max": max(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "n": len(samples),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment(mode) -> dict:
+    """What the numbers depend on besides the code."""
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "mode": mode,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def to_json(results, mode) -> dict:
+    return {
+        "meta": environment(mode),
+        "results": {r.name: {"value": r.value, "unit": r.unit, "better": r.better, **r.extra} for r in results},
+    }
+
+
+def save(report, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load(path) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(report, baseline, tolerance=0.25, tolerances=None) -> list:
+    """
+    Compare ``report`` with ``baseline`` result by result.
+
+    Parameters:
+    -----------
+    report, baseline : dict
+        Reports as written by ``to_json``.
+    tolerance : float
+        Allowed relative change in the wrong direction (0.25 = 25%).
+    tolerances : dict, optional
+        Per-result overrides of ``tolerance``.
+
+    Returns:
+    --------
+    list
+        ``(name, baseline, current, change, status)`` rows; ``change`` is
+        relative and signed so that positive means better, and ``status`` is
+        'ok', 'improved', 'regressed' or 'new'.
+    """
+    tolerances = tolerances or {}
+    rows = []
+    old = baseline.get("results", {})
+    for name, result in sorted(report["results"].items()):
+        previous = old.get(name)
+        if previous is None or not previous.get("value"):
+            rows.append((name, None, result["value"], None, "new"))
+            continue
+        change = (result["value"] - previous["value"]) / previous["value"]
+        if result["better"] == "lower":
+            change = -change
+        limit = tolerances.get(name, tolerance)
+        status = "regressed" if change < -limit else "improved" if change > limit else "ok"
+        rows.append((name, previous["value"], result["value"], change, status))
+    return rows
+
+
+def print_results(results, stream=sys.stdout):
+    width = max((len(r.name) for r in results), default=10) + 2
+    for r in results:
+        print(f"{r.name:<{width}}{_fmt(r.value):>14} {r.unit:<12}({r.better} is better)", file=stream)
+
+
+def print_comparison(rows, stream=sys.stdout):
+    width = max((len(row[0]) for row in rows), default=10) + 2
+    print(f"{'benchmark':<{width}}{'baseline':>14}{'current':>14}{'change':>10}  status", file=stream)
+    for name, old, new, change, status in rows:
+        shown = "" if change is None else f"{change:+.1%}"
+        print(f"{name:<{width}}{_fmt(old):>14}{_fmt(new):>14}{shown:>10}  {status}", file=stream)
+
+
+def _fmt(value) -> str:
+    if value is None:
+        return "-"
+    return f"{value:.4g}" if isinstance(value, float) else str(value)
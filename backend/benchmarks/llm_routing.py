@@ -0,0 +1,128 @@
+"""
+Tail latency and availability of routed LLM calls, against stub providers.
+
+Two in-process providers (``app.fake_llm.StubProvider``) answer in ``--latency``
+seconds, except for ``--slow-rate`` of the calls that take ``--slow`` seconds,
+the long tail of a hosted API. The same calls are made to the first provider
+alone, through the router without hedging and through the router with hedging;
+the report gives p50/p95/p99 and the share of calls that were hedged. A last run
+takes the first provider down halfway through to show the circuit breaker and the
+canned fallback keeping every call answered.
+
+Example:
+    python benchmarks/llm_routing.py --calls 400 --slow-rate 0.05
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Ensure that the application modules can be imported
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.fake_llm import StubProvider  # noqa: E402
+from app.llm import LLMError  # noqa: E402
+from app.providers import CircuitBreaker, LLMRouter, TemplateProvider  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "Tell me about your weekend."}]
+
+
+def percentile(values, q) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def latency(args, rng):
+    """A latency draw: fast most of the time, ``args.slow`` seconds for ``args.slow_rate`` of calls."""
+    return lambda: args.slow if rng.random() < args.slow_rate else args.latency * (0.5 + rng.random())
+
+
+def make_router(args, providers, hedge) -> LLMRouter:
+    router = LLMRouter()
+    router.hedge, router.hedge_budget = hedge, args.budget
+    router.hedge_min_delay, router.hedge_max_delay = args.min_delay, args.slow
+    for provider, tier in providers:
+        router.add(provider, tier=tier, breaker=CircuitBreaker(failures=5, cooldown=args.cooldown))
+    return router
+
+
+def measure(call, calls, concurrency) -> dict:
+    """Run ``call(i)`` ``calls`` times on ``concurrency`` threads; latencies in ms and failures."""
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            provider = call(i)
+        except LLMError:
+            provider = None
+        return (time.perf_counter() - start) * 1000, provider
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, range(calls)))
+    latencies = [ms for ms, _ in results]
+    providers = [provider for _, provider in results]
+    return {
+        "p50_ms": round(percentile(latencies, 0.5), 1),
+        "p95_ms": round(percentile(latencies, 0.95), 1),
+        "p99_ms": round(percentile(latencies, 0.99), 1),
+        "failed": providers.count(None),
+        "by_provider": {name: providers.count(name) for name in sorted(set(filter(None, providers)))},
+    }
+
+
+def run(args) -> dict:
+    rng = random.Random(args.seed)
+    report = {"calls": args.calls, "concurrency": args.concurrency, "slow_rate": args.slow_rate, "runs": {}}
+
+    single = StubProvider("a", latency=latency(args, rng))
+    report["runs"]["single"] = measure(lambda i: single.complete(MESSAGES, 50, 30.0) and "a",
+                                       args.calls, args.concurrency)
+
+    for name, hedge in (("routed", False), ("hedged", True)):
+        a, b = StubProvider("a", latency=latency(args, rng)), StubProvider("b", latency=latency(args, rng))
+        router = make_router(args, [(a, 0), (b, 0)], hedge)
+        report["runs"][name] = measure(lambda i: router.complete(MESSAGES).provider, args.calls, args.concurrency)
+        report["runs"][name]["calls_made"] = a.calls + b.calls
+        router.close()
+
+    # The only model goes down halfway through; its breaker opens and canned replies take over
+    outage = StubProvider("a", latency=latency(args, rng), fail=lambda: outage.calls > args.calls // 2)
+    router = make_router(args, [(outage, 0), (TemplateProvider(), 1)], True)
+    report["runs"]["outage"] = measure(lambda i: router.complete(MESSAGES).provider, args.calls, args.concurrency)
+    report["runs"]["outage"]["calls_made"] = outage.calls
+    router.close()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Routed LLM call latency benchmark.")
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02, help="Typical call latency in seconds.")
+    parser.add_argument("--slow", type=float, default=0.5, help="Latency of the slow tail in seconds.")
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="Share of calls in the slow tail.")
+    parser.add_argument("--min-delay", type=float, default=0.05, help="Shortest hedge delay in seconds.")
+    parser.add_argument("--budget", type=float, default=0.1, help="Hedges allowed per call.")
+    parser.add_argument("--cooldown", type=float, default=30.0, help="Circuit breaker cooldown in seconds.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON report.")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return report
+
+    print(f"{report['calls']} calls, {report['concurrency']} at a time, {report['slow_rate']:.0%} slow")
+    print(f"  {'run':<8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'failed':>7} {'upstream':>9}  answered by")
+    for name, run_report in report["runs"].items():
+        print(f"  {name:<8} {run_report['p50_ms']:>8} {run_report['p95_ms']:>8} {run_report['p99_ms']:>8} "
+              f"{run_report['failed']:>7} {run_report.get('calls_made', report['calls']):>9}  "
+              + ", ".join(f"{k} {v}" for k, v in run_report["by_provider"].items()))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Top-k match scoring benchmark.
+
+Builds a ``MatchIndex`` of N synthetic profiles and times single top-k queries
+(one matrix-vector product plus ``argpartition``), batched ``top_k_many``
+queries and incremental upserts. BLAS is pinned to one thread so the figures
+are per core.
+
+Encoding a million answer sets in Python would dominate the setup, so the
+benchmark encodes ``--distinct`` random answer sets and fills the index with
+jittered copies of them.
+
+Example:
+    python benchmarks/match_scoring.py --profiles 1000000 --queries 200 --k 10
+"""
+import os
+
+# Must be set before NumPy loads its BLAS
+for _var in ("OPENBLAS_NUM_THREADS", "OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(_var, "1")
+
+import argparse  # noqa: E402
+import json  # noqa: E402
+import random  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+
+import numpy as np  # type: ignore # noqa: E402
+
+# Ensure that the application modules can be imported
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.matching import COMMUNICATION, PERSONALITY, MatchIndex, ProfileEncoder  # noqa: E402
+
+WORDS = ("hiking climbing photography reading novels cooking baking travel surfing yoga chess gaming painting "
+         "music concerts jazz running cycling gardening volunteering conservation teaching startups family "
+         "animals rescue dogs poetry film museums dinner picnic beach sunset coffee wine karaoke dancing").split()
+
+
+def percentile(values, pct) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def synthetic_answers(rng) -> dict:
+    def text():
+        return " ".join(rng.sample(WORDS, rng.randint(1, 5)))
+    return {
+        "age": str(rng.randint(18, 70)),
+        "personality": rng.choice(PERSONALITY),
+        "communication": rng.choice(COMMUNICATION),
+        "hobby": text(), "passion": text(), "ideal_date": text(),
+    }
+
+
+def build_index(args, encoder):
+    rng = random.Random(args.seed)
+    base = encoder.encode_many([synthetic_answers(rng) for _ in range(args.distinct)])
+    nprng = np.random.default_rng(args.seed)
+    index = MatchIndex(encoder.dim, capacity=args.profiles)
+    start = time.perf_counter()
+    for offset in range(0, args.profiles, 100_000):
+        count = min(100_000, args.profiles - offset)
+        block = base[nprng.integers(0, args.distinct, count)]
+        block += nprng.normal(0, 0.02, block.shape).astype(np.float32)
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+        index.upsert_many(range(offset, offset + count), block)
+    return index, time.perf_counter() - start
+
+
+def run(args) -> dict:
+    encoder = ProfileEncoder(args.buckets)
+    index, build_seconds = build_index(args, encoder)
+    rng = random.Random(args.seed + 1)
+    user_ids = [rng.randrange(args.profiles) for _ in range(args.queries)]
+
+    index.top_k(index.vector(user_ids[0]), args.k, (user_ids[0],))  # Warm up
+    single = []
+    for user_id in user_ids:
+        query = index.vector(user_id)
+        start = time.perf_counter()
+        index.top_k(query, args.k, (user_id,))
+        single.append(time.perf_counter() - start)
+
+    queries = np.stack([index.vector(user_id) for user_id in user_ids[:args.batch]])
+    start = time.perf_counter()
+    index.top_k_many(queries, args.k, [(user_id,) for user_id in user_ids[:args.batch]])
+    batch_seconds = time.perf_counter() - start
+
+    answers = [synthetic_answers(rng) for _ in range(1000)]
+    start = time.perf_counter()
+    for i, item in enumerate(answers):
+        index.upsert(args.profiles + i, encoder.encode(item))
+    upsert_seconds = (time.perf_counter() - start) / len(answers)
+
+    return {
+        "profiles": args.profiles,
+        "dim": encoder.dim,
+        "matrix_mb": round(args.profiles * encoder.dim * 4 / 1e6, 1),
+        "build_s": round(build_seconds, 2),
+        "top_k_p50_ms": round(percentile(single, 50) * 1000, 2),
+        "top_k_p99_ms": round(percentile(single, 99) * 1000, 2),
+        "batched_ms_per_query": round(batch_seconds * 1000 / len(queries), 2),
+        "encode_and_upsert_us": round(upsert_seconds * 1e6, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Top-k match scoring benchmark.")
+    parser.add_argument("--profiles", type=int, default=1_000_000)
+    parser.add_argument("--distinct", type=int, default=20_000, help="Distinct answer sets encoded.")
+    parser.add_argument("--buckets", type=int, default=16, help="Hashed bag-of-words width per text block.")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=32, help="Queries per top_k_many call.")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON report.")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return report
+    for key, value in report.items():
+        print(f"{key:<24}{value:>12}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
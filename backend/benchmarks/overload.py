@@ -0,0 +1,131 @@
+"""
+Latency and goodput under overload, with and without the adaptive concurrency limit.
+
+A simulated worker serves requests in arrival order on ``--workers`` threads
+taking ``--service`` seconds each, like handlers contending for threads and
+database locks. Half the requests are flow steps (``critical``) and half
+free-form prompts (``low``). Each run first offers half the capacity, so the
+limit learns the unloaded latency, then ``--loads`` multiples of the capacity
+for ``--seconds``. It reports p50/p99 of served requests (from arrival to
+completion, waiting included), requests served per second and the share shed
+per priority, for no limit and for each limit algorithm.
+
+Example:
+    python benchmarks/overload.py --loads 1 2 5 --seconds 2
+"""
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+# Ensure that the application modules can be imported
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.overload import LIMITS, ConcurrencyController  # noqa: E402
+
+
+def percentile(values, q) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def offer(ctl, rate, seconds, workers, service) -> dict:
+    """Offer ``rate`` requests per second for ``seconds`` to a FIFO server guarded by ``ctl`` (None: unguarded)."""
+    jobs = queue.Queue()
+    latencies, offered, shed, lock = [], {"critical": 0, "low": 0}, {"critical": 0, "low": 0}, threading.Lock()
+
+    def work():
+        for done in iter(jobs.get, None):
+            time.sleep(service)
+            done.set()
+
+    def handle(level, arrived):
+        ticket = ctl.acquire(level, level) if ctl is not None else None
+        if ctl is not None and ticket is None:
+            with lock:
+                shed[level] += 1
+            return
+        done = threading.Event()
+        jobs.put(done)
+        done.wait()
+        if ticket is not None:
+            ticket.release()
+        with lock:
+            latencies.append(time.monotonic() - arrived)
+
+    servers = [threading.Thread(target=work, daemon=True) for _ in range(workers)]
+    for thread in servers:
+        thread.start()
+    threads = []
+    start = time.monotonic()
+    for i in range(int(rate * seconds)):
+        time.sleep(max(0.0, start + i / rate - time.monotonic()))
+        level = "low" if i % 2 else "critical"
+        offered[level] += 1
+        thread = threading.Thread(target=handle, args=(level, time.monotonic()), daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+    for _ in servers:
+        jobs.put(None)
+    return {
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "served_per_s": round(len(latencies) / elapsed, 1),
+        "shed": {level: round(shed[level] / max(1, offered[level]), 3) for level in shed},
+    }
+
+
+def make_controller(name, args) -> ConcurrencyController:
+    ctl = ConcurrencyController()
+    ctl.algorithm = LIMITS[name]()
+    ctl.limit = float(args.initial_limit)
+    ctl.queue_timeout = args.queue_timeout
+    return ctl
+
+
+def run(args) -> dict:
+    capacity = args.workers / args.service
+    report = {"capacity_per_s": capacity, "workers": args.workers, "service_ms": args.service * 1000, "runs": {}}
+    for load in args.loads:
+        for name in ["none"] + sorted(LIMITS):
+            ctl = None if name == "none" else make_controller(name, args)
+            offer(ctl, capacity / 2, 0.5, args.workers, args.service)
+            result = offer(ctl, capacity * load, args.seconds, args.workers, args.service)
+            if ctl is not None:
+                result["limit"] = round(ctl.limit, 1)
+            report["runs"][f"{load}x {name}"] = result
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load shedding benchmark against a simulated worker.")
+    parser.add_argument("--loads", type=float, nargs="+", default=[1, 2, 5], help="Offered load, in capacities.")
+    parser.add_argument("--seconds", type=float, default=1.0, help="Length of each overload run.")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--service", type=float, default=0.02, help="Seconds per request.")
+    parser.add_argument("--initial-limit", type=int, default=20)
+    parser.add_argument("--queue-timeout", type=float, default=0.2)
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON report.")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return report
+
+    print(f"capacity {report['capacity_per_s']:.0f}/s ({args.workers} workers, {args.service * 1000:.0f} ms each)")
+    print(f"  {'run':<14} {'p50 ms':>8} {'p99 ms':>8} {'served/s':>9} {'shed crit':>10} {'shed low':>9} {'limit':>6}")
+    for name, result in report["runs"].items():
+        print(f"  {name:<14} {result['p50_ms']:>8} {result['p99_ms']:>8} {result['served_per_s']:>9} "
+              f"{result['shed']['critical']:>10.1%} {result['shed']['low']:>9.1%} {result.get('limit', '-'):>6}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
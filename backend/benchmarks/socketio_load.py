@@ -0,0 +1,195 @@
+"""
+Socket.IO load-test harness for the conversation flow.
+
+Opens N simulated clients against a running server, walks each one through
+the compiled conversation flow with valid answers, and reports per-question latency
+(time from emitting an answer to receiving the next prompt) as p50/p99, plus
+how many connections each worker process held at the plateau. The asyncio
+client needs aiohttp: ``pip install -r benchmarks/requirements.txt``.
+
+Example:
+    SOCKETIO_ASYNC_MODE=eventlet python serve.py &
+    python benchmarks/socketio_load.py --url http://127.0.0.1:5000 --clients 2000 --hold 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import urllib.request
+
+import socketio  # type: ignore
+
+# Ensure that the application modules can be imported
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.flow import DEFAULT_FLOW_PATH, load_flow  # noqa: E402
+
+# Long enough that no text answer triggers a short-answer follow-up
+SAMPLE_ANSWERS = {"text": "Alex likes long hikes", "number": "29"}
+
+
+def answer_for(node) -> str:
+    """Return a valid answer for a flow node."""
+    if node.type == "choice":
+        return node.options[0]
+    return SAMPLE_ANSWERS.get(node.type, "Alex")
+
+
+def scripted_path(flow) -> list:
+    """Nodes visited, in order, when every question gets ``answer_for``."""
+    path, node = [], flow.start
+    while node is not None:
+        path.append(node)
+        node = flow.nodes.get(node.next_for(answer_for(node)))
+    return path
+
+
+def percentile(values, pct) -> float:
+    """Nearest-rank percentile of ``values`` (0 when empty)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class SimulatedClient:
+    """One Socket.IO client answering the scripted questions in order."""
+
+    def __init__(self, url, transports, timeout, path):
+        self.url = url
+        self.path = path
+        self.transports = transports
+        self.timeout = timeout
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.responses = asyncio.Queue()
+        self.latencies = [[] for _ in path]
+        self.errors = 0
+        self.sio.on('response', self._on_response)
+
+    async def _on_response(self, data):
+        await self.responses.put(data)
+
+    async def _next_response(self):
+        return await asyncio.wait_for(self.responses.get(), self.timeout)
+
+    async def connect(self):
+        await self.sio.connect(self.url, transports=self.transports)
+        # Welcome message and first question
+        await self._next_response()
+        await self._next_response()
+
+    async def walk(self):
+        for stage, node in enumerate(self.path):
+            start = time.perf_counter()
+            await self.sio.emit('message', answer_for(node))
+            try:
+                await self._next_response()
+            except asyncio.TimeoutError:
+                self.errors += 1
+                return
+            self.latencies[stage].append(time.perf_counter() - start)
+
+    async def close(self):
+        await self.sio.disconnect()
+
+
+def fetch_socket_stats(url):
+    """Read ``/socket_stats`` from whichever worker answers."""
+    with urllib.request.urlopen(f"{url}/socket_stats", timeout=5) as response:
+        return json.loads(response.read())
+
+
+async def run(args) -> dict:
+    path = scripted_path(load_flow(args.flow))
+    clients = [SimulatedClient(args.url, [args.transport], args.timeout, path) for _ in range(args.clients)]
+    gate = asyncio.Semaphore(args.connect_concurrency)
+    connect_failures = 0
+
+    async def connect(client):
+        nonlocal connect_failures
+        async with gate:
+            try:
+                await client.connect()
+            except Exception:
+                connect_failures += 1
+                client.errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(connect(c) for c in clients))
+    connect_seconds = time.perf_counter() - start
+    connected = [c for c in clients if c.sio.connected]
+
+    # Sample connection counts per worker while every client is idle and connected
+    per_process = {}
+    for _ in range(args.stats_samples):
+        try:
+            stats = await asyncio.to_thread(fetch_socket_stats, args.url)
+            per_process[stats["pid"]] = stats["connections"]
+        except Exception:
+            pass
+    if args.hold:
+        await asyncio.sleep(args.hold)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(c.walk() for c in connected))
+    walk_seconds = time.perf_counter() - start
+    await asyncio.gather(*(c.close() for c in connected), return_exceptions=True)
+
+    questions = []
+    for stage, node in enumerate(path):
+        samples = [s for c in connected for s in c.latencies[stage]]
+        questions.append({
+            "stage": stage,
+            "key": node.key,
+            "samples": len(samples),
+            "p50_ms": round(percentile(samples, 50) * 1000, 2),
+            "p99_ms": round(percentile(samples, 99) * 1000, 2),
+            "mean_ms": round(statistics.fmean(samples) * 1000, 2) if samples else 0.0,
+        })
+
+    return {
+        "clients": args.clients,
+        "connected": len(connected),
+        "connect_failures": connect_failures,
+        "errors": sum(c.errors for c in clients),
+        "connect_seconds": round(connect_seconds, 3),
+        "walk_seconds": round(walk_seconds, 3),
+        "connections_per_process": per_process,
+        "questions": questions,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Socket.IO conversation-flow load test.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--connect-concurrency", type=int, default=200, help="Simultaneous handshakes.")
+    parser.add_argument("--transport", default="websocket", choices=["websocket", "polling"])
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for each reply.")
+    parser.add_argument("--hold", type=float, default=0.0, help="Seconds to hold idle connections open.")
+    parser.add_argument("--stats-samples", type=int, default=10, help="/socket_stats polls at the plateau.")
+    parser.add_argument("--flow", default=DEFAULT_FLOW_PATH, help="Flow definition the server runs.")
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON report.")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return report
+
+    print(f"Clients: {report['connected']}/{report['clients']} connected in {report['connect_seconds']}s "
+          f"({report['errors']} errors)")
+    for pid, count in report["connections_per_process"].items():
+        print(f"  worker {pid}: {count} connections")
+    print(f"{'stage':<6}{'key':<16}{'samples':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for q in report["questions"]:
+        print(f"{q['stage']:<6}{q['key']:<16}{q['samples']:>8}{q['p50_ms']:>10}{q['p99_ms']:>10}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Start-up cost: import time, app creation and time to first response.
+
+Every measurement runs in a fresh interpreter, since an import is only slow
+once per process:
+
+- in-process stages, with ``LAZY_INIT`` on and off: ``import app``,
+  ``create_app()``, and the first and second ``GET /`` through the test client,
+  plus the number of modules loaded and whether numpy was actually loaded;
+- time to first response of a real server: from spawning ``serve.py`` or
+  ``prefork.py`` until ``GET /`` on its port returns 200;
+- memory of the preforked workers, from ``/proc/<pid>/smaps_rollup``: how much
+  of each worker is still shared with its siblings and how much is its own.
+
+Databases and SQLite stores are pointed at a scratch directory. The figures
+reported are medians over ``--repeat`` runs.
+
+Example:
+    python benchmarks/startup.py --repeat 5 --workers 2
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+application, _, _ = app.create_app()
+created = time.perf_counter()
+client = application.test_client()
+assert client.get('/').status_code == 200
+first = time.perf_counter()
+client.get('/')
+second = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1e3,
+    "create_app_ms": (created - imported) * 1e3,
+    "first_request_ms": (first - created) * 1e3,
+    "second_request_ms": (second - first) * 1e3,
+    "modules": len(sys.modules),
+    "numpy_loaded": type(sys.modules.get("numpy")).__name__ == "module",  # Not still a lazy placeholder
+}))
+"""
+
+
+def scratch_env(tmp, **overrides) -> dict:
+    """Environment that keeps every database of the app inside ``tmp``."""
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'app.db')}",
+        "RATELIMIT_SQLITE_PATH": os.path.join(tmp, "ratelimit.db"),
+        "CACHE_SQLITE_PATH": os.path.join(tmp, "cache.db"),
+        "STATE_SQLITE_PATH": os.path.join(tmp, "state.db"),
+        "JOBS_SQLITE_PATH": os.path.join(tmp, "jobs.db"),
+        "MATCH_INDEX_PATH": os.path.join(tmp, "match_index"),
+        "SQLALCHEMY_ECHO": "false",
+        "LOG_LEVEL": "WARNING",
+    })
+    env.update(overrides)
+    return env
+
+
+def probe(env) -> dict:
+    """Run the in-process stages once in a new interpreter."""
+    out = subprocess.run([sys.executable, "-c", PROBE], cwd=BACKEND, env=env, capture_output=True,
+                         text=True, check=True, timeout=120)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(port, deadline) -> bool:
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/")
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            time.sleep(0.005)
+        finally:
+            conn.close()
+    return False
+
+
+def children(pid) -> list:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def memory_kb(pid) -> dict:
+    """Resident, shared and private memory of ``pid`` in kB (empty where /proc is unavailable)."""
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if value.strip().endswith("kB"):
+                    fields[key] = int(value.split()[0])
+    except OSError:
+        return {}
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def serve_once(command, env, workers) -> dict:
+    """Spawn a server, time its first 200 and sample its workers' memory."""
+    port = free_port()
+    env = dict(env, PORT=str(port), HOST="127.0.0.1")
+    argv = [sys.executable, *command]
+    if "prefork.py" in command:
+        argv += ["--workers", str(workers), "--port", str(port)]
+    start = time.monotonic()
+    proc = subprocess.Popen(argv, cwd=BACKEND, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_ready(port, start + 60):
+            raise RuntimeError(f"{' '.join(command)} did not answer on port {port}")
+        result = {"first_response_ms": (time.monotonic() - start) * 1e3}
+        time.sleep(0.5)  # Let the other workers reach their accept loop
+        pids = children(proc.pid) if "prefork.py" in command else [proc.pid]
+        samples = [m for m in (memory_kb(pid) for pid in pids) if m]
+        if samples:
+            result["workers"] = len(samples)
+            for key in ("rss", "shared", "private"):
+                result[f"worker_{key}_kb"] = statistics.mean(m[key] for m in samples)
+        return result
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def median_of(samples) -> dict:
+    keys = samples[0].keys()
+    return {key: round(statistics.median(s[key] for s in samples), 2) if not isinstance(samples[0][key], bool)
+            else samples[0][key] for key in keys}
+
+
+def run(args) -> dict:
+    tmp = tempfile.mkdtemp(prefix="spokesperson-startup-")
+    try:
+        bare = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", "pass"], check=True)
+            bare.append((time.perf_counter() - start) * 1e3)
+        report = {"interpreter_ms": round(statistics.median(bare), 2)}
+        for lazy in ("true", "false"):
+            env = scratch_env(tmp, LAZY_INIT=lazy)
+            report[f"lazy_init_{lazy}"] = median_of([probe(env) for _ in range(args.repeat)])
+        if not args.no_servers:
+            env = scratch_env(tmp, SOCKETIO_ASYNC_MODE="eventlet")
+            report["serve.py"] = median_of([serve_once(["serve.py"], env, 1) for _ in range(args.repeat)])
+            report["prefork.py"] = median_of([serve_once(["prefork.py"], env, args.workers)
+                                              for _ in range(args.repeat)])
+        return report
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import time, app creation and time-to-first-response benchmark.")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh processes per measurement.")
+    parser.add_argument("--workers", type=int, default=2, help="Workers for prefork.py.")
+    parser.add_argument("--no-servers", action="store_true", help="Skip spawning serve.py and prefork.py.")
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON report.")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return report
+
+    print(f"interpreter start-up: {report['interpreter_ms']} ms")
+    print(f"{'LAZY_INIT':<12}{'import ms':>11}{'create ms':>11}{'1st req ms':>12}{'2nd req ms':>12}"
+          f"{'modules':>9}{'numpy':>7}")
+    for lazy in ("true", "false"):
+        r = report[f"lazy_init_{lazy}"]
+        print(f"{lazy:<12}{r['import_ms']:>11}{r['create_app_ms']:>11}{r['first_request_ms']:>12}"
+              f"{r['second_request_ms']:>12}{r['modules']:>9}{'yes' if r['numpy_loaded'] else 'no':>7}")
+    for server in ("serve.py", "prefork.py"):
+        if server in report:
+            r = report[server]
+            line = f"{server}: first response after {r['first_response_ms']} ms"
+            if "worker_rss_kb" in r:
+                line += (f"; per worker {r['worker_rss_kb'] / 1024:.1f} MB resident, "
+                         f"{r['worker_shared_kb'] / 1024:.1f} MB shared, {r['worker_private_kb'] / 1024:.1f} MB private")
+            print(line)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Bytes per active conversation: the compact ``Conversation`` record vs. the dict state.
+
+Builds N conversations part-way through the flow, each with its own answers,
+in two representations, as a worker holds them after loading them from the
+store:
+
+- dict: ``user_id``, ``flow_version``, ``conversation_node`` and a growing
+  ``user_data`` dict, rebuilt by unpickling as the Flask session did on every
+  event (every conversation holds its own copy of every string);
+- record: ``app.state.Conversation`` rebuilt by ``Conversation.unpack``, with
+  the stage as an integer, a fixed answer array and interned choice answers.
+
+Memory is measured with tracemalloc, so it counts every object a conversation
+owns. The serialized size (pickle, the JSON fields the SQLite/Redis backends
+stored, and the packed binary form) and the encode/decode time are reported
+alongside.
+
+Example:
+    python benchmarks/state_memory.py --conversations 20000
+"""
+import argparse
+import json
+import os
+import pickle
+import random
+import sys
+import time
+import tracemalloc
+
+# Ensure that the application modules can be imported
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.flow import load_flow, DEFAULT_FLOW_PATH  # noqa: E402
+from app.state import Conversation  # noqa: E402
+from socketio_load import answer_for  # noqa: E402
+
+WORDS = ("hiking", "photography", "music", "travel", "cooking", "a", "the", "with", "friends", "on", "weekends",
+         "long", "walks", "and", "coffee", "books", "beach", "mountains", "late", "night", "talks")
+
+
+def walk(flow, rng, answered):
+    """Answer up to ``answered`` questions along a random path; return (answers by node, current node)."""
+    answers, node = [], flow.start
+    while node is not None and len(answers) < answered:
+        if node.type == "choice":
+            raw = rng.choice(node.options)
+        elif node.type == "number":
+            raw = str(rng.randint(18, 80))
+        else:
+            raw = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 8)))
+        value, next_id = node.step(raw) or (answer_for(node), node.targets[0])
+        answers.append((node, value))
+        node = flow.nodes.get(next_id)
+    return answers, node or flow.start
+
+
+def as_dict(flow, user_id, answers, node) -> dict:
+    return {"user_id": user_id, "flow_version": flow.version, "conversation_node": node.id,
+            "user_data": {answered.key: value for answered, value in answers}}
+
+
+def as_record(flow, user_id, answers, node) -> Conversation:
+    conversation = Conversation(user_id, flow.version, len(flow.keys), flow.positions[node.id])
+    for answered, value in answers:
+        conversation.answer(flow.slots[answered.key], value, choice=answered.type == "choice")
+    return conversation
+
+
+def measure(build, count) -> tuple:
+    """Bytes allocated per item by ``build(i)`` for ``count`` items, and the items."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = [build(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    list_overhead = sys.getsizeof(items)  # The list holding them is not part of any conversation
+    return (after - before - list_overhead) / count, items
+
+
+def per_call_us(func, items, repeat=5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        best = min(best, time.perf_counter() - start)
+    return best / len(items) * 1e6
+
+
+def json_fields(state) -> bytes:
+    return b"".join(json.dumps(value).encode() for value in state.values())
+
+
+def run(args) -> dict:
+    flow = load_flow(DEFAULT_FLOW_PATH)
+    rng = random.Random(args.seed)
+    conversations = [walk(flow, rng, rng.randint(1, len(flow.main_path()))) for _ in range(args.conversations)]
+    pickled = [pickle.dumps(as_dict(flow, i + 1, *c), pickle.HIGHEST_PROTOCOL) for i, c in enumerate(conversations)]
+    packed = [as_record(flow, i + 1, *c).pack() for i, c in enumerate(conversations)]
+
+    dict_bytes, dicts = measure(lambda i: pickle.loads(pickled[i]), len(pickled))
+    record_bytes, records = measure(lambda i: Conversation.unpack(packed[i]), len(packed))
+    assert all(record.user_data(flow.keys) == state["user_data"] for record, state in zip(records, dicts))
+
+    sample = range(0, len(dicts), max(1, len(dicts) // 2000))
+    dict_sample = [dicts[i] for i in sample]
+    record_sample = [records[i] for i in sample]
+    count = len(dicts)
+    return {
+        "conversations": count,
+        "answers_per_conversation": round(sum(len(d["user_data"]) for d in dicts) / count, 2),
+        "dict": {
+            "memory_bytes": round(dict_bytes, 1),
+            "pickle_bytes": round(sum(map(len, pickled)) / count, 1),
+            "json_bytes": round(sum(len(json_fields(d)) for d in dicts) / count, 1),
+            "encode_us": round(per_call_us(lambda d: pickle.dumps(d, pickle.HIGHEST_PROTOCOL), dict_sample), 2),
+            "decode_us": round(per_call_us(pickle.loads, [pickled[i] for i in sample]), 2),
+        },
+        "record": {
+            "memory_bytes": round(record_bytes, 1),
+            "packed_bytes": round(sum(map(len, packed)) / count, 1),
+            "encode_us": round(per_call_us(Conversation.pack, record_sample), 2),
+            "decode_us": round(per_call_us(Conversation.unpack, [packed[i] for i in sample]), 2),
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memory per active conversation: compact record vs. dict state.")
+    parser.add_argument("--conversations", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON report.")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return report
+
+    d, r = report["dict"], report["record"]
+    print(f"{report['conversations']} conversations, {report['answers_per_conversation']} answers each on average")
+    print(f"{'':<24}{'dict state':>12}{'record':>12}{'ratio':>8}")
+    rows = [("memory bytes/conv", d["memory_bytes"], r["memory_bytes"]),
+            ("serialized bytes/conv", d["pickle_bytes"], r["packed_bytes"]),
+            ("encode us", d["encode_us"], r["encode_us"]),
+            ("decode us", d["decode_us"], r["decode_us"])]
+    for label, old, new in rows:
+        print(f"{label:<24}{old:>12}{new:>12}{old / new if new else 0:>7.1f}x")
+    print(f"{'JSON fields bytes/conv':<24}{d['json_bytes']:>12}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
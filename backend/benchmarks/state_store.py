@@ -0,0 +1,125 @@
+"""
+Per-event overhead of the conversation state store.
+
+Replays the state traffic of a conversation-flow event (load the state,
+record an answer and the next stage in its ``Conversation``, save) against each
+``StateStore`` backend and against a filesystem session baseline that behaves like the old
+``SESSION_TYPE = 'filesystem'`` setup: the whole session is unpickled from
+one file per key and rewritten atomically on every event.
+
+Example:
+    python benchmarks/state_store.py --keys 200 --events 5000
+"""
+import argparse
+import json
+import os
+import pickle
+import statistics
+import sys
+import tempfile
+import time
+
+# Ensure that the application modules can be imported
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.state import Conversation, StateStore  # noqa: E402
+
+
+class FilesystemSessionBaseline:
+    """Pickle-file-per-session store, as the filesystem session backend did."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, key.replace(":", "_"))
+
+    def event(self, key, stage, answer):
+        try:
+            with open(self._path(key), "rb") as f:
+                session = pickle.load(f)
+        except FileNotFoundError:
+            session = {"conversation_stage": 0, "user_data": {}}
+        session["user_data"][f"q{stage}"] = answer
+        session["conversation_stage"] = stage + 1
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(session, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(key))
+
+
+class StoreRunner:
+    """Drives a ``StateStore`` the way the socket handlers do."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def event(self, key, stage, answer):
+        with self.store.conversation(key) as state:
+            conversation = state.get("conversation") or Conversation(1, "bench", slots=10)
+            conversation.answer(stage, answer)
+            conversation.stage = stage + 1
+            state["conversation"] = conversation
+
+
+class _App:
+    def __init__(self, **config):
+        self.config = config
+        self.extensions = {}
+
+
+def measure(runner, keys, events) -> dict:
+    samples = []
+    for i in range(events):
+        key = f"sid:{i % keys}"
+        stage = (i // keys) % 10
+        start = time.perf_counter()
+        runner.event(key, stage, "Alex")
+        samples.append(time.perf_counter() - start)
+    ordered = sorted(samples)
+    return {
+        "events": events,
+        "mean_us": round(statistics.fmean(samples) * 1e6, 1),
+        "p50_us": round(ordered[len(ordered) // 2] * 1e6, 1),
+        "p99_us": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1e6, 1),
+    }
+
+
+def run(args) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        results["filesystem_session"] = measure(FilesystemSessionBaseline(workdir), args.keys, args.events)
+        for backend in ("memory", "sqlite", "redis"):
+            app = _App(
+                STATE_BACKEND=backend,
+                STATE_SWEEP_INTERVAL=0,
+                STATE_SQLITE_PATH=os.path.join(workdir, "state.db"),
+                STATE_REDIS_URL=args.redis_url,
+            )
+            results[backend] = measure(StoreRunner(StateStore(app)), args.keys, args.events)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Conversation state store per-event benchmark.")
+    parser.add_argument("--keys", type=int, default=200, help="Concurrent conversations.")
+    parser.add_argument("--events", type=int, default=5000, help="Events replayed per backend.")
+    parser.add_argument("--redis-url", default="local://state-bench", help="redis:// URL or local://<name>.")
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON report.")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return report
+
+    baseline = report["filesystem_session"]["mean_us"]
+    print(f"{'backend':<20}{'mean us':>10}{'p50 us':>10}{'p99 us':>10}{'speedup':>10}")
+    for name, result in report.items():
+        speedup = baseline / result["mean_us"] if result["mean_us"] else 0
+        print(f"{name:<20}{result['mean_us']:>10}{result['p50_us']:>10}{result['p99_us']:>10}{speedup:>9.1f}x")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Alembic environment: runs migrations against the app's configured database.
+"""
+from logging.config import fileConfig
+
+from alembic import context
+
+from app import create_app, db
+from config.config import get_config
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+# Reuse the app's engine so the URL, pool options and SQLite pragmas match what the app runs with;
+# "-x url=..." or a sqlalchemy.url main option points a run at another database
+config_class = get_config()
+url = context.get_x_argument(as_dictionary=True).get("url") or config.get_main_option("sqlalchemy.url")
+if url:
+    config_class = type("MigrationConfig", (config_class,), {"SQLALCHEMY_DATABASE_URI": url})
+app, _, _ = create_app(config_class)
+target_metadata = db.metadata
+
+
+def run_migrations_offline() -> None:
+    """Emit SQL to stdout instead of running it ("alembic upgrade head --sql")."""
+    context.configure(
+        url=app.config["SQLALCHEMY_DATABASE_URI"],
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        render_as_batch=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    with app.app_context(), db.engine.connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            # SQLite cannot ALTER most things in place; batch mode rebuilds the table
+            render_as_batch=connection.dialect.name == "sqlite",
+            compare_type=True,
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,36 @@
+"""Add id_allocation and the (user_id, timestamp) history index
+
+id_allocation may already exist where the log writer created it on demand.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 12:05:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if not sa.inspect(op.get_bind()).has_table('id_allocation'):
+        op.create_table(
+            'id_allocation',
+            sa.Column('name', sa.String(length=64), nullable=False),
+            sa.Column('next_id', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('name'),
+        )
+    op.create_index('ix_conversation_log_user_id_timestamp', 'conversation_log', ['user_id', 'timestamp'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_conversation_log_user_id_timestamp', table_name='conversation_log')
+    op.drop_table('id_allocation')
@@ -0,0 +1,27 @@
+"""Extend the history index with id for keyset pagination on (timestamp, id)
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 14:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_conversation_log_user_id_timestamp_id', 'conversation_log', ['user_id', 'timestamp', 'id'])
+    op.drop_index('ix_conversation_log_user_id_timestamp', table_name='conversation_log')
+
+
+def downgrade() -> None:
+    op.create_index('ix_conversation_log_user_id_timestamp', 'conversation_log', ['user_id', 'timestamp'])
+    op.drop_index('ix_conversation_log_user_id_timestamp_id', table_name='conversation_log')
@@ -0,0 +1,38 @@
+"""Add profile for structured profiles extracted from flow answers
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 16:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'profile',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('answers', sa.JSON(), nullable=False),
+        sa.Column('answers_hash', sa.String(length=64), nullable=False),
+        sa.Column('extractor', sa.String(length=16), nullable=False),
+        sa.Column('data', sa.JSON(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+    op.create_index('ix_profile_answers_hash', 'profile', ['answers_hash'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_profile_answers_hash', table_name='profile')
+    op.drop_table('profile')
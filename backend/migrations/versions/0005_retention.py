@@ -0,0 +1,45 @@
+"""Add a retention class and time index to conversation_log, and the conversation_archive catalog
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 20:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Existing rows are all answers to the flow or prompts; without a way to tell, keep them as answers
+    op.add_column('conversation_log',
+                  sa.Column('kind', sa.String(length=16), nullable=False, server_default='answer'))
+    op.create_index('ix_conversation_log_timestamp_id', 'conversation_log', ['timestamp', 'id'])
+    op.create_table(
+        'conversation_archive',
+        sa.Column('month', sa.String(length=7), nullable=False),
+        sa.Column('starts_at', sa.DateTime(), nullable=False),
+        sa.Column('ends_at', sa.DateTime(), nullable=False),
+        sa.Column('path', sa.String(length=255), nullable=False),
+        sa.Column('rows', sa.Integer(), nullable=False),
+        sa.Column('bytes', sa.Integer(), nullable=False),
+        sa.Column('blocks', sa.JSON(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('month'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('conversation_archive')
+    op.drop_index('ix_conversation_log_timestamp_id', table_name='conversation_log')
+    # SQLite cannot drop a column in place; batch mode copies the table
+    with op.batch_alter_table('conversation_log') as batch_op:
+        batch_op.drop_column('kind')
@@ -0,0 +1,127 @@
+"""
+Preforking production entry point: build the app once, then fork workers that share it.
+
+``serve.py`` runs one process. This master imports everything, builds the app
+with ``warm_up`` (compiled flow, numpy, match index), moves the surviving
+objects out of the garbage collector's reach with ``gc.freeze`` so collections
+in the workers never write to their pages, and forks ``--workers`` children
+that share that memory copy-on-write. Every child serves the inherited
+listening socket on its own event loop and the kernel spreads new connections
+across them. The master only restarts children that die and forwards SIGTERM/SIGINT.
+
+Nothing that cannot cross a fork is opened before it: the SQLAlchemy pool is
+disposed, and the SQLite-backed stores reopen their connections in a new
+process. Background threads (log writer, job runner, profile extractor) start
+on first use, so each worker starts its own.
+
+A shared socket does not pin a client to a worker, and Socket.IO long-polling
+needs every request of a session to reach the same process. Clients must use
+the websocket transport (``transports: ['websocket']``), and a shared BUS_BACKEND
+or SOCKETIO_MESSAGE_QUEUE must be set so emits reach sockets held by other workers. Behind a sticky load
+balancer, run ``serve.py`` once per port instead.
+
+Run:
+    python prefork.py --workers 4 --port 5000
+"""
+import os
+
+os.environ.setdefault("SOCKETIO_ASYNC_MODE", "eventlet")
+os.environ.setdefault("EVENTLET_THREADPOOL_SIZE", "1")
+os.environ.setdefault("SQLALCHEMY_ECHO", "false")
+os.environ.setdefault("LAZY_INIT", "false")
+
+import eventlet  # type: ignore
+eventlet.monkey_patch()
+
+import argparse  # noqa: E402
+import gc  # noqa: E402
+import logging  # noqa: E402
+import signal  # noqa: E402
+import sys  # noqa: E402
+
+import eventlet.wsgi  # type: ignore # noqa: E402
+from app import create_app, db, warm_up  # noqa: E402
+
+logger = logging.getLogger("spokesperson.prefork")
+
+# The master blocks in wait() and sleep() without starting an event loop of its own,
+# which its children would otherwise inherit
+_os = eventlet.patcher.original("os")
+_time = eventlet.patcher.original("time")
+
+# A worker that dies sooner than this after starting is restarted only after a pause
+MIN_WORKER_LIFETIME = 1.0
+
+
+def build():
+    """Create and warm the app in the master, leaving no open database connection behind."""
+    app, _, _ = create_app()
+    warm_up(app)
+    with app.app_context():
+        db.engine.dispose()
+    return app
+
+
+def serve(app, sock):
+    """Worker body: serve ``sock`` until SIGTERM, then exit through the normal interpreter shutdown."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The master forwards Ctrl-C as SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    eventlet.wsgi.server(sock, app, log_output=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the app from several preforked worker processes.")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 5000)))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--backlog", type=int, default=2048)
+    args = parser.parse_args(argv)
+
+    app = build()
+    sock = eventlet.listen((args.host, args.port), backlog=args.backlog)
+    gc.collect()
+    gc.freeze()
+
+    workers = {}
+    stopping = []
+
+    def spawn():
+        pid = _os.fork()
+        if pid == 0:
+            try:
+                serve(app, sock)
+            finally:
+                sys.exit(0)
+        workers[pid] = _time.monotonic()
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in workers:
+            try:
+                _os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(max(1, args.workers)):
+        spawn()
+    logger.info("Serving on %s:%s with %d workers", args.host, args.port, len(workers))
+
+    while workers:
+        try:
+            pid, status = _os.wait()
+        except ChildProcessError:
+            break
+        started = workers.pop(pid, None)
+        if stopping or started is None:
+            continue
+        logger.warning("Worker %d exited with status %d; restarting", pid, _os.waitstatus_to_exitcode(status))
+        if _time.monotonic() - started < MIN_WORKER_LIFETIME:
+            _time.sleep(MIN_WORKER_LIFETIME)
+        spawn()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
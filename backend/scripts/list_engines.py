@@ -1,52 +1,59 @@
-import openai  # type: ignore
 import os
+import sys
+
+import requests  # type: ignore
 from dotenv import load_dotenv  # type: ignore
 
+# Ensure that the application modules can be imported
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.providers import parse_providers  # noqa: E402
+from config.config import Config  # noqa: E402
+
 # Load environment variables from the .env file
 load_dotenv()
 
-# Set OpenAI API key from environment variable
-openai.api_key = os.getenv("OPENAI_API_KEY")
 
-def list_openai_engines():
+def list_models(timeout=10.0):
     """
-    Retrieve and print a list of available OpenAI engines/models.
+    Print the models offered by each provider in ``LLM_PROVIDERS``.
 
-    This function interacts with the OpenAI API to get a list of all available engines or models
-    associated with the provided API key. The function will print the engine ID and object type
-    for each available model.
+    Every OpenAI-compatible endpoint (the hosted API, a second vendor, a local
+    llama.cpp or Ollama server) answers ``GET {base}/models``; canned providers
+    are listed without a request.
 
     Example Output:
     ---------------
-    Available Engines/Models:
-    ID: text-davinci-003, Object: engine
-    ID: text-curie-001, Object: engine
-
-    Raises:
-    -------
-    Exception
-        If an error occurs during the API call, the exception is caught and a descriptive
-        message is printed to the console.
+    primary (https://api.openai.com/v1, using gpt-3.5-turbo):
+      gpt-3.5-turbo
+      gpt-4o-mini
+    template: canned replies, no model
+
+    Parameters:
+    -----------
+    timeout : float
+        Seconds to wait for each provider.
     """
-    try:
-        # Retrieve the list of available engines/models using the OpenAI API
-        engines = openai.Engine.list()
-        print("Available Engines/Models:")
-
-        # Loop through the returned engines and print the details
-        for engine in engines['data']:
-            print(f"ID: {engine['id']}, Object: {engine['object']}")
-
-    except openai.error.AuthenticationError:
-        print("Error: Invalid API key provided. Please check your OpenAI API key.")
-    except openai.error.OpenAIError as oe:
-        print(f"OpenAI API Error: {str(oe)}. Check your API key and network connection.")
-    except Exception as e:
-        print(f"An unexpected error occurred: {str(e)}")
+    config = {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+    for _, provider in parse_providers(config.get("LLM_PROVIDERS") or "primary", config):
+        if provider.canned:
+            print(f"{provider.name}: canned replies, no model")
+            continue
+        client = provider.client
+        print(f"{provider.name} ({client.api_base}, using {client.model}):")
+        headers = {"Authorization": f"Bearer {client.api_key}"} if client.api_key else {}
+        try:
+            response = requests.get(f"{client.api_base}/models", headers=headers, timeout=timeout)
+            response.raise_for_status()
+            for model in sorted(item["id"] for item in response.json().get("data", [])):
+                print(f"  {model}")
+        except requests.exceptions.HTTPError as e:
+            print(f"  Error: {e}. Check the provider's API key.")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"  Error: {e}. Check the URL and network connection.")
+        finally:
+            provider.close()
+
 
 if __name__ == "__main__":
-    # Ensure the OpenAI API key is set before proceeding
-    if openai.api_key:
-        list_openai_engines()
-    else:
-        print("Error: OpenAI API key not set. Please configure it in your environment variables.")
+    list_models()
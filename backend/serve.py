@@ -0,0 +1,49 @@
+"""
+Production entry point for the Socket.IO server on an event-loop worker.
+
+Each connection is a green thread rather than an OS thread, so a single process
+holds thousands of idle sockets. Monkey patching has to happen before anything
+else imports ``socket`` or ``threading``, which is why this lives apart from
+``app/main.py`` and outside the ``app`` package (importing the package would load Flask first).
+
+Run directly:
+    SOCKETIO_ASYNC_MODE=eventlet python serve.py
+
+Or under gunicorn (one worker per process; add processes behind a sticky load
+balancer and set SOCKETIO_MESSAGE_QUEUE so emits reach every worker):
+    gunicorn -k eventlet -w 1 --bind 0.0.0.0:5000 serve:app
+"""
+import os
+
+ASYNC_MODE = os.environ.setdefault("SOCKETIO_ASYNC_MODE", "eventlet")
+# SQLite has a single writer, so one native DB thread avoids lock contention between
+# native threads; raise this for PostgreSQL
+os.environ.setdefault("EVENTLET_THREADPOOL_SIZE", "1")
+# Statement logging would run on the native DB threads and contend on green logging locks
+os.environ.setdefault("SQLALCHEMY_ECHO", "false")
+
+if ASYNC_MODE == "eventlet":
+    import eventlet  # type: ignore
+    eventlet.monkey_patch()
+elif ASYNC_MODE == "gevent":
+    from gevent import monkey  # type: ignore
+    monkey.patch_all()
+
+from app import create_app  # noqa: E402
+from flask import Flask  # type: ignore # noqa: E402
+from flask_socketio import SocketIO  # type: ignore # noqa: E402
+from flask_sqlalchemy import SQLAlchemy  # type: ignore # noqa: E402
+
+app: Flask
+socketio: SocketIO
+db: SQLAlchemy
+app, socketio, db = create_app()
+
+if __name__ == '__main__':
+    socketio.run(
+        app,
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", 5000)),
+        debug=False,
+        log_output=False,
+    )
@@ -0,0 +1,69 @@
+# conftest.py
+"""
+Shared pytest fixtures for the Spokesperson backend.
+
+Every test gets a fresh app bound to a throwaway SQLite database and an
+in-memory state store, so nothing touches instance/spokesperson.db. Set
+TEST_DATABASE_URL (e.g. postgresql+psycopg2://localhost/spokesperson_test) to
+run the same tests against PostgreSQL; tables are dropped after each test.
+"""
+
+import os
+import sys
+
+import pytest
+
+# Ensure that the application modules can be imported
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.config import TestingConfig  # noqa: E402
+from app import create_app, db  # noqa: E402
+from app.models import User  # noqa: E402
+from app.fake_llm import FakeLLMServer  # noqa: E402
+
+
+@pytest.fixture
+def fake_llm():
+    """A local fake chat-completions server with no simulated latency."""
+    with FakeLLMServer() as server:
+        yield server
+
+
+@pytest.fixture
+def app(tmp_path, fake_llm):
+    """Flask app wired to a temporary database and the fake LLM server."""
+
+    class TestConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = os.getenv("TEST_DATABASE_URL") or f"sqlite:///{tmp_path / 'test.db'}"
+        SQLALCHEMY_ECHO = False
+        LLM_API_BASE = fake_llm.url
+        LLM_BACKOFF_BASE = 0.01
+
+    app, _, _ = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        # Handlers fall back to user 1; PostgreSQL enforces the foreign key to it
+        db.session.add(User(id=1, username="demo"))
+        db.session.commit()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        if db.engine.dialect.name != "sqlite":
+            db.drop_all()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    """Flask HTTP test client."""
+    return app.test_client()
+
+
+@pytest.fixture
+def socket_client(app):
+    """Flask-SocketIO test client connected to the app."""
+    from app import socketio
+    client = socketio.test_client(app, flask_test_client=app.test_client())
+    yield client
+    if client.is_connected():
+        client.disconnect()
@@ -7,6 +7,7 @@ then queries and prints the database contents for verification.
 
 import sys
 import os
+import tempfile
 from sqlalchemy.exc import IntegrityError # type: ignore
 
 if os.path.exists('spokesperson.db'):
@@ -17,12 +18,21 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 from app import create_app, db  # Import the app factory and db instance
 from app.models import User, ConversationLog  # Import models for database operations
+from config.config import Config
+
+
+class ScratchConfig(Config):
+    # A throwaway database, so running the suite never writes to instance/spokesperson.db
+    SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'spokesperson.db')}"
+
 
 # Create the Flask application using the factory function
-app, _, _ = create_app()  # Ignore socketio and db in the tuple return values for this test
+app, _, _ = create_app(ScratchConfig)  # Ignore socketio and db in the tuple return values for this test
 
 # Use the application context to perform database operations
 with app.app_context():
+    db.create_all()
+
     # Check if the test user already exists to avoid duplicate entries
     existing_user = User.query.filter_by(username="TestUserDB").first()
 
@@ -0,0 +1,134 @@
+# test_ann.py
+"""
+Tests for the memory-mapped IVF index: recall, persistence, deltas,
+tombstones, background rebuilds and serving matches through it.
+"""
+
+import numpy as np
+import pytest
+
+import app.ann as ann
+from app import db
+from app.ann import AnnIndex, current_generation, write_generation
+from app.matching import MatchIndex
+from app.models import Profile, User
+
+DIM = 16
+
+
+@pytest.fixture
+def clustered():
+    """2000 unit vectors around 40 cluster centres."""
+    rng = np.random.default_rng(3)
+    centres = rng.standard_normal((40, DIM))
+    vectors = centres[rng.integers(0, 40, 2000)] + rng.normal(0, 0.3, (2000, DIM))
+    vectors = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+    return np.arange(1, 2001), vectors
+
+
+def wait_for_rebuild(index):
+    thread = index._rebuild_thread
+    if thread is not None:
+        thread.join()
+
+
+def recall(index, exact, queries, k=10):
+    hits = 0
+    for query in queries:
+        expected = {user_id for user_id, _ in exact.top_k(query, k)}
+        hits += len(expected & {user_id for user_id, _ in index.top_k(query, k)})
+    return hits / (k * len(queries))
+
+
+def test_ivf_recall_against_exact_search(tmp_path, clustered):
+    ids, vectors = clustered
+    write_generation(str(tmp_path), ids, vectors)
+    exact = MatchIndex(DIM)
+    exact.upsert_many(ids.tolist(), vectors)
+    index = AnnIndex(str(tmp_path), DIM, nprobe=8)
+    assert index.meta["nlist"] == 45 and len(index) == 2000
+    assert recall(index, exact, vectors[:50]) >= 0.9
+    assert index.top_k(vectors[0], 10, nprobe=45) == pytest.approx(exact.top_k(vectors[0], 10))
+
+
+def test_generations_are_memory_mapped_and_shared(tmp_path, clustered):
+    ids, vectors = clustered
+    write_generation(str(tmp_path), ids, vectors)
+    first, second = AnnIndex(str(tmp_path), DIM), AnnIndex(str(tmp_path), DIM)
+    assert isinstance(first._base.vectors, np.memmap)
+    assert np.array_equal(first.vector(17), vectors[16]) and np.array_equal(second.vector(17), vectors[16])
+    assert AnnIndex(str(tmp_path), DIM * 2).generation is None  # Other encoder layout: ignored
+
+
+def test_inserts_updates_and_tombstones(tmp_path, clustered):
+    ids, vectors = clustered
+    write_generation(str(tmp_path), ids, vectors)
+    index = AnnIndex(str(tmp_path), DIM)
+
+    index.upsert(5000, vectors[0])
+    assert {user_id for user_id, _ in index.top_k(vectors[0], 2)} == {1, 5000}
+    index.remove(1)
+    assert 1 not in index and all(user_id != 1 for user_id, _ in index.top_k(vectors[0], 20))
+    index.upsert(2, -vectors[1])
+    assert index.vector(2) == pytest.approx(-vectors[1])
+    assert 2 not in {user_id for user_id, _ in index.top_k(vectors[1], 20)}
+    assert len(index) == 2000 and index.pending == 4  # 5000 and 2 in the delta, 1 and 2 tombstoned
+
+
+def test_rebuild_compacts_and_keeps_concurrent_changes(tmp_path, clustered, monkeypatch):
+    ids, vectors = clustered
+    write_generation(str(tmp_path), ids[:1500], vectors[:1500])
+    index = AnnIndex(str(tmp_path), DIM, rebuild_min=100, rebuild_ratio=0.1)
+    index.upsert_many(ids[1500:].tolist(), vectors[1500:])
+    index.remove(3)
+
+    write = ann.write_generation
+
+    def write_during_changes(*args, **kwargs):
+        index.upsert(9000, vectors[9])  # Arrives after the snapshot
+        index.remove(4)
+        return write(*args, **kwargs)
+
+    monkeypatch.setattr(ann, "write_generation", write_during_changes)
+    assert index.maybe_rebuild({"built_until": "2026-01-01T00:00:00"}) is True
+    wait_for_rebuild(index)
+
+    assert index.generation == current_generation(str(tmp_path)) == "gen-000002"
+    assert index.meta["count"] == 1999 and index.meta["built_until"] == "2026-01-01T00:00:00"
+    assert 9000 in index and 4 not in index and 3 not in index and 2000 in index
+    assert index.pending == 2  # 9000 in the delta, 4 tombstoned
+
+    other = AnnIndex(str(tmp_path), DIM)
+    assert other.generation == "gen-000002" and len(other) == 1999
+
+
+def test_other_processes_pick_up_new_generations(tmp_path, clustered):
+    ids, vectors = clustered
+    write_generation(str(tmp_path), ids[:100], vectors[:100])
+    reader = AnnIndex(str(tmp_path), DIM)
+    reader.upsert(7000, vectors[0])
+    assert reader.reload_if_changed() is False
+
+    write_generation(str(tmp_path), ids, vectors)
+    assert reader.reload_if_changed() is True
+    assert len(reader) == 2000 and 7000 not in reader
+
+
+def test_match_engine_serves_from_ivf_index(app, client, tmp_path):
+    from app import match_engine, profile_extractor
+    app.config.update(MATCH_INDEX="ivf", MATCH_INDEX_PATH=str(tmp_path / "index"), MATCH_REBUILD_MIN=2)
+    match_engine.init_app(app, profiles=profile_extractor)
+    answers = {"age": "30", "personality": "Adventurous", "communication": "Banter", "hobby": "hiking"}
+    with app.app_context():
+        db.session.add_all([User(id=i, username=f"user{i}") for i in range(2, 5)])
+        db.session.add_all([Profile(user_id=i, answers=dict(answers, name=str(i)), answers_hash=str(i),
+                                    extractor="rules/1", data={}) for i in range(1, 5)])
+        db.session.commit()
+
+    with client.session_transaction() as session:
+        session["user_id"] = 1
+    body = client.get('/matches/1?k=3').get_json()
+    assert sorted(match["user_id"] for match in body["matches"]) == [2, 3, 4]
+    wait_for_rebuild(match_engine.index)
+    assert match_engine.index.generation == "gen-000001"
+    assert match_engine.index.meta["built_until"] is not None
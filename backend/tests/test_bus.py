@@ -0,0 +1,155 @@
+# test_bus.py
+"""
+Tests for the message bus: the log backends, acknowledgements and replay on
+reconnect, and delivery between worker processes over a shared SQLite log.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from flask import Flask  # type: ignore
+
+from app.bus import MemoryBusBackend, MessageBus, RedisBusBackend, SQLiteBusBackend
+from app.localredis import LocalRedis
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+PUBLISHER = """
+import json, sys, time
+from flask import Flask
+from app.bus import MessageBus
+app = Flask("publisher")
+app.config.update(BUS_BACKEND="sqlite", BUS_SQLITE_PATH=sys.argv[1])
+bus = MessageBus()
+bus.init_app(app)
+count, batch = int(sys.argv[2]), 100
+start = time.time()
+for first in range(0, count, batch):
+    bus.publish_many([(f"user:{i % 10}", "response", {"n": i}, None) for i in range(first, min(first + batch, count))])
+bus.stop()
+print(json.dumps({"start": start, "published": time.time() - start}))
+"""
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteBusBackend(str(tmp_path / "bus.db"))
+    if request.param == "redis":
+        return RedisBusBackend(LocalRedis())
+    return MemoryBusBackend()
+
+
+def _bus(path, deliver):
+    app = Flask("bus")
+    app.config.update(BUS_BACKEND="sqlite", BUS_SQLITE_PATH=str(path), BUS_POLL_INTERVAL=0.01)
+    bus = MessageBus()
+    bus.init_app(app, deliver=deliver)
+    return bus
+
+
+def test_backend_log_replay_ack_and_purge(backend):
+    now = time.time()
+    rows = [("user:1", "response", {"message": "a"}, 11, "w1", now - 100),
+            ("user:2", "profile", {"city": "Oslo"}, None, "w1", now - 100),
+            ("user:1", "response", {"message": "b"}, 12, "w2", now)]
+    assert backend.append(rows) == 3 and backend.last_seq() == 3
+
+    log = backend.fetch(1, 10)
+    assert [(m.seq, m.room, m.data) for m in log] == [(2, "user:2", {"city": "Oslo"}), (3, "user:1", {"message": "b"})]
+    assert [m.message_id for m in backend.replay("user:1", 11, 10)] == [12]
+    assert [m.data["message"] for m in backend.replay("user:1", 0, 10)] == ["a", "b"]
+
+    backend.ack({"user:1": 12})
+    backend.ack({"user:1": 11})  # Acknowledgements never go backwards
+    assert backend.acked("user:1") == 12 and backend.acked("user:3") == 0
+
+    assert backend.purge(now - 50, now - 50) >= 2
+    assert [m.message_id for m in backend.replay("user:1", 0, 10)] == [12]
+
+
+def test_shared_bus_delivers_to_other_instances_only(tmp_path):
+    received, own = [], []
+    listener = _bus(tmp_path / "bus.db", lambda room, event, data: received.append((room, event, data)))
+    publisher = _bus(tmp_path / "bus.db", lambda room, event, data: own.append(room))
+    listener.start()
+    try:
+        publisher.publish("user:7", "response", {"id": "5", "message": "hi"}, message_id=5)
+        assert own == ["user:7"]  # This process's sockets are served at once
+        publisher.flush()
+        deadline = time.monotonic() + 5
+        while not received and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert received == [("user:7", "response", {"id": "5", "message": "hi"})]
+        assert publisher.stats()["pending"] == 0 and listener.stats()["delivered"] == 1
+    finally:
+        listener.stop()
+        publisher.stop()
+
+
+def signed_in(app, user_id=1):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
+    return client
+
+
+def test_replies_are_replayed_on_reconnect_until_acknowledged(app):
+    from app import socketio
+    app.config["STATE_KEY"] = "user"
+
+    first = socketio.test_client(app, flask_test_client=signed_in(app))
+    first.get_received()
+    first.emit('message', "Alex")
+    reply = [r["args"][0] for r in first.get_received() if r["name"] == "response"][-1]
+    assert int(reply["id"]) > 0
+    first.disconnect()
+
+    # The reply is sent again to the new socket, after the current question
+    second = socketio.test_client(app, flask_test_client=signed_in(app))
+    replayed = [r["args"][0] for r in second.get_received()]
+    assert replayed[-1] == reply and len(replayed) == 3
+    second.emit('ack', {"id": reply["id"]})
+    second.disconnect()
+
+    third = socketio.test_client(app, flask_test_client=signed_in(app))
+    assert len(third.get_received()) == 2
+    third.disconnect()
+
+    # A client can also say what it already has
+    fourth = socketio.test_client(app, flask_test_client=signed_in(app), auth={"last_id": 0})
+    assert fourth.get_received()[-1]["args"][0] == reply
+    fourth.disconnect()
+
+    # Anonymous sockets do not follow anyone, so nothing is replayed to them
+    anonymous = socketio.test_client(app, flask_test_client=app.test_client(), auth={"last_id": 0})
+    assert len(anonymous.get_received()) == 2
+    anonymous.disconnect()
+
+
+def test_cross_process_delivery_and_fan_out_throughput(tmp_path):
+    count = 5000
+    path = tmp_path / "bus.db"
+    received = []
+    listener = _bus(path, lambda room, event, data: received.append(data["n"]))
+    listener.batch_size = 1000
+    listener.start()
+    try:
+        out = subprocess.run([sys.executable, "-c", PUBLISHER, str(path), str(count)], cwd=BACKEND,
+                             capture_output=True, text=True, check=True, timeout=60)
+        deadline = time.monotonic() + 30
+        while len(received) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        finished = time.time()
+    finally:
+        listener.stop()
+
+    assert received == list(range(count))  # Every message, once, in publishing order
+    timing = json.loads(out.stdout.strip().splitlines()[-1])
+    rate = count / (finished - timing["start"])
+    print(f"\nbus fan-out across processes: {count} messages in {finished - timing['start']:.3f}s ({rate:.0f} msg/s)")
+    assert rate > 500
@@ -0,0 +1,129 @@
+# test_cache.py
+"""
+Tests for the completion cache: keys, eviction, shared backend and single-flight.
+"""
+
+import threading
+import time
+
+from app.cache import CompletionCache, MemoryBackend
+
+
+def make_cache(**config):
+    """Build a standalone cache from a config mapping."""
+    class _App:
+        extensions = {}
+    _App.config = config
+    return CompletionCache(_App())
+
+
+def user(text):
+    return [{"role": "user", "content": text}]
+
+
+def test_key_ignores_case_and_whitespace():
+    assert CompletionCache.key_for("m", user("Hello  there"), 50) == CompletionCache.key_for("m", user(" hello there "), 50)
+    assert CompletionCache.key_for("m", user("hello"), 50) != CompletionCache.key_for("m", user("hello"), 51)
+    assert CompletionCache.key_for("m", user("hello"), 50) != CompletionCache.key_for("other", user("hello"), 50)
+
+
+def test_memory_backend_lru_and_ttl():
+    backend = MemoryBackend(max_entries=2)
+    backend.set("a", "1", ttl=60)
+    backend.set("b", "2", ttl=60)
+    backend.get("a")
+    backend.set("c", "3", ttl=60)
+    assert backend.get("b") is None
+    assert backend.get("a") == "1"
+    backend.set("d", "4", ttl=-1)
+    assert backend.get("d") is None
+
+
+def test_get_or_compute_hits_after_first_call():
+    cache = make_cache()
+    calls = []
+    compute = lambda: calls.append(1) or "reply"  # noqa: E731
+    assert cache.get_or_compute("m", user("Hi"), 50, compute) == "reply"
+    assert cache.get_or_compute("m", user("  hi "), 50, compute) == "reply"
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1 and stats["upstream_calls"] == 1
+
+
+def test_token_semantic_key_matches_reordered_prompt():
+    cache = make_cache(CACHE_SEMANTIC_KEY="tokens")
+    cache.store("m", user("I like hiking and music!"), 50, "nice")
+    assert cache.lookup("m", user("music and hiking, I like"), 50) == "nice"
+    assert cache.stats()["semantic_hits"] == 1
+
+
+def test_embedder_fuzzy_lookup():
+    cache = make_cache()
+    cache.embedder = lambda text: [text.count("a"), text.count("b"), 1]
+    cache.store("m", user("aab"), 50, "close enough")
+    assert cache.lookup("m", user("aba"), 50) == "close enough"
+    assert cache.lookup("m", user("bbbbbbb"), 50) is None
+
+
+def test_disabled_cache_always_computes():
+    cache = make_cache(CACHE_ENABLED=False)
+    calls = []
+    for _ in range(2):
+        cache.get_or_compute("m", user("Hi"), 50, lambda: calls.append(1) or "reply")
+    assert len(calls) == 2
+
+
+def test_errors_are_not_cached():
+    cache = make_cache()
+    def boom():
+        raise RuntimeError("upstream down")
+    for _ in range(2):
+        try:
+            cache.get_or_compute("m", user("Hi"), 50, boom)
+        except RuntimeError:
+            pass
+    assert cache.lookup("m", user("Hi"), 50) is None
+
+
+def test_single_flight_coalesces_concurrent_misses():
+    cache = make_cache()
+    calls = []
+    def slow():
+        calls.append(1)
+        time.sleep(0.1)
+        return "reply"
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("m", user("same"), 50, slow)))
+               for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["reply"] * 10
+    assert len(calls) == 1
+    assert cache.stats()["coalesced"] >= 1
+
+
+def test_sqlite_backend_shared_between_instances(tmp_path):
+    path = str(tmp_path / "cache.db")
+    first = make_cache(CACHE_BACKEND="sqlite", CACHE_SQLITE_PATH=path)
+    second = make_cache(CACHE_BACKEND="sqlite", CACHE_SQLITE_PATH=path)
+    first.store("m", user("shared"), 50, "from worker one")
+    assert second.lookup("m", user("shared"), 50) == "from worker one"
+    assert second.stats()["shared_hits"] == 1
+
+
+def test_stream_through_records_completion():
+    cache = make_cache()
+    assert list(cache.stream_through("m", user("s"), 50, lambda: iter(["a", " b"]))) == ["a", " b"]
+    assert list(cache.stream_through("m", user("s"), 50, lambda: iter(["never"]))) == ["a b"]
+
+
+def test_generate_response_served_from_cache(client, fake_llm, monkeypatch):
+    # With history in the prompt, repeated inputs are different prompts; compare bare prompts
+    from app import context_manager
+    monkeypatch.setattr(context_manager, "enabled", False)
+    for _ in range(3):
+        response = client.post('/generate_response', json={"user_input": "Hello"})
+        assert response.get_json()["summary"] == "You said: Hello"
+    assert fake_llm.request_count == 1
@@ -0,0 +1,96 @@
+# test_context.py
+"""
+Tests for multi-turn prompt assembly: token counting, budget trimming,
+rolling summaries, cold loads from ConversationLog and the HTTP wiring.
+"""
+
+from app import context_manager, db, log_writer
+from app.context import ContextManager, ExtractiveSummarizer, LLMSummarizer, TokenCounter, Turn
+
+
+def make_manager(app, **overrides):
+    app.config.update({"CONTEXT_SYSTEM_PROMPT": "Be brief.", "CONTEXT_MAX_PROMPT_TOKENS": 200,
+                       "CONTEXT_SUMMARY_MAX_TOKENS": 40, **overrides})
+    return ContextManager(app)
+
+
+def test_token_counter_estimates_without_tiktoken():
+    counter = TokenCounter()
+    assert counter.count("") == 0
+    assert 5 <= counter.count("Hello there, how are you?") <= 8
+    assert counter.count("internationalization") > counter.count("hello")
+    assert counter.message("hi") == counter.count("hi") + 4
+
+
+def test_first_prompt_has_system_and_user_message(app):
+    manager = make_manager(app)
+    with app.app_context():
+        window = manager.build("s", 1, "Hello")
+    assert window.messages == [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "Hello"}]
+    assert window.tokens_saved == 0 and window.turns == 0
+
+
+def test_long_conversations_stay_within_budget(app):
+    manager = make_manager(app)
+    with app.app_context():
+        for i in range(40):
+            window = manager.build("s", 1, f"Message number {i}. I enjoy hiking, climbing and long walks by the sea.")
+            manager.record_reply("s", f"Reply {i}: that sounds lovely, tell me more about it.")
+    assert window.prompt_tokens <= 200
+    assert window.messages[1]["content"].startswith("Earlier in this conversation:")
+    assert window.messages[-2] == {"role": "assistant", "content": "Reply 38: that sounds lovely, tell me more about it."}
+    assert window.summarized_turns + window.turns == 78
+    assert window.tokens_saved > 1000
+    # Compaction happens in batches, not on every request
+    assert manager.compactions < 20
+
+
+def test_cold_session_loads_logged_turns(app):
+    with app.app_context():
+        ids = [log_writer.log(1, text) for text in ("I'm Alex", "I like chess")]
+        current = log_writer.log(1, "What should I write?")
+        window = make_manager(app).build("s", 1, "What should I write?", current)
+    assert [m["content"] for m in window.messages[1:]] == ["I'm Alex", "I like chess", "What should I write?"]
+    assert ids[0] < ids[1] < current
+
+
+def test_extractive_summary_respects_token_limit():
+    counter = TokenCounter()
+    turns = [Turn(None, "user", f"My name is Sam {i}. And more detail follows here.", 10) for i in range(30)]
+    summary = ExtractiveSummarizer().summarize("", turns, 40, counter)
+    assert counter.count(summary) <= 40
+    assert summary.splitlines()[-1] == "User: My name is Sam 29."
+
+
+def test_llm_summarizer_and_fallback(app, fake_llm):
+    from app import llm
+    fake_llm.reply = "The user is Sam, who likes chess."
+    turns = [Turn(None, "user", "I'm Sam and I like chess.", 10)]
+    assert LLMSummarizer(llm).summarize("", turns, 40, TokenCounter()) == "The user is Sam, who likes chess."
+    fake_llm.fail_first = 10
+    assert LLMSummarizer(llm).summarize("", turns, 40, TokenCounter()) == "User: I'm Sam and I like chess."
+
+
+def test_generate_response_sends_history(client, fake_llm):
+    with client.session_transaction() as session:
+        session["user_id"] = 1
+    client.post('/generate_response', json={"user_input": "My name is Alex"})
+    response = client.post('/generate_response', json={"user_input": "What is my name?"})
+    sent = [m["content"] for m in fake_llm.requests[-1]["messages"]]
+    assert sent[-3:] == ["My name is Alex", "You said: My name is Alex", "What is my name?"]
+    assert int(response.headers["X-Prompt-Tokens"]) == response.get_json()["context"]["prompt_tokens"]
+    assert response.headers["Server-Timing"].startswith("context;dur=")
+    assert context_manager.stats()["requests"] == 2
+
+
+def test_anonymous_clients_do_not_share_history(app, fake_llm):
+    first, second = app.test_client(), app.test_client()
+    first.post('/generate_response', json={"user_input": "My secret is blue"})
+    second.post('/generate_response', json={"user_input": "What is my secret?"})
+    first.post('/generate_response', json={"user_input": "And my name?"})
+
+    prompts = [[m["content"] for m in request["messages"] if m["role"] != "system"] for request in fake_llm.requests]
+    assert prompts == [["My secret is blue"], ["What is my secret?"], ["And my name?"]]
+    with app.app_context():
+        window = context_manager.build("s", None, "Hello")  # A socket without a user starts empty
+    assert window.turns == 0 and "blue" not in str(window.messages)
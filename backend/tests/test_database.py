@@ -0,0 +1,79 @@
+# test_database.py
+"""
+Tests for the database engine configuration and migrations.
+"""
+
+import os
+
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config as AlembicConfig
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine, inspect, text  # type: ignore
+from sqlalchemy.pool import NullPool  # type: ignore
+
+from app import db
+from app.database import engine_options
+from config.config import DevelopmentConfig, ProductionConfig, get_config
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def test_sqlite_connections_use_wal_and_normal_sync(app):
+    with app.app_context():
+        if db.engine.dialect.name != "sqlite":
+            pytest.skip("SQLite pragmas only")
+        with db.engine.connect() as conn:
+            assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+            assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+
+
+def test_history_index_exists(app):
+    with app.app_context():
+        indexes = {ix["name"]: ix["column_names"] for ix in inspect(db.engine).get_indexes("conversation_log")}
+    assert indexes["ix_conversation_log_user_id_timestamp_id"] == ["user_id", "timestamp", "id"]
+
+
+def test_engine_options_size_server_pools():
+    config = {"SQLALCHEMY_DATABASE_URI": "postgresql://app@db/spokesperson", "DB_POOL_SIZE": 5}
+    options = engine_options(config)
+    assert options["pool_size"] == 5
+    assert options["pool_pre_ping"] is True
+    assert options["pool_recycle"] == 1800
+
+    config["SQLALCHEMY_ENGINE_OPTIONS"] = {"poolclass": NullPool}
+    assert "pool_size" not in engine_options(config)
+
+
+def test_engine_options_for_sqlite_memory_skip_pool_sizing():
+    options = engine_options({"SQLALCHEMY_DATABASE_URI": "sqlite://"})
+    assert "pool_size" not in options
+    assert options["connect_args"]["timeout"] == 5
+
+
+def test_get_config_by_environment(monkeypatch):
+    monkeypatch.setenv("APP_ENV", "production")
+    assert get_config() is ProductionConfig
+    assert ProductionConfig.SQLALCHEMY_ECHO is False
+    assert get_config("development") is DevelopmentConfig
+    with pytest.raises(ValueError):
+        get_config("staging")
+
+
+def test_migrations_build_the_model_schema(tmp_path):
+    url = os.getenv("TEST_DATABASE_URL") or f"sqlite:///{tmp_path / 'migrated.db'}"
+    alembic_config = AlembicConfig(os.path.join(BACKEND_DIR, "alembic.ini"))
+    alembic_config.set_main_option("script_location", os.path.join(BACKEND_DIR, "migrations"))
+    alembic_config.set_main_option("sqlalchemy.url", url)
+
+    command.upgrade(alembic_config, "head")
+    engine = create_engine(url)
+    try:
+        with engine.connect() as conn:
+            assert compare_metadata(MigrationContext.configure(conn), db.metadata) == []
+        command.downgrade(alembic_config, "base")
+        assert set(inspect(engine).get_table_names()) == {"alembic_version"}
+    finally:
+        engine.dispose()
@@ -0,0 +1,124 @@
+# test_flow.py
+"""
+Tests for the compiled conversation-flow engine.
+"""
+
+import json
+import os
+
+import pytest
+
+from app.flow import DEFAULT_FLOW_PATH, FlowEngine, FlowError, compile_flow, load_flow
+from app.services import get_next_question, validate_input
+
+
+class _App:
+    def __init__(self, **config):
+        self.config = config
+        self.extensions = {}
+
+
+def small_flow(question="What is your name?"):
+    return {
+        "start": "name",
+        "nodes": [
+            {"id": "name", "question": question, "type": "text", "key": "name", "next": "mood"},
+            {"id": "mood", "question": "Happy or sad?", "type": "choice", "key": "mood",
+             "options": ["Happy", "Sad"], "branches": {"Sad": "why"}, "next": "age"},
+            {"id": "why", "question": "Why sad?", "type": "text", "key": "why", "next": "age"},
+            {"id": "age", "question": "Age?", "type": "number", "key": "age", "min": 18, "max": 99},
+        ],
+        "summary": {"template": "Bye {name}", "defaults": {"name": "User"}},
+    }
+
+
+def test_validators_normalize_and_reject():
+    flow = compile_flow(small_flow())
+    assert flow.nodes["name"].validate("  Alex ") == "Alex"
+    assert flow.nodes["name"].validate("   ") is None
+    assert flow.nodes["mood"].validate("sad") == "Sad"
+    assert flow.nodes["mood"].validate("Meh") is None
+    assert flow.nodes["age"].validate(" 30 ") == "30"
+    assert flow.nodes["age"].validate("17") is None
+    assert flow.nodes["age"].validate("3O") is None
+
+
+def test_choices_numbers_and_lengths_are_normalized():
+    definition = small_flow()
+    definition["max_length"] = 10
+    definition["nodes"][1]["options"].append("Deep-ish")
+    flow = compile_flow(definition)
+    assert flow.nodes["mood"].validate("  deep ISH! ") == "Deep-ish"
+    assert flow.nodes["mood"].validate("ＨＡＰＰＹ") == "Happy"  # Full-width letters, NFKC-normalized
+    assert flow.nodes["age"].validate("３０") == "30"
+    assert flow.nodes["age"].validate("²⁵") is None
+    assert flow.nodes["name"].validate("Alexandra") == "Alexandra"
+    assert flow.nodes["name"].validate("Alexandra Smith") is None  # The flow-wide max_length
+
+    definition["nodes"][1]["options"].append("happy!")
+    with pytest.raises(FlowError, match="only differ"):
+        compile_flow(definition)
+
+
+def test_validate_input_uses_the_compiled_rules():
+    assert validate_input("Alex", "text") and not validate_input("  ", "text")
+    assert validate_input("30", "number") and not validate_input("0", "number")
+    assert validate_input("deep discussions", "choice", ["Banter", "Deep discussions"])
+    assert not validate_input("Meh", "choice", ["Banter"]) and not validate_input("x", "choice")
+    assert not validate_input(None, "text") and not validate_input("x", "date")
+
+
+def test_branches_and_end_of_flow():
+    flow = compile_flow(small_flow())
+    mood = flow.nodes["mood"]
+    assert mood.next_for("Sad") == "why"
+    assert mood.next_for("Happy") == "age"
+    assert flow.nodes["age"].next_for("30") is None
+    assert flow.summary({}) == "Bye User"
+
+
+def test_default_flow_reprompts_short_answers():
+    flow = load_flow(DEFAULT_FLOW_PATH)
+    hobby = flow.nodes["hobby"]
+    assert hobby.next_for("music") == "hobby_details"
+    assert hobby.next_for("hiking and taking photos") == "personality"
+    assert [node.key for node in flow.main_path()] == [
+        "name", "age", "gender", "hobby", "personality", "communication", "passion", "ideal_date"]
+
+
+@pytest.mark.parametrize("mutate, message", [
+    (lambda d: d["nodes"][0].update(type="date"), "unknown type"),
+    (lambda d: d["nodes"][0].update(next="missing"), "undefined node"),
+    (lambda d: d["nodes"][1]["branches"].update(Meh="why"), "unknown option"),
+    (lambda d: d.update(start="nowhere"), "Start node"),
+])
+def test_compile_rejects_malformed_definitions(mutate, message):
+    definition = small_flow()
+    mutate(definition)
+    with pytest.raises(FlowError, match=message):
+        compile_flow(definition)
+
+
+def test_hot_reload_swaps_flow_and_keeps_old_version(tmp_path):
+    path = tmp_path / "flow.json"
+    path.write_text(json.dumps(small_flow()))
+    engine = FlowEngine(_App(FLOW_PATH=str(path), FLOW_RELOAD_INTERVAL=0))
+    old = engine.flow
+
+    path.write_text(json.dumps(small_flow("Who are you?")))
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000))
+    assert engine.reload()
+    assert engine.flow.start.question == "Who are you?"
+    assert engine.get(old.version) is old
+
+    # A broken edit leaves the running flow alone
+    path.write_text("{not json")
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 2_000_000))
+    assert not engine.reload()
+    assert engine.flow.start.question == "Who are you?"
+
+
+def test_get_next_question_follows_main_path(app):
+    assert get_next_question(0)["key"] == "name"
+    assert get_next_question(4)["options"] == ["Adventurous", "Routine-oriented"]
+    assert get_next_question(99, {"name": "Alex"})["question"].startswith("Nice to meet you, Alex!")
@@ -0,0 +1,133 @@
+# test_history.py
+"""
+Tests for the conversation history API, streaming export and export CLI.
+"""
+
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert  # type: ignore
+
+from app import db
+from app.history import decode_cursor, encode_cursor, gzip_chunks, iter_export, main as export_main
+from app.models import ConversationLog
+
+START = datetime(2026, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def client(app):
+    """HTTP client sending the operator token, which reading other users' messages requires."""
+    app.config["ADMIN_TOKEN"] = "ops"
+    client = app.test_client()
+    client.environ_base["HTTP_AUTHORIZATION"] = "Bearer ops"
+    return client
+
+
+@pytest.fixture
+def history(app):
+    """25 messages for user 1 (several sharing a timestamp) and 5 for user 2."""
+    rows = [{"id": i, "user_id": 1, "message": f"message {i}", "timestamp": START + timedelta(seconds=i // 3)}
+            for i in range(1, 26)]
+    rows += [{"id": 100 + i, "user_id": 2, "message": f"other {i}", "timestamp": START} for i in range(5)]
+    with app.app_context():
+        db.session.execute(insert(ConversationLog), rows)
+        db.session.commit()
+    return rows
+
+
+def collect_pages(client, url):
+    ids, pages, cursor = [], 0, None
+    while True:
+        response = client.get(url + (f"&cursor={cursor}" if cursor else ""))
+        assert response.status_code == 200
+        body = response.get_json()
+        ids.extend(row["id"] for row in body["conversations"])
+        pages += 1
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return ids, pages
+
+
+def test_keyset_pages_cover_every_row_once(client, history):
+    ids, pages = collect_pages(client, "/users/1/conversations?limit=4")
+    expected = [row["id"] for row in sorted(history[:25], key=lambda r: (r["timestamp"], r["id"]), reverse=True)]
+    assert ids == expected
+    assert pages == 7
+
+    ids, _ = collect_pages(client, "/users/1/conversations?limit=10&order=asc")
+    assert ids == list(range(1, 26))
+
+
+def test_new_rows_do_not_shift_later_pages(app, client, history):
+    first = client.get("/users/1/conversations?limit=5").get_json()
+    with app.app_context():
+        db.session.execute(insert(ConversationLog), [
+            {"id": 500, "user_id": 1, "message": "late", "timestamp": START + timedelta(days=1)}])
+        db.session.commit()
+    second = client.get(f"/users/1/conversations?limit=5&cursor={first['next_cursor']}").get_json()
+    assert second["conversations"][0]["id"] == first["conversations"][-1]["id"] - 1
+
+
+def test_bad_cursor_and_order_are_rejected(client, history):
+    assert client.get("/users/1/conversations?cursor=not-a-cursor").status_code == 400
+    assert client.get("/users/1/conversations?order=sideways").status_code == 400
+
+
+def test_history_is_for_the_user_or_an_operator(app, history):
+    anonymous = app.test_client()
+    assert anonymous.get("/users/1/conversations").status_code == 403
+    assert anonymous.get("/conversations/export").status_code == 403
+    with anonymous.session_transaction() as session:
+        session["user_id"] = 2
+    assert anonymous.get("/users/1/conversations").status_code == 403
+    assert len(anonymous.get("/users/2/conversations").get_json()["conversations"]) == 5
+    assert anonymous.get("/conversations/export?user_id=2").status_code == 403  # Bulk export is operator-only
+
+    app.config["ADMIN_TOKEN"] = ""
+    assert anonymous.get("/conversations/export", headers={"Authorization": "Bearer "}).status_code == 403
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(START, 42)) == (START, 42)
+
+
+def test_export_ndjson_and_csv(client, history):
+    response = client.get("/conversations/export?user_id=2")
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line["id"] for line in lines] == [100, 101, 102, 103, 104]
+
+    response = client.get(f"/conversations/export?format=csv&since={(START + timedelta(seconds=8)).isoformat()}")
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [int(row["id"]) for row in rows] == [24, 25]
+
+
+def test_export_gzip(client, history):
+    response = client.get("/conversations/export", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    lines = gzip.decompress(response.get_data()).decode().splitlines()
+    assert len(lines) == len(history)
+
+
+def test_iter_export_fetches_in_batches(app, history):
+    with app.app_context():
+        rows = iter_export(db.engine, batch_size=7)
+        assert [row.id for row in rows] == sorted(row["id"] for row in history)
+
+
+def test_gzip_chunks_stream():
+    chunks = list(gzip_chunks(f"line {i}\n" for i in range(1000)))
+    assert gzip.decompress(b"".join(chunks)).decode().count("\n") == 1000
+
+
+def test_export_cli_writes_gzip_csv(app, history, tmp_path, monkeypatch):
+    monkeypatch.setattr("app.create_app", lambda config_class=None: (app, None, db))
+    output = tmp_path / "export.csv.gz"
+    export_main(["--format", "csv", "--gzip", "--user-id", "1", "--output", str(output)])
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(output.read_bytes()).decode())))
+    assert len(rows) == 25 and rows[0]["message"] == "message 1"
@@ -0,0 +1,229 @@
+# test_jobs.py
+"""
+Tests for the background job queue: both backends, priorities, idempotency,
+retries, lease recovery, pushes to the job's room and the process-pool worker.
+"""
+
+import os
+import time
+
+import pytest
+
+from app import job_queue, metrics
+from app.jobs import DONE, FAILED, QUEUED, RUNNING, MemoryJobBackend, SQLiteJobBackend, task
+
+calls = []
+
+
+@task("test.record", max_attempts=3)
+def record(value, fail_times=0):
+    calls.append(value)
+    if calls.count(value) <= fail_times:
+        raise RuntimeError(f"attempt {calls.count(value)} failed")
+    return {"value": value}
+
+
+@task("test.pid", event="pid")
+def report_pid(value):
+    return {"value": value, "pid": os.getpid()}
+
+
+batches = []
+
+
+@task("test.batch", max_attempts=2, batch_size=3)
+def record_batch(payloads):
+    batches.append([payload["value"] for payload in payloads])
+    if len(batches) == 1:
+        raise RuntimeError("first batch failed")
+    return [{"value": payload["value"] * 2} for payload in payloads]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteJobBackend(str(tmp_path / "jobs.db"))
+    return MemoryJobBackend()
+
+
+@pytest.fixture
+def queue(app):
+    """The app's job queue with jobs run only when a test asks for it."""
+    pushed = []
+    calls.clear()
+    app.config.update(JOBS_MODE="external", JOBS_RETRY_BASE_DELAY=0)
+    job_queue.init_app(app, notify=lambda room, event, data: pushed.append((room, event, data)), metrics=metrics)
+    job_queue.pushed = pushed
+    yield job_queue
+    job_queue.stop()
+
+
+def test_backend_claims_by_priority_then_age(backend):
+    now = time.time()
+    low = backend.add("test.record", {"value": "low"}, -10, 3, None, None, now - 5)[0]
+    normal = backend.add("test.record", {"value": "normal"}, 0, 3, None, None, now - 1)[0]
+    older = backend.add("test.record", {"value": "older"}, 0, 3, None, None, now - 2)[0]
+    high = backend.add("test.record", {"value": "high"}, 10, 3, None, None, now)[0]
+    backend.add("test.record", {"value": "later"}, 99, 3, None, None, now + 60)
+
+    order = [backend.claim(now, {}).id for _ in range(4)]
+    assert order == [high.id, older.id, normal.id, low.id]
+    assert backend.claim(now, {}) is None
+    assert backend.counts() == {QUEUED: 1, RUNNING: 4, DONE: 0, FAILED: 0}
+
+
+def test_backend_recovers_jobs_from_expired_leases(backend):
+    now = time.time()
+    job = backend.add("test.record", {"value": 1}, 0, 2, None, None, now)[0]
+    assert backend.claim(now, {"test.record": 10}).attempts == 1
+    assert backend.claim(now + 5, {"test.record": 10}) is None  # Still leased
+    assert backend.claim(now + 11, {"test.record": 10}).attempts == 2  # Worker died: taken over
+    assert backend.claim(now + 22, {"test.record": 10}) is None  # Out of attempts
+    assert backend.get(job.id).status == FAILED and backend.get(job.id).error == "lease expired"
+
+
+def test_idempotency_key_returns_existing_job(backend):
+    now = time.time()
+    first, created = backend.add("test.record", {"value": 1}, 0, 3, "k", "room1", now)
+    again, created_again = backend.add("test.record", {"value": 2}, 0, 3, "k", "room2", now)
+    assert created and not created_again and again.id == first.id and again.payload == {"value": 1}
+    backend.fail(backend.claim(now, {}).id, "boom")
+    retried, created = backend.add("test.record", {"value": 1}, 0, 3, "k", "room3", now)
+    assert created and retried.id == first.id and retried.status == QUEUED and retried.room == "room3"
+
+
+def test_sqlite_jobs_survive_a_restart(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    job = SQLiteJobBackend(path).add("test.record", {"value": 1}, 0, 3, None, None, time.time())[0]
+    assert SQLiteJobBackend(path).claim(time.time(), {}).id == job.id
+
+
+def test_retries_with_backoff_then_pushes_result(queue):
+    job = queue.enqueue("test.record", {"value": "a", "fail_times": 2}, room="sid1")
+    assert queue.run_pending() == 3
+    job = queue.get(job.id)
+    assert (job.status, job.attempts, job.result) == (DONE, 3, {"value": "a"})
+    assert queue.pushed == [("sid1", "job", {"id": job.id, "name": "test.record", "status": DONE,
+                                             "result": {"value": "a"}, "error": None})]
+    assert (queue.processed, queue.retried, queue.failed) == (1, 2, 0)
+    assert 'spokesperson_jobs_total{name="test.record",status="retried"} 2' in metrics.render()
+
+
+def test_gives_up_after_max_attempts(queue):
+    queue.retry_base = 60  # A retry is not due again within this test
+    job = queue.enqueue("test.record", {"value": "b", "fail_times": 5}, room="sid1")
+    assert queue.run_pending() == 1
+    assert queue.get(job.id).status == QUEUED and "attempt 1 failed" in queue.get(job.id).error
+
+    queue.retry_base = 0
+    queue.backend.retry(job.id, "", time.time())
+    assert queue.run_pending() == 2
+    job = queue.get(job.id)
+    assert (job.status, job.attempts, calls.count("b")) == (FAILED, 3, 3)
+    assert queue.pushed[-1][2]["status"] == FAILED
+    assert queue.requeue_failed() == 1 and queue.get(job.id).status == QUEUED
+
+
+def test_done_job_with_same_key_is_pushed_again(queue):
+    first = queue.enqueue("test.pid", {"value": 1}, key="once", room="sid1")
+    queue.run_pending()
+    again = queue.enqueue("test.pid", {"value": 1}, key="once", room="sid2")
+    assert again.id == first.id and queue.run_pending() == 0
+    assert [(room, event) for room, event, _ in queue.pushed] == [("sid1", "pid"), ("sid2", "pid")]
+
+
+def test_batch_task_runs_ready_jobs_together_and_retries_each(queue):
+    batches.clear()
+    jobs = [queue.enqueue("test.batch", {"value": i}, room=f"sid{i}") for i in range(4)]
+    assert queue.run_pending() == 7  # Three failed attempts, then four successful ones
+
+    assert batches[0] == [0, 1, 2] and sorted(sum(batches[1:], [])) == [0, 1, 2, 3]
+    assert all(len(batch) <= 3 for batch in batches)
+    assert [queue.get(job.id).result for job in jobs] == [{"value": i * 2} for i in range(4)]
+    assert sorted(room for room, _, _ in queue.pushed) == ["sid0", "sid1", "sid2", "sid3"]
+
+
+def test_job_status_is_for_the_owner_or_an_operator(app, client, queue):
+    job = queue.enqueue("test.record", {"value": "x"}, room="user:2")
+    queue.run_pending()
+    assert client.get(f'/jobs/{job.id}').status_code == 404
+    with client.session_transaction() as session:
+        session["user_id"] = 3
+    assert client.get(f'/jobs/{job.id}').status_code == 404
+    assert client.get(f'/jobs/{job.id}', headers={"Authorization": "Bearer s3cret"}).status_code == 404  # No token set
+
+    app.config["ADMIN_TOKEN"] = "s3cret"
+    assert client.get(f'/jobs/{job.id}', headers={"Authorization": "Bearer wrong"}).status_code == 404
+    response = client.get(f'/jobs/{job.id}', headers={"Authorization": "Bearer s3cret"})
+    assert response.get_json()["result"] == {"value": "x"}
+    with client.session_transaction() as session:
+        session["user_id"] = 2
+    assert client.get(f'/jobs/{job.id}').get_json()["status"] == DONE
+
+
+def test_embedded_worker_runs_jobs_in_background(queue):
+    queue.mode = "embedded"
+    jobs = [queue.enqueue("test.record", {"value": i}) for i in range(5)]
+    deadline = time.monotonic() + 5
+    while any(queue.get(job.id).status != DONE for job in jobs) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sorted(calls) == list(range(5))
+    assert queue.stats()["jobs"][DONE] == 5
+
+
+def test_process_pool_worker(app, tmp_path, queue):
+    app.config.update(JOBS_BACKEND="sqlite", JOBS_SQLITE_PATH=str(tmp_path / "jobs.db"))
+    job_queue.init_app(app, notify=lambda room, event, data: queue.pushed.append((room, event, data)))
+    jobs = [job_queue.enqueue("test.pid", {"value": i}, room=f"sid{i}") for i in range(4)]
+    job_queue.start(processes=2)
+    deadline = time.monotonic() + 60
+    while job_queue.stats()["jobs"][DONE] < 4 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    job_queue.stop()
+
+    results = [job_queue.get(job.id).result for job in jobs]
+    assert [result["value"] for result in results] == [0, 1, 2, 3]
+    assert os.getpid() not in {result["pid"] for result in results}
+    assert sorted(room for room, _, _ in queue.pushed) == ["sid0", "sid1", "sid2", "sid3"]
+
+
+ANSWERS = ["Alex", "29", "nonbinary", "hiking and photography", "Adventurous", "Booked a last-minute flight",
+           "Banter", "Distracted boyfriend memes", "environmental conservation work", "a picnic on a hill"]
+
+
+def test_completed_flow_enqueues_profile_job(app):
+    from app import socketio
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = 1
+    socket_client = socketio.test_client(app, flask_test_client=client)
+    socket_client.get_received()
+    for answers in (ANSWERS, ANSWERS[:3] + ["reading good books"] + ANSWERS[4:], ANSWERS):
+        for answer in answers:
+            socket_client.emit('message', answer)
+    pushed = [event['args'][0] for event in socket_client.get_received() if event['name'] == 'profile']
+    socket_client.disconnect()
+    # Each completion runs, so going back to earlier answers stores and shows them again
+    assert [profile["interests"] for profile in pushed] == [["hiking", "photography"], ["reading"],
+                                                            ["hiking", "photography"]]
+    assert job_queue.stats()["jobs"][DONE] == 3
+    assert client.get('/users/1/profile').get_json()["interests"] == ["hiking", "photography"]
+    assert app.test_client().get('/jobs/1').status_code == 404  # Someone else's profile
+
+    body = client.get('/jobs/1').get_json()
+    assert body["name"] == "profiles.extract" and body["status"] == DONE
+    assert client.get('/jobs/99').status_code == 404
+
+
+def test_anonymous_flow_gets_a_summary_but_no_profile(socket_client):
+    from app import db
+    from app.models import Profile
+    socket_client.get_received()
+    for answer in ANSWERS:
+        socket_client.emit('message', answer)
+    received = socket_client.get_received()
+    assert "Alex" in received[-1]['args'][0]['message']
+    assert not [event for event in received if event['name'] == 'profile']
+    assert job_queue.stats()["jobs"][DONE] == 0
+    with socket_client.app.app_context():
+        assert db.session.get(Profile, 1) is None
@@ -0,0 +1,131 @@
+# test_llm.py
+"""
+Tests for the pooled, streaming LLM client, run against the local fake server.
+"""
+
+import threading
+import time
+
+import pytest
+
+from app.fake_llm import FakeLLMServer
+from app.llm import LLMBusyError, LLMClient, LLMError, LLMTimeoutError
+
+
+def make_client(server, **overrides):
+    """Build a standalone client pointed at ``server``."""
+    class _App:
+        extensions = {}
+        config = {"LLM_API_BASE": server.url, "LLM_BACKOFF_BASE": 0.01, **overrides}
+    return LLMClient(_App())
+
+
+def test_complete_returns_reply(fake_llm):
+    client = make_client(fake_llm)
+    reply = client.complete([{"role": "user", "content": "hello"}])
+    assert reply == "You said: hello"
+    assert fake_llm.requests[0]["model"] == "gpt-3.5-turbo"
+
+
+def test_stream_yields_tokens_in_order(fake_llm):
+    client = make_client(fake_llm)
+    tokens = list(client.stream([{"role": "user", "content": "one two three"}]))
+    assert len(tokens) > 1
+    assert "".join(tokens) == "You said: one two three"
+
+
+def test_stream_first_token_arrives_before_completion():
+    with FakeLLMServer(token_delay=0.05, reply="a b c d e f g h") as server:
+        client = make_client(server)
+        start = time.monotonic()
+        stream = client.stream([{"role": "user", "content": "hi"}])
+        next(stream)
+        first_token = time.monotonic() - start
+        list(stream)
+        total = time.monotonic() - start
+    assert first_token < total / 2
+
+
+def test_retries_transient_failures():
+    with FakeLLMServer(fail_first=2, fail_status=503) as server:
+        client = make_client(server, LLM_MAX_RETRIES=2)
+        assert client.complete([{"role": "user", "content": "retry"}]) == "You said: retry"
+        assert server.request_count == 3
+
+
+def test_does_not_retry_client_errors():
+    with FakeLLMServer(fail_first=1, fail_status=400) as server:
+        client = make_client(server, LLM_MAX_RETRIES=3)
+        with pytest.raises(LLMError):
+            client.complete([{"role": "user", "content": "bad"}])
+        assert server.request_count == 1
+
+
+def test_timeout_raises():
+    with FakeLLMServer(latency=0.5) as server:
+        client = make_client(server, LLM_MAX_RETRIES=0)
+        with pytest.raises(LLMTimeoutError):
+            client.complete([{"role": "user", "content": "slow"}], timeout=0.1)
+
+
+def test_concurrency_is_bounded():
+    with FakeLLMServer(latency=0.05) as server:
+        client = make_client(server, LLM_MAX_CONCURRENCY=2)
+        threads = [threading.Thread(target=client.complete, args=([{"role": "user", "content": "x"}],))
+                   for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert server.request_count == 6
+        assert server.max_in_flight <= 2
+
+
+def test_busy_when_queue_timeout_expires():
+    with FakeLLMServer(latency=0.3) as server:
+        client = make_client(server, LLM_MAX_CONCURRENCY=1, LLM_QUEUE_TIMEOUT=0.05)
+        holder = threading.Thread(target=client.complete, args=([{"role": "user", "content": "x"}],))
+        holder.start()
+        time.sleep(0.05)
+        with pytest.raises(LLMBusyError):
+            client.complete([{"role": "user", "content": "y"}])
+        holder.join()
+
+
+def test_generate_response_json(client):
+    response = client.post('/generate_response', json={"user_input": "Hello"})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert {key: body[key] for key in ("user_input", "summary")} == {"user_input": "Hello", "summary": "You said: Hello"}
+    assert body["context"]["prompt_tokens"] > 0
+
+
+def test_generate_response_streams_chunks(client):
+    response = client.post('/generate_response', json={"user_input": "Hello there", "stream": True})
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert b"".join(response.response) == b"You said: Hello there"
+
+
+def test_generate_response_upstream_error(client, fake_llm):
+    fake_llm.fail_first = 10
+    fake_llm.fail_status = 400
+    response = client.post('/generate_response', json={"user_input": "Hello"})
+    assert response.status_code == 500
+    assert "OpenAI API Error" in response.get_json()["error"]
+
+
+def test_socket_generate_streams_partial_responses(socket_client):
+    socket_client.get_received()
+    socket_client.emit('generate', {'user_input': 'stream me'})
+    deadline = time.monotonic() + 2
+    received = []
+    while time.monotonic() < deadline:
+        received += [r['args'][0] for r in socket_client.get_received()]
+        if received and not received[-1].get('partial'):
+            break
+        time.sleep(0.01)
+    partials = [r for r in received if r.get('partial')]
+    assert partials
+    assert received[-1]['message'] == "You said: stream me"
+    assert received[-1]['id'] == partials[0]['id'] != '0'
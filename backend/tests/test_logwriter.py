@@ -0,0 +1,79 @@
+# test_logwriter.py
+"""
+Tests for the write-behind ConversationLog writer and its id allocator.
+"""
+
+import threading
+
+import pytest
+
+from app import db
+from app.logwriter import ConversationLogWriter, IdAllocator, LogQueueFull
+from app.models import ConversationLog
+
+
+def make_writer(app, **config):
+    """A writer configured for async mode on top of the test app."""
+    app.config.update({"LOG_WRITER_MODE": "async", **config})
+    return ConversationLogWriter(app)
+
+
+def stored_rows(app):
+    with app.app_context():
+        return {row.id: row.message for row in ConversationLog.query.all()}
+
+
+def test_async_writer_batches_and_keeps_ids(app):
+    writer = make_writer(app, LOG_WRITER_BATCH_SIZE=50, LOG_WRITER_FLUSH_INTERVAL=0.5)
+    ids = [writer.log(1, f"message {i}") for i in range(200)]
+    writer.close()
+
+    assert ids == sorted(ids) and len(set(ids)) == 200
+    assert stored_rows(app) == {id_: f"message {i}" for i, id_ in enumerate(ids)}
+    assert writer.written == 200
+    assert writer.batches <= 8
+
+
+def test_close_flushes_pending_rows(app):
+    writer = make_writer(app, LOG_WRITER_FLUSH_INTERVAL=60)
+    message_id = writer.log(1, "shutting down")
+    writer.close()
+    assert stored_rows(app) == {message_id: "shutting down"}
+
+
+def test_backpressure_rejects_when_queue_stays_full(app):
+    writer = make_writer(app, LOG_WRITER_QUEUE_SIZE=1, LOG_WRITER_BATCH_SIZE=1, LOG_WRITER_PUT_TIMEOUT=0.05)
+    release = threading.Event()
+    original = writer._write
+    writer._write = lambda rows: release.wait() and original(rows)
+
+    try:
+        with pytest.raises(LogQueueFull):
+            for i in range(5):
+                writer.log(1, f"message {i}")
+        assert writer.dropped == 1
+    finally:
+        release.set()
+        writer.close()
+    assert len(stored_rows(app)) == i
+
+
+def test_allocators_reserve_disjoint_blocks(app):
+    first, second = IdAllocator(app, block_size=10), IdAllocator(app, block_size=10)
+    a = [first.next_id() for _ in range(15)]
+    b = [second.next_id() for _ in range(15)]
+    assert not set(a) & set(b)
+
+
+def test_allocator_skips_existing_rows(app):
+    with app.app_context():
+        db.session.add(ConversationLog(id=41, user_id=1, message="written directly"))
+        db.session.commit()
+    assert IdAllocator(app).next_id() == 42
+
+
+def test_socket_ids_match_stored_rows(app, socket_client):
+    socket_client.get_received()
+    socket_client.emit('message', 'Alex')
+    reply = socket_client.get_received()[-1]['args'][0]
+    assert stored_rows(app)[int(reply['id'])] == 'Alex'
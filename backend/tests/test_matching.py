@@ -0,0 +1,90 @@
+# test_matching.py
+"""
+Tests for profile encoding, the top-k match index and the /matches endpoint.
+"""
+
+import numpy as np
+
+from app import db, match_engine, profile_extractor
+from app.matching import MatchIndex, ProfileEncoder
+from app.models import Profile, User
+
+HIKER = {"age": "29", "personality": "Adventurous", "communication": "Banter",
+         "hobby": "hiking and climbing", "passion": "environmental conservation", "ideal_date": "a hike at sunset"}
+CLIMBER = {"age": "31", "personality": "Adventurous", "communication": "Banter",
+           "hobby": "climbing and hiking trips", "passion": "conservation", "ideal_date": "sunset hike"}
+READER = {"age": "58", "personality": "Routine-oriented", "communication": "Deep discussions",
+          "hobby": "reading novels", "passion": "teaching", "ideal_date": "dinner at home"}
+
+
+def test_similar_answers_score_higher():
+    encoder = ProfileEncoder(buckets=16)
+    hiker, climber, reader = encoder.encode_many([HIKER, CLIMBER, READER])
+    assert hiker.shape == (encoder.dim,)
+    assert np.isclose(np.linalg.norm(hiker), 1.0)
+    assert hiker @ climber > 0.8 > hiker @ reader
+
+
+def test_index_top_k_excludes_self_and_grows():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((50, 8)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = MatchIndex(8, capacity=4)
+    index.upsert_many(list(range(100, 150)), vectors)
+    assert len(index) == 50
+
+    matches = index.top_k(vectors[0], k=5, exclude=(100,))
+    expected = np.argsort(-(vectors @ vectors[0]))[1:6] + 100
+    assert [user_id for user_id, _ in matches] == list(expected)
+    assert all(a[1] >= b[1] for a, b in zip(matches, matches[1:]))
+
+
+def test_index_remove_and_replace():
+    index = MatchIndex(2)
+    index.upsert_many([1, 2, 3], np.array([[1, 0], [0.8, 0.6], [0, 1]], dtype=np.float32))
+    index.remove(1)
+    assert 1 not in index and len(index) == 2
+    assert [user_id for user_id, _ in index.top_k([1, 0], k=5)] == [2, 3]
+    index.upsert(3, [1, 0])
+    assert index.top_k([1, 0], k=1) == [(3, 1.0)]
+
+
+def test_top_k_many_matches_single_queries():
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((300, 16)).astype(np.float32)
+    index = MatchIndex(16)
+    index.upsert_many(list(range(300)), vectors)
+    batched = index.top_k_many(vectors[:4], k=7, excludes=[(i,) for i in range(4)], block_rows=64)
+    for i, matches in enumerate(batched):
+        single = index.top_k(vectors[i], k=7, exclude=(i,))
+        assert [user_id for user_id, _ in matches] == [user_id for user_id, _ in single]
+        assert np.allclose([score for _, score in matches], [score for _, score in single], atol=1e-5)
+
+
+def test_engine_loads_stored_profiles_and_serves_matches(app, client):
+    with app.app_context():
+        db.session.add_all([User(id=2, username="climber"), User(id=3, username="reader")])
+        db.session.add_all([Profile(user_id=2, answers=CLIMBER, answers_hash="a", extractor="rules/1", data={}),
+                            Profile(user_id=3, answers=READER, answers_hash="b", extractor="rules/1", data={})])
+        db.session.commit()
+    with client.session_transaction() as session:
+        session["user_id"] = 1
+    assert client.get('/matches/1').status_code == 404
+
+    # Completed conversations reach the index without waiting for a refresh
+    profile_extractor.process([(1, HIKER)])
+    body = client.get('/matches/1?k=5').get_json()
+    assert [match["user_id"] for match in body["matches"]] == [2, 3]
+    assert body["matches"][0]["score"] > body["matches"][1]["score"]
+    assert len(match_engine.index) == 3
+
+
+def test_matches_are_for_the_user_or_an_operator(app, client):
+    app.config["ADMIN_TOKEN"] = "ops"
+    profile_extractor.process([(1, HIKER)])
+
+    assert client.get('/matches/1').status_code == 403
+    with client.session_transaction() as session:
+        session["user_id"] = 2
+    assert client.get('/matches/1').status_code == 403
+    assert client.get('/matches/1', environ_base={"HTTP_AUTHORIZATION": "Bearer ops"}).status_code == 200
@@ -0,0 +1,85 @@
+# test_metrics.py
+"""
+Tests for the /metrics exposition, per-stage event timing and the
+structured, sampled event logger.
+"""
+
+import json
+import logging
+
+from app import metrics
+from app.logs import EventLogger, JSONFormatter, _Event
+from app.metrics import Counter, Histogram, Metrics
+
+
+def test_exposition_format():
+    histogram = Histogram("demo_seconds", "Demo latency.", ("event",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 3.0):
+        histogram.observe(value, "message")
+    counter = Counter("demo_errors", "Demo errors.", ("where",))
+    counter.inc("socket", amount=2)
+    assert histogram.render()[2:] == [
+        'demo_seconds_bucket{event="message",le="0.1"} 1',
+        'demo_seconds_bucket{event="message",le="1.0"} 2',
+        'demo_seconds_bucket{event="message",le="+Inf"} 3',
+        'demo_seconds_sum{event="message"} 3.55',
+        'demo_seconds_count{event="message"} 3',
+    ]
+    assert counter.render() == ["# HELP demo_errors Demo errors.", "# TYPE demo_errors counter",
+                                'demo_errors_total{where="socket"} 2']
+
+
+def test_socket_message_stages_and_gauges(client, socket_client):
+    stages = ("session_io", "validate", "db", "lookup", "emit")
+    before = {stage: metrics.stage_seconds.count("message", stage) for stage in stages}
+    invalid = metrics.invalid_inputs.value("age")
+
+    socket_client.emit('message', "Alex")
+    socket_client.emit('message', "not a number")
+    socket_client.get_received()
+
+    assert metrics.stage_seconds.count("message", "validate") - before["validate"] == 2
+    assert metrics.stage_seconds.count("message", "db") - before["db"] == 1
+    assert metrics.stage_seconds.count("message", "session_io") - before["session_io"] == 4
+    assert metrics.invalid_inputs.value("age") == invalid + 1
+    assert metrics.event_seconds.count("message", "invalid") >= 1
+
+    body = client.get('/metrics').get_data(as_text=True)
+    assert "spokesperson_socket_connections 1\n" in body
+    assert 'spokesperson_queue_depth{queue="llm_admission"} 0' in body
+    assert 'spokesperson_event_stage_seconds_bucket{event="message",stage="validate",le="+Inf"}' in body
+
+
+def test_http_requests_are_timed_by_stage(client):
+    requests = metrics.event_seconds.count("http:main.generate_response", "200")
+    llm_calls = metrics.stage_seconds.count("http:main.generate_response", "llm")
+    assert client.post('/generate_response', json={"user_input": "Hi"}).status_code == 200
+    assert metrics.event_seconds.count("http:main.generate_response", "200") == requests + 1
+    assert metrics.stage_seconds.count("http:main.generate_response", "llm") == llm_calls + 1
+    assert client.get('/metrics').headers["Content-Type"].startswith("text/plain; version=0.0.4")
+
+
+def test_disabled_metrics_record_nothing():
+    disabled = Metrics()
+    disabled.enabled = False
+    timer = disabled.timer("message")
+    timer.mark("validate")
+    timer.finish()
+    disabled.error("socket")
+    assert "spokesperson_event_seconds_count" not in disabled.render()
+    assert disabled.errors.value("socket") == 0
+
+
+def test_event_logger_is_level_gated_and_sampled(caplog, monkeypatch):
+    log = EventLogger("app.tests")
+    monkeypatch.setattr(EventLogger, "sample_rate", 0.0)
+    with caplog.at_level(logging.INFO, logger="app"):
+        log.debug("dropped.by_level")
+        log.info("dropped.by_sampling", user_id=1)
+        log.error("kept", user_id=1)
+    assert [record.getMessage() for record in caplog.records] == ["kept user_id=1"]
+
+    record = logging.LogRecord("app.tests", logging.INFO, __file__, 1, _Event("message.handled", {"ms": 1.5}),
+                               (), None)
+    entry = json.loads(JSONFormatter().format(record))
+    assert entry["event"] == "message.handled" and entry["ms"] == 1.5 and entry["level"] == "info"
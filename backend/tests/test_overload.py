@@ -0,0 +1,223 @@
+# test_overload.py
+"""
+Tests for the adaptive concurrency limit: the limit algorithms, priority
+shedding, degraded replies, and a simulated overload at five times capacity.
+"""
+
+import queue
+import threading
+import time
+
+import pytest
+
+from app.overload import AIMDLimit, ConcurrencyController, GradientLimit, Window, parse_shares
+
+
+def window(rtt, samples=10, inflight=10, dropped=0, key="k"):
+    w = Window(0.0)
+    for _ in range(samples):
+        w.add(key, rtt, dropped, inflight)
+    return w
+
+
+def controller(limit=4.0, queue_timeout=0.0, **overrides):
+    ctl = ConcurrencyController()
+    ctl.limit, ctl.queue_timeout = limit, queue_timeout
+    ctl.window_seconds, ctl.window_samples = 0.05, 5
+    for name, value in overrides.items():
+        setattr(ctl, name, value)
+    return ctl
+
+
+def test_gradient_limit_shrinks_when_latency_rises_and_grows_back():
+    algorithm = GradientLimit(min_limit=4, max_limit=100)
+    limit = 40.0
+    for _ in range(3):
+        limit = algorithm.update(limit, window(0.010, inflight=40))  # Baseline: 10 ms
+    assert limit > 40
+
+    grown = limit
+    for _ in range(5):
+        limit = algorithm.update(limit, window(0.050, inflight=40))  # Five times slower
+    assert limit < grown / 2
+
+    shrunk = limit
+    for _ in range(10):
+        limit = algorithm.update(limit, window(0.010, inflight=100))
+    assert limit > shrunk * 2
+
+    # A worker using less than half its limit learns nothing about a larger one
+    assert algorithm.update(limit, window(0.010, inflight=1)) == limit
+
+
+def test_aimd_limit_backs_off_on_drops_and_slowdowns():
+    algorithm = AIMDLimit(min_limit=4, max_limit=100, backoff=0.5)
+    assert algorithm.update(20, window(0.010, inflight=20)) == 21
+    assert algorithm.update(20, window(0.010, inflight=20, dropped=1)) == 10
+    assert algorithm.update(20, window(0.050, inflight=20)) == 10
+    assert algorithm.update(4, window(0.010, inflight=4, dropped=1)) == 4
+
+
+def test_low_priority_work_is_shed_first():
+    ctl = controller(limit=4.0)
+    held = [ctl.acquire("critical", "flow") for _ in range(2)]
+
+    assert ctl.acquire("low", "generate") is None  # Half of the limit is in use
+    normal = ctl.acquire("normal", "history")
+    critical = ctl.acquire("critical", "flow")
+    assert normal is not None and critical is not None
+    assert ctl.acquire("critical", "flow") is None  # Full, and nothing may wait
+
+    for ticket in held + [normal, critical]:
+        ticket.release()
+    assert ctl.inflight == 0
+    assert ctl.stats()["shed"] == {"low": 1, "critical": 1}
+
+
+def test_waiting_critical_work_is_admitted_before_normal_work():
+    ctl = controller(limit=1.0, queue_timeout=1.0)
+    held = ctl.acquire("critical", "flow")
+    admitted = []
+
+    def wait_for(level):
+        ticket = ctl.acquire(level, level)
+        admitted.append(level)
+        time.sleep(0.02)
+        ticket.release()
+
+    threads = [threading.Thread(target=wait_for, args=(level,)) for level in ("normal", "critical")]
+    threads[0].start()
+    time.sleep(0.02)
+    threads[1].start()
+    time.sleep(0.02)
+    held.release()
+    for thread in threads:
+        thread.join()
+    assert admitted == ["critical", "normal"]
+
+
+def test_parse_shares():
+    assert parse_shares("low=0.25") == {"critical": 1.0, "normal": 0.9, "low": 0.25}
+    with pytest.raises(ValueError):
+        parse_shares("urgent=1")
+
+
+def simulate(ctl, rate, seconds, workers=2, service=0.02):
+    """
+    Offer ``rate`` requests per second, half flow steps and half free-form
+    prompts, to a server of ``workers`` threads taking ``service`` seconds
+    each, in arrival order.
+
+    Returns the latencies of served requests, from arrival to completion, and
+    the shed counts by priority.
+    """
+    jobs = queue.Queue()
+    latencies, shed, lock = [], {"critical": 0, "low": 0}, threading.Lock()
+
+    def work():
+        while True:
+            done = jobs.get()
+            if done is None:
+                return
+            time.sleep(service)
+            done.set()
+
+    def handle(level, arrived):
+        ticket = ctl.acquire(level, level) if ctl is not None else None
+        if ctl is not None and ticket is None:
+            with lock:
+                shed[level] += 1
+            return
+        done = threading.Event()
+        jobs.put(done)
+        done.wait()
+        if ticket is not None:
+            ticket.release()
+        with lock:
+            latencies.append(time.monotonic() - arrived)
+
+    servers = [threading.Thread(target=work) for _ in range(workers)]
+    for thread in servers:
+        thread.start()
+    threads = []
+    start = time.monotonic()
+    for i in range(int(rate * seconds)):
+        time.sleep(max(0.0, start + i / rate - time.monotonic()))
+        thread = threading.Thread(target=handle, args=("low" if i % 2 else "critical", time.monotonic()))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    for _ in servers:
+        jobs.put(None)
+    return sorted(latencies), shed
+
+
+def p99(latencies):
+    return latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))]
+
+
+def test_p99_stays_bounded_at_five_times_capacity():
+    capacity = 2 / 0.02  # Two workers, 20 ms per request
+    ctl = controller(limit=10.0, queue_timeout=0.2, window_seconds=0.05, window_samples=5)
+    simulate(ctl, capacity / 2, 0.4)  # Learn the unloaded latency first
+
+    served, shed = simulate(ctl, capacity * 5, 0.6)
+    unguarded, _ = simulate(None, capacity * 5, 0.6)
+
+    # Without the limit the backlog grows for as long as the overload lasts
+    assert p99(unguarded) > 1.5
+    assert p99(served) < 0.45  # Queue timeout plus a few service times
+    assert len(served) >= capacity * 0.6 * 0.6  # Most of the capacity still does useful work
+    assert shed["low"] > shed["critical"]  # Free-form prompts go first
+    assert ctl.stats()["limit"] < 10
+
+
+def test_shed_generate_response_gets_a_cached_or_templated_reply(app, client):
+    from app import completion_cache, llm, overload
+    overload.enabled, overload.limit = True, 1.0
+    held = overload.acquire("critical", "socket.message")
+    try:
+        response = client.post("/generate_response", json={"user_input": "I like hiking"})
+        assert response.status_code == 200 and response.headers["X-Degraded"] == "shed"
+        assert response.headers["X-LLM-Provider"] == "template" and response.get_json()["degraded"]
+
+        completion_cache.store(llm.model, [{"role": "system", "content": app.config["CONTEXT_SYSTEM_PROMPT"]},
+                                           {"role": "user", "content": "Hi"}], 50, "Hello there!")
+        response = client.post("/generate_response", json={"user_input": "Hi", "stream": True})
+        assert response.data == b"Hello there!" and response.headers["X-LLM-Provider"] == "cache"
+
+        assert client.get("/overload_stats").get_json()["shed"] == {"low": 2}  # Stats are never shed
+    finally:
+        held.release()
+
+    response = client.post("/generate_response", json={"user_input": "I like hiking"})
+    assert "X-Degraded" not in response.headers and response.get_json()["summary"] == "You said: I like hiking"
+    assert overload.inflight == 0
+
+
+def test_generate_response_degrades_when_no_llm_provider_is_free(client):
+    from app import llm
+    breaker = llm.routes[0].breaker
+    breaker.state, breaker.opened_at = breaker.OPEN, time.monotonic()
+
+    response = client.post("/generate_response", json={"user_input": "I like hiking"})
+
+    assert response.status_code == 200 and response.headers["X-Degraded"] == "busy"
+
+
+def test_socket_events_are_shed_under_overload(app, socket_client):
+    from app import overload
+    socket_client.get_received()
+    overload.enabled, overload.limit, overload.queue_timeout = True, 1.0, 0.0
+    held = overload.acquire("critical", "socket.message")
+    try:
+        socket_client.emit("message", "Alex")
+        socket_client.emit("generate", {"user_input": "I like hiking"})
+        received = socket_client.get_received()
+    finally:
+        held.release()
+
+    assert received[0]["name"] == "overloaded" and received[0]["args"][0]["event"] == "message"
+    reply = received[1]["args"][0]
+    assert reply["degraded"] and reply["message"].startswith('Thanks for sharing "I like hiking"')
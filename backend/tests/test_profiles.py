@@ -0,0 +1,137 @@
+# test_profiles.py
+"""
+Tests for structured profile extraction: the rule and batched LLM extractors,
+answer-hash caching, batched extraction jobs and the end-of-flow wiring.
+"""
+
+import json
+
+from app import db, profile_extractor
+from app.models import Profile, User
+from app.profiles import LLMExtractor, RuleExtractor, answers_hash
+
+ANSWERS = {
+    "name": "Alex", "age": "29", "gender": "nonbinary", "hobby": "hiking and photography",
+    "personality": "Adventurous", "spontaneous": "Booked a last-minute flight to Lisbon",
+    "communication": "Banter", "go_to_joke": "Distracted boyfriend memes",
+    "passion": "environmental conservation and personal growth", "ideal_date": "a picnic in the park at sunset",
+}
+
+
+def test_rule_extractor_builds_schema():
+    profile = RuleExtractor().extract(ANSWERS)
+    assert profile["interests"] == ["hiking", "photography"]
+    assert profile["values"] == ["environmentalism", "personal_growth"]
+    assert profile["personality_traits"]["adventurous"] is True
+    assert profile["communication_style"] == {"humor": True, "casual_tone": True, "expressiveness": False}
+    assert profile["date_preferences"] == {"settings": ["outdoor_adventures"], "atmosphere": "exciting_and_memorable"}
+    assert profile["additional_details"] == "Booked a last-minute flight to Lisbon"
+
+
+def test_answers_hash_ignores_spacing_and_case():
+    assert answers_hash({"hobby": "Hiking  trips"}) == answers_hash({"hobby": " hiking trips "})
+    assert answers_hash({"hobby": "hiking"}) != answers_hash({"hobby": "running"})
+
+
+def test_extract_many_caches_by_answer_hash(app):
+    calls = []
+
+    class CountingExtractor(RuleExtractor):
+        def extract_many(self, batch):
+            calls.append(len(batch))
+            return super().extract_many(batch)
+
+    profile_extractor.extractor = CountingExtractor()
+    other = dict(ANSWERS, hobby="reading")
+    profiles = profile_extractor.extract_many([ANSWERS, other, dict(ANSWERS)])
+    assert calls == [2]
+    assert profiles[0] == profiles[2]
+    profile_extractor.extract_many([ANSWERS])
+    assert calls == [2]
+
+
+def test_stored_profiles_are_reused_after_restart(app):
+    with app.app_context():
+        db.session.add(User(id=2, username="sam"))
+        db.session.commit()
+    profile_extractor.process([(2, ANSWERS)])
+    profile_extractor.cache.clear()
+    profile_extractor.extractor = type("Failing", (RuleExtractor,), {"extract": None})()
+    assert profile_extractor.extract_many([ANSWERS])[0]["interests"] == ["hiking", "photography"]
+
+
+def test_llm_extractor_batches_users_into_one_request(app, fake_llm):
+    from app import llm
+    fake_llm.reply = json.dumps({
+        "0": {"interests": ["hiking"], "values": ["growth"], "personality_traits": {"adventurous": True}},
+        "1": {"interests": ["chess"]},
+    })
+    profiles = LLMExtractor(llm).extract_many([ANSWERS, {"hobby": "chess"}, {"hobby": "golf"}])
+    assert fake_llm.request_count == 1
+    assert profiles[0]["interests"] == ["hiking"] and profiles[0]["personality_traits"]["adventurous"] is True
+    assert profiles[1]["interests"] == ["chess"]
+    assert profiles[2]["date_preferences"]["atmosphere"] == "casual"  # Missing id: rule fallback
+
+
+def test_llm_extractor_falls_back_on_unparseable_reply(app, fake_llm):
+    from app import llm
+    fake_llm.reply = "Sorry, I can't help with that."
+    assert LLMExtractor(llm).extract_many([ANSWERS]) == [RuleExtractor().extract(ANSWERS)]
+
+
+def test_queued_extract_jobs_share_one_llm_request(app, fake_llm):
+    from app import job_queue
+    pushed = []
+    app.config.update(JOBS_MODE="external", PROFILE_EXTRACTOR="llm")
+    job_queue.init_app(app, notify=lambda room, event, data: pushed.append((room, event, data["user_id"])))
+    profile_extractor.init_app(app)
+    fake_llm.reply = json.dumps({str(i): {"interests": [f"hobby{i}"]} for i in range(5)})
+    with app.app_context():
+        db.session.add_all([User(id=i, username=f"user{i}") for i in range(2, 6)])
+        db.session.commit()
+    for user_id in range(1, 6):
+        job_queue.enqueue("profiles.extract", {"user_id": user_id, "answers": dict(ANSWERS, name=f"user{user_id}")},
+                          room=f"sid{user_id}")
+
+    assert job_queue.run_pending() == 5
+    assert fake_llm.request_count == 1
+    assert sorted(pushed) == [(f"sid{i}", "profile", i) for i in range(1, 6)]
+    with app.app_context():
+        assert db.session.query(Profile).count() == 5
+
+
+def signed_in(app, user_id=1):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
+    return client
+
+
+def test_completed_flow_stores_and_pushes_profile(app):
+    from app import socketio
+    client = signed_in(app)
+    socket_client = socketio.test_client(app, flask_test_client=client)
+    socket_client.get_received()
+    for answer in ["Alex", "29", "nonbinary", "hiking and photography", "Adventurous",
+                   "Booked a last-minute flight", "Banter", "Distracted boyfriend memes",
+                   "environmental conservation work", "a picnic on a hill"]:
+        socket_client.emit('message', answer)
+    pushed = [event for event in socket_client.get_received() if event['name'] == 'profile']
+    assert pushed[0]['args'][0]['interests'] == ["hiking", "photography"]
+    socket_client.disconnect()
+
+    body = client.get('/users/1/profile').get_json()
+    assert body["extractor"] == "rules/1"
+    assert body["values"] == ["environmentalism"]
+
+
+def test_profiles_are_for_the_user_or_an_operator(app):
+    app.config["ADMIN_TOKEN"] = "ops"
+    profile_extractor.process([(1, ANSWERS)])
+    operator = {"HTTP_AUTHORIZATION": "Bearer ops"}
+
+    assert app.test_client().get('/users/1/profile').status_code == 403
+    assert signed_in(app, 2).get('/users/1/profile').status_code == 403
+    assert signed_in(app).get('/users/1/profile').status_code == 200
+    assert app.test_client().get('/users/1/profile', environ_base=operator).status_code == 200
+    assert app.test_client().get('/users/99/profile', environ_base=operator).status_code == 404
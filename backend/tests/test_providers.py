@@ -0,0 +1,155 @@
+# test_providers.py
+"""
+Tests for routing LLM calls across providers: latency-aware choice, hedging,
+failover, circuit breakers and the canned fallback, run against in-process
+stub providers with injected latency.
+"""
+
+import time
+
+import pytest
+
+from app.fake_llm import StubProvider
+from app.llm import LLMError
+from app.providers import CircuitBreaker, LLMRouter, TemplateProvider, parse_providers
+
+MESSAGES = [{"role": "user", "content": "Do you like hiking?"}]
+
+
+def make_router(*providers, hedge=True, min_delay=0.05, max_delay=0.05, budget=1.0, timeout=2.0):
+    """A router over ``(provider, tier)`` pairs, hedging after a fixed delay."""
+    router = LLMRouter()
+    router.hedge, router.hedge_budget, router.timeout = hedge, budget, timeout
+    router.hedge_min_delay, router.hedge_max_delay = min_delay, max_delay
+    for provider, tier in providers:
+        router.add(provider, tier=tier)
+    return router
+
+
+def test_calls_go_to_the_fastest_provider_once_both_are_measured():
+    slow, fast = StubProvider("slow", latency=0.03), StubProvider("fast", latency=0.001)
+    router = make_router((slow, 0), (fast, 0), hedge=False)
+
+    providers = [router.complete(MESSAGES).provider for _ in range(10)]
+
+    # Each is sampled once, then the fast one takes the traffic
+    assert providers[:2] == ["slow", "fast"] and set(providers[2:]) == {"fast"}
+    assert router.stats()["fast"]["complete_p50_ms"] < router.stats()["slow"]["complete_p50_ms"]
+
+
+def test_a_slow_call_is_hedged_to_the_next_provider_and_the_first_answer_wins():
+    stuck, backup = StubProvider("stuck", latency=1.0), StubProvider("backup", latency=0.01)
+    router = make_router((stuck, 0), (backup, 0))
+
+    start = time.monotonic()
+    reply = router.complete(MESSAGES)
+    elapsed = time.monotonic() - start
+
+    assert reply == "Reply from backup." and reply.provider == "backup" and reply.cacheable
+    assert 0.05 <= elapsed < 0.5  # Hedge delay plus the backup, not the stuck provider's second
+    assert stuck.calls == backup.calls == 1
+
+
+def test_hedges_are_limited_by_the_budget():
+    stuck, backup = StubProvider("stuck", latency=0.2), StubProvider("backup", latency=0.01)
+    router = make_router((stuck, 0), (backup, 0), budget=0.0)
+
+    assert router.complete(MESSAGES).provider == "backup"  # Spends the one hedge banked at start
+
+    # Still unmeasured, the stuck provider ranks first and nothing is left to hedge with
+    start = time.monotonic()
+    assert router.complete(MESSAGES).provider == "stuck"
+    assert time.monotonic() - start >= 0.15 and backup.calls == 1
+
+
+def test_failures_move_to_the_next_tier():
+    broken, local = StubProvider("broken", fail=True), StubProvider("local", latency=0.001)
+    router = make_router((broken, 0), (local, 1))
+
+    reply = router.complete(MESSAGES)
+
+    assert reply.provider == "local" and broken.calls == 1
+
+
+def test_breaker_opens_after_repeated_failures_and_closes_after_a_good_probe():
+    failing = [True]
+    flaky = StubProvider("flaky", fail=lambda: failing[0])
+    spare = StubProvider("spare", latency=0.001)
+    router = LLMRouter()
+    router.hedge = False
+    router.add(flaky, breaker=CircuitBreaker(failures=3, cooldown=0.1))
+    router.add(spare, tier=1)
+
+    for _ in range(5):
+        assert router.complete(MESSAGES).provider == "spare"
+    assert flaky.calls == 3 and router.stats()["flaky"]["breaker"] == "open"
+
+    # After the cooldown a single probe goes through; success closes the breaker
+    time.sleep(0.12)
+    failing[0] = False
+    assert router.complete(MESSAGES).provider == "flaky"
+    assert router.stats()["flaky"]["breaker"] == "closed"
+
+
+def test_a_failed_probe_reopens_the_breaker():
+    flaky = StubProvider("flaky", fail=True)
+    breaker = CircuitBreaker(failures=1, cooldown=0.05)
+    router = LLMRouter()
+    router.add(flaky, breaker=breaker)
+    router.add(TemplateProvider(), tier=1)
+
+    router.complete(MESSAGES)
+    time.sleep(0.06)
+    assert router.complete(MESSAGES).provider == "template"
+    assert flaky.calls == 2 and breaker.state == "open"
+
+
+def test_canned_fallback_is_not_used_when_the_caller_parses_the_reply():
+    router = make_router((StubProvider("broken", fail=True), 0), (TemplateProvider(), 1))
+
+    assert router.complete(MESSAGES).provider == "template"
+    with pytest.raises(LLMError):
+        router.complete(MESSAGES, fallback=False)
+
+
+def test_stream_is_hedged_on_the_first_token_and_the_loser_is_closed():
+    stuck = StubProvider("stuck", latency=0.3, reply="slow words")
+    backup = StubProvider("backup", latency=0.01, reply="one two three")
+    router = make_router((stuck, 0), (backup, 0))
+
+    stream = router.stream(MESSAGES)
+    assert "".join(stream) == "one two three"
+    assert stream.provider == "backup" and stream.cacheable
+
+    time.sleep(0.4)  # The stuck provider's first token arrives after the race is decided
+    assert stuck.closed == 1 and backup.closed == 1
+
+
+def test_parse_providers_reads_tiers_and_named_endpoints():
+    config = {"LLM_API_BASE": "http://primary.local/v1", "LLM_LOCAL_API_KEY": "k"}
+    providers = parse_providers("primary, local=http://127.0.0.1:8080/v1 phi-3 | template", config)
+
+    assert [(tier, p.name, p.model) for tier, p in providers] == [
+        (0, "primary", "gpt-3.5-turbo"), (0, "local", "phi-3"), (1, "template", "template")]
+    assert providers[1][1].client.api_base == "http://127.0.0.1:8080/v1"
+    with pytest.raises(ValueError):
+        parse_providers("primary | mystery", config)
+
+
+def test_generate_response_falls_back_to_canned_replies_and_does_not_cache_them(app, client, fake_llm):
+    from app import completion_cache, llm
+    fake_llm.fail_first, fake_llm.fail_status = 100, 503
+    llm.add(TemplateProvider(), tier=1)
+
+    response = client.post("/generate_response", json={"user_input": "I like hiking"})
+    assert response.status_code == 200 and response.headers["X-LLM-Provider"] == "template"
+    assert response.get_json()["summary"].startswith('Thanks for sharing "I like hiking"')
+    assert completion_cache.memory.items() == []
+
+    fake_llm.fail_first = 0
+    response = client.post("/generate_response", json={"user_input": "Cooking too"})
+    assert response.headers["X-LLM-Provider"] == "primary"
+    assert [type(value) for _, value in completion_cache.memory.items()] == [str]
+
+    stats = client.get("/llm_stats").get_json()
+    assert stats["primary"]["breaker"] == "closed" and stats["template"]["tier"] == 1
@@ -0,0 +1,197 @@
+# test_ratelimit.py
+"""
+Tests for the token-bucket limiter: limit parsing, the shared backends,
+HTTP and Socket.IO enforcement and the upstream admission queue.
+"""
+
+import threading
+import time
+
+import pytest
+
+from app import limiter, llm
+from app.llm import LLMBusyError
+from app.localredis import LocalRedis, WatchError
+from app.ratelimit import (
+    AdmissionQueue,
+    AdmissionRejected,
+    Limit,
+    MemoryBucketBackend,
+    RedisBucketBackend,
+    SQLiteBucketBackend,
+    parse_limit,
+    parse_overrides,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteBucketBackend(str(tmp_path / "ratelimit.db"))
+    if request.param == "redis":
+        return RedisBucketBackend(LocalRedis())
+    return MemoryBucketBackend()
+
+
+@pytest.fixture
+def limited(app):
+    app.config.update(RATELIMIT_ENABLED=True, RATELIMIT_DEFAULT="100 per minute")
+    limiter.init_app(app, upstream=llm)
+    return app
+
+
+def test_parse_limit():
+    assert parse_limit("10 per minute") == Limit(10 / 60, 10)
+    assert parse_limit("100/hour burst 5") == Limit(100 / 3600, 5)
+    assert parse_limit("2 per 10 seconds") == Limit(0.2, 2)
+    assert parse_overrides("main.index=1/second; socket.message=5 per minute") == {
+        "main.index": Limit(1.0, 1), "socket.message": Limit(5 / 60, 5)}
+    with pytest.raises(ValueError):
+        parse_limit("ten a minute")
+
+
+def test_bucket_allows_burst_then_refills(backend):
+    limit = Limit(20.0, 3)
+    assert [backend.take("k", limit).allowed for _ in range(4)] == [True, True, True, False]
+    denied = backend.take("k", limit)
+    assert not denied.allowed and 0 < denied.wait <= 0.05 and denied.remaining == 0
+    assert backend.take("other", limit).allowed  # Buckets are per key
+    time.sleep(0.06)
+    assert backend.take("k", limit).allowed
+
+
+def test_shared_backends_serialize_concurrent_workers(tmp_path):
+    redis = LocalRedis()
+    for make in (lambda: SQLiteBucketBackend(str(tmp_path / "shared.db")), lambda: RedisBucketBackend(redis)):
+        workers = [make() for _ in range(4)]  # One backend per simulated process
+        allowed = []
+
+        def hammer(backend):
+            allowed.extend(backend.take("user:1", Limit(0.001, 25)).allowed for _ in range(20))
+
+        threads = [threading.Thread(target=hammer, args=(backend,)) for backend in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert allowed.count(True) == 25
+
+
+def test_local_redis_watch_detects_concurrent_writes():
+    redis = LocalRedis()
+    redis.set("k", 1)
+    with redis.pipeline() as pipe:
+        pipe.watch("k")
+        assert pipe.get("k") == b"1"
+        redis.set("k", 2)
+        pipe.multi()
+        pipe.set("k", 3)
+        with pytest.raises(WatchError):
+            pipe.execute()
+    assert redis.get("k") == b"2"
+
+
+def test_http_limits_are_per_user_and_per_endpoint(limited, client):
+    statuses = [client.post('/generate_response', json={"user_input": "hi"}).status_code for _ in range(6)]
+    assert statuses == [200] * 5 + [429]
+    response = client.post('/generate_response', json={"user_input": "hi"})
+    assert int(response.headers["Retry-After"]) >= 1
+    assert client.get('/').status_code == 200  # Other endpoints only draw from RATELIMIT_DEFAULT
+
+    with client.session_transaction() as session:
+        session["user_id"] = 2
+    response = client.post('/generate_response', json={"user_input": "hi"})
+    assert response.status_code == 200 and response.headers["X-RateLimit-Remaining"] == "4"
+    assert client.get('/ratelimit_stats').get_json()["denied"] == {"main.generate_response": 2}
+
+
+def test_socket_events_are_limited(limited, socket_client):
+    socket_client.get_received()
+    for _ in range(6):
+        socket_client.emit('generate', {"user_input": "hi"})
+    rejected = [event for event in socket_client.get_received() if event["name"] == "rate_limited"]
+    assert len(rejected) == 1 and rejected[0]["args"][0]["event"] == "generate"
+
+
+def test_anonymous_clients_do_not_throttle_each_other(limited):
+    from app import socketio
+    client = limited.test_client()
+    first, second = ({"REMOTE_ADDR": addr} for addr in ("10.0.0.1", "10.0.0.2"))
+    statuses = [client.post('/generate_response', json={"user_input": "hi"}, environ_base=first).status_code
+                for _ in range(6)]
+    assert statuses[-1] == 429
+    assert client.post('/generate_response', json={"user_input": "hi"}, environ_base=second).status_code == 200
+
+    limited.config["RATELIMIT_TRUSTED_PROXIES"] = 1
+    limiter.init_app(limited, upstream=llm)
+    sockets = [socketio.test_client(limited, flask_test_client=limited.test_client(),
+                                    headers={"X-Forwarded-For": f"spoofed, 10.0.1.{i}"}) for i in range(2)]
+    for _ in range(6):
+        sockets[0].emit('generate', {"user_input": "hi"})
+    sockets[1].emit('generate', {"user_input": "hi"})
+    rejected = [[e for e in client.get_received() if e["name"] == "rate_limited"] for client in sockets]
+    assert len(rejected[0]) == 1 and rejected[1] == []
+    for client in sockets:
+        client.disconnect()
+
+
+def test_reconnecting_does_not_refill_an_anonymous_bucket(limited):
+    from app import socketio
+    for _ in range(2):
+        socket_client = socketio.test_client(limited, flask_test_client=limited.test_client())
+        for _ in range(3):
+            socket_client.emit('generate', {"user_input": "hi"})
+        rejected = [e for e in socket_client.get_received() if e["name"] == "rate_limited"]
+        socket_client.disconnect()
+    assert len(rejected) == 1  # Burst of 5 per address, not per connection
+
+
+def test_each_connection_keeps_the_declared_event_limit(limited):
+    from app import socketio
+    limited.config["RATELIMIT_ENDPOINTS"] = "socket.generate=100 per minute burst 50"  # Raised for a NAT
+    limiter.init_app(limited, upstream=llm)
+    sockets = [socketio.test_client(limited, flask_test_client=limited.test_client()) for _ in range(2)]
+    for client in sockets:
+        for _ in range(6):
+            client.emit('generate', {"user_input": "hi"})
+    rejected = [[e for e in client.get_received() if e["name"] == "rate_limited"] for client in sockets]
+    assert [len(events) for events in rejected] == [1, 1]
+    for client in sockets:
+        client.disconnect()
+
+
+def test_admission_queue_paces_bursts_instead_of_rejecting():
+    queue = AdmissionQueue(rpm=1200, burst_window=0.05, max_wait=1.0)  # 20/s, one at a time
+    waits = []
+    threads = [threading.Thread(target=lambda: waits.append(queue.admit())) for _ in range(4)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - start >= 0.14
+    assert sorted(waits) == pytest.approx([0, 0.05, 0.1, 0.15], abs=0.02)
+    stats = queue.stats()
+    assert stats["admitted"] == 4 and stats["delayed"] == 3 and stats["depth"] == 0 and stats["peak_depth"] >= 2
+    assert stats["max_wait_ms"] >= 130
+
+    with pytest.raises(AdmissionRejected):
+        AdmissionQueue(tpm=60, max_wait=0.5).admit(tokens=100)  # Larger than a burst window holds
+
+
+def test_llm_calls_wait_for_the_upstream_quota(limited, client):
+    limiter.admission.__init__(limiter.backend, rpm=600, burst_window=0.1, max_wait=0.5)  # 1 at a time, 10/s
+    replies = []
+    threads = [threading.Thread(target=lambda: replies.append(llm.complete([{"role": "user", "content": "x"}])))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(replies) == 3 and limiter.admission.stats()["delayed"] == 2
+
+    limiter.admission.max_wait = 0
+    with pytest.raises(LLMBusyError):
+        for _ in range(3):
+            llm.complete([{"role": "user", "content": "x"}])
+    assert client.get('/ratelimit_stats').get_json()["admission"]["rejected"] >= 1
@@ -0,0 +1,142 @@
+# test_retention.py
+"""
+Tests for ConversationLog retention: per-class expiry, monthly archives,
+history reads across the table and the archives, and interrupted runs.
+"""
+
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, insert, select  # type: ignore
+
+from app import db, log_retention
+from app.history import iter_export
+from app.models import ConversationArchive, ConversationLog, User
+
+NOW = datetime(2026, 10, 18, 12, 0, 0)
+
+
+@pytest.fixture
+def client(app):
+    """HTTP client sending the operator token, which reading other users' messages requires."""
+    app.config["ADMIN_TOKEN"] = "ops"
+    client = app.test_client()
+    client.environ_base["HTTP_AUTHORIZATION"] = "Bearer ops"
+    return client
+
+
+@pytest.fixture
+def retention(app, tmp_path):
+    """Retention with small blocks, sort runs and batches, so every path is taken on a few rows."""
+    app.config.update(RETENTION_ARCHIVE_PATH=str(tmp_path / "archive"), RETENTION_HOT_DAYS=30,
+                      RETENTION_BLOCK_ROWS=3, RETENTION_SORT_BUFFER=4, RETENTION_BATCH_SIZE=2,
+                      RETENTION_BATCH_PAUSE=0, RETENTION_TTL_DAYS={"answer": 0, "prompt": 0})
+    log_retention.init_app(app)
+    return log_retention
+
+
+@pytest.fixture
+def messages(app):
+    """Messages of users 1 and 2 from May to October, a few of them prompts."""
+    rows, next_id = [], 1
+    for month, count in ((5, 6), (6, 5), (8, 4), (10, 3)):
+        for i in range(count):
+            for user_id in (2, 1):  # Interleaved ids, so archives must reorder by user
+                rows.append({"id": next_id, "user_id": user_id, "message": f"{user_id}: {month}/{i} é",
+                             "timestamp": datetime(2026, month, 1 + i, 9, 0, 0),
+                             "kind": "prompt" if i % 2 else "answer"})
+                next_id += 1
+    with app.app_context():
+        db.session.add(User(id=2, username="other"))
+        db.session.execute(insert(ConversationLog), rows)
+        db.session.commit()
+    return rows
+
+
+def table_ids(app):
+    with app.app_context():
+        return set(db.session.execute(select(ConversationLog.id)).scalars())
+
+
+def history_ids(client, user_id, order):
+    ids, cursor = [], None
+    while True:
+        url = f"/users/{user_id}/conversations?limit=4&order={order}" + (f"&cursor={cursor}" if cursor else "")
+        body = client.get(url).get_json()
+        ids.extend(row["id"] for row in body["conversations"])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return ids
+
+
+def expected_ids(messages, user_id, order):
+    rows = sorted((m for m in messages if m["user_id"] == user_id), key=lambda m: (m["timestamp"], m["id"]))
+    return [m["id"] for m in (rows if order == "asc" else reversed(rows))]
+
+
+def test_months_past_the_hot_window_are_archived_and_still_readable(app, client, retention, messages):
+    with app.app_context():
+        report = retention.run(now=NOW)
+
+    assert report["months"] == ["2026-05", "2026-06", "2026-08"] and report["complete"]
+    assert report["archived"] == report["deleted"] == 30
+    assert table_ids(app) == {m["id"] for m in messages if m["timestamp"].month == 10}
+
+    with app.app_context():
+        partitions = retention.partitions()
+    may = partitions[0]
+    assert (may.rows, len(may.blocks)) == (12, 4)
+    with gzip.open(os.path.join(retention.archive_path, may.path), "rt", encoding="utf-8") as f:
+        archived = [json.loads(line) for line in f]  # An ordinary .ndjson.gz, whatever the block layout
+    assert [(r["user_id"], r["timestamp"]) for r in archived] == sorted((r["user_id"], r["timestamp"]) for r in archived)
+    assert archived[0]["message"] == "1: 5/0 é" and {r["kind"] for r in archived} == {"answer", "prompt"}
+
+    for user_id in (1, 2):
+        for order in ("asc", "desc"):
+            assert history_ids(client, user_id, order) == expected_ids(messages, user_id, order)
+    with app.app_context():
+        exported = [row.id for row in iter_export(db.engine)]
+    assert sorted(exported) == sorted(m["id"] for m in messages)
+
+    # Nothing left to do until another month leaves the hot window
+    with app.app_context():
+        assert retention.run(now=NOW)["months"] == []
+
+
+def test_ttl_per_class_expires_the_table_and_rewrites_archives(app, client, retention, messages):
+    with app.app_context():
+        retention.run(now=NOW)
+        retention.ttl_days = {"answer": 0, "prompt": 100}
+        report = retention.run(now=NOW)
+        partitions = {p.month: p for p in retention.partitions()}
+
+    # May and June ended more than 100 days ago: their prompts are gone, August keeps its own
+    assert report["rewritten"] == 6 + 4
+    assert partitions["2026-05"].rows == 6 and partitions["2026-06"].rows == 6 and partitions["2026-08"].rows == 8
+    kept = [m for m in messages if not (m["kind"] == "prompt" and m["timestamp"] < datetime(2026, 7, 1))]
+    assert history_ids(client, 1, "asc") == expected_ids(kept, 1, "asc")
+
+    # In the table, rows expire one by one
+    retention.ttl_days = {"answer": 1, "prompt": 0}
+    with app.app_context():
+        assert retention.run(now=NOW + timedelta(days=2))["expired"] == 4
+    assert table_ids(app) == {m["id"] for m in messages if m["timestamp"].month == 10 and m["kind"] == "prompt"}
+
+
+def test_archived_months_are_read_from_the_archive_until_the_table_is_cleaned(app, client, retention, messages):
+    starts_at, ends_at = datetime(2026, 5, 1), datetime(2026, 6, 1)
+    with app.app_context():
+        retention._compact(starts_at, ends_at)  # As if the run stopped right after registering the month
+        assert db.session.scalar(select(func.count()).select_from(ConversationLog)) == len(messages)
+    assert history_ids(client, 1, "asc") == expected_ids(messages, 1, "asc")  # No duplicates
+
+    # A second run that reaches the same month does not register it again
+    with app.app_context():
+        assert retention._compact(starts_at, ends_at) is None
+        assert db.session.scalar(select(func.count()).select_from(ConversationArchive)) == 1
+        report = retention.run(now=NOW)
+    assert report["deleted"] == 30 and report["months"] == ["2026-06", "2026-08"]
+    assert history_ids(client, 2, "desc") == expected_ids(messages, 2, "desc")
@@ -0,0 +1,92 @@
+# test_sanitize.py
+"""
+Tests for the input limits and scrubber: the Aho-Corasick term matcher,
+PII replacement, rejection of oversize frames, and re-checking stored logs.
+"""
+
+import random
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert, select  # type: ignore
+
+from app import db, sanitizer, state_store
+from app.models import ConversationLog
+from app.sanitize import TermMatcher
+
+
+def naive_spans(terms, text):
+    """Longest term ending at each position, on word boundaries, by brute force."""
+    found = []
+    for end in range(1, len(text) + 1):
+        for length in sorted({len(t) for t in terms if text[:end].endswith(t)}, reverse=True):
+            start = end - length
+            if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                found.append((start, end))
+                break
+    return found
+
+
+@pytest.mark.parametrize("prefilter", [256, 0])
+def test_term_matcher_agrees_with_brute_force(prefilter, monkeypatch):
+    monkeypatch.setattr("app.sanitize.PREFILTER_MAX_PREFIXES", prefilter)  # With and without the regex skip
+    terms = ["ab", "bab", "abc", "b", "ca", "a b"]
+    matcher = TermMatcher(terms)
+    rng = random.Random(7)
+    for _ in range(2000):
+        text = "".join(rng.choice("abc ") for _ in range(14))
+        assert matcher.spans(text) == naive_spans(terms, text), text
+    assert TermMatcher(["Shit"]).mask("SHIT happens, İ shit") == "**** happens, İ ****"
+
+
+def test_scrub_masks_terms_on_word_boundaries_and_replaces_pii(app):
+    assert sanitizer.scrub("What the fuck, this is bullshit") == "What the ****, this is ********"
+    assert sanitizer.scrub("A classic Scunthorpe assessment") == "A classic Scunthorpe assessment"
+    assert sanitizer.scrub("mail me at alex.b+x@example.co.uk or call +44 (0)20 7946-0958") == \
+        "mail me at [email] or call [number]"
+    assert sanitizer.scrub("I am 29, born 1996-04-01") == "I am 29, born 1996-04-01"
+    for timestamp in ("2024-01-15 10:30:00", "2024-01-15T10:30:00.123", "15.01.2024 10:30", "10:30:00 2024-01-15"):
+        assert sanitizer.scrub(f"free from {timestamp} on") == f"free from {timestamp} on"
+    assert sanitizer.scrub("on 2024-01-15 call 555 123 4567") == "on 2024-01-15 call [number]"
+    assert sanitizer.scrub("card 4111 1111 1111 1111") == "card [number]"
+    for number in ("0171-12-34567", "0800-1-234567", "1234-5-6789012", "4111-11-11 1111 1111"):
+        assert sanitizer.scrub(f"call {number} now") == "call [number] now"
+    assert sanitizer.scrub("call 12:34 5678 9012 now") == "call 12:[number] now"
+    clean = "hiking and taking photos"
+    assert sanitizer.scrub(clean) is clean
+
+    finding = sanitizer.check("x" * 2001)
+    assert finding.reasons == ("oversize",)
+    assert [f.reasons for f in sanitizer.check_many(["ok", "shit", "a@b.io shit"])] == [(), ("profanity",),
+                                                                                    ("pii", "profanity")]
+
+
+def test_oversize_frames_are_rejected_before_any_session_work(app, socket_client, monkeypatch):
+    socket_client.get_received()
+    monkeypatch.setattr(state_store, "load", lambda key: (_ for _ in ()).throw(AssertionError("state loaded")))
+    socket_client.emit('message', "x" * (sanitizer.max_chars + 1))
+    socket_client.emit('message', {"not": "text"})
+    replies = [r["args"][0]["message"] for r in socket_client.get_received()]
+    assert replies == ["Messages are limited to 2000 characters.", "Messages must be text."]
+    monkeypatch.undo()
+
+    # Answers are scrubbed before they are stored and logged
+    socket_client.emit('message', "Alex, alex@example.com")
+    socket_client.get_received()
+    app.extensions["log_writer"].flush()
+    with app.app_context():
+        assert db.session.scalar(select(ConversationLog.message)) == "Alex, [email]"
+
+
+def test_scan_reports_and_fixes_stored_messages(app):
+    rows = [{"id": 1, "user_id": 1, "message": "hello", "timestamp": datetime(2026, 10, 1)},
+            {"id": 2, "user_id": 1, "message": "call 555 123 4567 8", "timestamp": datetime(2026, 10, 2)},
+            {"id": 3, "user_id": 1, "message": "shit " * 500, "timestamp": datetime(2026, 10, 3)}]
+    with app.app_context():
+        db.session.execute(insert(ConversationLog), rows)
+        db.session.commit()
+        report = sanitizer.scan(db.engine, batch_size=2)
+        assert report == {"rows": 3, "oversize": 1, "pii": 1, "profanity": 1, "archived": 0, "fixed": 0}
+        assert sanitizer.scan(db.engine, fix=True)["fixed"] == 2
+        messages = db.session.execute(select(ConversationLog.message).order_by(ConversationLog.id)).scalars().all()
+    assert messages[:2] == ["hello", "call [number]"] and set(messages[2].split()) == {"****"}
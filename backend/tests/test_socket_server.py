@@ -0,0 +1,89 @@
+# test_socket_server.py
+"""
+Tests for the Socket.IO serving options: message-queue fan-out and worker helpers.
+"""
+
+import time
+import uuid
+
+import socketio  # type: ignore
+
+from app.pubsub import LocalPubSubManager, socketio_options
+from app.utils import run_blocking
+
+
+def make_worker(channel):
+    """A bare Socket.IO server standing in for one worker process on the local queue."""
+    server = socketio.Server(async_mode="threading", client_manager=LocalPubSubManager(channel=channel))
+    # Servers start their queue listener on the first connection; start it up front instead
+    server.manager_initialized = True
+    server.manager.initialize()
+    return server
+
+
+def test_local_queue_fans_out_between_workers():
+    channel = uuid.uuid4().hex
+    worker_a, worker_b = make_worker(channel), make_worker(channel)
+    delivered = []
+    original = worker_b.manager._handle_emit
+    worker_b.manager._handle_emit = lambda message: delivered.append(message) or original(message)
+
+    # Emitted by worker A, handed to worker B so it can deliver to its own clients
+    worker_a.emit('response', {'id': '0', 'message': 'hello from A'}, room='user:1')
+
+    deadline = time.monotonic() + 2
+    while not delivered and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [(m['event'], m['room'], m['data'][0]['message']) for m in delivered] == \
+        [('response', 'user:1', 'hello from A')]
+    worker_a.manager.close()
+    worker_b.manager.close()
+
+
+def test_socketio_options_from_config():
+    options = socketio_options({"SOCKETIO_ASYNC_MODE": "eventlet", "SOCKETIO_MESSAGE_QUEUE": "redis://q:6379/0"})
+    assert options["async_mode"] == "eventlet"
+    assert options["message_queue"] == "redis://q:6379/0"
+    assert options["cors_allowed_origins"] == "*"
+
+    local = socketio_options({"SOCKETIO_MESSAGE_QUEUE": "local://tests"})
+    assert isinstance(local["client_manager"], LocalPubSubManager)
+    assert local["client_manager"].channel == "tests"
+    local["client_manager"].close()
+
+
+def test_run_blocking_runs_inline_in_threading_mode(app):
+    assert run_blocking(lambda a, b=0: a + b, 2, b=3) == 5
+
+
+def test_socket_stats_counts_connections(client, socket_client):
+    stats = client.get('/socket_stats').get_json()
+    assert stats["async_mode"] == "threading"
+    assert stats["connections"] >= 1
+    socket_client.disconnect()
+    assert client.get('/socket_stats').get_json()["connections"] == stats["connections"] - 1
+
+
+def test_conversation_flow_over_socket(socket_client):
+    socket_client.get_received()
+    answers = ["Alex", "29", "nonbinary", "climbing and bouldering outdoors", "Adventurous",
+               "Booked a last-minute flight", "Banter", "Distracted boyfriend memes", "environmental conservation work",
+               "a picnic on a hill"]
+    ids, prompts = [], []
+    for answer in answers:
+        socket_client.emit('message', answer)
+        reply = socket_client.get_received()[-1]['args'][0]
+        ids.append(reply['id'])
+        prompts.append(reply['message'])
+    assert len(set(ids)) == len(answers)
+    assert prompts[4].startswith("Love the thrill-seekers!")
+    assert prompts[6].startswith("A good laugh goes a long way!")
+    assert reply['message'].startswith("Nice to meet you, Alex!")
+
+
+def test_short_answer_gets_follow_up_over_socket(socket_client):
+    socket_client.get_received()
+    for answer in ["Alex", "29", "nonbinary", "music"]:
+        socket_client.emit('message', answer)
+    reply = socket_client.get_received()[-1]['args'][0]
+    assert reply['message'].startswith("That sounds awesome!")
@@ -0,0 +1,60 @@
+# test_startup.py
+"""
+Tests for start-up work: what importing the package loads, lazy and eager
+initialization, the build-time flow check and connections reopened after a fork.
+"""
+
+import os
+import subprocess
+import sys
+import threading
+
+from app import create_app, flow_engine, match_engine
+from app.flow import main as flow_main
+from app.utils import thread_connection
+from config.config import TestingConfig
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def test_import_does_not_load_numpy_or_openai():
+    code = ("import sys, app; "
+            "print(type(sys.modules.get('numpy')).__name__, 'openai' in sys.modules)")
+    out = subprocess.run([sys.executable, "-c", code], cwd=BACKEND, capture_output=True, text=True, check=True)
+    assert out.stdout.split() == ["_LazyModule", "False"]
+
+
+def test_lazy_init_defers_flow_and_match_index(app, client):
+    assert flow_engine._flow is None and match_engine._index is None
+    assert client.get('/').status_code == 200
+    assert flow_engine.flow.version and flow_engine._flow is not None
+
+
+def test_eager_init_warms_up(tmp_path):
+    config = type("EagerConfig", (TestingConfig,), {
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'eager.db'}",
+        "LAZY_INIT": False,
+    })
+    create_app(config)  # No profile table yet: the index load is skipped, not fatal
+    assert flow_engine._flow is not None and match_engine._index is not None
+
+
+def test_flow_check(tmp_path, capsys):
+    assert flow_main(["check"]) == 0
+    assert "nodes" in capsys.readouterr().out
+    broken = tmp_path / "flow.json"
+    broken.write_text('{"start": "missing", "nodes": []}')
+    assert flow_main(["check", str(broken)]) == 1
+
+
+def test_thread_connection_reopens_in_a_forked_process():
+    local, opened = threading.local(), []
+
+    def connect():
+        opened.append(object())
+        return opened[-1]
+
+    first = thread_connection(local, connect)
+    assert thread_connection(local, connect) is first
+    local.pid = -1  # As seen from a child forked after the connection was opened
+    assert thread_connection(local, connect) is not first and len(opened) == 2
@@ -0,0 +1,148 @@
+# test_state.py
+"""
+Tests for the conversation state store and its backends.
+"""
+
+import time
+
+import pytest
+
+from app.localredis import LocalRedis
+from app.state import (
+    Conversation,
+    ConversationState,
+    MemoryStateBackend,
+    RedisStateBackend,
+    SQLiteStateBackend,
+    StateStore,
+)
+
+
+class _App:
+    def __init__(self, **config):
+        self.config = config
+        self.extensions = {}
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteStateBackend(str(tmp_path / "state.db"))
+    if request.param == "redis":
+        return RedisStateBackend(LocalRedis())
+    return MemoryStateBackend()
+
+
+def test_backend_round_trip_and_partial_update(backend):
+    backend.save("sid:1", {"conversation_stage": 2, "user_data": {"name": "Alex"}}, ttl=60)
+    backend.save("sid:1", {"conversation_stage": 3}, ttl=60)
+    assert backend.load("sid:1") == {"conversation_stage": 3, "user_data": {"name": "Alex"}}
+
+    backend.delete("sid:1")
+    assert backend.load("sid:1") == {}
+
+
+def test_conversation_packs_to_binary_and_interns_choices():
+    conversation = Conversation(42, "8814b5877984", slots=4, stage=3)
+    conversation.answer(0, "Alex")
+    conversation.answer(2, "".join(["Adven", "turous"]), choice=True)
+    packed = conversation.pack()
+    assert packed[:1] == Conversation.MARKER and len(packed) < 50
+    conversation.answer(3, "é" * 200)  # Length over one varint byte
+    packed = conversation.pack()
+
+    restored = Conversation.unpack(packed)
+    assert restored == conversation and restored.answers[1] is None
+    assert restored.answers[2] is conversation.answers[2]  # One shared string per choice value
+    assert restored.user_data(("name", "age", "personality", "hobby")) == {
+        "name": "Alex", "personality": "Adventurous", "hobby": "é" * 200}
+    for invalid in (b'{"stage": 1}', packed[:-1]):
+        with pytest.raises(ValueError):
+            Conversation.unpack(invalid)
+
+
+def test_backend_stores_conversations_next_to_json_fields(backend):
+    conversation = Conversation(1, "v1", slots=2, stage=1)
+    conversation.answer(1, "Banter", choice=True)
+    backend.save("sid:1", {"conversation": conversation, "context": {"turns": 2}}, ttl=60)
+    assert backend.load("sid:1") == {"conversation": conversation, "context": {"turns": 2}}
+
+
+def test_backend_expires_idle_state(backend):
+    backend.save("sid:1", {"conversation_stage": 1}, ttl=1)
+    backend.save("sid:2", {"conversation_stage": 1}, ttl=60)
+    time.sleep(1.1)
+    backend.sweep()
+    assert backend.load("sid:1") == {}
+    assert backend.load("sid:2") == {"conversation_stage": 1}
+
+
+def test_state_tracks_dirty_fields():
+    state = ConversationState("sid:1", {"conversation_stage": 0, "user_data": {}})
+    state.setdefault("user_data", {"ignored": True})
+    assert not state.dirty
+
+    state["conversation_stage"] = 1
+    state.setdefault("user_id", 7)
+    assert state.dirty == {"conversation_stage", "user_id"}
+
+
+def test_store_writes_only_dirty_fields_once():
+    store = StateStore(_App(STATE_BACKEND="memory", STATE_SWEEP_INTERVAL=0))
+    writes = []
+    save = store.backend.save
+    store.backend.save = lambda key, fields, ttl: writes.append(dict(fields)) or save(key, fields, ttl)
+
+    with store.conversation("sid:1") as state:
+        state["conversation_stage"] = 1
+        state["conversation_stage"] = 2
+        state["user_data"] = {"name": "Alex"}
+    with store.conversation("sid:1") as state:
+        assert state["conversation_stage"] == 2
+
+    assert writes == [{"conversation_stage": 2, "user_data": {"name": "Alex"}}, {}]
+
+
+def test_background_sweeper_removes_expired_state():
+    store = StateStore(_App(STATE_BACKEND="memory", STATE_TTL=0.05, STATE_SWEEP_INTERVAL=0.05))
+    try:
+        with store.conversation("sid:1") as state:
+            state["conversation_stage"] = 1
+        deadline = time.time() + 2
+        while len(store.backend) and time.time() < deadline:
+            time.sleep(0.02)
+        assert len(store.backend) == 0
+    finally:
+        store.stop()
+
+
+def test_socket_state_is_per_connection_and_dropped_on_disconnect(app, socket_client):
+    from app import socketio, state_store
+
+    socket_client.get_received()
+    socket_client.emit('message', "Alex")
+    other = socketio.test_client(app, flask_test_client=app.test_client())
+    other.get_received()
+
+    keys = list(state_store.backend._data)
+    assert len(keys) == 2
+    from app import flow_engine
+    nodes = sorted(flow_engine.flow.node_at(state_store.backend.load(key)["conversation"].stage).id for key in keys)
+    assert nodes == ["age", "name"]
+
+    other.disconnect()
+    assert len(state_store.backend) == 1
+
+
+def test_next_question_route_reads_the_state_store(app, client):
+    from app import socketio
+    app.config["STATE_KEY"] = "user"
+    with client.session_transaction() as session:
+        session["user_id"] = 1
+    socket_client = socketio.test_client(app, flask_test_client=client)
+    for answer in ("Alex", "29"):
+        socket_client.emit('message', answer)
+
+    assert client.get('/get_next_question').get_json() == {"question": "What is your gender?"}
+    assert app.test_client().get('/get_next_question').get_json() == {"question": "What is your name?"}
+    socket_client.disconnect()